@@ -18,6 +18,10 @@
 
 from contextlib import contextmanager
 from distutils.version import LooseVersion
+import gzip
+import hashlib
+import io
+import json
 import os
 import logging
 import re
@@ -55,9 +59,11 @@ __all__ = [
     'RELOAD',
     'RESTART',
     'cmd_log',
+    'compress_static_files',
     'find_missing_packages',
     'get_api_address',
     'get_port',
+    'get_jujugui_static_dir',
     'get_release_file_path',
     'install_missing_packages',
     'log_hook',
@@ -91,6 +97,10 @@ RUNSERVER_DIR = os.path.join(os.path.sep, 'usr', 'local', 'bin')
 RUNSERVER_SH_PATH = os.path.join(RUNSERVER_DIR, 'runserver.sh')
 
 JUJU_PEM = 'juju.includes-private-key.pem'
+# The extensions of the Juju GUI static files compressed at install time, and
+# the name of the manifest listing them, written in the static directory.
+COMPRESSED_EXTENSIONS = ('.css', '.js', '.json', '.svg')
+STATIC_MANIFEST = 'guiserver-manifest.json'
 
 START = "start"
 RESTART = "restart"
@@ -417,6 +427,77 @@ def setup_gui():
         'file:///{}'.format(jujugui_deps), release_tarball_path)
     with su('root'):
         cmd_log(run(*cmd))
+        static_dir = get_jujugui_static_dir()
+        log('Compressing Juju GUI static files in {}.'.format(static_dir))
+        compress_static_files(static_dir)
+
+
+def get_jujugui_static_dir():
+    """Return the static files directory of the installed Juju GUI."""
+    package_dir = run(
+        'python2', '-c',
+        'import os, jujugui; print(os.path.dirname(jujugui.__file__))')
+    return os.path.join(package_dir.strip(), 'static')
+
+
+def _write_file(path, contents):
+    """Atomically write the given contents to the given path."""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as temp_file:
+        temp_file.write(contents)
+    os.rename(temp_path, path)
+
+
+def _gzip(contents):
+    """Return the given contents compressed at the maximum level.
+
+    The modification time is not stored, so that the same contents are
+    always compressed to the same bytes.
+    """
+    output = io.BytesIO()
+    with gzip.GzipFile(
+            filename='', mode='wb', compresslevel=9, fileobj=output,
+            mtime=0) as gzip_file:
+        gzip_file.write(contents)
+    return output.getvalue()
+
+
+def compress_static_files(static_dir):
+    """Write the gzip variants of the Juju GUI static files.
+
+    A "<name>.gz" file is written next to each JavaScript, CSS, SVG and JSON
+    file, unless compressing does not make the file smaller, so that the
+    builtin server can send precompressed files to browsers. A manifest
+    mapping paths relative to the static directory to the size and the
+    SHA256 hash of the files and of their gzip variants is also written, and
+    returned as a dict.
+    """
+    manifest = {}
+    for dirpath, _, filenames in os.walk(static_dir):
+        for filename in filenames:
+            if (not filename.endswith(COMPRESSED_EXTENSIONS) or
+                    filename == STATIC_MANIFEST):
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path, 'rb') as static_file:
+                contents = static_file.read()
+            entry = {
+                'sha256': hashlib.sha256(contents).hexdigest(),
+                'size': len(contents),
+            }
+            compressed = _gzip(contents)
+            gzip_path = path + '.gz'
+            if len(compressed) < len(contents):
+                _write_file(gzip_path, compressed)
+                entry['gzip_sha256'] = hashlib.sha256(compressed).hexdigest()
+                entry['gzip_size'] = len(compressed)
+            elif os.path.exists(gzip_path):
+                os.remove(gzip_path)
+            manifest[os.path.relpath(path, static_dir)] = entry
+    _write_file(
+        os.path.join(static_dir, STATIC_MANIFEST),
+        json.dumps(manifest, indent=2, sort_keys=True))
+    return manifest
 
 
 def save_or_create_certificates(
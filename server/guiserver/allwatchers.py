@@ -0,0 +1,417 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Juju GUI server shared AllWatcher support.
+
+When Juju API connections are multiplexed (see guiserver.multiplex), the GUI
+server can also share AllWatchers: a single upstream watcher is kept for each
+model and access level, and its deltas are fanned out to all the subscribed
+browser connections.
+
+    - WatcherHub: the registry of shared watchers, owned by the multiplexer.
+      It intercepts WatchAll, Next and Stop requests sent by browsers.
+    - SharedWatcher: an upstream AllWatcher driven by the GUI server. It keeps
+      a snapshot of the model entities, so that new subscribers immediately
+      receive the current state of the model.
+    - Subscription: the watcher as seen by a single browser connection, which
+      refers to it using a GUI server generated watcher id.
+
+Watchers are only shared between sessions whose users have the same access
+level to the model, as reported by the Juju login response. If the access
+level is not available, watchers are only shared between browser connections
+of the same user.
+
+When the session driving a shared watcher is closed, the watcher is moved to
+the session of another subscriber, where a new upstream watcher is started.
+The first deltas of the new watcher describe the whole model: they replace
+the snapshot and are sent to the subscribers, together with remove deltas
+for the entities which disappeared in the meantime.
+"""
+
+from collections import OrderedDict
+import itertools
+import logging
+import re
+
+from tornado import escape
+
+from guiserver.utils import (
+    json_decode_dict,
+    make_type_matcher,
+)
+
+
+# Identify the browser requests possibly handled by the hub.
+_WATCH_ALL_PATTERN = re.compile(r'"Request"\s*:\s*"WatchAll"')
+_is_all_watcher_request = make_type_matcher(('AllWatcher',))
+# The prefix of the watcher ids returned to browsers.
+WATCHER_ID_PREFIX = 'gui-'
+# The entity fields used to identify entities, in order of precedence. Juju 1
+# uses capitalized names while Juju 2 uses lower case ones.
+_ENTITY_ID_FIELDS = ('Id', 'id', 'Name', 'name', 'Key', 'key', 'Tag', 'tag')
+
+
+def get_entity_id(entity):
+    """Return the identifier of the given entity.
+
+    Return None if the identifier cannot be found.
+    """
+    for field in _ENTITY_ID_FIELDS:
+        value = entity.get(field)
+        if value is not None:
+            return value
+    return None
+
+
+def get_access_key(apiurl, username, login_response):
+    """Return the key used to share watchers, given a login response.
+
+    Sessions sharing the same key are allowed to see the same deltas.
+    """
+    response = login_response.get('Response') or {}
+    user_info = response.get('user-info') or {}
+    access = user_info.get('model-access')
+    if access is None:
+        return (apiurl, 'user', username)
+    return (apiurl, 'access', access)
+
+
+def apply_deltas(snapshot, deltas):
+    """Apply the given deltas to the snapshot.
+
+    The snapshot is an ordered dict mapping (kind, id) keys to the most recent
+    delta for each entity.
+    """
+    for delta in deltas:
+        try:
+            kind, operation, entity = delta
+        except (TypeError, ValueError):
+            continue
+        key = (kind, get_entity_id(entity))
+        if operation == 'remove':
+            snapshot.pop(key, None)
+        else:
+            snapshot.pop(key, None)
+            snapshot[key] = delta
+
+
+def join_batches(batches):
+    """Join the given list of JSON encoded delta lists into a single list.
+
+    Empty lists are skipped.
+    """
+    parts = [batch[1:-1] for batch in batches]
+    return '[' + ','.join(part for part in parts if part.strip()) + ']'
+
+
+class WatcherHub(object):
+    """Handle the AllWatchers shared by browser connections."""
+
+    def __init__(self):
+        # Map access keys to shared watchers.
+        self.watchers = {}
+        # Map browser watcher ids to subscriptions.
+        self.subscriptions = {}
+        self._watcher_ids = itertools.count(1)
+
+    def handle(self, session, connection, request_id, message):
+        """Handle the given browser request if it is related to AllWatchers.
+
+        Return True if the request has been handled, False if it must be
+        propagated to the Juju API.
+        """
+        if _WATCH_ALL_PATTERN.search(message) is not None:
+            data = json_decode_dict(message)
+            if (data is None or data.get('Type') != 'Client' or
+                    session.access_key is None):
+                return False
+            self.subscribe(session, connection, request_id, data)
+            return True
+        if _is_all_watcher_request(message) is not None:
+            data = json_decode_dict(message)
+            if data is None:
+                return False
+            subscription = self.subscriptions.get(data.get('Id'))
+            if subscription is None:
+                return False
+            if data.get('Request') == 'Next':
+                subscription.next(request_id)
+            else:
+                # Only stop the subscription, not the shared watcher.
+                self.unsubscribe(subscription)
+                connection.on_message(make_response(request_id, '{}'))
+            return True
+        return False
+
+    def subscribe(self, session, connection, request_id, data):
+        """Subscribe the given browser connection to the shared watcher.
+
+        Start a new shared watcher if required.
+        """
+        watcher = self.watchers.get(session.access_key)
+        if watcher is None:
+            watcher = SharedWatcher(self, session, data.get('Version'))
+            self.watchers[session.access_key] = watcher
+            watcher.start()
+        watcher_id = WATCHER_ID_PREFIX + str(next(self._watcher_ids))
+        subscription = Subscription(watcher, session, connection, watcher_id)
+        watcher.subscriptions.add(subscription)
+        connection.subscriptions.add(subscription)
+        self.subscriptions[watcher_id] = subscription
+        response = escape.json_encode({'AllWatcherId': watcher_id})
+        connection.on_message(make_response(request_id, response))
+
+    def unsubscribe(self, subscription):
+        """Remove the given subscription.
+
+        Stop the shared watcher if this was its last subscription.
+        """
+        self.subscriptions.pop(subscription.watcher_id, None)
+        subscription.connection.subscriptions.discard(subscription)
+        watcher = subscription.watcher
+        watcher.subscriptions.discard(subscription)
+        if not watcher.subscriptions:
+            watcher.stop()
+
+    def remove(self, watcher):
+        """Remove the given shared watcher."""
+        if self.watchers.get(watcher.key) is watcher:
+            del self.watchers[watcher.key]
+        for subscription in list(watcher.subscriptions):
+            self.subscriptions.pop(subscription.watcher_id, None)
+            subscription.connection.subscriptions.discard(subscription)
+
+    def session_closed(self, session):
+        """Handle the given session being closed.
+
+        Remove the subscriptions of the session. Move the shared watchers
+        driven by the session to the session of another subscriber, or stop
+        them if no subscribers remain.
+        """
+        for subscription in list(self.subscriptions.values()):
+            if subscription.session is session:
+                self.unsubscribe(subscription)
+        for watcher in list(self.watchers.values()):
+            if watcher.session is not session:
+                continue
+            if watcher.subscriptions:
+                subscription = next(iter(watcher.subscriptions))
+                watcher.restart(subscription.session)
+            else:
+                watcher.fail('shared watcher stopped')
+
+
+class SharedWatcher(object):
+    """An AllWatcher whose deltas are fanned out to many subscribers."""
+
+    def __init__(self, hub, session, version):
+        self._hub = hub
+        self.session = session
+        self.key = session.access_key
+        self._version = version
+        self.subscriptions = set()
+        # The upstream watcher id, available once the watcher is started.
+        self.juju_watcher_id = None
+        # The current state of the model, as a map of (kind, id) keys to the
+        # most recent delta for each entity.
+        self.snapshot = OrderedDict()
+        # Whether the initial snapshot has been received from Juju.
+        self.ready = False
+        # The deltas key used in responses: Juju 2 uses lower case names.
+        self.deltas_key = 'Deltas'
+        self._stopped = False
+        # Whether the upstream watcher has been restarted in another session
+        # and its initial deltas have not been received yet.
+        self._restarted = False
+
+    def _make_request(self, request, **kwargs):
+        """Return a request data dictionary."""
+        data = dict(kwargs, Request=request)
+        if self._version is not None:
+            data['Version'] = self._version
+        return data
+
+    def start(self):
+        """Start the upstream watcher."""
+        logging.info('watchers: starting shared watcher for {}'.format(
+            self.key))
+        data = self._make_request('WatchAll', Type='Client', Params={})
+        self.session.call(data, self._on_watch_all)
+
+    def restart(self, session):
+        """Start a new upstream watcher using the given session."""
+        logging.info('watchers: moving shared watcher for {}'.format(
+            self.key))
+        self.session = session
+        self.juju_watcher_id = None
+        self._restarted = True
+        self.start()
+
+    def _on_watch_all(self, data):
+        """Handle the WatchAll response and start retrieving deltas."""
+        if self._check_error(data):
+            return
+        self.juju_watcher_id = data.get('Response', {}).get('AllWatcherId')
+        if self._stopped:
+            return self.stop()
+        self._next()
+
+    def _next(self):
+        """Request the next deltas to the upstream watcher."""
+        data = self._make_request(
+            'Next', Type='AllWatcher', Id=self.juju_watcher_id)
+        self.session.call(data, self._on_next)
+
+    def _on_next(self, data):
+        """Apply the received deltas and fan them out to the subscribers."""
+        if self._stopped or self._check_error(data):
+            return
+        response = data.get('Response') or {}
+        if 'deltas' in response:
+            self.deltas_key = 'deltas'
+        deltas = response.get(self.deltas_key) or []
+        if self._restarted:
+            self._restarted = False
+            deltas = self.replace(deltas)
+        else:
+            self.apply(deltas)
+        self.ready = True
+        if deltas:
+            batch = escape.json_encode(deltas)
+            for subscription in self.subscriptions:
+                subscription.push(batch)
+        else:
+            # Only send the snapshot to the browsers waiting for it.
+            for subscription in self.subscriptions:
+                subscription.flush()
+        self._next()
+
+    def _check_error(self, data):
+        """Fail the watcher if the given response is an error.
+
+        Return True if the watcher failed.
+        """
+        error = data.get('Error')
+        if error is None:
+            return False
+        self.fail(error)
+        return True
+
+    def apply(self, deltas):
+        """Apply the given deltas to the snapshot."""
+        apply_deltas(self.snapshot, deltas)
+
+    def replace(self, deltas):
+        """Replace the snapshot with the given deltas describing the model.
+
+        Return the given deltas followed by remove deltas for the entities
+        which are no longer in the model.
+        """
+        previous = self.snapshot
+        self.snapshot = OrderedDict()
+        self.apply(deltas)
+        removed = [
+            [delta[0], 'remove', delta[2]]
+            for key, delta in previous.items() if key not in self.snapshot]
+        return deltas + removed
+
+    def get_snapshot(self):
+        """Return the snapshot as a JSON encoded list of deltas."""
+        return escape.json_encode(self.snapshot.values())
+
+    def stop(self):
+        """Stop the upstream watcher and remove it from the hub."""
+        self._stopped = True
+        self._hub.remove(self)
+        if self.juju_watcher_id is not None:
+            data = self._make_request(
+                'Stop', Type='AllWatcher', Id=self.juju_watcher_id)
+            self.session.call(data, lambda data: None)
+        logging.info('watchers: shared watcher for {} stopped'.format(
+            self.key))
+
+    def fail(self, error):
+        """Stop the watcher and return the given error to the subscribers."""
+        logging.error('watchers: shared watcher for {} failed: {}'.format(
+            self.key, error))
+        self._stopped = True
+        subscriptions = list(self.subscriptions)
+        self._hub.remove(self)
+        for subscription in subscriptions:
+            subscription.fail(error)
+
+
+class Subscription(object):
+    """A browser connection subscribed to a shared watcher."""
+
+    def __init__(self, watcher, session, connection, watcher_id):
+        self.watcher = watcher
+        # The shared session the browser connection is attached to.
+        self.session = session
+        self.connection = connection
+        self.watcher_id = watcher_id
+        self._snapshot_sent = False
+        # JSON encoded delta lists not yet sent to the browser.
+        self._pending = []
+        # The id of the Next request waiting for deltas, if any.
+        self._parked_request_id = None
+
+    def next(self, request_id):
+        """Handle a Next request from the browser."""
+        self._parked_request_id = request_id
+        self.flush()
+
+    def push(self, batch):
+        """Queue the given JSON encoded deltas for the browser."""
+        if self._snapshot_sent:
+            self._pending.append(batch)
+        self.flush()
+
+    def flush(self):
+        """Send the pending deltas if the browser is waiting for them."""
+        request_id = self._parked_request_id
+        if request_id is None:
+            return
+        if not self._snapshot_sent:
+            if not self.watcher.ready:
+                return
+            deltas = self.watcher.get_snapshot()
+            self._snapshot_sent = True
+        elif self._pending:
+            deltas = join_batches(self._pending)
+            self._pending = []
+        else:
+            return
+        self._parked_request_id = None
+        response = '{"' + self.watcher.deltas_key + '":' + deltas + '}'
+        self.connection.on_message(make_response(request_id, response))
+
+    def fail(self, error):
+        """Return the given error to the browser if it is waiting for deltas.
+        """
+        request_id = self._parked_request_id
+        if request_id is not None:
+            self._parked_request_id = None
+            self.connection.on_message(escape.json_encode({
+                'RequestId': request_id,
+                'Error': error,
+                'Response': {},
+            }))
+
+
+def make_response(request_id, response):
+    """Return a JSON encoded response, given the encoded response value."""
+    return '{"RequestId":' + str(request_id) + ',"Response":' + response + '}'
@@ -17,6 +17,7 @@
 """Juju GUI server applications."""
 
 from distutils.version import LooseVersion
+import os
 import time
 
 from pyramid.config import Configurator
@@ -26,10 +27,22 @@ from tornado.wsgi import WSGIContainer
 
 from guiserver import (
     auth,
+    backpressure,
+    cache,
+    deflate,
+    frames,
     handlers,
+    reconnect,
+    static,
+    stores,
     utils,
+    wsgi,
 )
+from guiserver.multiplex import Multiplexer
+from guiserver.pool import ConnectionPool
+from guiserver.bundles import views
 from guiserver.bundles.base import Deployer
+import jujugui
 from jujugui import make_application
 
 
@@ -41,26 +54,133 @@ WEBSOCKET_MODEL_TARGET_TEMPLATE = 'wss://{server}:{port}/model/{uuid}/api'
 WEBSOCKET_TARGET_TEMPLATE_PRE2 = 'wss://{server}:{port}/environment/{uuid}/api'
 
 
-def server():
+def _get_compression_options():
+    """Return the WebSocket compression options.
+
+    Return None if WebSocket compression is disabled.
+    """
+    if not options.wscompression:
+        return None
+    return deflate.CompressionOptions(
+        level=options.wscompressionlevel,
+        window_bits=options.wscompressionwindowbits,
+        context_takeover=options.wscompressioncontexttakeover)
+
+
+def _get_watermarks():
+    """Return the WebSocket backpressure watermarks.
+
+    Return None if backpressure is disabled.
+    """
+    if not options.wshighwatermark:
+        return None
+    return backpressure.Watermarks(
+        options.wshighwatermark, options.wslowwatermark,
+        policy=options.wsbackpressure)
+
+
+def _get_reconnect_policy():
+    """Return the policy used to reconnect to the Juju API.
+
+    Return None if reconnections are disabled.
+    """
+    if not options.wsreconnectattempts:
+        return None
+    addresses = [
+        address.strip() for address in options.apiaddresses.split(',')
+        if address.strip()]
+    return reconnect.ReconnectPolicy(
+        options.wsreconnectattempts, addresses=addresses)
+
+
+def _get_frame_log_options():
+    """Return the options used to log WebSocket frames."""
+    return frames.FrameLogOptions(
+        sample=options.wslogsample, max_payload=options.wslogpayload,
+        ring_size=options.wsframes)
+
+
+def _get_response_cache(application):
+    """Return the given WSGI application wrapped by the response cache.
+
+    Return the application itself if the cache is disabled in the options.
+    The cache is cleared when a new jujugui release is installed.
+    """
+    if not options.wsgicachesize:
+        return application
+    return cache.ResponseCache(
+        application, max_size=options.wsgicachesize,
+        release_path=os.path.dirname(jujugui.__file__))
+
+
+def _get_wsgi_container(application):
+    """Return the container serving the given WSGI application.
+
+    The application is run in a pool of threads, unless disabled in the
+    options.
+    """
+    if not options.wsgithreads:
+        return WSGIContainer(application)
+    return wsgi.ThreadedWSGIContainer(
+        application, max_workers=options.wsgithreads,
+        max_queued=options.wsgiqueue)
+
+
+def _get_token_stores(shared_state):
+    """Return the authentication and change set token stores.
+
+    Tokens are stored in a SQLite database if a path is provided in the
+    options, in the shared state if running multiple worker processes, or
+    in memory otherwise.
+    """
+    if options.tokenstore:
+        return (
+            stores.SQLiteTokenStore(options.tokenstore, 'auth_tokens'),
+            stores.SQLiteTokenStore(options.tokenstore, 'changesets'),
+        )
+    if shared_state is not None:
+        return shared_state.tokens, shared_state.changesets
+    return stores.MemoryTokenStore(), stores.MemoryTokenStore()
+
+
+def server(shared_state=None):
     """Return the main server application.
 
     The server app is responsible for serving the WebSocket connection, the
     Juju GUI static files and the main index file for dynamic URLs.
+    If a shared state is provided, authentication and change set tokens are
+    shared with the other worker processes: see guiserver.workers.
     """
     # Set up the bundle deployer.
     deployer = Deployer(options.apiurl, options.apiversion,
                         options.charmworldurl)
+    compression = _get_compression_options()
     # Set up handlers.
     server_handlers = []
+    tokens = None
     if options.sandbox:
         # Sandbox mode.
         server_handlers.append(
-            (r'^/ws(?:/.*)?$', handlers.SandboxHandler, {}))
+            (r'^/ws(?:/.*)?$', handlers.SandboxHandler,
+                {'compression': compression}))
     else:
         # Real environment.
         is_legacy_juju = LooseVersion(options.jujuversion) < LooseVersion('2')
-        tokens = auth.AuthenticationTokenHandler()
+        token_store, changeset_store = _get_token_stores(shared_state)
+        views.set_changeset_store(changeset_store)
+        stores.Sweeper([token_store, changeset_store]).start()
+        tokens = auth.AuthenticationTokenHandler(store=token_store)
         auth_backend = auth.get_backend(options.apiversion)
+        watermarks = _get_watermarks()
+        reconnect_policy = _get_reconnect_policy()
+        frame_log_options = _get_frame_log_options()
+        pool = None
+        if options.poolsize:
+            pool = ConnectionPool(options.poolsize)
+        multiplexer = None
+        if options.multiplex:
+            multiplexer = Multiplexer(
+                share_watchers=options.sharewatchers, pool=pool)
         ws_model_target_template = WEBSOCKET_MODEL_TARGET_TEMPLATE
         if is_legacy_juju:
             ws_model_target_template = WEBSOCKET_TARGET_TEMPLATE_PRE2
@@ -75,6 +195,25 @@ def server():
                 'deployer': deployer,
                 # The tokens collection for authentication token requests.
                 'tokens': tokens,
+                # The WebSocket compression options.
+                'compression': compression,
+                # The multiplexer used for sharing Juju API connections.
+                'multiplexer': multiplexer,
+                # The pool of idle Juju API connections.
+                'pool': pool,
+                # The limits for messages queued while connecting to Juju.
+                'max_queued_messages': options.wsqueuemessages,
+                'max_queued_size': options.wsqueuesize,
+                # The browser connection backpressure watermarks.
+                'watermarks': watermarks,
+                # The policy used to reconnect to the Juju API.
+                'reconnect_policy': reconnect_policy,
+                # The seconds a Juju API connection is parked for resumption.
+                'resume_grace': options.resumegrace,
+                # The options used to log proxied frames.
+                'frame_log_options': frame_log_options,
+                # Whether to record the latency of Juju API requests.
+                'measure_latency': options.wslatency,
                 # The WebSocket URL template the browser uses for connecting.
                 'ws_source_template': WEBSOCKET_CONTROLLER_SOURCE_TEMPLATE,
                 # The WebSocket URL template used for connecting to Juju.
@@ -92,6 +231,25 @@ def server():
             'deployer': deployer,
             # The tokens collection for authentication token requests.
             'tokens': tokens,
+            # The WebSocket compression options.
+            'compression': compression,
+            # The multiplexer used for sharing Juju API connections.
+            'multiplexer': multiplexer,
+            # The pool of idle Juju API connections.
+            'pool': pool,
+            # The limits for messages queued while connecting to Juju.
+            'max_queued_messages': options.wsqueuemessages,
+            'max_queued_size': options.wsqueuesize,
+            # The browser connection backpressure watermarks.
+            'watermarks': watermarks,
+            # The policy used to reconnect to the Juju API.
+            'reconnect_policy': reconnect_policy,
+            # The seconds a Juju API connection is parked for resumption.
+            'resume_grace': options.resumegrace,
+            # The options used to log proxied frames.
+            'frame_log_options': frame_log_options,
+            # Whether to record the latency of Juju API requests.
+            'measure_latency': options.wslatency,
             # The WebSocket URL template the browser uses for the connection.
             'ws_source_template': WEBSOCKET_MODEL_SOURCE_TEMPLATE,
             # The WebSocket URL template used for connecting to Juju.
@@ -123,6 +281,11 @@ def server():
         'sandbox': options.sandbox,
         'start_time': int(time.time()),
     }
+    profile_handler_options = {
+        'directory': options.profiledir,
+        'token': options.profiletoken,
+        'duration': options.profileduration,
+    }
     wsgi_settings = {
         'jujugui.apiAddress': options.apiurl,
         'jujugui.combine': not options.jujuguidebug,
@@ -144,10 +307,27 @@ def server():
     if options.password:
         wsgi_settings['jujugui.password'] = options.password
     config = Configurator(settings=wsgi_settings)
-    wsgi_app = WSGIContainer(make_application(config))
+    static_path = os.path.join(os.path.dirname(jujugui.__file__), 'static')
+    static_handler_options = {
+        'path': static_path,
+        'manifest': static.load_manifest(static_path),
+    }
+    wsgi_app = _get_wsgi_container(
+        _get_response_cache(make_application(config)))
     server_handlers.extend([
         # Handle GUI server info.
         (r'^/gui-server-info', handlers.InfoHandler, info_handler_options),
+        # Handle GUI server Juju API latency histograms.
+        (r'^/gui-server-latency', handlers.LatencyHandler),
+        # Handle GUI server metrics in the Prometheus text format.
+        (r'^/metrics', handlers.MetricsHandler,
+            {'deployer': deployer, 'tokens': tokens}),
+        # Handle requests to start the sampling profiler.
+        (r'^/gui-server-profile', handlers.ProfileHandler,
+            profile_handler_options),
+        # Serve the Juju GUI static files.
+        (r'^/static/(.*)', static.StaticFileHandler,
+            static_handler_options),
         (r".*", web.FallbackHandler, dict(fallback=wsgi_app))
     ])
     return web.Application(server_handlers, debug=options.debug)
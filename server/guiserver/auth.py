@@ -51,6 +51,8 @@ import uuid
 
 from tornado.ioloop import IOLoop
 
+from guiserver import stores
+
 
 class User(object):
     """The current WebSocket user."""
@@ -285,14 +287,45 @@ class AuthenticationTokenHandler(object):
             'ErrorCode': 'unauthorized access',
             'Response': {},
         }
+
+    Authenticated users can also ask for a resume token, used to reattach
+    to the same Juju API connection after a page reload (see
+    guiserver.resume). The token is only valid for the grace window
+    starting when the browser connection is closed.
+
+        {
+            'RequestId': 42,
+            'Type': 'GUIToken',
+            'Request': 'CreateResume',
+            'Params': {},
+        }
+
+    A successful response looks like {'RequestId': 42, 'Response': {'Token':
+    'TOKEN-STRING'}}. A resume request looks like the following:
+
+        {
+            'RequestId': 42,
+            'Type': 'GUIToken',
+            'Request': 'Resume',
+            'Params': {'Token': 'TOKEN-STRING'},
+        }
     """
 
-    def __init__(self, max_life=datetime.timedelta(minutes=2), io_loop=None):
+    def __init__(
+            self, max_life=datetime.timedelta(minutes=2), io_loop=None,
+            store=None):
         self._max_life = max_life
         if io_loop is None:
             io_loop = IOLoop.current()
         self._io_loop = io_loop
-        self._data = {}
+        # Map tokens to credentials. The store can be shared by worker
+        # processes: see guiserver.stores and guiserver.workers. Expired
+        # tokens are removed by the store sweeper.
+        if store is None:
+            store = stores.MemoryTokenStore()
+        self._store = store
+        # Map resume tokens to parked sessions.
+        self._parked = {}
 
     def token_requested(self, data):
         """Does data represent a token creation request?  True or False."""
@@ -312,21 +345,15 @@ class AuthenticationTokenHandler(object):
                 Response={}))
             return
         token = uuid.uuid4().hex
-
-        def expire_token():
-            self._data.pop(token, None)
-            logging.info('auth: expired token {}'.format(token))
-        handle = self._io_loop.add_timeout(self._max_life, expire_token)
         now = datetime.datetime.utcnow()
         # Stashing these is a security risk.  We currently deem this risk to
         # be acceptably small.  Even keeping an authenticated websocket in
         # memory seems to be of a similar risk profile, and we cannot operate
         # without that.
-        self._data[token] = dict(
+        self._store.put(token, dict(
             username=user.username,
             password=user.password,
-            handle=handle
-            )
+            ), self._max_life)
         write_message({
             'RequestId': data['RequestId'],
             'Response': {
@@ -350,10 +377,9 @@ class AuthenticationTokenHandler(object):
     def process_authentication_request(self, data, write_message):
         """Get the credentials for the token, or send an error."""
         token = data['Params']['Token']
-        credentials = self._data.pop(token, None)
+        credentials = self._store.pop(token)
         if credentials is not None:
             logging.info('auth: using token {}'.format(token))
-            self._io_loop.remove_timeout(credentials['handle'])
             return credentials['username'], credentials['password']
         else:
             write_message({
@@ -365,6 +391,76 @@ class AuthenticationTokenHandler(object):
             # None is an explicit return marker to say "I handled this".
             # It is returned by default.
 
+    def resume_token_requested(self, data):
+        """Does data represent a resume token creation request?
+
+        Return True or False.
+        """
+        return (
+            'RequestId' in data and
+            data.get('Type') == 'GUIToken' and
+            data.get('Request') == 'CreateResume'
+        )
+
+    def process_resume_token_request(self, data, user, write_message):
+        """Create a resume token and send it back.
+
+        Return the token, or None if the user is not authenticated. The token
+        can be used only after the session is parked: see park.
+        """
+        if not user.is_authenticated:
+            write_message(dict(
+                RequestId=data['RequestId'],
+                Error='tokens can only be created by authenticated users.',
+                ErrorCode='unauthorized access',
+                Response={}))
+            return None
+        token = uuid.uuid4().hex
+        write_message({
+            'RequestId': data['RequestId'],
+            'Response': {'Token': token},
+        })
+        return token
+
+    def resume_requested(self, data):
+        """Does data represent a session resume request?  True or False."""
+        params = data.get('Params', {})
+        return (
+            'RequestId' in data and
+            data.get('Type') == 'GUIToken' and
+            data.get('Request') == 'Resume' and
+            'Token' in params
+        )
+
+    def park(self, token, session, max_life):
+        """Store the given parked session, resumable using the given token.
+
+        The session expire method is called if the session is not resumed
+        before the given max life timedelta elapses.
+        """
+        def expire_session():
+            self._parked.pop(token, None)
+            logging.info('auth: expired resume token {}'.format(token))
+            session.expire()
+        handle = self._io_loop.add_timeout(max_life, expire_session)
+        self._parked[token] = dict(session=session, handle=handle)
+
+    def unpark(self, token):
+        """Return the session parked with the given token.
+
+        Return None if the token is unknown, already used or expired.
+        """
+        info = self._parked.pop(token, None)
+        if info is None:
+            return None
+        logging.info('auth: using resume token {}'.format(token))
+        self._io_loop.remove_timeout(info['handle'])
+        return info['session']
+
+    def sizes(self):
+        """Return the number of stored tokens and parked sessions."""
+        return {'tokens': len(self._store), 'parked': len(self._parked)}
+
     def process_authentication_response(self, data, user):
         """Make a successful token authentication response.
 
@@ -0,0 +1,194 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Juju GUI server WebSocket backpressure support.
+
+Messages received from the Juju API are written to the browser connection as
+soon as they arrive. If the browser is slower than Juju, the browser stream
+write buffer grows without limits. To avoid that, reading from the Juju API
+connection is paused when the buffered outbound bytes exceed a high
+watermark, and resumed when they drop below a low watermark.
+
+Reading is paused between WebSocket frames: while paused, the Juju API
+stream stops reading from the socket, so that TCP flow control eventually
+slows down the Juju API server itself.
+
+Alternatively, AllWatcher deltas can be coalesced while the browser is
+congested, without pausing the Juju API connection: see guiserver.coalesce.
+"""
+
+import logging
+
+from tornado.ioloop import IOLoop
+
+
+# The interval, in seconds, between checks of a congested browser stream.
+POLL_INTERVAL = 0.05
+# The policies used when a browser connection is congested.
+PAUSE = 'pause'
+COALESCE = 'coalesce'
+POLICIES = (PAUSE, COALESCE)
+
+
+class Watermarks(object):
+    """Hold the high and low watermarks, in bytes, and the policy to apply.
+    """
+
+    def __init__(self, high, low, policy=PAUSE):
+        if low > high:
+            raise ValueError('low watermark greater than high watermark')
+        if policy not in POLICIES:
+            raise ValueError('invalid backpressure policy: {}'.format(policy))
+        self.high = high
+        self.low = low
+        self.policy = policy
+
+
+class BackpressureStats(object):
+    """Collect backpressure counters."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Reset all the counters."""
+        # The number of connections currently stalled.
+        self.stalled = 0
+        # The number of times connections have been stalled.
+        self.stalls = 0
+        # The number of deltas superseded by newer ones for the same entity.
+        self.coalesced = 0
+
+    def as_dict(self):
+        """Return the counters."""
+        return {
+            'stalled': self.stalled,
+            'stalls': self.stalls,
+            'coalesced': self.coalesced,
+        }
+
+
+# Collect backpressure counters for all the connections in this process.
+stats = BackpressureStats()
+
+
+def get_write_buffer_size(stream):
+    """Return the number of bytes buffered for writing in the given stream.
+    """
+    if not stream.writing():
+        return 0
+    return sum(len(chunk) for chunk in stream._write_buffer)
+
+
+class Backpressure(object):
+    """Pause reading from a WebSocket connection while a browser is congested.
+
+    The source is a guiserver.clients.WebSocketClientConnection, and the
+    handler is the WebSocket handler messages read from the source are
+    written to.
+    """
+
+    def __init__(
+            self, watermarks, source, handler, io_loop=None, summary=''):
+        if io_loop is None:
+            io_loop = IOLoop.current()
+        self._io_loop = io_loop
+        self._watermarks = watermarks
+        self._handler = handler
+        self._summary = summary
+        self._timeout = None
+        self.paused = False
+        # Wrap the protocol method used to start reading the next frame.
+        protocol = self._protocol = source.protocol
+        self._receive_frame = protocol._receive_frame
+        self._receive_pending = False
+        protocol._receive_frame = self._maybe_receive_frame
+
+    def _maybe_receive_frame(self):
+        """Read the next frame unless reading is paused."""
+        if self.paused:
+            self._receive_pending = True
+        else:
+            self._receive_frame()
+
+    def _get_stream(self):
+        """Return the browser stream, or None if the browser disconnected."""
+        ws_connection = self._handler.ws_connection
+        if ws_connection is None or ws_connection.stream.closed():
+            return None
+        return ws_connection.stream
+
+    def check(self):
+        """Pause reading if the browser exceeds the high watermark.
+
+        This is called each time a message is written to the browser.
+        """
+        if self.paused:
+            return
+        stream = self._get_stream()
+        if stream is None:
+            return
+        size = get_write_buffer_size(stream)
+        if size > self._watermarks.high:
+            logging.warning(self._summary + 'browser connection stalled: '
+                            '{} bytes buffered'.format(size))
+            self.paused = True
+            stats.stalled += 1
+            stats.stalls += 1
+            self._schedule()
+
+    def _schedule(self):
+        """Schedule the next browser stream check."""
+        self._timeout = self._io_loop.add_timeout(
+            self._io_loop.time() + POLL_INTERVAL, self._poll)
+
+    def _poll(self):
+        """Resume reading if the browser dropped below the low watermark."""
+        self._timeout = None
+        stream = self._get_stream()
+        if stream is None:
+            return self.close()
+        if get_write_buffer_size(stream) > self._watermarks.low:
+            return self._schedule()
+        logging.info(self._summary + 'browser connection resumed')
+        self._resume()
+
+    def _resume(self):
+        """Resume reading frames."""
+        self.paused = False
+        stats.stalled -= 1
+        if self._receive_pending:
+            self._receive_pending = False
+            self._receive_frame()
+
+    def close(self):
+        """Stop applying backpressure.
+
+        Reading from the source is restored, as the source may outlive the
+        browser connection (see guiserver.resume).
+        """
+        if self._timeout is not None:
+            self._io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+        if self.paused:
+            self.paused = False
+            stats.stalled -= 1
+        protocol = self._protocol
+        protocol._receive_frame = self._receive_frame
+        if self._receive_pending:
+            self._receive_pending = False
+            if not protocol.stream.closed():
+                self._receive_frame()
@@ -0,0 +1,171 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Juju GUI server micro-benchmarks.
+
+Benchmarks are simple functions measuring the per-operation cost of hot code
+paths in the GUI server, usually comparing a new implementation against the
+one it replaced. Each benchmark function returns a list of (label, seconds)
+tuples, where seconds is the average time spent for a single operation.
+Use the runbenchmarks.py script to run all the benchmarks.
+"""
+
+import timeit
+import uuid
+
+from tornado import escape
+from tornado.ioloop import IOLoop
+
+from guiserver import (
+    auth,
+    handlers,
+)
+from guiserver.bundles.base import (
+    ChangeSetMiddleware,
+    DeployMiddleware,
+)
+from guiserver.expiry import TimingWheel
+from guiserver.utils import json_decode_dict
+
+
+# Define how many times each operation is repeated by default.
+DEFAULT_NUMBER = 10000
+
+
+def _make_messages():
+    """Return a list of (label, message) tuples representing GUI requests."""
+    deltas = [
+        ['unit', 'change', {'Name': 'django/{}'.format(i), 'Status': 'ok'}]
+        for i in range(200)
+    ]
+    return [
+        ('small request', escape.json_encode({
+            'RequestId': 42,
+            'Type': 'Client',
+            'Request': 'FullStatus',
+            'Params': {},
+        })),
+        ('large request', escape.json_encode({
+            'RequestId': 47,
+            'Type': 'Client',
+            'Request': 'SetAnnotations',
+            'Params': {'Deltas': deltas},
+        })),
+        ('change set request', escape.json_encode({
+            'RequestId': 1,
+            'Type': 'ChangeSet',
+            'Request': 'GetChanges',
+            'Params': {'YAML': 'services: {}'},
+        })),
+    ]
+
+
+def _measure(function, message, number):
+    """Return the average time spent calling function(message)."""
+    timer = timeit.Timer(lambda: function(message))
+    return timer.timeit(number=number) / number
+
+
+def message_classification(number=DEFAULT_NUMBER):
+    """Compare browser messages classification strategies.
+
+    The legacy chain decodes every message and then checks each middleware
+    in turn. The matcher only decodes messages that could be handled by the
+    GUI server middlewares.
+    """
+    user = auth.User()
+    changeset = ChangeSetMiddleware(user, None)
+    deployment = DeployMiddleware(user, None, None)
+    tokens = auth.AuthenticationTokenHandler(io_loop=object())
+    backend = auth.get_backend('go')
+
+    def legacy_chain(message):
+        data = json_decode_dict(message)
+        if data is not None:
+            (changeset.requested(data) or
+             deployment.requested(data) or
+             backend.request_is_login(data) or
+             tokens.authentication_requested(data) or
+             tokens.token_requested(data))
+
+    def matcher(message):
+        if handlers.get_server_request_type(message) is not None:
+            json_decode_dict(message)
+
+    results = []
+    for label, message in _make_messages():
+        results.extend([
+            ('{} (legacy chain)'.format(label),
+             _measure(legacy_chain, message, number)),
+            ('{} (matcher)'.format(label),
+             _measure(matcher, message, number)),
+        ])
+    return results
+
+
+def token_expiry(number=DEFAULT_NUMBER):
+    """Compare token expiry strategies.
+
+    Each timing is the cost of creating and then using a token, measured
+    over a burst of number tokens. Tokens used to register an IO loop timeout
+    each, cancelled when the token is used. The timing wheel adds tokens to
+    coarse buckets swept periodically.
+    """
+    tokens = [uuid.uuid4().hex for _ in range(number)]
+    io_loop = IOLoop()
+    wheel = TimingWheel()
+
+    def expire_token():
+        pass
+
+    def timeouts():
+        deadline = io_loop.time() + 120
+        handles = [
+            io_loop.add_timeout(deadline, expire_token) for _ in tokens]
+        for handle in handles:
+            io_loop.remove_timeout(handle)
+
+    def timing_wheel():
+        expires = io_loop.time() + 120
+        for token in tokens:
+            wheel.add(token, expires)
+        for token in tokens:
+            wheel.discard(token)
+
+    try:
+        return [
+            ('token burst (IO loop timeouts)',
+             timeit.Timer(timeouts).timeit(number=1) / number),
+            ('token burst (timing wheel)',
+             timeit.Timer(timing_wheel).timeit(number=1) / number),
+        ]
+    finally:
+        io_loop.close()
+
+
+# Define the list of benchmarks run by main().
+BENCHMARKS = (
+    message_classification,
+    token_expiry,
+)
+
+
+def main():
+    """Run all the benchmarks and print the results."""
+    for benchmark in BENCHMARKS:
+        print(benchmark.__name__)
+        for label, seconds in benchmark():
+            print('  {:<40} {:>10.2f} us'.format(label, seconds * 1e6))
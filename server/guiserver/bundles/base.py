@@ -92,6 +92,10 @@ class Deployer(object):
         self._queue = []
         # The futures attribute maps deployment identifiers to Futures.
         self._futures = {}
+        # The seconds spent by the validation and import workers, and when
+        # the import worker started processing the current queue.
+        self._busy_time = {'validate': 0.0, 'import': 0.0}
+        self._import_started = None
 
         # Options used by the juju-deployer.
         self.importer_options = blocking.get_default_guiserver_options()
@@ -113,12 +117,15 @@ class Deployer(object):
         apiversion = self._apiversion
         if apiversion not in SUPPORTED_API_VERSIONS:
             raise gen.Return('unsupported API version: {}'.format(apiversion))
+        started = time.time()
         try:
             yield self._validate_executor.submit(
                 blocking.validate, self._apiurl, user.username, user.password,
                 bundle)
         except Exception as err:
             raise gen.Return(str(err))
+        finally:
+            self._busy_time['validate'] += time.time() - started
 
     def import_bundle(
             self, user, name, bundle, version, bundle_id, test_callback=None):
@@ -146,6 +153,8 @@ class Deployer(object):
         deployment_id = self._observer.add_deployment()
         self._observer.notify_position(deployment_id, len(self._queue))
         # Add this deployment to the queue.
+        if not self._queue:
+            self._import_started = time.time()
         self._queue.append(deployment_id)
         # Add the import bundle job to the run executor, and set up a callback
         # to be called when the import process completes.
@@ -188,6 +197,9 @@ class Deployer(object):
         # Remove the completed deployment job from the queue.
         self._queue.remove(deployment_id)
         del self._futures[deployment_id]
+        if not self._queue and self._import_started is not None:
+            self._busy_time['import'] += time.time() - self._import_started
+            self._import_started = None
         # Notify the new position of all remaining deployments in the queue.
         for position, deploy_id in enumerate(self._queue):
             self._observer.notify_position(deploy_id, position)
@@ -244,6 +256,17 @@ class Deployer(object):
         watchers = self._observer.deployments.values()
         return [i.getlast() for i in watchers]
 
+    def worker_stats(self):
+        """Return the deployment queue length and the workers busy time.
+
+        The busy time is the number of seconds each worker (validate or
+        import) spent processing jobs.
+        """
+        busy_time = dict(self._busy_time)
+        if self._import_started is not None:
+            busy_time['import'] += time.time() - self._import_started
+        return {'queue': len(self._queue), 'busy_time': busy_time}
+
 
 class DeployMiddleware(object):
     """Handle the bundles deployment request/response process.
@@ -69,9 +69,9 @@ from jujubundlelib import (
     validation,
 )
 from tornado import gen
-from tornado.ioloop import IOLoop
 import yaml
 
+from guiserver import stores
 from guiserver.bundles.utils import (
     prepare_bundle,
     require_authenticated_user,
@@ -208,8 +208,10 @@ def next(request, deployer):
     changes = yield deployer.next(watcher_id)
     if changes is None:
         raise response(error='invalid request: invalid watcher identifier')
-    logging.info('next: returning changes for watcher {}:\n{}'.format(
-        watcher_id, changes))
+    # The changes can be a long list: only log them when debugging.
+    logging.info('next: returning changes for watcher {} ({} changes)'.format(
+        watcher_id, len(changes)))
+    logging.debug('next: changes for watcher %s:\n%s', watcher_id, changes)
     raise response({'Changes': changes})
 
 
@@ -252,8 +254,10 @@ def status(request, deployer):
     raise response({'LastChanges': last_changes})
 
 
-# Map bundle tokens to the corresponding set of changes and the expire handle.
-_bundle_changesets = {}
+# Map bundle tokens to the corresponding set of changes. The store can be
+# shared by worker processes: see set_changeset_store. Expired tokens are
+# removed by the store sweeper.
+_bundle_changesets = stores.MemoryTokenStore()
 # Define the expiration timeout for a bundle token.
 _bundle_max_life = datetime.timedelta(minutes=2)
 
@@ -282,14 +286,12 @@ def get_changes(request):
     token = params.get('Token')
     if token is not None:
         # Retrieve the change set using the provided token.
-        data = _bundle_changesets.pop(token, None)
-        if data is None:
+        changes = _bundle_changesets.pop(token)
+        if changes is None:
             error = 'unknown, fulfilled, or expired bundle token'
             raise response(error=error)
         logging.info('get change set: using token {}'.format(token))
-        io_loop = IOLoop.current()
-        io_loop.remove_timeout(data['handle'])
-        raise response({'Changes': data['changes']})
+        raise response({'Changes': changes})
 
     # Retrieve the change set using the provided bundle content.
     content = params.get('YAML')
@@ -325,18 +327,8 @@ def set_changes(request):
 
     # Create and store the bundle token.
     token = uuid.uuid4().hex
-
-    def expire_token():
-        _bundle_changesets.pop(token, None)
-        logging.info('set change set: expired token {}'.format(token))
-
-    io_loop = IOLoop.current()
-    handle = io_loop.add_timeout(_bundle_max_life, expire_token)
     now = datetime.datetime.utcnow()
-    _bundle_changesets[token] = {
-        'changes': changes,
-        'handle': handle,
-    }
+    _bundle_changesets.put(token, changes, _bundle_max_life)
     raise response({
         'Token': token,
         'Created': now.isoformat() + 'Z',
@@ -344,6 +336,16 @@ def set_changes(request):
     })
 
 
+def set_changeset_store(store):
+    """Store the change set tokens in the given token store.
+
+    This is used to share change set tokens between processes: see
+    guiserver.stores and guiserver.workers.
+    """
+    global _bundle_changesets
+    _bundle_changesets = store
+
+
 def _validate_and_parse_bundle(content):
     """Validate and parse the given bundle YAML encoded content.
 
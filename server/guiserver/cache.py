@@ -0,0 +1,335 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Juju GUI server WSGI response cache.
+
+The responses of the jujugui application (the index, config.js and the
+combined JavaScript and CSS files) only depend on the application settings,
+which do not change while the GUI server runs, and on the request path and
+query. The ResponseCache is a WSGI middleware storing those responses, so
+that they are generated only once.
+
+Cached responses include an ETag and a Last-Modified header, and conditional
+requests get a "304 Not Modified" response. The cache is bounded in size,
+evicting the least recently used responses, and it is cleared when a new
+Juju GUI release is installed.
+"""
+
+from collections import OrderedDict
+from email.utils import (
+    formatdate,
+    mktime_tz,
+    parsedate_tz,
+)
+import hashlib
+import logging
+import os
+import threading
+import time
+
+
+# The default maximum size in bytes of the cached responses.
+DEFAULT_MAX_SIZE = 32 * 1024 * 1024
+# The seconds between checks for a new Juju GUI release.
+RELEASE_CHECK_INTERVAL = 5
+# The headers included in "304 Not Modified" responses.
+NOT_MODIFIED_HEADERS = frozenset([
+    'cache-control',
+    'content-location',
+    'date',
+    'etag',
+    'expires',
+    'last-modified',
+    'vary',
+])
+
+
+class CacheStats(object):
+    """Collect response cache counters."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Reset all the counters."""
+        # The number of requests served from the cache, the number of those
+        # getting a "304 Not Modified" response, and the number of requests
+        # passed to the application.
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+        # The number and the size in bytes of the cached responses.
+        self.entries = 0
+        self.size = 0
+        # The number of responses evicted to make room for new ones, and the
+        # number of times the cache was cleared because of a new release.
+        self.evictions = 0
+        self.invalidations = 0
+
+    def as_dict(self):
+        """Return the counters."""
+        return {
+            'hits': self.hits,
+            'not_modified': self.not_modified,
+            'misses': self.misses,
+            'entries': self.entries,
+            'size': self.size,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+# Collect response cache counters for this process.
+stats = CacheStats()
+
+
+class CachedResponse(object):
+    """A cached WSGI response."""
+
+    def __init__(self, status, headers, body, now):
+        header_names = set(key.lower() for key, _ in headers)
+        headers = list(headers)
+        if 'etag' not in header_names:
+            etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+            headers.append(('ETag', etag))
+        if 'last-modified' not in header_names:
+            headers.append(('Last-Modified', formatdate(now, usegmt=True)))
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = _get_header(headers, 'etag')
+        self.last_modified = _parse_date(_get_header(headers, 'last-modified'))
+        self.size = len(body) + sum(
+            len(key) + len(value) for key, value in headers)
+
+    def is_not_modified(self, environ):
+        """Report whether the conditional request has a fresh copy."""
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            etags = [etag.strip() for etag in if_none_match.split(',')]
+            return '*' in etags or self.etag in etags
+        since = _parse_date(environ.get('HTTP_IF_MODIFIED_SINCE'))
+        return (
+            since is not None and self.last_modified is not None and
+            self.last_modified <= since)
+
+
+class ResponseCache(object):
+    """A WSGI middleware caching the responses of the given application.
+
+    Only successful responses to GET requests, not setting cookies and not
+    varying on request headers other than Accept-Encoding are cached.
+    Responses larger than a quarter of the maximum cache size are not cached.
+    If a release path is provided, the cache is cleared when its
+    modification time changes. The cache can be used by multiple threads.
+    """
+
+    def __init__(
+            self, application, max_size=DEFAULT_MAX_SIZE, release_path=None,
+            check_interval=RELEASE_CHECK_INTERVAL):
+        self.application = application
+        self._max_size = max_size
+        self._max_entry_size = max_size // 4
+        self._release_path = release_path
+        self._check_interval = check_interval
+        self._release = _get_release(release_path)
+        self._release_checked = time.time()
+        # Map cache keys to responses, from the least recently used.
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        method = environ['REQUEST_METHOD']
+        if method not in ('GET', 'HEAD'):
+            return self.application(environ, start_response)
+        key = _make_key(environ)
+        with self._lock:
+            self._check_release()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = self._entries.pop(key)
+                stats.hits += 1
+            else:
+                stats.misses += 1
+        if entry is None:
+            if method == 'HEAD':
+                return self.application(environ, start_response)
+            entry, response = self._fetch(environ, start_response)
+            if entry is None:
+                return response
+            self._store(key, entry)
+        return self._respond(entry, environ, start_response)
+
+    def _fetch(self, environ, start_response):
+        """Run the application.
+
+        Return a (entry, response) tuple. If the response can be cached,
+        the entry is the cached response, and the response is None.
+        Otherwise the entry is None, and the response is the WSGI response
+        to be returned to the server.
+        """
+        captured = {}
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            return written.append
+
+        app_response = self.application(environ, capture)
+        if captured and not self._is_cacheable(
+                captured['status'], captured['headers']):
+            # Stream the response without buffering it.
+            start_response(captured['status'], captured['headers'])
+            return None, _passthrough(written, app_response)
+        try:
+            for chunk in app_response:
+                written.append(chunk)
+        finally:
+            if hasattr(app_response, 'close'):
+                app_response.close()
+        body = b''.join(written)
+        status, headers = captured['status'], captured['headers']
+        if (len(body) > self._max_entry_size or
+                not self._is_cacheable(status, headers)):
+            start_response(status, headers)
+            return None, [body]
+        return CachedResponse(status, headers, body, time.time()), None
+
+    def _is_cacheable(self, status, headers):
+        """Report whether a response with the given status and headers can
+        be cached.
+        """
+        if not status.startswith('200'):
+            return False
+        for key, value in headers:
+            key, value = key.lower(), value.lower()
+            if key == 'set-cookie':
+                return False
+            if key == 'cache-control' and (
+                    'no-store' in value or 'no-cache' in value or
+                    'private' in value):
+                return False
+            if key == 'vary' and value.strip() not in ('', 'accept-encoding'):
+                return False
+            if key == 'content-length' and int(value) > self._max_entry_size:
+                return False
+        return True
+
+    def _store(self, key, entry):
+        """Store the given response, evicting the least recently used ones.
+        """
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous.size
+            self._entries[key] = entry
+            self._size += entry.size
+            while self._size > self._max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+                stats.evictions += 1
+            stats.entries = len(self._entries)
+            stats.size = self._size
+
+    def _respond(self, entry, environ, start_response):
+        """Send the given cached response."""
+        if entry.is_not_modified(environ):
+            with self._lock:
+                stats.not_modified += 1
+            headers = [
+                (key, value) for key, value in entry.headers
+                if key.lower() in NOT_MODIFIED_HEADERS]
+            start_response('304 Not Modified', headers)
+            return []
+        start_response(entry.status, list(entry.headers))
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        return [entry.body]
+
+    def _check_release(self):
+        """Clear the cache if a new release has been installed.
+
+        This must be called holding the lock.
+        """
+        now = time.time()
+        if now - self._release_checked < self._check_interval:
+            return
+        self._release_checked = now
+        release = _get_release(self._release_path)
+        if release == self._release:
+            return
+        self._release = release
+        self._entries.clear()
+        self._size = 0
+        stats.entries = stats.size = 0
+        stats.invalidations += 1
+        logging.info('cache: new release detected: responses cleared')
+
+
+def _make_key(environ):
+    """Return the cache key for the given WSGI environment."""
+    accepts_gzip = 'gzip' in environ.get('HTTP_ACCEPT_ENCODING', '')
+    return (
+        environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', ''),
+        environ.get('QUERY_STRING', ''),
+        accepts_gzip,
+    )
+
+
+def _passthrough(written, app_response):
+    """Yield the written data and then the application response chunks."""
+    try:
+        for chunk in written:
+            yield chunk
+        for chunk in app_response:
+            yield chunk
+    finally:
+        if hasattr(app_response, 'close'):
+            app_response.close()
+
+
+def _get_header(headers, name):
+    """Return the value of the header with the given lower case name."""
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _parse_date(value):
+    """Return the timestamp of the given HTTP date, or None if not valid."""
+    if not value:
+        return None
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return mktime_tz(parsed)
+
+
+def _get_release(path):
+    """Return the modification time of the given release path.
+
+    Return None if the path is None or it does not exist.
+    """
+    if path is None:
+        return None
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
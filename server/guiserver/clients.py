@@ -21,8 +21,14 @@ from tornado import (
     websocket,
 )
 
+from guiserver import (
+    deflate,
+    metrics,
+)
+
 
-def websocket_connect(io_loop, url, on_message_callback, headers=None):
+def websocket_connect(
+        io_loop, url, on_message_callback, headers=None, compression=None):
     """WebSocket client connection factory.
 
     The client factory receives the following arguments:
@@ -31,7 +37,9 @@ def websocket_connect(io_loop, url, on_message_callback, headers=None):
         - on_message_callback: a callback that will be called each time
           a new message is received by the client;
         - headers (optional): a dict of additional headers to include in the
-          client handshake.
+          client handshake;
+        - compression (optional): a deflate.CompressionOptions instance used
+          to negotiate the permessage-deflate extension with the server.
 
     Return a Future whose result is a WebSocketClientConnection.
     """
@@ -39,7 +47,8 @@ def websocket_connect(io_loop, url, on_message_callback, headers=None):
         url, validate_cert=False, request_timeout=100)
     if headers is not None:
         request.headers.update(headers)
-    conn = WebSocketClientConnection(io_loop, request, on_message_callback)
+    conn = WebSocketClientConnection(
+        io_loop, request, on_message_callback, compression=compression)
     return conn.connect_future
 
 
@@ -50,14 +59,66 @@ class WebSocketClientConnection(websocket.WebSocketClientConnection):
     <http://www.tornadoweb.org/en/stable/websocket.html#client-side-support>.
     """
 
-    def __init__(self, io_loop, request, on_message_callback):
+    _protocol = None
+    # Whether this connection is included in the open connections count.
+    _counted = False
+
+    def __init__(
+            self, io_loop, request, on_message_callback, compression=None):
         """Client initializer.
 
         The WebSocket client receives all the arguments accepted by
         tornado.websocket.WebSocketClientConnection and a callback that will be
         called each time a new message is received by the client.
+        If compression options are provided, the permessage-deflate extension
+        is offered to the server.
         """
+        self._on_message_callback = on_message_callback
+        self._compression = compression
+        if compression is not None:
+            request.headers['Sec-WebSocket-Extensions'] = deflate.CLIENT_OFFER
         super(WebSocketClientConnection, self).__init__(io_loop, request)
+
+    @property
+    def protocol(self):
+        """The WebSocket protocol instance used by this connection."""
+        return self._protocol
+
+    @protocol.setter
+    def protocol(self, protocol):
+        """Set the WebSocket protocol instance.
+
+        Tornado creates the protocol as soon as the server handshake response
+        is received. Use a protocol supporting compression instead if the
+        server accepted the permessage-deflate extension, or a protocol able
+        to send multiple messages at once otherwise.
+        """
+        if type(protocol) is websocket.WebSocketProtocol13:
+            params = None
+            if self._compression is not None:
+                params = deflate.negotiate_client(
+                    self.headers.get('Sec-WebSocket-Extensions'),
+                    self._compression)
+            if params is None:
+                protocol = deflate.BatchWebSocketProtocol(
+                    self, mask_outgoing=True)
+            else:
+                protocol = deflate.DeflateWebSocketProtocol(
+                    self, params, mask_outgoing=True)
+        if protocol is not None and not self._counted:
+            self._counted = True
+            metrics.stats.juju_connections += 1
+        self._protocol = protocol
+
+    def write_messages(self, messages):
+        """Send the given messages to the server using a single stream write.
+
+        Each message is still sent in its own WebSocket frame.
+        """
+        self.protocol.write_messages(messages)
+
+    def set_on_message_callback(self, on_message_callback):
+        """Set the callback called each time a new message is received."""
         self._on_message_callback = on_message_callback
 
     def on_message(self, message):
@@ -65,5 +126,9 @@ class WebSocketClientConnection(websocket.WebSocketClientConnection):
 
         The on_message_callback is called passing it the message.
         """
+        if message is None and self._counted:
+            # The connection is closed.
+            self._counted = False
+            metrics.stats.juju_connections -= 1
         super(WebSocketClientConnection, self).on_message(message)
         self._on_message_callback(message)
@@ -0,0 +1,255 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Juju GUI server AllWatcher deltas coalescing.
+
+This is an alternative to pausing the Juju API connection when a browser is
+congested (see guiserver.backpressure). Pausing stalls the whole watcher for
+the session: instead, while the browser is behind, AllWatcher responses are
+held back by the GUI server, which keeps requesting deltas on behalf of the
+browser and merges them so that only the latest delta for each entity is
+retained. When the browser connection drains, the merged deltas are sent as
+a single compact response.
+
+The browser never sees the Next requests issued by the GUI server: its own
+Next requests are answered using the merged deltas.
+"""
+
+from collections import OrderedDict
+import itertools
+
+from tornado import escape
+from tornado.ioloop import IOLoop
+
+from guiserver.allwatchers import get_entity_id
+from guiserver.backpressure import (
+    get_write_buffer_size,
+    POLL_INTERVAL,
+    stats,
+)
+from guiserver.utils import (
+    get_request_id,
+    json_decode_dict,
+    make_type_matcher,
+    replace_request_id,
+)
+
+
+# Identify browser requests for AllWatcher deltas.
+_is_watcher_request = make_type_matcher(('AllModelWatcher', 'AllWatcher'))
+# The GUI server issues Next requests using identifiers starting from this
+# value, to avoid conflicts with the identifiers used by the browser.
+REQUEST_ID_BASE = 1 << 62
+
+
+class WatcherState(object):
+    """Keep track of the deltas retained for a single watcher."""
+
+    def __init__(self, facade, watcher_id, version):
+        self.facade = facade
+        self.watcher_id = watcher_id
+        self.version = version
+        # Map (kind, id) keys to the latest delta for each entity, or None if
+        # no deltas are retained.
+        self.deltas = None
+        self.deltas_key = 'Deltas'
+        # The browser Next request waiting for the retained deltas, if any.
+        self.request_id = None
+        # Whether a Next request issued by the GUI server is in progress.
+        self.in_flight = False
+
+    def merge(self, response):
+        """Merge the deltas in the given response data into the retained ones.
+        """
+        if 'deltas' in response:
+            self.deltas_key = 'deltas'
+        if self.deltas is None:
+            self.deltas = OrderedDict()
+        deltas = self.deltas
+        for delta in response.get(self.deltas_key) or []:
+            try:
+                kind, _, entity = delta
+                key = (kind, get_entity_id(entity))
+            except (AttributeError, TypeError, ValueError):
+                # Retain unexpected deltas as they are.
+                key = object()
+            if deltas.pop(key, None) is not None:
+                stats.coalesced += 1
+            deltas[key] = delta
+
+    def pop_response(self, request_id):
+        """Return the retained deltas as an encoded response and clear them.
+        """
+        response = {
+            'RequestId': request_id,
+            'Response': {self.deltas_key: self.deltas.values()},
+        }
+        self.deltas = None
+        self.request_id = None
+        return escape.json_encode(response)
+
+
+class DeltaCoalescer(object):
+    """Coalesce AllWatcher deltas sent to a congested browser connection.
+
+    The handler is the WebSocketHandler proxying the browser connection.
+    """
+
+    def __init__(self, watermarks, handler, io_loop=None):
+        if io_loop is None:
+            io_loop = IOLoop.current()
+        self._io_loop = io_loop
+        self._watermarks = watermarks
+        self._handler = handler
+        self._request_ids = itertools.count(REQUEST_ID_BASE)
+        # Map watcher ids to watcher states.
+        self._watchers = {}
+        # Map in progress Next request ids to watcher states.
+        self._requests = {}
+        self._timeout = None
+
+    def _get_buffer_size(self):
+        """Return the bytes buffered for the browser connection."""
+        ws_connection = self._handler.ws_connection
+        if ws_connection is None:
+            return 0
+        return get_write_buffer_size(ws_connection.stream)
+
+    def handle_request(self, message):
+        """Handle a message sent by the browser.
+
+        Return True if the message has been handled, or False if it must be
+        propagated to the Juju API.
+        """
+        if _is_watcher_request(message) is None:
+            return False
+        data = json_decode_dict(message)
+        if data is None:
+            return False
+        watcher_id = data.get('Id')
+        if data.get('Request') != 'Next':
+            self._watchers.pop(watcher_id, None)
+            return False
+        state = self._watchers.get(watcher_id)
+        if state is None:
+            state = self._watchers[watcher_id] = WatcherState(
+                data['Type'], watcher_id, data.get('Version'))
+        request_id = data.get('RequestId')
+        if state.deltas:
+            # Reply with the deltas retained while the browser was behind.
+            self._handler.write_message(state.pop_response(request_id))
+            return True
+        if state.in_flight:
+            # Wait for the Next request issued by the GUI server.
+            state.request_id = request_id
+            return True
+        self._requests[request_id] = state
+        return False
+
+    def handle_response(self, message):
+        """Handle a message received from the Juju API.
+
+        Return True if the message has been handled, or False if it must be
+        propagated to the browser.
+        """
+        if not self._requests:
+            return False
+        request_id, start, end = get_request_id(message)
+        state = self._requests.pop(request_id, None)
+        if state is None:
+            return False
+        proxied = request_id >= REQUEST_ID_BASE
+        if proxied:
+            state.in_flight = False
+        elif self._get_buffer_size() <= self._watermarks.high:
+            # The browser is keeping up: propagate the response as it is.
+            return False
+        data = json_decode_dict(message)
+        if data is None or 'Error' in data:
+            self._watchers.pop(state.watcher_id, None)
+            if proxied and state.request_id is not None:
+                # Propagate the error to the browser.
+                self._handler.write_message(replace_request_id(
+                    message, state.request_id, start, end))
+            return proxied
+        state.merge(data.get('Response') or {})
+        if not proxied:
+            state.request_id = request_id
+        self._update(state)
+        return True
+
+    def _update(self, state):
+        """Send the retained deltas or request more depending on congestion.
+        """
+        if self._get_buffer_size() > self._watermarks.low:
+            self._next(state)
+            self._schedule()
+        elif state.request_id is not None:
+            self._handler.write_message(state.pop_response(state.request_id))
+
+    def _next(self, state):
+        """Request the next deltas on behalf of the browser."""
+        if state.in_flight:
+            return
+        request_id = next(self._request_ids)
+        request = {
+            'RequestId': request_id,
+            'Type': state.facade,
+            'Request': 'Next',
+            'Id': state.watcher_id,
+        }
+        if state.version is not None:
+            request['Version'] = state.version
+        state.in_flight = True
+        self._requests[request_id] = state
+        self._handler.juju_connection.write_message(
+            escape.json_encode(request))
+
+    def _schedule(self):
+        """Schedule a check of the browser connection."""
+        if self._timeout is None:
+            self._timeout = self._io_loop.add_timeout(
+                self._io_loop.time() + POLL_INTERVAL, self._poll)
+
+    def _poll(self):
+        """Flush the retained deltas if the browser connection drained."""
+        self._timeout = None
+        if self._handler.ws_connection is None:
+            return
+        if self._get_buffer_size() > self._watermarks.low:
+            return self._schedule()
+        for state in self._watchers.values():
+            if state.deltas is not None and state.request_id is not None:
+                self._handler.write_message(
+                    state.pop_response(state.request_id))
+
+    def reset(self):
+        """Forget all the watchers, for instance after a reconnection.
+
+        Return the identifiers of the browser requests waiting for deltas.
+        """
+        request_ids = [
+            state.request_id for state in self._watchers.values()
+            if state.request_id is not None]
+        self._watchers.clear()
+        self._requests.clear()
+        return request_ids
+
+    def close(self):
+        """Stop checking the browser connection."""
+        if self._timeout is not None:
+            self._io_loop.remove_timeout(self._timeout)
+            self._timeout = None
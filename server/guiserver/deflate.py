@@ -0,0 +1,435 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Juju GUI server WebSocket compression support.
+
+This module implements the permessage-deflate WebSocket extension (see RFC
+7692) on top of the Tornado WebSocket protocol, so that both the browser and
+the Juju API connections can exchange compressed messages.
+
+    - CompressionOptions: the compression configuration, usually created once
+      from the GUI server options and shared by all the connections.
+    - negotiate_server and negotiate_client: functions returning the
+      compression parameters to use for a single connection, given the
+      extension header sent by the other end of the connection.
+    - BatchWebSocketProtocol: a WebSocket protocol implementation able to
+      send multiple messages, each one in its own frame, using a single
+      stream write.
+    - DeflateWebSocketProtocol: the WebSocket protocol implementation
+      compressing outgoing messages and decompressing incoming ones.
+    - stats: a CompressionStats instance collecting server-wide compression
+      counters.
+
+Note that, per the RFC, compressing outgoing messages is optional: messages
+smaller than COMPRESSION_MIN_SIZE are sent uncompressed, as well as all the
+messages on connections for which the negotiated window size is not supported
+by zlib. Incoming compressed messages are always decompressed.
+"""
+
+import os
+import struct
+import zlib
+
+from tornado.escape import utf8
+from tornado.iostream import StreamClosedError
+from tornado.util import _websocket_mask
+from tornado.websocket import WebSocketProtocol13
+
+
+# Define the extension name included in the Sec-WebSocket-Extensions header.
+EXTENSION_NAME = 'permessage-deflate'
+# Define the Sec-WebSocket-Extensions header value sent by WebSocket clients.
+CLIENT_OFFER = EXTENSION_NAME + '; client_max_window_bits'
+# Define the frame header bit used to mark compressed messages.
+RSV1 = 0x40
+# Define the minimum size in bytes of compressed outgoing messages.
+COMPRESSION_MIN_SIZE = 128
+# Define the maximum size in bytes of decompressed incoming messages. This is
+# the same limit used by Tornado for messages received by WebSocket clients.
+MAX_MESSAGE_SIZE = 104857600
+# Define the LZ77 window sizes (as base two logarithms) supported by zlib.
+MIN_WINDOW_BITS = 9
+MAX_WINDOW_BITS = 15
+# Each compressed message ends with an empty uncompressed deflate block.
+_TAIL = b'\x00\x00\xff\xff'
+
+
+class CompressionOptions(object):
+    """The permessage-deflate configuration.
+
+    The options are:
+      - level: the zlib compression level, from 0 (no compression) to 9;
+      - window_bits: the maximum LZ77 window size used for compressing;
+      - context_takeover: whether to reuse the LZ77 sliding window across
+        messages. Disabling this reduces the compression ratio and the memory
+        used by each connection.
+    """
+
+    def __init__(
+            self, level=zlib.Z_DEFAULT_COMPRESSION,
+            window_bits=MAX_WINDOW_BITS, context_takeover=True):
+        self.level = level
+        self.window_bits = window_bits
+        self.context_takeover = context_takeover
+
+    def __repr__(self):
+        return '<CompressionOptions: level={} window_bits={} {}>'.format(
+            self.level, self.window_bits,
+            'context_takeover' if self.context_takeover else
+            'no_context_takeover')
+
+
+class CompressionStats(object):
+    """Collect compression counters.
+
+    Bytes are counted before compression and after decompression (raw) and
+    on the wire (compressed), for both sent and received messages.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Reset all the counters."""
+        self.sent_raw = 0
+        self.sent_compressed = 0
+        self.received_raw = 0
+        self.received_compressed = 0
+
+    @staticmethod
+    def _ratio(raw, compressed):
+        if not compressed:
+            return None
+        return round(float(raw) / compressed, 2)
+
+    def as_dict(self):
+        """Return the counters and the resulting compression ratios."""
+        return {
+            'sent_raw_bytes': self.sent_raw,
+            'sent_compressed_bytes': self.sent_compressed,
+            'sent_ratio': self._ratio(self.sent_raw, self.sent_compressed),
+            'received_raw_bytes': self.received_raw,
+            'received_compressed_bytes': self.received_compressed,
+            'received_ratio': self._ratio(
+                self.received_raw, self.received_compressed),
+        }
+
+
+# Collect compression counters for all the connections in this process.
+stats = CompressionStats()
+
+
+def parse_extensions(header):
+    """Parse the given Sec-WebSocket-Extensions header value.
+
+    Return a list of (name, params) tuples, in which params is a dict mapping
+    parameter names to values. The value is None for parameters without one.
+    """
+    extensions = []
+    for extension in (header or '').split(','):
+        parts = [part.strip() for part in extension.split(';')]
+        if not parts[0]:
+            continue
+        params = {}
+        for part in parts[1:]:
+            if not part:
+                continue
+            key, sep, value = part.partition('=')
+            params[key.strip()] = value.strip().strip('"') if sep else None
+        extensions.append((parts[0], params))
+    return extensions
+
+
+def _parse_window_bits(value):
+    """Return the integer window bits in the given parameter value.
+
+    Raise a ValueError if the value is missing or not a valid window size.
+    """
+    if value is None:
+        raise ValueError('missing window bits')
+    window_bits = int(value)
+    if not 8 <= window_bits <= MAX_WINDOW_BITS:
+        raise ValueError('invalid window bits: {}'.format(value))
+    return window_bits
+
+
+def negotiate_server(header, options):
+    """Accept a permessage-deflate offer sent by a WebSocket client.
+
+    Receive the client Sec-WebSocket-Extensions header and the compression
+    options. Return a (params, response) tuple in which params is a dict of
+    parameters for DeflateWebSocketProtocol and response is the extension
+    header value to send back to the client. Return (None, None) if no
+    acceptable offer is found.
+    """
+    for name, offer in parse_extensions(header):
+        if name != EXTENSION_NAME:
+            continue
+        window_bits = options.window_bits
+        context_takeover = options.context_takeover
+        response = [EXTENSION_NAME]
+        try:
+            for key, value in offer.items():
+                if key == 'server_max_window_bits':
+                    window_bits = min(window_bits, _parse_window_bits(value))
+                    response.append('{}={}'.format(key, window_bits))
+                elif key == 'server_no_context_takeover':
+                    context_takeover = False
+                elif key == 'client_max_window_bits':
+                    if value is not None:
+                        _parse_window_bits(value)
+                elif key != 'client_no_context_takeover':
+                    raise ValueError('unknown parameter: {}'.format(key))
+        except ValueError:
+            # Try the next offer, if any.
+            continue
+        if not context_takeover:
+            response.append('server_no_context_takeover')
+        params = {
+            'level': options.level,
+            'window_bits': window_bits,
+            'context_takeover': context_takeover,
+        }
+        return params, '; '.join(response)
+    return None, None
+
+
+def negotiate_client(header, options):
+    """Parse the permessage-deflate response sent by a WebSocket server.
+
+    Receive the server Sec-WebSocket-Extensions header and the compression
+    options. Return a dict of parameters for DeflateWebSocketProtocol, or None
+    if the server did not accept the offer.
+    """
+    for name, response in parse_extensions(header):
+        if name != EXTENSION_NAME:
+            continue
+        window_bits = options.window_bits
+        context_takeover = options.context_takeover
+        value = response.get('client_max_window_bits')
+        if value is not None:
+            try:
+                window_bits = min(window_bits, _parse_window_bits(value))
+            except ValueError:
+                return None
+        if 'client_no_context_takeover' in response:
+            context_takeover = False
+        return {
+            'level': options.level,
+            'window_bits': window_bits,
+            'context_takeover': context_takeover,
+        }
+    return None
+
+
+class _Compressor(object):
+    """Compress outgoing messages."""
+
+    def __init__(self, level, window_bits, context_takeover):
+        self._level = level
+        self._window_bits = window_bits
+        self._context_takeover = context_takeover
+        self._compressobj = None
+
+    def compress(self, data):
+        """Compress the given message payload and return the result."""
+        compressobj = self._compressobj
+        if compressobj is None or not self._context_takeover:
+            # Note that negative window bits produce a raw deflate stream.
+            compressobj = self._compressobj = zlib.compressobj(
+                self._level, zlib.DEFLATED, -self._window_bits)
+        compressed = compressobj.compress(data) + compressobj.flush(
+            zlib.Z_SYNC_FLUSH)
+        # Remove the empty block tail, as required by the RFC.
+        compressed = compressed[:-len(_TAIL)]
+        stats.sent_raw += len(data)
+        stats.sent_compressed += len(compressed)
+        return compressed
+
+
+class _Decompressor(object):
+    """Decompress incoming messages."""
+
+    def __init__(self):
+        # Always use the maximum window size, so that messages compressed
+        # with any window size can be decompressed.
+        self._decompressobj = zlib.decompressobj(-MAX_WINDOW_BITS)
+
+    def decompress(self, data):
+        """Decompress the given message payload and return the result.
+
+        Raise a ValueError if the message is not valid or too big.
+        """
+        try:
+            decompressed = self._decompressobj.decompress(
+                data + _TAIL, MAX_MESSAGE_SIZE)
+        except zlib.error as err:
+            raise ValueError('invalid compressed message: {}'.format(err))
+        if self._decompressobj.unconsumed_tail:
+            raise ValueError('decompressed message too big')
+        stats.received_raw += len(decompressed)
+        stats.received_compressed += len(data)
+        return decompressed
+
+
+class BatchWebSocketProtocol(WebSocketProtocol13):
+    """A WebSocket protocol able to send multiple messages at once.
+
+    All the frames are encoded by encode_message and _encode_frame, so that
+    they can be either written one at a time or joined in a single write.
+    """
+
+    def encode_message(self, message, binary=False):
+        """Return the given message encoded as a WebSocket frame."""
+        opcode = 0x2 if binary else 0x1
+        return self._encode_frame(True, opcode, utf8(message))
+
+    def write_message(self, message, binary=False):
+        """Send the given message."""
+        self._write(self.encode_message(message, binary=binary))
+
+    def write_messages(self, messages):
+        """Send the given messages using a single stream write.
+
+        Each message is still sent in its own frame.
+        """
+        self._write(b''.join(
+            self.encode_message(message) for message in messages))
+
+    def _write(self, data):
+        """Write the given encoded frames to the stream.
+
+        Abort the connection if the stream is closed.
+        """
+        try:
+            self.stream.write(data)
+        except StreamClosedError:
+            self._abort()
+
+    def _write_frame(self, fin, opcode, data):
+        """Send a frame. This is used by Tornado for control frames."""
+        self.stream.write(self._encode_frame(fin, opcode, data))
+
+    def _encode_frame(self, fin, opcode, data):
+        """Return a frame including the given data.
+
+        This is the same as WebSocketProtocol13._write_frame, but the frame
+        is returned rather than written to the stream.
+        """
+        finbit = 0x80 if fin else 0
+        frame = struct.pack('B', finbit | opcode)
+        length = len(data)
+        mask_bit = 0x80 if self.mask_outgoing else 0
+        if length < 126:
+            frame += struct.pack('B', length | mask_bit)
+        elif length <= 0xFFFF:
+            frame += struct.pack('!BH', 126 | mask_bit, length)
+        else:
+            frame += struct.pack('!BQ', 127 | mask_bit, length)
+        if self.mask_outgoing:
+            mask = os.urandom(4)
+            data = mask + _websocket_mask(mask, data)
+        return frame + data
+
+
+class DeflateWebSocketProtocol(BatchWebSocketProtocol):
+    """A WebSocket protocol supporting the permessage-deflate extension.
+
+    This protocol is used by both the server and the client WebSocket
+    connections, replacing the WebSocketProtocol13 instance created by
+    Tornado. The given params are the ones returned by negotiate_server or
+    negotiate_client. The extension_header is the Sec-WebSocket-Extensions
+    header value to include in the server handshake response.
+    """
+
+    def __init__(
+            self, handler, params, mask_outgoing=False, extension_header=None):
+        BatchWebSocketProtocol.__init__(
+            self, handler, mask_outgoing=mask_outgoing)
+        self._extension_header = extension_header
+        self._compressor = None
+        if params['window_bits'] >= MIN_WINDOW_BITS:
+            self._compressor = _Compressor(
+                params['level'], params['window_bits'],
+                params['context_takeover'])
+        self._decompressor = _Decompressor()
+        self._message_compressed = False
+
+    def _accept_connection(self):
+        """Send the server handshake response.
+
+        This is the same as WebSocketProtocol13._accept_connection, but also
+        includes the extension header.
+        """
+        subprotocol_header = ''
+        subprotocols = self.request.headers.get('Sec-WebSocket-Protocol', '')
+        subprotocols = [s.strip() for s in subprotocols.split(',')]
+        if subprotocols:
+            selected = self.handler.select_subprotocol(subprotocols)
+            if selected:
+                assert selected in subprotocols
+                subprotocol_header = (
+                    'Sec-WebSocket-Protocol: {}\r\n'.format(selected))
+        self.stream.write(utf8(
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            'Sec-WebSocket-Accept: {}\r\n'
+            'Sec-WebSocket-Extensions: {}\r\n'
+            '{}'
+            '\r\n'.format(
+                self._challenge_response(), self._extension_header,
+                subprotocol_header)))
+        handler = self.handler
+        self.async_callback(handler.open)(
+            *handler.open_args, **handler.open_kwargs)
+        self._receive_frame()
+
+    def encode_message(self, message, binary=False):
+        """Return the given message as a frame, compressing it if possible.
+        """
+        opcode = 0x2 if binary else 0x1
+        message = utf8(message)
+        if (self._compressor is not None and
+                len(message) >= COMPRESSION_MIN_SIZE):
+            message = self._compressor.compress(message)
+            opcode |= RSV1
+        return self._encode_frame(True, opcode, message)
+
+    def _on_frame_start(self, data):
+        """Handle the RSV1 bit, marking compressed messages."""
+        header, payloadlen = struct.unpack('BB', data)
+        opcode = header & 0xf
+        if header & RSV1:
+            if opcode not in (0x1, 0x2):
+                # Only the first frame of data messages can be compressed.
+                self._abort()
+                return
+            self._message_compressed = True
+            data = struct.pack('BB', header & ~RSV1, payloadlen)
+        elif opcode in (0x1, 0x2):
+            self._message_compressed = False
+        WebSocketProtocol13._on_frame_start(self, data)
+
+    def _handle_message(self, opcode, data):
+        """Decompress incoming data messages if required."""
+        if self._message_compressed and opcode in (0x1, 0x2):
+            try:
+                data = self._decompressor.decompress(data)
+            except ValueError:
+                self._abort()
+                return
+        WebSocketProtocol13._handle_message(self, opcode, data)
@@ -0,0 +1,100 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Juju GUI server key expiry.
+
+Tokens used to register an IO loop timeout each, so that a burst of token
+requests grew the IO loop timeouts heap, and each used token had to cancel
+its timeout. Expiry does not need to be precise: a token is never usable
+after its expiration time anyway (see guiserver.stores), and expired tokens
+only need to be removed eventually.
+
+The timing wheel groups keys in coarse buckets, one for each slot of the
+given resolution. Adding and removing a key are constant time operations,
+and a single periodic sweep removes all the keys in the elapsed buckets.
+"""
+
+import math
+
+
+# The default size in seconds of each timing wheel bucket.
+DEFAULT_RESOLUTION = 1
+
+
+class TimingWheel(object):
+    """Track keys expiring at given times, using coarse buckets.
+
+    Keys are reported as expired by the first sweep happening after their
+    expiration time, never before.
+    """
+
+    def __init__(self, resolution=DEFAULT_RESOLUTION):
+        self._resolution = resolution
+        # Map slots to the set of keys expiring in that slot.
+        self._buckets = {}
+        # Map keys to their slot.
+        self._slots = {}
+        # The last swept slot.
+        self._cursor = None
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def add(self, key, expires):
+        """Add the given key expiring at the given time in seconds.
+
+        If the key is already present, its expiration time is updated.
+        """
+        self.discard(key)
+        slot = int(math.ceil(expires / float(self._resolution)))
+        if self._cursor is not None:
+            # Already expired keys are reported in the slot following the
+            # last sweep.
+            slot = max(slot, self._cursor + 1)
+        self._buckets.setdefault(slot, set()).add(key)
+        self._slots[key] = slot
+
+    def discard(self, key):
+        """Remove the given key if present."""
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return
+        bucket = self._buckets[slot]
+        bucket.discard(key)
+        if not bucket:
+            del self._buckets[slot]
+
+    def expire(self, now):
+        """Remove and return the keys expired at the given time."""
+        current = int(math.floor(now / float(self._resolution)))
+        cursor = self._cursor
+        self._cursor = current
+        if cursor is None or current - cursor > len(self._buckets):
+            # Going through the buckets is cheaper than through the slots.
+            slots = [slot for slot in self._buckets if slot <= current]
+        else:
+            slots = range(cursor + 1, current + 1)
+        expired = []
+        for slot in slots:
+            keys = self._buckets.pop(slot, ())
+            for key in keys:
+                del self._slots[key]
+            expired.extend(keys)
+        return expired
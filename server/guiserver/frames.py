@@ -0,0 +1,187 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Juju GUI server WebSocket frames logging.
+
+Logging every frame proxied between the browser and the Juju API is too
+expensive to be done unconditionally: frames can be several megabytes long,
+and encoding them only to discard the resulting log message wastes CPU on
+the hot path. For this reason:
+
+    - frames are only formatted if debug logging is enabled, and only when
+      the message is actually emitted;
+    - debug messages can be sampled, logging one frame every n frames;
+    - logged payloads are truncated;
+    - the most recent (truncated) frames of each connection are kept in a
+      small ring buffer, which can be dumped on demand (see dump_all) even if
+      debug logging is disabled.
+
+Frames including credentials are never logged nor kept: login and token
+requests, and the responses to them, are replaced by a summary including
+their request id, type and size.
+"""
+
+from collections import deque
+import json
+import logging
+import time
+import weakref
+
+from tornado import escape
+
+from guiserver.utils import (
+    get_request_id,
+    is_debug_enabled,
+    make_type_matcher,
+)
+
+
+# The default frames logging options.
+DEFAULT_SAMPLE = 1
+DEFAULT_MAX_PAYLOAD = 256
+DEFAULT_RING_SIZE = 16
+# Keep track of the frame logs of all the live connections.
+_frame_logs = weakref.WeakSet()
+# Detect browser requests whose frames include credentials.
+_has_credentials = make_type_matcher(('Admin', 'GUIToken'))
+
+
+class FrameLogOptions(object):
+    """Hold the frames logging options.
+
+    Log one frame every sample frames, truncating payloads to max_payload
+    characters, and keep the last ring_size frames of each connection.
+    """
+
+    def __init__(
+            self, sample=DEFAULT_SAMPLE, max_payload=DEFAULT_MAX_PAYLOAD,
+            ring_size=DEFAULT_RING_SIZE):
+        if sample < 1:
+            raise ValueError('invalid sample rate: {}'.format(sample))
+        self.sample = sample
+        self.max_payload = max_payload
+        self.ring_size = ring_size
+
+
+class Payload(object):
+    """Format a WebSocket message for logging only when required."""
+
+    __slots__ = ('message', 'size', 'max_payload')
+
+    def __init__(self, message, max_payload, size=None):
+        self.message = message
+        self.size = len(message) if size is None else size
+        self.max_payload = max_payload
+
+    def __str__(self):
+        message = self.message[:self.max_payload]
+        if isinstance(message, unicode):
+            message = message.encode('utf-8')
+        if self.size > self.max_payload:
+            message += '... ({} characters)'.format(self.size)
+        return message
+
+
+def redact(message, is_request):
+    """Return a summary of the given message not including its contents."""
+    fields = {}
+    if is_request:
+        try:
+            data = escape.json_decode(message)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            fields = dict(
+                (key, data[key]) for key in ('RequestId', 'Type', 'Request')
+                if key in data)
+    else:
+        request_id, _, _ = get_request_id(message)
+        fields['RequestId'] = request_id
+    return u'<redacted {} ({} characters)>'.format(
+        json.dumps(fields, sort_keys=True), len(message))
+
+
+class FrameLog(object):
+    """Log the WebSocket frames of a single browser connection.
+
+    The summary is used as a prefix for log messages. Directions starting
+    with "client" identify frames sent by the browser.
+    """
+
+    def __init__(self, summary, options=None):
+        if options is None:
+            options = FrameLogOptions()
+        self._summary = summary
+        self._sample = options.sample
+        self._max_payload = options.max_payload
+        self._count = 0
+        self._frames = None
+        if options.ring_size:
+            self._frames = deque(maxlen=options.ring_size)
+        # The ids of the requests including credentials whose responses have
+        # not been recorded yet.
+        self._redacted_ids = set()
+        _frame_logs.add(self)
+
+    def record(self, direction, message):
+        """Record the given message sent in the given direction.
+
+        The direction is a string like "client -> juju".
+        """
+        if direction.startswith('client'):
+            if _has_credentials(message) is not None:
+                request_id, _, _ = get_request_id(message)
+                self._redacted_ids.add(request_id)
+                message = redact(message, True)
+        elif self._redacted_ids:
+            request_id, _, _ = get_request_id(message)
+            if request_id in self._redacted_ids:
+                self._redacted_ids.remove(request_id)
+                message = redact(message, False)
+        frames = self._frames
+        if frames is not None:
+            frames.append((
+                time.time(), direction, message[:self._max_payload],
+                len(message)))
+        if not is_debug_enabled():
+            return
+        self._count += 1
+        if self._count >= self._sample:
+            self._count = 0
+            logging.debug(
+                '%s%s: %s', self._summary, direction,
+                Payload(message, self._max_payload))
+
+    def dump(self):
+        """Log the frames in the ring buffer."""
+        frames = self._frames
+        if not frames:
+            return
+        now = time.time()
+        logging.info('{}last {} frames:'.format(self._summary, len(frames)))
+        for timestamp, direction, message, size in frames:
+            logging.info(
+                '%s%.3fs ago %s: %s', self._summary, now - timestamp,
+                direction, Payload(message, self._max_payload, size=size))
+
+
+def dump_all():
+    """Log the recent frames of all the live connections."""
+    frame_logs = list(_frame_logs)
+    logging.info('frames: dumping {} connections'.format(len(frame_logs)))
+    for frame_log in frame_logs:
+        frame_log.dump()
@@ -16,22 +16,48 @@
 
 """Juju GUI server HTTP/HTTPS handlers."""
 
-from collections import deque
+import datetime
+import hmac
 import logging
 import os
 import time
 import urlparse
 
 from tornado import (
+    concurrent,
     escape,
     gen,
     httpclient,
+    httputil,
     web,
     websocket,
 )
 from tornado.ioloop import IOLoop
 
-from guiserver import get_version
+try:
+    import pycurl
+except ImportError:
+    # The proxy handlers only pause transfers run by the curl HTTP client.
+    pycurl = None
+
+from guiserver import (
+    backpressure,
+    cache,
+    coalesce,
+    deflate,
+    frames,
+    get_version,
+    latency,
+    logs,
+    metrics,
+    pool,
+    profiler,
+    queues,
+    reconnect,
+    resume,
+    watchdog,
+    wsgi,
+)
 from guiserver.auth import (
     AuthMiddleware,
     User,
@@ -40,13 +66,19 @@ from guiserver.bundles.base import (
     ChangeSetMiddleware,
     DeployMiddleware,
 )
-from guiserver.clients import websocket_connect
+from guiserver.clients import (
+    websocket_connect,
+    WebSocketClientConnection,
+)
 from guiserver.utils import (
     clone_request,
     get_headers,
     get_juju_api_url,
+    get_request_id,
     join_url,
     json_decode_dict,
+    make_type_matcher,
+    replace_request_id,
     request_summary,
     wrap_write_message,
 )
@@ -54,10 +86,62 @@ from guiserver.utils import (
 
 # Define the path to the fallback charm icon hosted by charmworld.
 DEFAULT_CHARM_ICON_PATH = '/static/img/charm_160.svg'
+# Define the number of proxied bytes waiting to be sent to the client before
+# the transfer from the target server is paused.
+PROXY_MAX_PENDING = 1024 * 1024
+# Define the seconds after which proxied requests are aborted. Transfers are
+# paused while the client is slow, so this must allow for large downloads.
+PROXY_REQUEST_TIMEOUT = 600
+# Define the hop-by-hop headers, which are not propagated by proxies.
+HOP_BY_HOP_HEADERS = frozenset([
+    'connection',
+    'keep-alive',
+    'proxy-authenticate',
+    'proxy-authorization',
+    'te',
+    'trailer',
+    'transfer-encoding',
+    'upgrade',
+])
+# Detect requests handled by the GUI server middlewares: all other requests
+# are propagated to the Juju API without being decoded.
+get_server_request_type = make_type_matcher(
+    ('Admin', 'ChangeSet', 'Deployer', 'GUIToken'))
 
 
 class _WebSocketBaseHandler(websocket.WebSocketHandler):
-    """Base WebSocket handler defining shared methods."""
+    """Base WebSocket handler defining shared methods.
+
+    Subclasses can set the compression attribute to a
+    deflate.CompressionOptions instance in order to support the
+    permessage-deflate extension.
+    """
+
+    compression = None
+    _ws_connection = None
+
+    @property
+    def ws_connection(self):
+        """The WebSocket protocol instance used by this connection."""
+        return self._ws_connection
+
+    @ws_connection.setter
+    def ws_connection(self, protocol):
+        """Set the WebSocket protocol instance.
+
+        Tornado creates the protocol right before accepting the connection.
+        Use a protocol supporting compression instead if the client offered
+        the permessage-deflate extension.
+        """
+        if (self.compression is not None and
+                type(protocol) is websocket.WebSocketProtocol13):
+            params, header = deflate.negotiate_server(
+                self.request.headers.get('Sec-WebSocket-Extensions'),
+                self.compression)
+            if params is not None:
+                protocol = deflate.DeflateWebSocketProtocol(
+                    self, params, extension_header=header)
+        self._ws_connection = protocol
 
     def select_subprotocol(self, subprotocols):
         """Return the first sub-protocol sent by the client.
@@ -100,56 +184,176 @@ class WebSocketHandler(_WebSocketBaseHandler):
     @gen.coroutine
     def initialize(
             self, apiurl, auth_backend, deployer, tokens, ws_source_template,
-            ws_target_template, io_loop=None):
+            ws_target_template, io_loop=None, compression=None,
+            multiplexer=None, pool=None, watermarks=None,
+            max_queued_messages=queues.DEFAULT_MAX_MESSAGES,
+            max_queued_size=queues.DEFAULT_MAX_SIZE, reconnect_policy=None,
+            resume_grace=0, frame_log_options=None, measure_latency=False):
         """Initialize the WebSocket server.
 
         Create a new WebSocket client and connect it to the Juju API.
         Set up the authentication system.
         Handle the queued messages.
+        If compression options are provided, the permessage-deflate extension
+        is negotiated on both the browser and the Juju API connections.
+        If a multiplexer is provided, the connection to the Juju API is
+        established only when the first message is received from the browser:
+        if that message is a login request, an existing Juju API session for
+        the same user can be shared.
+        If a connection pool is provided, connections to the Juju API are
+        taken from the pool rather than established from scratch.
+        If watermarks are provided, reading from the Juju API is paused while
+        the browser connection is congested, or AllWatcher deltas are
+        coalesced, depending on the watermarks policy: see
+        guiserver.backpressure and guiserver.coalesce.
+        Messages received before the Juju API is connected are queued, up to
+        the given number of messages and size.
+        If a reconnect policy is provided, and the multiplexer is not used,
+        an unexpected Juju API disconnection is handled by reconnecting and
+        logging in again, without closing the browser connection: see
+        guiserver.reconnect.
+        If a resume grace window (in seconds) is provided, the Juju API
+        connection of a browser holding a resume token is parked when the
+        browser disconnects, so that a reloaded GUI can resume it: see
+        guiserver.resume. In this case the connection to the Juju API is
+        established only when the first message is received from the browser.
+        Proxied frames are logged as described in guiserver.frames, using the
+        given frame log options.
+        If measure_latency is True, the latency of Juju API requests is
+        recorded: see guiserver.latency.
         """
         if io_loop is None:
             io_loop = IOLoop.current()
         self._io_loop = io_loop
+        self.compression = compression
         self._summary = request_summary(self.request) + ' '
         logging.info(self._summary + 'client connected')
+        self._frames = frames.FrameLog(self._summary, frame_log_options)
+        self._request_timer = None
+        if measure_latency:
+            self._request_timer = latency.RequestTimer()
         self.connected = True
         self.juju_connected = False
-        self._juju_message_queue = queue = deque()
+        self._juju_message_queue = queues.MessageQueue(
+            max_messages=max_queued_messages, max_size=max_queued_size)
+        self._juju_connected_future = None
         # Set up the authentication infrastructure.
         self.tokens = tokens
         write_message = wrap_write_message(self)
         self.user = User()
+        self._auth_backend = auth_backend
         self.auth = AuthMiddleware(
             self.user, auth_backend, tokens, write_message)
         # Set up the bundle deployment and change set infrastructure.
         self.deployment = DeployMiddleware(self.user, deployer, write_message)
         self.changeset = ChangeSetMiddleware(self.user, write_message)
-        apiurl = get_juju_api_url(
+        self._apiurl = get_juju_api_url(
             self.request.path, ws_source_template, ws_target_template, apiurl)
         # Juju requires the Origin header to be included in the WebSocket
         # client handshake request. Propagate the client origin if present;
         # use the Juju API server as origin otherwise.
-        headers = get_headers(self.request, apiurl)
-        # Connect the WebSocket client to the Juju API server.
-        self._juju_connected_future = websocket_connect(
-            io_loop, apiurl, self.on_juju_message, headers=headers)
+        self._headers = get_headers(self.request, self._apiurl)
+        self._multiplexer = multiplexer
+        self._pool = pool
+        self._watermarks = watermarks
+        self._backpressure = None
+        self._coalescer = None
+        if (watermarks is not None and
+                watermarks.policy == backpressure.COALESCE):
+            self._coalescer = coalesce.DeltaCoalescer(
+                watermarks, self, io_loop=io_loop)
+        self._reconnect_policy = None
+        self._pending_requests = None
+        if reconnect_policy is not None and multiplexer is None:
+            self._reconnect_policy = reconnect_policy
+            self._pending_requests = reconnect.PendingRequests()
+        # The last login request sent to the Juju API, and whether it is being
+        # replayed after a reconnection.
+        self._login_message = None
+        self._relogin = False
+        # The response to the login request, cached for resumed sessions.
+        self._login_response = None
+        self._resume_grace = resume_grace
+        self._resume_token = None
+        self._watcher_cache = None
+        if resume_grace and self._coalescer is None:
+            # The cache cannot see the deltas requested by the coalescer.
+            self._watcher_cache = resume.WatcherCache()
+        if multiplexer is None and not resume_grace:
+            yield self.connect_juju()
+
+    def open(self):
+        """Hook called when the WebSocket connection is established."""
+        metrics.stats.browser_connections += 1
+
+    @gen.coroutine
+    def connect_juju(self, data=None):
+        """Connect the WebSocket client to the Juju API server.
+
+        If the multiplexer is enabled and the given data is a login request,
+        the connection is possibly shared with other browser connections.
+        Handle the queued messages once the connection is established.
+        """
+        apiurl = self._apiurl
+        credentials = None
+        if (self._multiplexer is not None and data is not None and
+                self._auth_backend.request_is_login(data)):
+            credentials = self._auth_backend.get_credentials(data)
+        if credentials is None and self._pool is None:
+            self._juju_connected_future = websocket_connect(
+                self._io_loop, apiurl, self.on_juju_message,
+                headers=self._headers, compression=self.compression)
+        elif credentials is None:
+            self._juju_connected_future = self._pool.connect(
+                apiurl, self.on_juju_message, headers=self._headers,
+                compression=self.compression)
+        else:
+            username, password = credentials
+            self._juju_connected_future = self._multiplexer.connect(
+                apiurl, username, password, self.on_juju_message,
+                headers=self._headers, compression=self.compression)
         try:
             self.juju_connection = yield self._juju_connected_future
         except Exception as err:
             logging.error(self._summary + 'unable to connect to the Juju API')
             logging.exception(err)
             self.connected = False
+            self._juju_message_queue.clear()
             return
         # At this point the Juju API is successfully connected.
         self.juju_connected = True
+        self._start_backpressure()
         logging.info(self._summary + 'Juju API connected: {}'.format(apiurl))
-        # Send all the messages that have been enqueued before the connection
-        # to the Juju API server was established.
-        while self.connected and self.juju_connected and len(queue):
-            message = queue.popleft()
-            encoded = message.encode('utf-8')
-            logging.debug(self._summary + 'queue -> juju: {}'.format(encoded))
-            self.juju_connection.write_message(message)
+        self._flush_queue()
+
+    def _start_backpressure(self):
+        """Start applying backpressure to the Juju API connection if required.
+        """
+        # Shared Juju API connections are never paused, as that would stall
+        # all the browser connections sharing them.
+        if (self._watermarks is not None and
+                self._watermarks.policy == backpressure.PAUSE and
+                isinstance(self.juju_connection, WebSocketClientConnection)):
+            self._backpressure = backpressure.Backpressure(
+                self._watermarks, self.juju_connection, self,
+                io_loop=self._io_loop, summary=self._summary)
+
+    def _flush_queue(self):
+        """Send the queued messages to the Juju API.
+
+        All the messages enqueued while the connection to the Juju API server
+        was being established are sent using a single write.
+        """
+        queue = self._juju_message_queue
+        if self.connected and len(queue):
+            messages = queue.popall()
+            logging.debug(
+                '%squeue -> juju: %d messages', self._summary, len(messages))
+            for tracker in (self._pending_requests, self._request_timer):
+                if tracker is not None:
+                    for message in messages:
+                        tracker.sent(message)
+            self.juju_connection.write_messages(messages)
 
     def on_message(self, message):
         """Hook called when a new message is received from the browser.
@@ -159,79 +363,315 @@ class WebSocketHandler(_WebSocketBaseHandler):
         Otherwise the message is propagated to the Juju API server.
         Messages sent before the client connection to the Juju API server is
         established are queued for later delivery.
+
+        Only messages possibly handled by the GUI server middlewares are
+        decoded: see get_server_request_type.
         """
-        data = json_decode_dict(message)
-        encoded = None
-        if data is not None:
+        stats = metrics.stats
+        stats.browser_frames += 1
+        stats.browser_bytes += len(message)
+        data = None
+        if get_server_request_type(message) is not None:
+            data = json_decode_dict(message)
+            request_type = None if data is None else data.get('Type')
             # Handle change set requests.
-            if self.changeset.requested(data):
+            if request_type == 'ChangeSet' and self.changeset.requested(data):
                 return self.changeset.process_request(data)
             # Handle deployment requests.
-            if self.deployment.requested(data):
+            if request_type == 'Deployer' and self.deployment.requested(data):
                 return self.deployment.process_request(data)
-            # Handle authentication requests.
-            if not self.user.is_authenticated:
-                new_data = self.auth.process_request(data)
-                if new_data is None:
-                    # The None marker indicates that a response was sent.
-                    return
-                elif new_data != data:
-                    encoded = escape.json_encode(new_data)
-                    message = encoded.decode('utf8')
-            # Handle authentication token requests.
-            if self.tokens.token_requested(data):
-                return self.tokens.process_token_request(
-                    data, self.user, wrap_write_message(self))
+            if request_type in ('Admin', 'GUIToken'):
+                # Handle authentication requests.
+                if not self.user.is_authenticated:
+                    new_data = self.auth.process_request(data)
+                    if new_data is None:
+                        # The None marker indicates that a response was sent.
+                        return
+                    elif new_data != data:
+                        message = escape.json_encode(new_data).decode('utf8')
+                        data = new_data
+                # Handle authentication token requests.
+                if self.tokens.token_requested(data):
+                    return self.tokens.process_token_request(
+                        data, self.user, wrap_write_message(self))
+                # Handle session resumption requests.
+                if self._resume_grace:
+                    if self.tokens.resume_token_requested(data):
+                        self._resume_token = (
+                            self.tokens.process_resume_token_request(
+                                data, self.user, wrap_write_message(self)))
+                        return
+                    if self.tokens.resume_requested(data):
+                        return self.resume(data)
+                # Store the login request so that it can be replayed if the
+                # Juju API must be reconnected.
+                if (self._reconnect_policy is not None and
+                        self._auth_backend.request_is_login(data)):
+                    self._login_message = message
+        if (self._watcher_cache is not None and
+                self._watcher_cache.handle_request(
+                    message, self.write_message)):
+            # The AllWatcher request has been answered using the cache.
+            return
+        if (self._coalescer is not None and
+                self._coalescer.handle_request(message)):
+            # The AllWatcher request has been answered by the GUI server.
+            return
+        if self._juju_connected_future is None:
+            # The multiplexer is enabled: connect to the Juju API now that
+            # the login request can be inspected.
+            self.connect_juju(data)
         # Propagate messages to the Juju API server.
-        if encoded is None:
-            encoded = message.encode('utf-8')
         if self.juju_connected:
-            logging.debug(self._summary + 'client -> juju: {}'.format(encoded))
+            self._frames.record('client -> juju', message)
+            if self._pending_requests is not None:
+                self._pending_requests.sent(message)
+            if self._request_timer is not None:
+                self._request_timer.sent(message)
             return self.juju_connection.write_message(message)
-        logging.debug(self._summary + 'client -> queue: {}'.format(encoded))
-        self._juju_message_queue.append(message)
+        self._frames.record('client -> queue', message)
+        if not self._juju_message_queue.append(message):
+            logging.error(self._summary + 'message queue full')
+            self._send_queue_full_error(message)
+
+    def resume(self, data):
+        """Reattach to the Juju API connection parked with the given token.
+
+        The resume request is answered using the cached login response.
+        """
+        session = None
+        if self._juju_connected_future is None:
+            # Only connections not yet connected to Juju can be resumed.
+            session = self.tokens.unpark(data['Params']['Token'])
+        if session is None or not session.resume(self.on_juju_message):
+            return wrap_write_message(self)({
+                'RequestId': data['RequestId'],
+                'Error': 'unknown, fulfilled, or expired token',
+                'ErrorCode': 'unauthorized access',
+                'Response': {},
+            })
+        logging.info(self._summary + 'session resumed')
+        user = self.user
+        user.username = session.username
+        user.password = session.password
+        user.is_authenticated = True
+        self._login_message = session.login_message
+        self._login_response = session.login_response
+        if session.watchers is not None:
+            self._watcher_cache = session.watchers
+        self.juju_connection = session.connection
+        self._juju_connected_future = concurrent.Future()
+        self._juju_connected_future.set_result(session.connection)
+        self.juju_connected = True
+        self._start_backpressure()
+        wrap_write_message(self)(
+            dict(session.login_response, RequestId=data['RequestId']))
+        self._flush_queue()
+
+    def _send_queue_full_error(self, message):
+        """Tell the browser that the given message could not be queued."""
+        response = {
+            'Error': 'too many messages sent while connecting to the Juju API',
+            'ErrorCode': 'queue full',
+            'Response': {},
+        }
+        request_id, _, _ = get_request_id(message)
+        if request_id is not None:
+            response['RequestId'] = request_id
+        wrap_write_message(self)(response)
 
     def on_juju_message(self, message):
         """Hook called when a new message is received from the Juju API server.
 
-        The message is propagated to the browser.
+        The message is propagated to the browser. Messages are only decoded
+        while the authentication process is in progress: in all other cases
+        the Juju API frames are passed through to the browser as they are.
         """
         if message is None:
             # The Juju API closed the connection.
             return self.on_juju_close()
-        data = json_decode_dict(message)
-        if (data is not None) and self.auth.in_progress():
-            encoded = escape.json_encode(
-                self.auth.process_response(data))
-            message = encoded.decode('utf8')
-        else:
-            encoded = message.encode('utf-8')
-        logging.debug(self._summary + 'juju -> client: {}'.format(encoded))
+        stats = metrics.stats
+        stats.juju_frames += 1
+        stats.juju_bytes += len(message)
+        if self._relogin:
+            return self._handle_relogin_response(message)
+        if self._pending_requests is not None:
+            self._pending_requests.received(message)
+        if self._request_timer is not None:
+            self._request_timer.received(message)
+        if (self._watcher_cache is not None and
+                self._watcher_cache.handle_response(
+                    message, self.write_message)):
+            # The deltas were requested by the GUI server.
+            return
+        if (self._coalescer is not None and
+                self._coalescer.handle_response(message)):
+            # The AllWatcher deltas are retained for a congested browser.
+            return
+        if self.auth.in_progress():
+            data = json_decode_dict(message)
+            if data is not None:
+                authenticated = self.user.is_authenticated
+                new_data = self.auth.process_response(data)
+                if self.user.is_authenticated and not authenticated:
+                    self._login_response = new_data
+                if new_data is not data:
+                    message = escape.json_encode(new_data).decode('utf8')
+        self._frames.record('juju -> client', message)
         self.write_message(message)
+        if self._backpressure is not None:
+            self._backpressure.check()
 
     def on_close(self):
         """Hook called when the WebSocket connection is terminated."""
         logging.info(self._summary + 'client connection closed')
+        metrics.stats.browser_connections -= 1
         self.connected = False
+        self._juju_message_queue.clear()
+        if self._backpressure is not None:
+            self._backpressure.close()
+        if self._coalescer is not None:
+            self._coalescer.close()
+        if (self._resume_token is not None and self.juju_connected and
+                self._login_response is not None):
+            # Keep the Juju API connection for the browser to resume it.
+            session = resume.ParkedSession(
+                self.juju_connection, self.user.username, self.user.password,
+                self._login_message, self._login_response,
+                watchers=self._watcher_cache)
+            session.park()
+            self.tokens.park(
+                self._resume_token, session,
+                datetime.timedelta(seconds=self._resume_grace))
+            logging.info(self._summary + 'Juju API connection parked')
+            return
         # At this point the WebSocket client connection to the Juju API server
         # might not yet be established. For this reason the connection is
         # terminated adding a callback to the corresponding future.
-        callback = lambda _: self.juju_connection.close()
-        self._io_loop.add_future(self._juju_connected_future, callback)
+        if self._juju_connected_future is not None:
+            self._io_loop.add_future(
+                self._juju_connected_future, self._close_juju_connection)
+
+    def _close_juju_connection(self, future):
+        """Close the Juju API connection resulting from the given future."""
+        if future.exception() is None:
+            future.result().close()
 
     def on_juju_close(self):
         """Hook called when the WebSocket connection to Juju is terminated."""
         logging.info(self._summary + 'Juju API connection closed')
         self.juju_connected = False
         self.juju_connection = None
+        relogin, self._relogin = self._relogin, False
+        if self._backpressure is not None:
+            self._backpressure.close()
+            self._backpressure = None
         # Usually the Juju API connection is terminated as a consequence of a
-        # browser disconnection. A server disconnection is unexpected and
-        # unlikely to happen. In the future Juju will support HA and we will
-        # need to react accordingly to server disconnections, but for the time
-        # being we just disconnect the browser and log an error.
-        if self.connected:
-            logging.error(self._summary + 'Juju API unexpectedly disconnected')
-            self.close()
+        # browser disconnection. A server disconnection happens when a
+        # controller goes away: if possible, connect to another controller,
+        # otherwise disconnect the browser and log an error.
+        if not self.connected:
+            return
+        if (self._reconnect_policy is not None and not relogin and
+                self._login_message is not None and
+                self.user.is_authenticated):
+            logging.warning(self._summary + 'Juju API disconnected')
+            return self.reconnect_juju()
+        logging.error(self._summary + 'Juju API unexpectedly disconnected')
+        self._frames.dump()
+        self.close()
+
+    @gen.coroutine
+    def reconnect_juju(self):
+        """Reconnect to the Juju API and replay the login request.
+
+        Pending requests are re-issued or failed, and browser messages are
+        queued until the Juju API accepts the login request.
+        The browser connection is closed if the Juju API cannot be reached.
+        """
+        self._requeue_pending_requests()
+        policy = self._reconnect_policy
+        urls = policy.get_urls(self._apiurl)
+        for attempt in range(policy.attempts):
+            if attempt:
+                yield gen.Task(
+                    self._io_loop.add_timeout,
+                    self._io_loop.time() + policy.delay)
+            for url in urls:
+                if not self.connected:
+                    return
+                self._juju_connected_future = websocket_connect(
+                    self._io_loop, url, self.on_juju_message,
+                    headers=self._headers, compression=self.compression)
+                try:
+                    connection = yield self._juju_connected_future
+                except Exception as err:
+                    logging.warning(
+                        self._summary + 'unable to reconnect to {}: {}'.format(
+                            url, err))
+                    continue
+                if not self.connected:
+                    # The connection is closed by on_close.
+                    return
+                logging.info(
+                    self._summary + 'Juju API reconnected: {}'.format(url))
+                self.juju_connection = connection
+                self._start_backpressure()
+                _, start, end = get_request_id(self._login_message)
+                self._relogin = True
+                connection.write_message(replace_request_id(
+                    self._login_message, reconnect.LOGIN_REQUEST_ID,
+                    start, end))
+                return
+        logging.error(self._summary + 'unable to reconnect to the Juju API')
+        reconnect.stats.failures += 1
+        self.close()
+
+    def _requeue_pending_requests(self):
+        """Queue the pending requests that can be re-issued to the Juju API.
+
+        Fail all the other pending requests, including the AllWatcher requests
+        retained by the deltas coalescer.
+        """
+        failed = []
+        if self._coalescer is not None:
+            failed.extend(self._coalescer.reset())
+        queue = self._juju_message_queue
+        for request_id, message in self._pending_requests.popall():
+            if reconnect.is_idempotent(message) and queue.append(message):
+                reconnect.stats.reissued += 1
+            else:
+                failed.append(request_id)
+        write_message = wrap_write_message(self)
+        for request_id in failed:
+            reconnect.stats.failed += 1
+            write_message({
+                'RequestId': request_id,
+                'Error': 'connection to the Juju API lost',
+                'ErrorCode': 'connection lost',
+                'Response': {},
+            })
+
+    def _handle_relogin_response(self, message):
+        """Handle the Juju API response to the replayed login request.
+
+        Send the queued messages if the login succeeded, otherwise close the
+        browser connection.
+        """
+        request_id, _, _ = get_request_id(message)
+        if request_id != reconnect.LOGIN_REQUEST_ID:
+            # Unexpected message sent before the login response.
+            return
+        self._relogin = False
+        data = json_decode_dict(message)
+        if data is None or 'Error' in data:
+            logging.error(
+                self._summary + 'login failed after reconnecting to Juju')
+            reconnect.stats.failures += 1
+            return self.close()
+        reconnect.stats.reconnections += 1
+        self.juju_connected = True
+        self._flush_queue()
 
 
 class SandboxHandler(_WebSocketBaseHandler):
@@ -246,8 +686,9 @@ class SandboxHandler(_WebSocketBaseHandler):
     # discard messages.
     connected = True
 
-    def initialize(self):
+    def initialize(self, compression=None):
         """Set up a fake user and a change set middleware."""
+        self.compression = compression
         user = User(
             username='sandbox-user',
             password='sandbox-passwd',
@@ -284,7 +725,15 @@ class IndexHandler(web.StaticFileHandler):
 
 
 class ProxyHandler(web.RequestHandler):
-    """An HTTP(S) proxy from the server to the given target URL."""
+    """An HTTP(S) proxy from the server to the given target URL.
+
+    Responses declaring their length are relayed to the client as they are
+    received. When the client is slower than the target server, the transfer
+    is paused until the data already received is flushed, so that proxying
+    large files, like charm archives, does not make the server memory grow.
+    Other responses are buffered. The transfer is aborted if the client goes
+    away.
+    """
 
     def initialize(self, target_url, validate_cert=True):
         """Initialize the proxy.
@@ -294,6 +743,19 @@ class ProxyHandler(web.RequestHandler):
         """
         self.target_url = target_url
         self.validate_cert = validate_cert
+        # The status code and headers received from the target server.
+        self._response_code = None
+        self._response_headers = None
+        # Whether the response is relayed while received (None if not yet
+        # known), and the body chunks received if the response is buffered.
+        self._streaming = None
+        self._chunks = []
+        # The pycurl handle used to pause the transfer, the number of bytes
+        # waiting to be flushed, and whether the transfer is paused.
+        self._curl = None
+        self._pending = 0
+        self._paused = False
+        self._client_closed = False
 
     @gen.coroutine
     def get(self, path):
@@ -320,26 +782,126 @@ class ProxyHandler(web.RequestHandler):
         self._send_error with the given error.
         """
         request = clone_request(
-            self.request, url, validate_cert=self.validate_cert)
+            self.request, url, validate_cert=self.validate_cert,
+            header_callback=self._on_header_line,
+            streaming_callback=self._on_chunk,
+            prepare_curl_callback=self._on_curl,
+            request_timeout=PROXY_REQUEST_TIMEOUT, use_gzip=False)
         client = httpclient.AsyncHTTPClient()
         try:
             response = yield client.fetch(request)
         except httpclient.HTTPError as err:
             response = getattr(err, 'response', None)
+            if self._client_closed:
+                logging.info('proxy: client went away: {} aborted'.format(
+                    url.encode('utf-8')))
+                raise gen.Return(None)
+            if self._streaming and err.code == 599:
+                # The response is partially sent: close the connection.
+                logging.error('error fetching data from {}: {}'.format(
+                    url.encode('utf-8'), err))
+                self.request.connection.stream.close()
+                raise gen.Return(None)
             if not response:
                 self._send_error(url, err)
+        if response is not None:
+            # The curl HTTP client reports the time spent in its queue.
+            queue_wait = response.time_info.get('queue')
+            if queue_wait is not None:
+                metrics.stats.http_requests += 1
+                metrics.stats.http_queue_wait += queue_wait
         raise gen.Return(response)
 
+    def relay_response(self, code):
+        """Report whether a response with the given code can be relayed
+        while it is received.
+
+        Subclasses can override this in order to handle some responses
+        once fully received.
+        """
+        return True
+
     def send_response(self, response):
         """Prepare and send the response to the client."""
-        self.set_status(response.code)
-        set_header = self.set_header
-        for key, value in response.headers.items():
-            set_header(key, value)
-        body = response.body
+        if self._streaming:
+            # The response has been already relayed.
+            return
+        headers = self._response_headers
+        if headers is None:
+            headers = response.headers
+        self._send_headers(response.code, headers)
+        body = b''.join(self._chunks) or response.body
         if body:
             self.write(body)
 
+    def on_connection_close(self):
+        """Abort the transfer if the client goes away.
+
+        The transfer is resumed if paused, so that it is aborted as soon as
+        the next chunk is received.
+        """
+        self._client_closed = True
+        self._resume()
+
+    def _on_header_line(self, line):
+        """Parse a header line received from the target server."""
+        if line.startswith('HTTP/'):
+            # A new response starts, e.g. after a "100 Continue" response.
+            self._response_code = int(line.split()[1])
+            self._response_headers = httputil.HTTPHeaders()
+        elif line.strip() and self._response_headers is not None:
+            self._response_headers.parse_line(line)
+
+    def _on_chunk(self, chunk):
+        """Relay or buffer a body chunk received from the target server.
+
+        Return 0 if the client went away: curl aborts the transfer when the
+        returned value is not the length of the chunk.
+        """
+        if self._client_closed:
+            return 0
+        if self._streaming is None:
+            self._streaming = (
+                self._response_code is not None and
+                'Content-Length' in self._response_headers and
+                self.relay_response(self._response_code))
+            if self._streaming:
+                self._send_headers(
+                    self._response_code, self._response_headers)
+        if not self._streaming:
+            self._chunks.append(chunk)
+            return
+        self.write(chunk)
+        self._pending += len(chunk)
+        self.flush(callback=self._on_flushed)
+        if self._pending >= PROXY_MAX_PENDING and self._curl is not None:
+            if not self._paused:
+                self._curl.pause(pycurl.PAUSE_RECV)
+                self._paused = True
+
+    def _on_flushed(self):
+        """Resume the transfer once the data received is sent."""
+        self._pending = 0
+        self._resume()
+
+    def _resume(self):
+        """Resume the transfer from the target server if paused."""
+        if self._paused:
+            self._paused = False
+            self._curl.pause(pycurl.PAUSE_CONT)
+
+    def _on_curl(self, curl):
+        """Store the pycurl handle used to fetch the response."""
+        self._curl = curl
+
+    def _send_headers(self, code, headers):
+        """Set the response status code and headers."""
+        self.set_status(code)
+        set_header = self.set_header
+        for key, value in headers.items():
+            if key.lower() not in HOP_BY_HOP_HEADERS:
+                set_header(key, value)
+
     def _send_error(self, url, exception):
         """Send a 500 internal server error to the client."""
         msg = 'error fetching data from {}: {}'.format(
@@ -367,6 +929,7 @@ class JujuProxyHandler(ProxyHandler):
             target_url, validate_cert=False)
         self.default_charm_icon_url = urlparse.urljoin(
             charmworld_url, DEFAULT_CHARM_ICON_PATH)
+        self.proxied_path = None
 
     @gen.coroutine
     def get(self, path):
@@ -375,6 +938,7 @@ class JujuProxyHandler(ProxyHandler):
 
         Override to handle the case when a charm icon is not found.
         """
+        self.proxied_path = path
         url = join_url(self.target_url, path, self.request.query)
         response = yield self.send_request(url)
         if response is not None:
@@ -386,6 +950,14 @@ class JujuProxyHandler(ProxyHandler):
                 # Return the response to the client as usual.
                 self.send_response(response)
 
+    def relay_response(self, code):
+        """See ProxyHandler.relay_response.
+
+        Missing charm icons are handled once the response is received.
+        """
+        return not (
+            code == 404 and self._charm_icon_requested(self.proxied_path))
+
     def _charm_icon_requested(self, path):
         """Return True if the current request is for a charm icon."""
         return (
@@ -413,11 +985,22 @@ class InfoHandler(web.RequestHandler):
         return {
             'apiurl': self.apiurl,
             'apiversion': self.apiversion,
+            'backpressure': backpressure.stats.as_dict(),
+            'cache': cache.stats.as_dict(),
+            'compression': deflate.stats.as_dict(),
             'debug': settings.get('debug', False),
             'deployer': self.deployer.status(),
+            'logs': logs.stats.as_dict(),
+            'pool': pool.stats.as_dict(),
+            'profiler': profiler.stats.as_dict(),
+            'queues': queues.stats.as_dict(),
+            'reconnect': reconnect.stats.as_dict(),
+            'resume': resume.stats.as_dict(),
             'sandbox': self.sandbox,
             'uptime': int(time.time()) - self.start_time,
             'version': get_version(),
+            'watchdog': watchdog.stats.as_dict(),
+            'wsgi': wsgi.stats.as_dict(),
         }
 
     def get(self):
@@ -429,6 +1012,198 @@ class InfoHandler(web.RequestHandler):
         self.write(info)
 
 
+class LatencyHandler(web.RequestHandler):
+    """Return the Juju API latency histograms of the GUI server."""
+
+    def get(self):
+        """Handle GET requests."""
+        self.write(latency.stats.as_dict())
+
+
+class MetricsHandler(web.RequestHandler):
+    """Return the GUI server metrics in the Prometheus text format."""
+
+    def initialize(self, deployer, tokens=None):
+        """Initialize the handler.
+
+        The tokens argument is the authentication token handler, or None in
+        sandbox mode.
+        """
+        self.deployer = deployer
+        self.tokens = tokens
+
+    def get_metrics(self):
+        """Return the metrics document."""
+        writer = metrics.MetricsWriter()
+        add = writer.add
+        traffic = metrics.stats
+        add('browser_connections', 'gauge',
+            'Open browser WebSocket connections.',
+            traffic.browser_connections)
+        add('juju_connections', 'gauge',
+            'Open Juju API WebSocket connections.', traffic.juju_connections)
+        add('websocket_frames_received_total', 'counter',
+            'WebSocket messages received, by source.', [
+                ({'source': 'browser'}, traffic.browser_frames),
+                ({'source': 'juju'}, traffic.juju_frames),
+            ])
+        add('websocket_bytes_received_total', 'counter',
+            'Length of the WebSocket messages received, by source.', [
+                ({'source': 'browser'}, traffic.browser_bytes),
+                ({'source': 'juju'}, traffic.juju_bytes),
+            ])
+        add('queued_messages', 'gauge',
+            'Messages queued while connecting to the Juju API.',
+            queues.stats.messages)
+        add('queued_bytes', 'gauge',
+            'Length of the messages queued while connecting to the Juju API.',
+            queues.stats.size)
+        add('queue_overflows_total', 'counter',
+            'Messages rejected because a queue was full.',
+            queues.stats.overflows)
+        if self.tokens is not None:
+            sizes = self.tokens.sizes()
+            add('tokens', 'gauge',
+                'Stored authentication tokens, by kind.', [
+                    ({'kind': 'login'}, sizes['tokens']),
+                    ({'kind': 'resume'}, sizes['parked']),
+                ])
+        worker_stats = self.deployer.worker_stats()
+        add('deployer_queue_length', 'gauge',
+            'Bundle deployments started or queued.', worker_stats['queue'])
+        add('deployer_busy_seconds_total', 'counter',
+            'Seconds spent by the deployer workers, by worker.', [
+                ({'worker': worker}, busy_time)
+                for worker, busy_time in sorted(
+                    worker_stats['busy_time'].items())
+            ])
+        add('http_client_requests_total', 'counter',
+            'HTTP client requests with a known queue wait.',
+            traffic.http_requests)
+        add('http_client_queue_wait_seconds_total', 'counter',
+            'Seconds HTTP client requests waited in the client queue.',
+            traffic.http_queue_wait)
+        add('ioloop_lag_seconds', 'gauge',
+            'Last measured IO loop lag.', traffic.ioloop_lag)
+        add('ioloop_lag_max_seconds', 'gauge',
+            'Maximum measured IO loop lag.', traffic.ioloop_lag_max)
+        add('ioloop_checks_total', 'counter',
+            'IO loop lag measurements.', traffic.ioloop_checks)
+        add('ioloop_lag_seconds_total', 'counter',
+            'Total measured IO loop lag.', traffic.ioloop_lag_total)
+        add('ioloop_stalls_total', 'counter',
+            'Times the IO loop was found blocked by the watchdog.',
+            watchdog.stats.stalls)
+        wsgi_stats = wsgi.stats
+        add('wsgi_queued_requests', 'gauge',
+            'Juju GUI application requests waiting for a thread.',
+            wsgi_stats.queued)
+        add('wsgi_running_requests', 'gauge',
+            'Juju GUI application requests being run.', wsgi_stats.running)
+        add('wsgi_requests_total', 'counter',
+            'Completed Juju GUI application requests.', wsgi_stats.requests)
+        add('wsgi_rejected_requests_total', 'counter',
+            'Juju GUI application requests rejected because too many were '
+            'queued.', wsgi_stats.rejected)
+        add('wsgi_queue_wait_seconds_total', 'counter',
+            'Seconds Juju GUI application requests waited for a thread.',
+            wsgi_stats.queue_wait)
+        add('wsgi_execution_seconds_total', 'counter',
+            'Seconds spent running the Juju GUI application.',
+            wsgi_stats.execution_time)
+        add('wsgi_execution_max_seconds', 'gauge',
+            'Maximum seconds spent running a Juju GUI application request.',
+            wsgi_stats.execution_max_time)
+        cache_stats = cache.stats
+        add('wsgi_cache_hits_total', 'counter',
+            'Juju GUI application responses served from the cache.',
+            cache_stats.hits)
+        add('wsgi_cache_not_modified_total', 'counter',
+            'Cached Juju GUI application responses answered with 304.',
+            cache_stats.not_modified)
+        add('wsgi_cache_misses_total', 'counter',
+            'Juju GUI application responses not found in the cache.',
+            cache_stats.misses)
+        add('wsgi_cache_entries', 'gauge',
+            'Cached Juju GUI application responses.', cache_stats.entries)
+        add('wsgi_cache_bytes', 'gauge',
+            'Size of the cached Juju GUI application responses.',
+            cache_stats.size)
+        add('wsgi_cache_evictions_total', 'counter',
+            'Cached responses evicted to make room for new ones.',
+            cache_stats.evictions)
+        add('wsgi_cache_invalidations_total', 'counter',
+            'Times the response cache was cleared by a new release.',
+            cache_stats.invalidations)
+        self._add_latency(writer)
+        return writer.getvalue()
+
+    def _add_latency(self, writer):
+        """Add the Juju API latency histograms to the given writer."""
+        bounds = latency.BUCKETS + (float('inf'),)
+        samples = []
+        errors = []
+        histograms = latency.stats.histograms
+        for (facade, request), histogram in sorted(histograms.items()):
+            labels = {'type': facade, 'request': request}
+            cumulative = 0
+            for bound, count in zip(bounds, histogram.buckets):
+                cumulative += count
+                samples.append(
+                    ('_bucket', dict(labels, le=bound), cumulative))
+            samples.append(('_sum', labels, histogram.sum))
+            samples.append(('_count', labels, histogram.count))
+            errors.append((labels, histogram.errors))
+        writer.add(
+            'juju_api_request_duration_seconds', 'histogram',
+            'Juju API request latency, by facade and method.', samples)
+        writer.add(
+            'juju_api_request_errors_total', 'counter',
+            'Juju API error responses, by facade and method.', errors)
+
+    def get(self):
+        """Handle GET requests."""
+        self.set_header('Content-Type', metrics.CONTENT_TYPE)
+        self.write(self.get_metrics())
+
+
+class ProfileHandler(web.RequestHandler):
+    """Start the sampling profiler: see guiserver.profiler.
+
+    Requests must include the profiler token in an "Authorization: Bearer"
+    header. The profile duration in seconds can be passed using the duration
+    argument.
+    """
+
+    def initialize(self, directory, token, duration):
+        """Initialize the handler.
+
+        Profiles are written in the given directory. If the token is empty
+        the endpoint is disabled.
+        """
+        self.directory = directory
+        self.token = token
+        self.duration = duration
+
+    def post(self):
+        """Handle POST requests."""
+        if not self.token:
+            raise web.HTTPError(404)
+        authorization = str(self.request.headers.get('Authorization', ''))
+        if not hmac.compare_digest(authorization, 'Bearer ' + self.token):
+            raise web.HTTPError(403)
+        try:
+            duration = float(self.get_argument('duration', self.duration))
+        except ValueError:
+            duration = 0
+        if not 0 < duration <= profiler.MAX_DURATION:
+            raise web.HTTPError(400, 'invalid duration')
+        path = profiler.start(duration, self.directory)
+        if path is None:
+            raise web.HTTPError(409, 'profiler already running')
+        self.write({'duration': duration, 'path': path})
+
+
 class HttpsRedirectHandler(web.RequestHandler):
     """Permanently redirect all the requests to the equivalent HTTPS URL."""
 
@@ -0,0 +1,175 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Juju GUI server Juju API latency measurements.
+
+The WebSocket handler timestamps the requests it sends to the Juju API and
+matches them with the corresponding responses, so that the time spent by the
+Juju controller serving each request is recorded. Latencies are aggregated
+for all the connections in latency histograms keyed by Juju facade (the
+request Type) and method (the request Request).
+
+Requests are not decoded: the relevant fields are extracted using regular
+expressions, and only when latency measurements are enabled.
+"""
+
+import bisect
+import re
+import time
+
+from guiserver.utils import get_request_id
+
+
+# The upper bounds, in seconds, of the histogram buckets. Values greater than
+# the last bound are stored in an additional bucket.
+BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# The maximum number of distinct (Type, Request) keys: additional requests
+# are recorded using the OTHER key.
+MAX_KEYS = 500
+OTHER = ('other', 'other')
+# Extract the relevant fields from requests and responses.
+_TYPE_PATTERN = re.compile(r'"Type"\s*:\s*"([^"]*)"')
+_REQUEST_PATTERN = re.compile(r'"Request"\s*:\s*"([^"]*)"')
+_ERROR_PATTERN = re.compile(r'"Error"\s*:\s*"')
+
+
+def is_error(message):
+    """Return True if the given Juju API response is an error.
+
+    Juju encodes the response value after the error fields: only the part
+    preceding the response value is searched.
+    """
+    end = message.find('"Response"')
+    if end == -1:
+        end = len(message)
+    return _ERROR_PATTERN.search(message, 0, end) is not None
+
+
+class Histogram(object):
+    """A latency histogram with fixed buckets."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value, error=False):
+        """Record the given latency, in seconds."""
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        if error:
+            self.errors += 1
+
+    def percentile(self, fraction):
+        """Return an estimate of the given percentile, e.g. 0.95.
+
+        The value is linearly interpolated within the matching bucket.
+        Return None if no values have been recorded.
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        cumulative = 0
+        for index, count in enumerate(self.buckets):
+            if count and cumulative + count >= rank:
+                lower = BUCKETS[index - 1] if index else 0
+                upper = BUCKETS[index] if index < len(BUCKETS) else self.max
+                upper = min(upper, self.max)
+                lower = min(lower, upper)
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.max
+
+    def as_dict(self):
+        """Return the histogram summary."""
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean': self.sum / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+        }
+
+
+class LatencyStats(object):
+    """Collect latency histograms for all the connections."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Remove all the histograms."""
+        # Map (Type, Request) keys to histograms.
+        self.histograms = {}
+
+    def observe(self, key, value, error=False):
+        """Record the given latency for the given (Type, Request) key."""
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            if len(self.histograms) >= MAX_KEYS:
+                key = OTHER
+            histogram = self.histograms.setdefault(key, Histogram())
+        histogram.observe(value, error=error)
+
+    def as_dict(self):
+        """Return the histogram summaries keyed by "Type.Request" strings."""
+        return dict(
+            ('{}.{}'.format(*key), histogram.as_dict())
+            for key, histogram in self.histograms.items())
+
+
+# Collect latencies for all the connections in this process.
+stats = LatencyStats()
+
+
+class RequestTimer(object):
+    """Measure the latency of the requests sent by a single connection."""
+
+    def __init__(self):
+        # Map request identifiers to ((Type, Request), start time) tuples.
+        self._requests = {}
+
+    def sent(self, message):
+        """Record the given message as sent to the Juju API."""
+        request_id, _, _ = get_request_id(message)
+        if request_id is None:
+            return
+        facade = _TYPE_PATTERN.search(message)
+        request = _REQUEST_PATTERN.search(message)
+        key = (
+            facade.group(1) if facade is not None else '',
+            request.group(1) if request is not None else '',
+        )
+        self._requests[request_id] = (key, time.time())
+
+    def received(self, message):
+        """Record the given message as received from the Juju API."""
+        if not self._requests:
+            return
+        request_id, _, _ = get_request_id(message)
+        info = self._requests.pop(request_id, None)
+        if info is not None:
+            key, start = info
+            stats.observe(key, time.time() - start, error=is_error(message))
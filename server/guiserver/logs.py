@@ -0,0 +1,172 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Juju GUI server non-blocking logging.
+
+By default log records are written synchronously by the handlers set up on
+the root logger when the command line is parsed. A slow disk or a stalled
+journald would therefore block the IO loop, and with it all the proxied
+WebSocket connections.
+
+The QueueLogHandler replaces the root logger handlers: records are put in a
+bounded queue and written by a background thread using the original
+handlers. If the queue is full, records are dropped and counted rather than
+blocking the IO loop. Queued records are flushed when the handler is closed,
+which happens at interpreter exit (see logging.shutdown).
+"""
+
+import logging
+import Queue
+import threading
+
+
+# The default maximum number of records waiting to be written.
+DEFAULT_MAX_SIZE = 10000
+# The marker used to stop the background thread.
+_STOP = object()
+
+
+class LogStats(object):
+    """Collect logging counters."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Reset all the counters."""
+        # The number of records dropped because the queue was full.
+        self.dropped = 0
+
+    def as_dict(self):
+        """Return the counters."""
+        return {'dropped': self.dropped}
+
+
+# Collect logging counters for this process.
+stats = LogStats()
+
+
+class QueueLogHandler(logging.Handler):
+    """A logging handler writing records from a background thread.
+
+    Records are written using the given handlers.
+    """
+
+    def __init__(self, handlers, max_size=DEFAULT_MAX_SIZE):
+        logging.Handler.__init__(self)
+        self.handlers = list(handlers)
+        self._queue = Queue.Queue(max_size)
+        self._thread = None
+
+    def start(self):
+        """Start writing records from the background thread."""
+        self._thread = threading.Thread(
+            target=self._run, name='guiserver-logging')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def prepare(self, record):
+        """Prepare the record to be written by another thread.
+
+        The message is formatted right away, so that its arguments and the
+        exception information are not accessed concurrently.
+        """
+        message = self.format(record)
+        record.msg = message
+        record.message = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def emit(self, record):
+        """Queue the record, or drop it if the queue is full."""
+        try:
+            self._queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            stats.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def handle_record(self, record):
+        """Write the given record using the target handlers."""
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _run(self):
+        """Write the queued records until the handler is closed."""
+        queue = self._queue
+        while True:
+            record = queue.get()
+            try:
+                if record is _STOP:
+                    return
+                self.handle_record(record)
+            finally:
+                queue.task_done()
+
+    def restart(self):
+        """Restart writing records after the process is forked.
+
+        Threads do not survive a fork, and locks might have been held by them
+        when the process was forked: recreate the queue and the locks.
+        """
+        self._queue = Queue.Queue(self._queue.maxsize)
+        self.createLock()
+        for handler in self.handlers:
+            handler.createLock()
+        self.start()
+
+    def flush(self):
+        """Wait for the queued records to be written."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+        for handler in self.handlers:
+            handler.flush()
+
+    def close(self):
+        """Write all the queued records and stop the background thread."""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join()
+        self._thread = None
+        for handler in self.handlers:
+            handler.flush()
+        logging.Handler.close(self)
+
+
+def restart():
+    """Restart the root logger background thread in a forked process."""
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, QueueLogHandler):
+            handler.restart()
+
+
+def install(max_size=DEFAULT_MAX_SIZE):
+    """Make the root logger write records from a background thread.
+
+    Return the installed QueueLogHandler.
+    """
+    root = logging.getLogger()
+    handler = QueueLogHandler(root.handlers, max_size=max_size)
+    for target in handler.handlers:
+        root.removeHandler(target)
+    root.addHandler(handler)
+    handler.start()
+    return handler
@@ -18,18 +18,33 @@
 
 import logging
 import os
+import signal
 import ssl
 import sys
+import tempfile
 
 from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
 from tornado.options import (
     define,
     options,
     parse_command_line,
 )
+from tornado.process import fork_processes
 
 import guiserver
+from guiserver import (
+    cache,
+    frames,
+    logs,
+    metrics,
+    profiler,
+    watchdog,
+    workers,
+    wsgi,
+)
 from guiserver.apps import (
     redirector,
     server,
@@ -89,6 +104,37 @@ def _validate_range(option_name, min_value, max_value):
                  '{} and {}'.format(option_name, min_value, max_value))
 
 
+def _dump_frames(signum, frame):
+    """Log the recent WebSocket frames of all the browser connections.
+
+    This is used as a signal handler.
+    """
+    IOLoop.instance().add_callback_from_signal(frames.dump_all)
+
+
+def _start_profiler(signum, frame):
+    """Start the sampling profiler.
+
+    This is used as a signal handler.
+    """
+    IOLoop.instance().add_callback_from_signal(
+        profiler.start, options.profileduration, options.profiledir)
+
+
+def _get_profile_dir():
+    """Return the directory where profiles are written.
+
+    Unless explicitly provided, profiles are written in the directory of the
+    server log file, or in the temporary directory if logging to a file is
+    not configured.
+    """
+    if options.profiledir:
+        return options.profiledir
+    if options.log_file_prefix:
+        return os.path.dirname(os.path.abspath(options.log_file_prefix))
+    return tempfile.gettempdir()
+
+
 def _get_ssl_options():
     """Return a Tornado SSL options dict.
 
@@ -160,20 +206,206 @@ def setup():
         help='Enable gzip compression in the gui.')
     define('gtm', type=bool, default=False, help='Enable Google tag manager.')
     define('gisf', type=bool, default=False, help='Enable GUI in store front.')
+    define(
+        'wscompression', type=bool, default=False,
+        help='Set to True to negotiate the permessage-deflate extension on '
+             'both the browser and the Juju API WebSocket connections.')
+    define(
+        'wscompressionlevel', type=int, default=6,
+        help='The WebSocket compression level, from 0 (no compression) to 9 '
+             '(maximum compression).')
+    define(
+        'wscompressionwindowbits', type=int, default=15,
+        help='The base two logarithm of the maximum LZ77 window size used '
+             'for compressing WebSocket messages, from 9 to 15.')
+    define(
+        'wscompressioncontexttakeover', type=bool, default=True,
+        help='Set to False to compress each WebSocket message independently, '
+             'reducing the memory used by each connection at the expense of '
+             'the compression ratio.')
+    define(
+        'multiplex', type=bool, default=False,
+        help='Set to True to share a single Juju API connection between '
+             'multiple browser connections of the same user.')
+    define(
+        'sharewatchers', type=bool, default=False,
+        help='Set to True to share a single AllWatcher between browser '
+             'connections of users with the same model access. This option '
+             'is only used if multiplex is enabled.')
+    define(
+        'poolsize', type=int, default=0,
+        help='The number of idle connections kept open to each recently '
+             'used Juju API URL, from 0 (pool disabled) to 100.')
+    define(
+        'wshighwatermark', type=int, default=4194304,
+        help='The number of bytes buffered for a browser connection above '
+             'which reading from the Juju API is paused. Set to 0 to disable '
+             'backpressure.')
+    define(
+        'wslowwatermark', type=int, default=1048576,
+        help='The number of bytes buffered for a browser connection below '
+             'which reading from the Juju API is resumed.')
+    define(
+        'wsbackpressure', type=str, default='pause',
+        help='The policy applied to congested browser connections: "pause" '
+             'stops reading from the Juju API, "coalesce" merges AllWatcher '
+             'deltas so that only the latest state of each entity is sent.')
+    define(
+        'wsqueuemessages', type=int, default=1000,
+        help='The maximum number of browser messages queued while the '
+             'connection to the Juju API is being established.')
+    define(
+        'wsqueuesize', type=int, default=10485760,
+        help='The maximum size of browser messages queued while the '
+             'connection to the Juju API is being established.')
+    define(
+        'wsreconnectattempts', type=int, default=0,
+        help='The number of times the GUI server tries to reconnect to the '
+             'Juju API when the connection drops, without disconnecting the '
+             'browser. Set to 0 (default) to disable reconnections.')
+    define(
+        'apiaddresses', type=str, default='',
+        help='A comma separated list of alternative "host:port" addresses of '
+             'Juju controllers, used when reconnecting to the Juju API.')
+    define(
+        'resumegrace', type=int, default=0,
+        help='The number of seconds the Juju API connection of a reloaded '
+             'GUI is kept open waiting for the browser to resume it. Set to '
+             '0 (default) to disable session resumption.')
+    define(
+        'wslogsample', type=int, default=frames.DEFAULT_SAMPLE,
+        help='When debugging, log one WebSocket frame every the given number '
+             'of frames.')
+    define(
+        'wslogpayload', type=int, default=frames.DEFAULT_MAX_PAYLOAD,
+        help='The maximum number of characters logged for each WebSocket '
+             'frame.')
+    define(
+        'wsframes', type=int, default=frames.DEFAULT_RING_SIZE,
+        help='The number of recent WebSocket frames kept for each browser '
+             'connection, logged when the Juju API disconnects unexpectedly '
+             'or when the server receives SIGUSR1. Set to 0 to disable.')
+    define(
+        'wslatency', type=bool, default=True,
+        help='Set to False to stop recording the latency of Juju API '
+             'requests, exposed in /gui-server-latency.')
+    define(
+        'watchdog', type=float, default=1,
+        help='Log the stack of the server thread when the IO loop is blocked '
+             'for more than the given number of seconds. Set to 0 to disable '
+             'the watchdog.')
+    define(
+        'profiledir', type=str, default='',
+        help='The directory where profiles are written. Defaults to the '
+             'directory of the log file, or to the temporary directory.')
+    define(
+        'profileduration', type=int, default=30,
+        help='The seconds the sampling profiler runs when the server '
+             'receives SIGUSR2.')
+    define(
+        'profiletoken', type=str, default='',
+        help='The secret token required to start the sampling profiler '
+             'using /gui-server-profile. The endpoint is disabled by '
+             'default.')
+    define(
+        'wsgithreads', type=int, default=wsgi.DEFAULT_MAX_WORKERS,
+        help='The number of threads serving the Juju GUI application, so '
+             'that it does not block the IO loop. Set to 0 to serve the '
+             'application from the IO loop.')
+    define(
+        'wsgiqueue', type=int, default=wsgi.DEFAULT_MAX_QUEUED,
+        help='The maximum number of Juju GUI application requests waiting '
+             'for a thread. Further requests are rejected.')
+    define(
+        'wsgicachesize', type=int, default=cache.DEFAULT_MAX_SIZE,
+        help='The maximum size in bytes of the cached Juju GUI application '
+             'responses. Set to 0 to disable the response cache.')
+    define(
+        'workers', type=int, default=1,
+        help='The number of server processes sharing the listening sockets. '
+             'Set to 0 to start a process for each CPU.')
+    define(
+        'tokenstore', type=str, default='',
+        help='The path to a SQLite database where authentication and bundle '
+             'change set tokens are stored, so that they survive restarts '
+             'and can be shared by GUI servers on the same machine. Tokens '
+             'are stored in memory by default.')
+    define(
+        'logqueue', type=int, default=0,
+        help='The maximum number of log records waiting to be written by a '
+             'background thread, so that slow log writes do not block the '
+             'server. Set to 0 (default) to write log records synchronously.')
     # In Tornado, parsing the options also sets up the default logger.
     parse_command_line()
     _validate_choices('apiversion', ('go', 'python'))
     _validate_range('port', 1, 65535)
+    _validate_range('wscompressionlevel', 0, 9)
+    _validate_range('wscompressionwindowbits', 9, 15)
+    _validate_range('poolsize', 0, 100)
+    _validate_range('wslowwatermark', 0, options.wshighwatermark)
+    _validate_choices('wsbackpressure', ('pause', 'coalesce'))
+    _validate_range('wsqueuemessages', 1, 1000000)
+    _validate_range('wsqueuesize', 1, 1073741824)
+    _validate_range('wsreconnectattempts', 0, 100)
+    _validate_range('resumegrace', 0, 3600)
+    _validate_range('wslogsample', 1, 1000000)
+    _validate_range('wslogpayload', 1, 1048576)
+    _validate_range('wsframes', 0, 1000)
+    _validate_range('logqueue', 0, 1000000)
+    _validate_range('watchdog', 0, 3600)
+    _validate_range('profileduration', 1, profiler.MAX_DURATION)
+    _validate_range('workers', 0, 128)
+    _validate_range('wsgithreads', 0, 100)
+    _validate_range('wsgiqueue', 1, 100000)
+    _validate_range('wsgicachesize', 0, 1024 * 1024 * 1024)
+    options.profiledir = _get_profile_dir()
+    if options.logqueue:
+        logs.install(max_size=options.logqueue)
     _add_debug(logging.getLogger())
     # Configure the asynchronous HTTP client used by proxy handlers.
     AsyncHTTPClient.configure(
         'tornado.curl_httpclient.CurlAsyncHTTPClient', max_clients=20)
 
 
+def _run_workers(port, ssl_options, redirect):
+    """Bind the listening sockets and fork the worker processes.
+
+    Return in each worker process once its servers are listening.
+    """
+    sockets = bind_sockets(port)
+    redirector_sockets = bind_sockets(80) if redirect else None
+    # Start the coordinator before forking, so that all the workers share
+    # the same tokens. This is not required if tokens are stored in SQLite.
+    shared_state = None
+    if not options.tokenstore:
+        shared_state = workers.start_coordinator()
+    task_id = fork_processes(options.workers or None)
+    logs.restart()
+    logging.info('worker {} started'.format(task_id))
+    if redirector_sockets is not None:
+        HTTPServer(redirector()).add_sockets(redirector_sockets)
+    HTTPServer(
+        server(shared_state=shared_state), ssl_options=ssl_options,
+    ).add_sockets(sockets)
+
+
 def run():
     """Run the server"""
     port = options.port
-    if options.insecure:
+    if options.workers != 1:
+        # Run the server in multiple processes.
+        ssl_options = None
+        redirect = False
+        if options.insecure:
+            if port is None:
+                port = 80
+        else:
+            if port is None:
+                port = 443
+                redirect = True
+            ssl_options = _get_ssl_options()
+        _run_workers(port, ssl_options, redirect)
+    elif options.insecure:
         # Run the server over an insecure HTTP connection.
         if port is None:
             port = 80
@@ -187,4 +419,15 @@ def run():
     version = guiserver.get_version()
     logging.info('starting Juju GUI server v{}'.format(version))
     logging.info('listening on port {}'.format(port))
-    IOLoop.instance().start()
+    signal.signal(signal.SIGUSR1, _dump_frames)
+    signal.signal(signal.SIGUSR2, _start_profiler)
+    io_loop = IOLoop.instance()
+    interval = metrics.DEFAULT_LAG_INTERVAL
+    if options.watchdog:
+        # Check the IO loop often enough to detect blocking callbacks.
+        interval = min(interval, options.watchdog / 2.0)
+    lag_monitor = metrics.LagMonitor(interval=interval, io_loop=io_loop)
+    lag_monitor.start()
+    if options.watchdog:
+        watchdog.Watchdog(lag_monitor, options.watchdog).start()
+    io_loop.start()
@@ -0,0 +1,173 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Juju GUI server metrics in the Prometheus text format.
+
+This module collects the counters not already tracked by other GUI server
+modules (WebSocket traffic, open connections, HTTP client queueing and IO
+loop lag), and provides the writer used to expose all the GUI server metrics
+in the Prometheus text exposition format. See
+<https://prometheus.io/docs/instrumenting/exposition_formats/>.
+"""
+
+from tornado.ioloop import IOLoop
+
+
+# The content type of the Prometheus text format.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# The seconds between IO loop lag measurements.
+DEFAULT_LAG_INTERVAL = 1
+# The prefix used for all the GUI server metric names.
+PREFIX = 'guiserver_'
+
+
+class MetricsStats(object):
+    """Collect traffic and scheduling counters for all the connections."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Reset all the counters."""
+        # The number of WebSocket connections currently open.
+        self.browser_connections = 0
+        self.juju_connections = 0
+        # The number and the length of the messages received from the
+        # browsers and from the Juju API.
+        self.browser_frames = 0
+        self.browser_bytes = 0
+        self.juju_frames = 0
+        self.juju_bytes = 0
+        # The number of HTTP client responses reporting the time spent in
+        # the HTTP client queue, and the total seconds they waited.
+        self.http_requests = 0
+        self.http_queue_wait = 0.0
+        # The number of IO loop lag measurements, and their total, last and
+        # maximum value in seconds.
+        self.ioloop_checks = 0
+        self.ioloop_lag_total = 0.0
+        self.ioloop_lag = 0.0
+        self.ioloop_lag_max = 0.0
+
+    def as_dict(self):
+        """Return the counters."""
+        return {
+            'browser_connections': self.browser_connections,
+            'juju_connections': self.juju_connections,
+            'browser_frames': self.browser_frames,
+            'browser_bytes': self.browser_bytes,
+            'juju_frames': self.juju_frames,
+            'juju_bytes': self.juju_bytes,
+            'http_requests': self.http_requests,
+            'http_queue_wait': self.http_queue_wait,
+            'ioloop_checks': self.ioloop_checks,
+            'ioloop_lag_total': self.ioloop_lag_total,
+            'ioloop_lag': self.ioloop_lag,
+            'ioloop_lag_max': self.ioloop_lag_max,
+        }
+
+
+# Collect metrics for all the connections in this process.
+stats = MetricsStats()
+
+
+class LagMonitor(object):
+    """Periodically measure how late the IO loop runs scheduled callbacks.
+
+    A high lag means that callbacks are blocking the IO loop, and therefore
+    that all the connections served by this process are delayed.
+    """
+
+    def __init__(self, interval=DEFAULT_LAG_INTERVAL, io_loop=None):
+        if io_loop is None:
+            io_loop = IOLoop.current()
+        self.io_loop = io_loop
+        self._interval = interval
+        # The IO loop time at which the next measurement is due, also used by
+        # the watchdog to detect a blocked IO loop: see guiserver.watchdog.
+        self.deadline = None
+        self._handle = None
+
+    def start(self):
+        """Start measuring the IO loop lag."""
+        self.deadline = self.io_loop.time() + self._interval
+        self._handle = self.io_loop.add_timeout(self.deadline, self._check)
+
+    def stop(self):
+        """Stop measuring the IO loop lag."""
+        if self._handle is not None:
+            self.io_loop.remove_timeout(self._handle)
+            self._handle = None
+
+    def _check(self):
+        """Record the lag and schedule the next measurement."""
+        lag = max(self.io_loop.time() - self.deadline, 0)
+        stats.ioloop_checks += 1
+        stats.ioloop_lag_total += lag
+        stats.ioloop_lag = lag
+        stats.ioloop_lag_max = max(stats.ioloop_lag_max, lag)
+        self.start()
+
+
+def _escape(value):
+    """Escape the given label value."""
+    if isinstance(value, (int, float)):
+        value = _format_value(value)
+    return unicode(value).replace(
+        '\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_value(value):
+    """Format the given sample value."""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class MetricsWriter(object):
+    """Build a Prometheus text format document."""
+
+    def __init__(self):
+        self._lines = []
+
+    def add(self, name, kind, description, samples):
+        """Add the metric with the given name, type and description.
+
+        The samples argument is either a value or a list of (labels, value)
+        tuples, where labels is a dict. Histograms samples are provided as
+        (suffix, labels, value) tuples instead.
+        """
+        name = PREFIX + name
+        lines = self._lines
+        lines.append(u'# HELP {} {}'.format(name, description))
+        lines.append(u'# TYPE {} {}'.format(name, kind))
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+        for sample in samples:
+            suffix = sample[0] if len(sample) == 3 else ''
+            labels, value = sample[-2:]
+            label_text = u','.join(
+                u'{}="{}"'.format(key, _escape(labels[key]))
+                for key in sorted(labels))
+            if label_text:
+                label_text = u'{' + label_text + u'}'
+            lines.append(u'{}{}{} {}'.format(
+                name, suffix, label_text, _format_value(value)))
+
+    def getvalue(self):
+        """Return the document."""
+        return u'\n'.join(self._lines) + u'\n'
@@ -0,0 +1,396 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Juju GUI server Juju API connections multiplexing.
+
+This module allows multiple browser connections of the same user to share a
+single WebSocket connection to the Juju API, reducing the number of sessions
+and watchers the Juju controller must handle.
+
+    - Multiplexer: the registry of shared Juju API sessions, instantiated
+      once when the application is bootstrapped and used as a singleton by
+      all WebSocket handlers. Sessions are keyed by Juju API URL (and
+      therefore by model) and user name.
+    - SharedSession: a single WebSocket connection to the Juju API, shared by
+      multiple browser connections. Request identifiers are rewritten so that
+      responses can be routed back to the browser connection which sent the
+      corresponding request.
+    - MultiplexedConnection: the object used by WebSocket handlers to
+      communicate with the Juju API through a shared session. It exposes the
+      same write_message/close interface as the WebSocket client connection.
+
+A session is shared only after the Juju API accepted its credentials: other
+browser connections attach to the session only if they provide the same
+credentials. In that case their login requests are not sent to Juju: the
+cached login response is returned instead, provided that the request
+includes the credentials of the session. Other login requests are rejected.
+
+If enabled, AllWatchers are also shared between sessions: see
+guiserver.allwatchers.
+"""
+
+import hmac
+import itertools
+import logging
+import re
+
+from tornado import (
+    escape,
+    gen,
+)
+from tornado.ioloop import IOLoop
+
+from guiserver.allwatchers import (
+    get_access_key,
+    WatcherHub,
+)
+from guiserver.clients import websocket_connect
+from guiserver.utils import (
+    get_request_id,
+    json_decode_dict,
+    make_type_matcher,
+    replace_request_id,
+)
+
+
+# Detect login requests and requests for starting new watchers.
+_is_admin = make_type_matcher(('Admin',))
+_WATCH_ALL_PATTERN = re.compile(r'"Request"\s*:\s*"WatchAll"')
+# Map the facades used to start watchers to the corresponding watcher facade.
+_WATCHER_FACADES = {
+    'Client': 'AllWatcher',
+    'Controller': 'AllModelWatcher',
+}
+
+
+def _decode_login(message):
+    """Return the decoded login request in the given message.
+
+    Return None if the message is not a login request.
+    """
+    if _is_admin(message) is None:
+        return None
+    data = json_decode_dict(message)
+    if (data is None or data.get('Type') != 'Admin' or
+            data.get('Request') != 'Login'):
+        return None
+    return data
+
+
+class Multiplexer(object):
+    """Handle the Juju API sessions shared by browser connections."""
+
+    def __init__(self, io_loop=None, share_watchers=False, pool=None):
+        if io_loop is None:
+            io_loop = IOLoop.current()
+        self._io_loop = io_loop
+        # The optional pool used to establish Juju API connections.
+        self.pool = pool
+        # Map (Juju API URL, user name) keys to logged in shared sessions.
+        self.sessions = {}
+        # The hub used to share AllWatchers, if enabled.
+        self.watchers = WatcherHub() if share_watchers else None
+
+    @gen.coroutine
+    def connect(
+            self, apiurl, username, password, on_message_callback,
+            headers=None, compression=None):
+        """Return a connection to the Juju API for the given user.
+
+        The connection shares an existing session if the given credentials
+        match the ones of an already logged in session. Otherwise a new
+        session is created, and it will be shared as soon as the Juju API
+        accepts the user credentials.
+
+        The given callback is called each time a message for this connection
+        is received from the Juju API, or with None if the Juju API closes
+        the connection.
+
+        Return a Future whose result is a MultiplexedConnection.
+        """
+        key = (apiurl, username)
+        session = self.sessions.get(key)
+        if session is None or not session.check_password(password):
+            session = SharedSession(self, key, password)
+            yield session.connect(headers=headers, compression=compression)
+        else:
+            logging.info('multiplex: sharing session for {}'.format(username))
+        raise gen.Return(session.attach(on_message_callback))
+
+    def register(self, session):
+        """Start sharing the given logged in session.
+
+        Sessions are not registered if another session is already shared for
+        the same key: in that case the given session is used only by the
+        browser connection which created it.
+        """
+        self.sessions.setdefault(session.key, session)
+
+    def unregister(self, session):
+        """Stop sharing the given session."""
+        if self.sessions.get(session.key) is session:
+            del self.sessions[session.key]
+
+
+class SharedSession(object):
+    """A Juju API WebSocket connection shared by browser connections."""
+
+    def __init__(self, multiplexer, key, password):
+        self._multiplexer = multiplexer
+        self.key = key
+        self._password = password
+        self._connection = None
+        self._closed = False
+        # The set of attached browser connections.
+        self._connections = set()
+        # Generate the request identifiers used with the Juju API.
+        self._request_ids = itertools.count(1)
+        # Map Juju request identifiers to (connection, original id) tuples.
+        self._requests = {}
+        # Map Juju request identifiers to callbacks for the requests sent by
+        # the GUI server itself.
+        self._callbacks = {}
+        # Store the identifiers of in progress login and WatchAll requests.
+        self._login_request_ids = set()
+        self._watch_requests = {}
+        # Store the login response once the user is logged in.
+        self.login_response = None
+        # The key used to share watchers, available once logged in.
+        self.access_key = None
+
+    def check_password(self, password):
+        """Return True if the given password is the one of this session.
+
+        Only logged in sessions can be shared.
+        """
+        return (
+            self.login_response is not None and
+            hmac.compare_digest(
+                escape.utf8(self._password), escape.utf8(password)))
+
+    def check_login(self, data):
+        """Return True if the given login request data includes the
+        credentials of this session.
+        """
+        params = (data or {}).get('Params')
+        if not isinstance(params, dict):
+            return False
+        password = params.get('Password')
+        return (
+            params.get('AuthTag') == self.key[1] and
+            isinstance(password, basestring) and
+            self.check_password(password))
+
+    @gen.coroutine
+    def connect(self, headers=None, compression=None):
+        """Connect this session to the Juju API."""
+        apiurl = self.key[0]
+        pool = self._multiplexer.pool
+        if pool is None:
+            self._connection = yield websocket_connect(
+                self._multiplexer._io_loop, apiurl, self.on_message,
+                headers=headers, compression=compression)
+        else:
+            self._connection = yield pool.connect(
+                apiurl, self.on_message, headers=headers,
+                compression=compression)
+
+    def attach(self, on_message_callback):
+        """Attach a browser connection to this session.
+
+        Return a MultiplexedConnection.
+        """
+        connection = MultiplexedConnection(self, on_message_callback)
+        self._connections.add(connection)
+        return connection
+
+    def detach(self, connection):
+        """Detach the given browser connection from this session.
+
+        Pending responses for the connection are discarded, and watchers
+        started by the connection are stopped. The Juju API connection is
+        terminated when the last browser connection is detached.
+        """
+        self._connections.discard(connection)
+        hub = self._multiplexer.watchers
+        for subscription in list(connection.subscriptions):
+            hub.unsubscribe(subscription)
+        for request_id, (conn, _) in self._requests.items():
+            if conn is connection:
+                del self._requests[request_id]
+        if not self._connections:
+            self.close()
+            return
+        for facade, watcher_id, version in connection.watchers:
+            request = {
+                'RequestId': next(self._request_ids),
+                'Type': facade,
+                'Request': 'Stop',
+                'Id': watcher_id,
+            }
+            if version is not None:
+                request['Version'] = version
+            self._connection.write_message(escape.json_encode(request))
+
+    def close(self):
+        """Terminate the Juju API connection and stop sharing this session."""
+        self._closed = True
+        self._multiplexer.unregister(self)
+        if self._multiplexer.watchers is not None:
+            self._multiplexer.watchers.session_closed(self)
+        if self._connection is not None:
+            self._connection.close()
+
+    def call(self, data, callback):
+        """Send a request on behalf of the GUI server.
+
+        The given callback is called passing the decoded response data.
+        """
+        if self._closed:
+            return
+        juju_request_id = next(self._request_ids)
+        self._callbacks[juju_request_id] = callback
+        data = dict(data, RequestId=juju_request_id)
+        self._connection.write_message(escape.json_encode(data))
+
+    def send(self, connection, message):
+        """Send a message from the given browser connection to the Juju API.
+        """
+        if self._closed:
+            return
+        request_id, start, end = get_request_id(message)
+        if request_id is None:
+            # The Juju API will return an error.
+            return self._connection.write_message(message)
+        login = _decode_login(message)
+        is_login = login is not None
+        if is_login and self.login_response is not None:
+            # Reply to login requests using the cached response, but only if
+            # they include the credentials used to log in this session.
+            if self.check_login(login):
+                response = dict(self.login_response, RequestId=request_id)
+            else:
+                logging.warning(
+                    'multiplex: login with different credentials rejected')
+                response = {
+                    'RequestId': request_id,
+                    'Error': 'invalid entity name or password',
+                    'ErrorCode': 'unauthorized access',
+                    'Response': {},
+                }
+            return connection.on_message(escape.json_encode(response))
+        hub = self._multiplexer.watchers
+        if hub is not None and hub.handle(
+                self, connection, request_id, message):
+            return
+        juju_request_id = next(self._request_ids)
+        self._requests[juju_request_id] = (connection, request_id)
+        if is_login:
+            self._login_request_ids.add(juju_request_id)
+        elif _WATCH_ALL_PATTERN.search(message) is not None:
+            data = json_decode_dict(message)
+            if data is not None:
+                facade = _WATCHER_FACADES.get(data.get('Type'))
+                if facade is not None:
+                    self._watch_requests[juju_request_id] = (
+                        facade, data.get('Version'))
+        message = replace_request_id(message, juju_request_id, start, end)
+        self._connection.write_message(message)
+
+    def on_message(self, message):
+        """Route a message received from the Juju API to a browser connection.
+        """
+        if message is None:
+            # The Juju API closed the connection.
+            self._closed = True
+            self._multiplexer.unregister(self)
+            if self._multiplexer.watchers is not None:
+                self._multiplexer.watchers.session_closed(self)
+            for connection in list(self._connections):
+                connection.on_message(None)
+            return
+        juju_request_id, start, end = get_request_id(message)
+        callback = self._callbacks.pop(juju_request_id, None)
+        if callback is not None:
+            return callback(json_decode_dict(message) or {})
+        info = self._requests.pop(juju_request_id, None)
+        if info is None:
+            # The browser connection is detached, or this is the response to
+            # a request sent by the session itself.
+            return
+        connection, request_id = info
+        if juju_request_id in self._login_request_ids:
+            self._login_request_ids.remove(juju_request_id)
+            self._handle_login_response(message)
+        elif juju_request_id in self._watch_requests:
+            facade, version = self._watch_requests.pop(juju_request_id)
+            data = json_decode_dict(message)
+            watcher_id = (data or {}).get('Response', {}).get('AllWatcherId')
+            if watcher_id is not None:
+                connection.watchers.append((facade, watcher_id, version))
+        message = replace_request_id(message, request_id, start, end)
+        connection.on_message(message)
+
+    def _handle_login_response(self, message):
+        """Start sharing this session if the login succeeded."""
+        data = json_decode_dict(message)
+        if (data is None) or ('Error' in data) or (self._closed):
+            return
+        self.login_response = data
+        self.access_key = get_access_key(self.key[0], self.key[1], data)
+        self._multiplexer.register(self)
+        logging.info('multiplex: session for {} logged in'.format(self.key[1]))
+
+
+class MultiplexedConnection(object):
+    """A browser connection to the Juju API through a shared session."""
+
+    def __init__(self, session, on_message_callback):
+        self._session = session
+        self._on_message_callback = on_message_callback
+        self._closed = False
+        # Store (facade, id, version) tuples for the watchers started by this
+        # connection, so that they can be stopped when it is closed.
+        self.watchers = []
+        # The shared watcher subscriptions of this connection.
+        self.subscriptions = set()
+
+    def write_message(self, message):
+        """Send the given message to the Juju API."""
+        if not self._closed:
+            self._session.send(self, message)
+
+    def write_messages(self, messages):
+        """Send the given messages to the Juju API."""
+        for message in messages:
+            self.write_message(message)
+
+    def set_on_message_callback(self, on_message_callback):
+        """Set the callback called each time a new message is received."""
+        self._on_message_callback = on_message_callback
+
+    def on_message(self, message):
+        """Propagate a message from the Juju API."""
+        if not self._closed:
+            if message is None:
+                self._closed = True
+            self._on_message_callback(message)
+
+    def close(self):
+        """Detach this connection from the shared session."""
+        if not self._closed:
+            self._closed = True
+            self._session.detach(self)
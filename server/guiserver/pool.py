@@ -0,0 +1,218 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Juju GUI server pool of pre-established Juju API connections.
+
+Establishing a secure WebSocket connection to the Juju API requires a TCP and
+a full TLS handshake. The pool keeps a small number of idle connections to
+each recently used Juju API URL, so that browser connections can start
+talking to Juju right away, and so that a burst of browser reconnections
+(e.g. after a GUI server restart) does not translate into a burst of
+handshakes against the controller.
+
+Idle connections have not yet logged in: the login request is always sent by
+the browser once the connection is taken from the pool. Idle connections are
+opened with the headers of the browser connection which triggered the refill
+(e.g. its Origin), so they are only handed to browser connections sending the
+same headers.
+"""
+
+from collections import (
+    deque,
+    OrderedDict,
+)
+import functools
+import logging
+import time
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from guiserver.clients import websocket_connect
+
+
+# The maximum number of Juju API URLs for which idle connections are kept.
+MAX_TARGETS = 10
+
+
+class PoolStats(object):
+    """Collect connection pool counters."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Reset all the counters."""
+        self.hits = 0
+        self.misses = 0
+        self.handshakes = 0
+        self.handshake_time = 0
+        self.handshake_max_time = 0
+
+    def add_handshake(self, elapsed):
+        """Record a completed handshake which took the given seconds."""
+        self.handshakes += 1
+        self.handshake_time += elapsed
+        self.handshake_max_time = max(self.handshake_max_time, elapsed)
+
+    def as_dict(self):
+        """Return the counters, the hit ratio and the handshake latencies.
+
+        Latencies are expressed in milliseconds.
+        """
+        requests = self.hits + self.misses
+        hit_ratio = None
+        if requests:
+            hit_ratio = round(float(self.hits) / requests, 2)
+        handshake_avg = None
+        if self.handshakes:
+            handshake_avg = round(
+                self.handshake_time * 1000 / self.handshakes, 2)
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': hit_ratio,
+            'handshakes': self.handshakes,
+            'handshake_avg_ms': handshake_avg,
+            'handshake_max_ms': round(self.handshake_max_time * 1000, 2),
+        }
+
+
+# Collect pool counters for all the connections in this process.
+stats = PoolStats()
+
+
+class ConnectionPool(object):
+    """A pool of idle WebSocket connections to the Juju API.
+
+    Connections are pooled by URL, compression options and request headers.
+    The pool for a key is filled when the first connection for that key is
+    requested, and refilled each time a connection is taken. The connection
+    established for the first request counts toward the pool size, so that
+    the first request does not cost more handshakes than the pool size.
+    """
+
+    def __init__(self, size, io_loop=None):
+        if io_loop is None:
+            io_loop = IOLoop.current()
+        self._io_loop = io_loop
+        self.size = size
+        # Map (URL, compression, headers) keys to deques of idle connections.
+        # Keys are stored from the least to the most recently used.
+        self._idle = OrderedDict()
+        # Map keys to the number of connections being established.
+        self._pending = {}
+
+    def connect(
+            self, url, on_message_callback, headers=None, compression=None):
+        """Return a connection to the given WebSocket URL.
+
+        Use an idle connection if available, or establish a new one.
+        Accept the same arguments as guiserver.clients.websocket_connect,
+        and return a Future whose result is a WebSocketClientConnection.
+        """
+        key = (url, compression, tuple(sorted((headers or {}).items())))
+        dialled = 0
+        idle = self._idle.pop(key, None)
+        if idle is None:
+            # The connection established below counts toward the pool size.
+            dialled = 1
+            idle = deque()
+        # Mark the key as the most recently used one.
+        self._idle[key] = idle
+        self._evict()
+        if idle:
+            stats.hits += 1
+            conn = idle.popleft()
+            conn.set_on_message_callback(on_message_callback)
+            future = Future()
+            future.set_result(conn)
+        else:
+            stats.misses += 1
+            future = self._dial(url, on_message_callback, headers, compression)
+        self._fill(key, dialled=dialled)
+        return future
+
+    def _dial(self, url, on_message_callback, headers, compression):
+        """Establish a new connection, recording the handshake latency."""
+        start = time.time()
+        future = websocket_connect(
+            self._io_loop, url, on_message_callback, headers=headers,
+            compression=compression)
+
+        def record(future):
+            if future.exception() is None:
+                stats.add_handshake(time.time() - start)
+        future.add_done_callback(record)
+        return future
+
+    def _fill(self, key, dialled=0):
+        """Establish new idle connections for the given key if required.
+
+        The given number of connections just established for callers are
+        subtracted from the connections to be established.
+        """
+        url, compression, headers = key
+        headers = dict(headers)
+        idle = self._idle.get(key)
+        if idle is None:
+            return
+        missing = (
+            self.size - dialled - len(idle) - self._pending.get(key, 0))
+        for _ in range(missing):
+            self._pending[key] = self._pending.get(key, 0) + 1
+            holder = []
+            callback = functools.partial(self._on_idle_message, key, holder)
+            future = self._dial(url, callback, headers, compression)
+            self._io_loop.add_future(
+                future, functools.partial(self._on_connected, key, holder))
+
+    def _on_connected(self, key, holder, future):
+        """Add the newly established connection to the idle ones."""
+        self._pending[key] -= 1
+        if not self._pending[key]:
+            del self._pending[key]
+        try:
+            conn = future.result()
+        except Exception as err:
+            logging.error('pool: unable to connect to {}: {}'.format(
+                key[0], err))
+            return
+        idle = self._idle.get(key)
+        if idle is None:
+            # The key has been evicted in the meanwhile.
+            return conn.close()
+        holder.append(conn)
+        idle.append(conn)
+
+    def _on_idle_message(self, key, holder, message):
+        """Handle messages received by idle connections.
+
+        Idle connections are not logged in, so the only expected message is
+        the None marker, sent when Juju closes the connection: in that case
+        the connection is removed from the pool.
+        """
+        if message is None and holder:
+            idle = self._idle.get(key, ())
+            if holder[0] in idle:
+                idle.remove(holder[0])
+
+    def _evict(self):
+        """Close the idle connections of the least recently used URLs."""
+        while len(self._idle) > MAX_TARGETS:
+            _, idle = self._idle.popitem(last=False)
+            for conn in idle:
+                conn.close()
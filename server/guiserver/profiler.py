@@ -0,0 +1,153 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Juju GUI server on-demand sampling profiler.
+
+The profiler can be started while the server is running, either sending
+SIGUSR2 to the server process or using the /gui-server-profile endpoint. A
+helper thread periodically samples the stack of the IO loop thread for the
+requested number of seconds, and then writes the samples to a file in the
+collapsed stack format, one "frame;frame;frame count" line for each distinct
+stack, root frame first. The file can be fed to flame graph tools like
+<https://github.com/brendangregg/FlameGraph>.
+
+Sampling does not instrument the profiled code: the IO loop only pays for the
+helper thread holding the interpreter lock while a stack is collected.
+"""
+
+from collections import defaultdict
+import logging
+import os
+import sys
+import thread
+import threading
+import time
+
+
+# The default seconds between samples.
+DEFAULT_INTERVAL = 0.01
+# The maximum number of seconds a profile can last.
+MAX_DURATION = 300
+
+
+class ProfilerStats(object):
+    """Collect profiler counters."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Reset all the counters."""
+        # The number of completed profiles and the samples they collected.
+        self.profiles = 0
+        self.samples = 0
+
+    def as_dict(self):
+        """Return the counters."""
+        return {'profiles': self.profiles, 'samples': self.samples}
+
+
+# Collect profiler counters for this process.
+stats = ProfilerStats()
+# The sampler currently running, if any.
+_sampler = None
+
+
+def collapse(frame):
+    """Return the given stack as a collapsed stack string, root first."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}'.format(
+            os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler(object):
+    """Sample the stack of a thread and write the collapsed stacks to a file.
+    """
+
+    def __init__(self, thread_id, duration, path, interval=DEFAULT_INTERVAL):
+        self.thread_id = thread_id
+        self.duration = duration
+        self.path = path
+        self.interval = interval
+        # Map collapsed stacks to the number of times they were sampled.
+        self.stacks = defaultdict(int)
+        self._thread = None
+
+    def start(self):
+        """Start sampling in a helper thread."""
+        self._thread = threading.Thread(
+            target=self.run, name='guiserver-profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def is_alive(self):
+        """Return True if the sampler is still running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def sample(self):
+        """Record the current stack of the sampled thread."""
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is not None:
+            self.stacks[collapse(frame)] += 1
+
+    def run(self):
+        """Sample the thread for the requested duration and write the file."""
+        end = time.time() + self.duration
+        while time.time() < end:
+            self.sample()
+            time.sleep(self.interval)
+        samples = sum(self.stacks.values())
+        try:
+            with open(self.path, 'w') as output:
+                for stack, count in sorted(self.stacks.items()):
+                    output.write('{} {}\n'.format(stack, count))
+        except (IOError, OSError) as err:
+            logging.error('profiler: cannot write {}: {}'.format(
+                self.path, err))
+            return
+        stats.profiles += 1
+        stats.samples += samples
+        logging.info('profiler: {} samples written to {}'.format(
+            samples, self.path))
+
+
+def is_running():
+    """Return True if a profile is being collected."""
+    return _sampler is not None and _sampler.is_alive()
+
+
+def start(duration, directory, interval=DEFAULT_INTERVAL):
+    """Start profiling the calling thread for the given number of seconds.
+
+    This must be called from the IO loop thread. The profile is written in
+    the given directory. Return the path of the resulting file, or None if a
+    profile is already being collected.
+    """
+    global _sampler
+    if is_running():
+        logging.warning('profiler: already running')
+        return None
+    name = 'guiserver-{}.collapsed'.format(time.strftime('%Y%m%d-%H%M%S'))
+    path = os.path.join(directory, name)
+    _sampler = Sampler(thread.get_ident(), duration, path, interval=interval)
+    _sampler.start()
+    logging.info('profiler: sampling for {} seconds'.format(duration))
+    return path
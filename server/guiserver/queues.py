@@ -0,0 +1,110 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Juju GUI server bounded message queues.
+
+Messages sent by the browser before the connection to the Juju API is
+established are queued for later delivery. The queue is bounded both by
+number of messages and by size, so that a browser cannot make the GUI server
+memory grow while the Juju API is unreachable.
+"""
+
+from collections import deque
+
+
+# The default limits for queued messages.
+DEFAULT_MAX_MESSAGES = 1000
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024
+
+
+class QueueStats(object):
+    """Collect message queue counters for all the connections."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Reset all the counters."""
+        # The number and the size of messages currently queued.
+        self.messages = 0
+        self.size = 0
+        # The number of messages rejected because a queue was full.
+        self.overflows = 0
+
+    def as_dict(self):
+        """Return the counters."""
+        return {
+            'messages': self.messages,
+            'size': self.size,
+            'overflows': self.overflows,
+        }
+
+
+# Collect queue counters for all the connections in this process.
+stats = QueueStats()
+
+
+class MessageQueue(object):
+    """A FIFO queue of messages bounded by length and size.
+
+    The size of a message is its length: for unicode messages this is the
+    number of characters rather than the number of encoded bytes.
+    """
+
+    def __init__(
+            self, max_messages=DEFAULT_MAX_MESSAGES,
+            max_size=DEFAULT_MAX_SIZE):
+        self.max_messages = max_messages
+        self.max_size = max_size
+        self.size = 0
+        self._messages = deque()
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def append(self, message):
+        """Add the given message to the queue.
+
+        Return False without queueing the message if the queue is full,
+        True otherwise.
+        """
+        size = len(message)
+        if (len(self._messages) >= self.max_messages or
+                self.size + size > self.max_size):
+            stats.overflows += 1
+            return False
+        self._messages.append(message)
+        self.size += size
+        stats.messages += 1
+        stats.size += size
+        return True
+
+    def popall(self):
+        """Remove all the messages from the queue and return them as a list.
+        """
+        messages = list(self._messages)
+        self.clear()
+        return messages
+
+    def clear(self):
+        """Remove all the messages from the queue."""
+        stats.messages -= len(self._messages)
+        stats.size -= self.size
+        self._messages.clear()
+        self.size = 0
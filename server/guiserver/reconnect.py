@@ -0,0 +1,138 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Juju GUI server transparent reconnection to the Juju API.
+
+When the Juju API connection drops while the browser is still connected,
+for instance because a controller in an HA setup went away, the WebSocket
+handler can reconnect to another controller address and replay the login
+request of the user, so that the browser connection stays open.
+
+Requests in flight when the connection dropped are re-issued if they only
+read data, and explicitly failed otherwise: the browser is expected to retry
+them, and to restart its watchers, as they do not survive the reconnection.
+"""
+
+import re
+import urlparse
+
+from guiserver.utils import get_request_id
+
+
+# The request identifier used when replaying the login request.
+LOGIN_REQUEST_ID = (1 << 62) - 1
+# The delay, in seconds, between reconnection attempts.
+DEFAULT_DELAY = 1
+# Detect requests which can be safely re-issued after a reconnection.
+_IDEMPOTENT_PATTERN = re.compile(
+    r'"Request"\s*:\s*"(?:Get|List|Full|Model(?:Get|Info))')
+
+
+class ReconnectStats(object):
+    """Collect reconnection counters for all the connections."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Reset all the counters."""
+        # The number of successful and failed reconnections.
+        self.reconnections = 0
+        self.failures = 0
+        # The number of in flight requests re-issued or failed.
+        self.reissued = 0
+        self.failed = 0
+
+    def as_dict(self):
+        """Return the counters."""
+        return {
+            'reconnections': self.reconnections,
+            'failures': self.failures,
+            'reissued': self.reissued,
+            'failed': self.failed,
+        }
+
+
+# Collect reconnection counters for all the connections in this process.
+stats = ReconnectStats()
+
+
+class ReconnectPolicy(object):
+    """Hold the controller addresses and the attempts used to reconnect.
+
+    Addresses are "host:port" strings of alternative controllers.
+    """
+
+    def __init__(self, attempts, addresses=(), delay=DEFAULT_DELAY):
+        if attempts < 1:
+            raise ValueError('invalid number of attempts: {}'.format(attempts))
+        self.attempts = attempts
+        self.addresses = tuple(addresses)
+        self.delay = delay
+
+    def get_urls(self, apiurl):
+        """Return the list of Juju API URLs to try when reconnecting.
+
+        The URLs point to the same API path on the alternative controllers,
+        and the given URL is tried last.
+        """
+        parts = urlparse.urlsplit(apiurl)
+        urls = []
+        for address in self.addresses:
+            url = urlparse.urlunsplit(parts._replace(netloc=address))
+            if url != apiurl and url not in urls:
+                urls.append(url)
+        urls.append(apiurl)
+        return urls
+
+
+def is_idempotent(message):
+    """Return True if the given request can be safely sent again."""
+    return _IDEMPOTENT_PATTERN.search(message) is not None
+
+
+class PendingRequests(object):
+    """Keep track of the requests sent to the Juju API and not yet answered.
+    """
+
+    def __init__(self):
+        # Map request identifiers to request messages.
+        self._requests = {}
+
+    def __len__(self):
+        return len(self._requests)
+
+    def sent(self, message):
+        """Record the given message as sent to the Juju API."""
+        request_id, _, _ = get_request_id(message)
+        if request_id is not None:
+            self._requests[request_id] = message
+
+    def received(self, message):
+        """Record the given message as received from the Juju API."""
+        if self._requests:
+            request_id, _, _ = get_request_id(message)
+            self._requests.pop(request_id, None)
+
+    def popall(self):
+        """Return the pending (request id, message) pairs and clear them.
+
+        Requests are sorted by request identifier.
+        """
+        requests = sorted(self._requests.items())
+        self._requests.clear()
+        return requests
@@ -0,0 +1,321 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Juju GUI server session resumption.
+
+When the GUI is reloaded, the browser WebSocket connection is closed and a
+new one is opened right after. Without resumption, the new connection pays
+again for the TLS handshake, the login and the full AllWatcher snapshot.
+
+An authenticated browser can ask for a resume token (see
+auth.AuthenticationTokenHandler). When a browser connection holding a resume
+token is closed, its Juju API connection is parked instead of being closed,
+and its AllWatcher is kept running by the GUI server. A new browser
+connection presenting the token within the grace window reattaches to the
+parked Juju API connection: its login is answered using the cached login
+response, and its first AllWatcher deltas using the cached model snapshot.
+Parked connections are closed when the grace window expires.
+
+    - WatcherCache: keep a snapshot of the model as seen by the browser
+      AllWatcher, and keep retrieving deltas while the connection is parked.
+    - ParkedSession: the state of a closed browser connection waiting to be
+      resumed.
+"""
+
+from collections import OrderedDict
+import itertools
+import logging
+import re
+
+from tornado import escape
+
+from guiserver.allwatchers import apply_deltas
+from guiserver.utils import (
+    get_request_id,
+    json_decode_dict,
+    make_type_matcher,
+)
+
+
+# The default grace window, in seconds, for resuming parked sessions.
+DEFAULT_GRACE = 30
+# The GUI server issues Next requests using identifiers starting from this
+# value, to avoid conflicts with the identifiers used by the browser.
+REQUEST_ID_BASE = 1 << 61
+# Identify the browser requests related to AllWatchers.
+_WATCH_ALL_PATTERN = re.compile(r'"Request"\s*:\s*"WatchAll"')
+_is_all_watcher_request = make_type_matcher(('AllWatcher',))
+
+
+class ResumeStats(object):
+    """Collect session resumption counters for all the connections."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Reset all the counters."""
+        # The number of sessions currently parked.
+        self.parked = 0
+        # The number of sessions resumed and expired.
+        self.resumed = 0
+        self.expired = 0
+
+    def as_dict(self):
+        """Return the counters."""
+        return {
+            'parked': self.parked,
+            'resumed': self.resumed,
+            'expired': self.expired,
+        }
+
+
+# Collect resumption counters for all the connections in this process.
+stats = ResumeStats()
+
+
+class WatcherCache(object):
+    """Keep track of the model state as seen by the browser AllWatcher.
+
+    Only the AllWatcher started with the Client facade is tracked.
+    """
+
+    def __init__(self):
+        self.watcher_id = None
+        self.version = None
+        self.snapshot = OrderedDict()
+        self.deltas_key = 'Deltas'
+        self._request_ids = itertools.count(REQUEST_ID_BASE)
+        # The identifier of the WatchAll request in progress, if any.
+        self._watch_request_id = None
+        # The identifiers of the browser Next requests in progress.
+        self._requests = set()
+        # The identifiers of the Next requests whose responses are only
+        # consumed by the cache.
+        self._server_requests = set()
+        # Whether the snapshot must be sent to a resumed browser, and the
+        # browser Next request waiting for the snapshot, if any.
+        self._resumed = False
+        self._held_request_id = None
+
+    def handle_request(self, message, write_message):
+        """Handle a message sent by the browser.
+
+        Use the given write_message callable to reply to the browser.
+        Return True if the message has been handled, or False if it must be
+        propagated to the Juju API.
+        """
+        if _WATCH_ALL_PATTERN.search(message) is not None:
+            data = json_decode_dict(message)
+            if data is None or data.get('Type') != 'Client':
+                return False
+            if self._resumed:
+                # Reuse the watcher of the parked session.
+                write_message(escape.json_encode({
+                    'RequestId': data.get('RequestId'),
+                    'Response': {'AllWatcherId': self.watcher_id},
+                }))
+                return True
+            self._watch_request_id = data.get('RequestId')
+            self.version = data.get('Version')
+            return False
+        if _is_all_watcher_request(message) is None:
+            return False
+        data = json_decode_dict(message)
+        if data is None or data.get('Id') != self.watcher_id:
+            return False
+        request_id = data.get('RequestId')
+        if data.get('Request') != 'Next':
+            self.forget()
+            return False
+        if self._resumed:
+            self._resumed = False
+            if self._server_requests:
+                # Wait for the deltas requested by the GUI server.
+                self._held_request_id = request_id
+            else:
+                write_message(self._make_snapshot_response(request_id))
+            return True
+        self._requests.add(request_id)
+        return False
+
+    def handle_response(self, message, write_message):
+        """Handle a message received from the Juju API.
+
+        Use the given write_message callable to reply to the browser.
+        Return True if the message has been handled, or False if it must be
+        propagated to the browser.
+        """
+        if (self._watch_request_id is None and not self._requests and
+                not self._server_requests):
+            return False
+        request_id, _, _ = get_request_id(message)
+        if request_id is None:
+            return False
+        if request_id == self._watch_request_id:
+            self._watch_request_id = None
+            data = json_decode_dict(message) or {}
+            watcher_id = (data.get('Response') or {}).get('AllWatcherId')
+            if watcher_id is not None:
+                self.forget()
+                self.watcher_id = watcher_id
+            return False
+        if request_id in self._server_requests:
+            self._server_requests.remove(request_id)
+            consumed = True
+        elif request_id in self._requests:
+            self._requests.remove(request_id)
+            consumed = False
+        else:
+            return False
+        data = json_decode_dict(message)
+        if data is None or 'Error' in data:
+            held_request_id = self._held_request_id
+            self.forget()
+            if held_request_id is not None:
+                write_message(escape.json_encode(
+                    dict(data or {}, RequestId=held_request_id)))
+            return consumed
+        response = data.get('Response') or {}
+        if 'deltas' in response:
+            self.deltas_key = 'deltas'
+        apply_deltas(self.snapshot, response.get(self.deltas_key) or [])
+        if consumed and self._held_request_id is not None:
+            write_message(self._make_snapshot_response(self._held_request_id))
+            self._held_request_id = None
+        return consumed
+
+    def _make_snapshot_response(self, request_id):
+        """Return the encoded response including the whole snapshot."""
+        return escape.json_encode({
+            'RequestId': request_id,
+            'Response': {self.deltas_key: self.snapshot.values()},
+        })
+
+    def park(self):
+        """Start consuming the responses to pending browser requests."""
+        self._server_requests.update(self._requests)
+        self._requests.clear()
+        self._resumed = False
+        self._held_request_id = None
+
+    def resume(self):
+        """Send the snapshot in response to the next browser Next request."""
+        self._resumed = self.watcher_id is not None
+
+    def next_request(self):
+        """Return a Next request to be sent on behalf of the browser.
+
+        Return None if no requests are required, because there is no watcher
+        or because deltas have already been requested.
+        """
+        if (self.watcher_id is None or self._requests or
+                self._server_requests):
+            return None
+        request_id = next(self._request_ids)
+        self._server_requests.add(request_id)
+        request = {
+            'RequestId': request_id,
+            'Type': 'AllWatcher',
+            'Request': 'Next',
+            'Id': self.watcher_id,
+        }
+        if self.version is not None:
+            request['Version'] = self.version
+        return escape.json_encode(request)
+
+    def forget(self):
+        """Stop tracking the current watcher."""
+        self.watcher_id = None
+        self.snapshot = OrderedDict()
+        self._requests.clear()
+        self._resumed = False
+        self._held_request_id = None
+
+
+class ParkedSession(object):
+    """A Juju API connection waiting for a browser to resume it.
+
+    The connection is either a clients.WebSocketClientConnection or a
+    multiplex.MultiplexedConnection.
+    """
+
+    def __init__(
+            self, connection, username, password, login_message,
+            login_response, watchers=None):
+        self.connection = connection
+        self.username = username
+        self.password = password
+        self.login_message = login_message
+        self.login_response = login_response
+        self.watchers = watchers
+        # Whether the session is still parked.
+        self.parked = False
+
+    def park(self):
+        """Start handling the Juju API messages on behalf of the browser."""
+        self.parked = True
+        stats.parked += 1
+        self.connection.set_on_message_callback(self.on_message)
+        if self.watchers is not None:
+            self.watchers.park()
+            self._next()
+
+    def _unpark(self):
+        """Stop handling the Juju API messages."""
+        self.parked = False
+        stats.parked -= 1
+
+    def on_message(self, message):
+        """Handle a message received from the Juju API while parked."""
+        if not self.parked:
+            return
+        if message is None:
+            # The Juju API closed the connection: the session cannot be
+            # resumed anymore.
+            logging.info('resume: parked connection closed by Juju')
+            return self._unpark()
+        if self.watchers is not None:
+            self.watchers.handle_response(message, lambda message: None)
+            self._next()
+
+    def _next(self):
+        """Ask for the next watcher deltas if required."""
+        request = self.watchers.next_request()
+        if request is not None:
+            self.connection.write_message(request)
+
+    def resume(self, on_message_callback):
+        """Hand the connection over to a new browser connection.
+
+        Return False if the session can no longer be resumed.
+        """
+        if not self.parked:
+            return False
+        self._unpark()
+        stats.resumed += 1
+        self.connection.set_on_message_callback(on_message_callback)
+        if self.watchers is not None:
+            self.watchers.resume()
+        return True
+
+    def expire(self):
+        """Close the parked Juju API connection."""
+        if self.parked:
+            self._unpark()
+            stats.expired += 1
+            self.connection.close()
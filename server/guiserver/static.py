@@ -0,0 +1,268 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Juju GUI server static files.
+
+The Juju GUI static files are served by the GUI server itself rather than by
+the jujugui WSGI application, which would read whole files in memory.
+
+Tornado's StaticFileHandler reads files in chunks, but it writes all of them
+to the connection buffer before the first one is sent. The StaticFileHandler
+defined here flushes each chunk before reading the next one, so that serving
+a large file to a slow client only keeps one chunk in memory. Precompressed
+".gz" siblings, when present, are served to clients accepting gzip, and
+versioned files are cached by browsers for as long as possible.
+
+The charm compresses the static files when the Juju GUI is installed, and
+writes a manifest listing the precompressed files and their hashes. When the
+manifest is available, it is used in place of looking for ".gz" files and of
+hashing the files to compute their ETags. It is also used to recognize file
+names including the hash of their contents, e.g. "app.8f4e2a1c.js".
+"""
+
+import json
+import logging
+import mimetypes
+import os
+import re
+
+from tornado import (
+    gen,
+    httputil,
+    web,
+)
+from tornado.concurrent import Future
+
+
+# Hashes are included in versioned file names as a hexadecimal part, e.g.
+# "app.8f4e2a1c.js".
+HASH_PART = re.compile(r'(?:^|[.-])([0-9a-f]{8,})(?=[.-]|$)')
+# The name of the manifest written by the charm in the static directory.
+MANIFEST = 'guiserver-manifest.json'
+
+
+def load_manifest(root):
+    """Return the manifest of the static files in the given directory.
+
+    The manifest maps file paths relative to the directory to dicts
+    including the SHA256 hash of the file ("sha256") and, if a precompressed
+    variant exists, of the variant ("gzip_sha256"). Return None if the
+    manifest is missing or not valid.
+    """
+    path = os.path.join(root, MANIFEST)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (IOError, ValueError) as err:
+        logging.warning('static: cannot load {}: {}'.format(path, err))
+        return None
+    if not isinstance(manifest, dict):
+        logging.warning('static: invalid manifest {}'.format(path))
+        return None
+    return manifest
+
+
+def accepts_gzip(accept_encoding):
+    """Report whether the given Accept-Encoding header value allows gzip.
+
+    Content codings with a zero or invalid quality value are not accepted.
+    """
+    qvalues = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        qvalue = 1
+        for param in params.split(';'):
+            key, sep, value = param.partition('=')
+            if sep and key.strip().lower() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0
+        qvalues[coding] = qvalue
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qvalues:
+            return qvalues[coding] > 0
+    return False
+
+
+def includes_hash(path, content_hash):
+    """Report whether the given file path includes the given content hash.
+
+    The file name must include a hexadecimal part of at least eight digits
+    which is a prefix of the hash.
+    """
+    if not content_hash:
+        return False
+    name = os.path.basename(path)
+    return any(
+        content_hash.startswith(part) for part in HASH_PART.findall(name))
+
+
+class StaticFileHandler(web.StaticFileHandler):
+    """Serve the Juju GUI static files.
+
+    Files are streamed, flushing each chunk to the client before reading the
+    next one. Requests including a "v" argument as generated by Tornado's
+    static_url, and files whose name includes the hash of their contents as
+    listed in the manifest, are served with far-future immutable cache
+    headers. If a manifest is provided (see load_manifest), it is also used
+    to find precompressed files and to compute ETags.
+    """
+
+    def initialize(self, path, default_filename=None, manifest=None):
+        """See tornado.web.StaticFileHandler.initialize."""
+        super(StaticFileHandler, self).initialize(
+            path, default_filename=default_filename)
+        self.manifest = manifest
+        # The requested file, which can differ from the absolute path of the
+        # file being sent if a precompressed variant is served.
+        self.content_path = None
+        # The hash of the file being sent, as listed in the manifest.
+        self.content_hash = None
+        # The hash of the requested file, as listed in the manifest.
+        self.file_hash = None
+        self._flushed = None
+
+    def head(self, path):
+        """Handle HEAD requests."""
+        return self.get(path, include_body=False)
+
+    @gen.coroutine
+    def get(self, path, include_body=True):
+        """Handle GET requests."""
+        self.path = self.parse_url_path(path)
+        absolute_path = self.get_absolute_path(self.root, self.path)
+        self.absolute_path = self.validate_absolute_path(
+            self.root, absolute_path)
+        if self.absolute_path is None:
+            return
+        self.content_path = self.absolute_path
+        self._select_variant()
+        self.modified = self.get_modified_time()
+        self.set_headers()
+        if self.should_return_304():
+            self.set_status(304)
+            return
+        size = self.get_content_size()
+        start = end = None
+        range_header = self.request.headers.get('Range')
+        request_range = None
+        if range_header:
+            # As per RFC 2616 14.16, invalid Range headers are ignored.
+            request_range = httputil._parse_request_range(range_header)
+        if request_range:
+            start, end = request_range
+            if (start is not None and start >= size) or end == 0:
+                self.set_status(416)  # Range Not Satisfiable.
+                self.set_header('Content-Type', 'text/plain')
+                self.set_header('Content-Range', 'bytes */{}'.format(size))
+                return
+            if start is not None and start < 0:
+                start += size
+            if end is not None and end > size:
+                end = size
+            if size != (end or size) - (start or 0):
+                self.set_status(206)  # Partial Content.
+                self.set_header(
+                    'Content-Range',
+                    httputil._get_content_range(start, end, size))
+        self.set_header('Content-Length', (end or size) - (start or 0))
+        if not include_body:
+            return
+        for chunk in self.get_content(self.absolute_path, start, end):
+            self.write(chunk)
+            yield self._flush()
+            if self.request.connection.stream.closed():
+                return
+
+    def _select_variant(self):
+        """Switch to the precompressed variant of the file if possible.
+
+        Range requests are always served using the uncompressed file.
+        """
+        gzip_path = self.absolute_path + '.gz'
+        entry = {}
+        if self.manifest is None:
+            has_gzip = os.path.isfile(gzip_path)
+        else:
+            relative_path = os.path.relpath(
+                self.absolute_path, os.path.abspath(self.root))
+            entry = self.manifest.get(relative_path) or {}
+            self.content_hash = self.file_hash = entry.get('sha256')
+            has_gzip = 'gzip_sha256' in entry
+        if not has_gzip:
+            return
+        self.set_header('Vary', 'Accept-Encoding')
+        accept_encoding = self.request.headers.get('Accept-Encoding', '')
+        if (accepts_gzip(accept_encoding) and
+                'Range' not in self.request.headers):
+            self.absolute_path = gzip_path
+            self.set_header('Content-Encoding', 'gzip')
+            self.content_hash = entry.get('gzip_sha256')
+
+    def _flush(self):
+        """Flush the response, returning a future.
+
+        The future is also resolved if the client closes the connection.
+        """
+        self._flushed = future = Future()
+        self.flush(callback=lambda: self._resolve_flushed(future))
+        return future
+
+    def _resolve_flushed(self, future):
+        """Resolve the given flush future if it is still pending."""
+        if not future.done():
+            future.set_result(None)
+
+    def on_connection_close(self):
+        """Stop waiting for the response to be flushed."""
+        if self._flushed is not None:
+            self._resolve_flushed(self._flushed)
+
+    def compute_etag(self):
+        """Return the ETag of the file, using the manifest if possible."""
+        if self.content_hash is not None:
+            return '"{}"'.format(self.content_hash)
+        return super(StaticFileHandler, self).compute_etag()
+
+    def get_content_type(self):
+        """Return the content type of the requested file."""
+        mime_type, _ = mimetypes.guess_type(self.content_path)
+        return mime_type
+
+    def is_versioned(self, path):
+        """Report whether the given path refers to a versioned file."""
+        return 'v' in self.request.arguments or includes_hash(
+            path, self.file_hash)
+
+    def get_cache_time(self, path, modified, mime_type):
+        """See tornado.web.StaticFileHandler.get_cache_time."""
+        if self.is_versioned(path):
+            return self.CACHE_MAX_AGE
+        return 0
+
+    def set_extra_headers(self, path):
+        """Mark versioned files as immutable."""
+        if self.is_versioned(path):
+            self.set_header(
+                'Cache-Control',
+                'public, max-age={}, immutable'.format(self.CACHE_MAX_AGE))
@@ -0,0 +1,283 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Juju GUI server token stores.
+
+Authentication tokens and bundle change set tokens are created on one
+connection and used, at most once, on another one. A token store maps tokens
+to JSON serializable values, each one expiring after a given time to live.
+
+Two stores are available:
+  - MemoryTokenStore keeps tokens in a dict. The dict can be shared by worker
+    processes (see guiserver.workers), but tokens are lost on restart;
+  - SQLiteTokenStore keeps tokens in a local SQLite database in WAL mode, so
+    that they survive restarts and can be shared by any process on the
+    machine, including independent GUI servers behind a load balancer using
+    a shared directory.
+
+Values are stored JSON encoded, and compressed when their encoded size
+exceeds a threshold, so that large change sets do not make the GUI server
+memory grow.
+
+Expired tokens cannot be used, and are periodically removed from all the
+stores by a single sweeper: see Sweeper below.
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+import zlib
+
+from tornado.ioloop import (
+    IOLoop,
+    PeriodicCallback,
+)
+
+from guiserver.expiry import TimingWheel
+
+
+# The encoded size in bytes above which stored values are compressed.
+DEFAULT_COMPRESS_SIZE = 4096
+# The default interval in seconds between expired tokens sweeps.
+DEFAULT_SWEEP_INTERVAL = 5
+
+
+def _total_seconds(ttl):
+    """Return the given time to live, a timedelta or a number, in seconds."""
+    try:
+        return ttl.total_seconds()
+    except AttributeError:
+        return ttl
+
+
+def encode(value, compress_size=DEFAULT_COMPRESS_SIZE):
+    """Encode the given value.
+
+    Return a (compressed, data) tuple where compressed is a flag reporting
+    whether the data bytes are compressed.
+    """
+    data = json.dumps(value, separators=(',', ':'))
+    if len(data) > compress_size:
+        return True, zlib.compress(data)
+    return False, data
+
+
+def decode(compressed, data):
+    """Decode the value encoded by the encode function above."""
+    if compressed:
+        data = zlib.decompress(data)
+    return json.loads(data)
+
+
+class MemoryTokenStore(object):
+    """A token store keeping tokens in memory.
+
+    Tokens are stored in the given dict-like object, or in a new dict if not
+    provided. Expiration times are tracked in a timing wheel, so that purging
+    only goes through the expired tokens. When the dict is shared by several
+    processes, each one purges the tokens it stored.
+    """
+
+    def __init__(self, data=None, compress_size=DEFAULT_COMPRESS_SIZE):
+        # Map tokens to (expires, compressed, data) tuples.
+        self._data = {} if data is None else data
+        self._compress_size = compress_size
+        self._wheel = TimingWheel()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, token):
+        return token in self._data
+
+    def put(self, token, value, ttl):
+        """Store the value for the given token and time to live."""
+        expires = time.time() + _total_seconds(ttl)
+        compressed, data = encode(value, self._compress_size)
+        self._data[token] = (expires, compressed, data)
+        self._wheel.add(token, expires)
+
+    def pop(self, token):
+        """Remove the given token and return its value.
+
+        Return None if the token is unknown, already used or expired.
+        """
+        self._wheel.discard(token)
+        item = self._data.pop(token, None)
+        if item is None:
+            return None
+        expires, compressed, data = item
+        if expires <= time.time():
+            return None
+        return decode(compressed, data)
+
+    def discard(self, token):
+        """Remove the given token if present."""
+        self._wheel.discard(token)
+        self._data.pop(token, None)
+
+    def purge(self):
+        """Remove the expired tokens and return how many were removed."""
+        removed = 0
+        for token in self._wheel.expire(time.time()):
+            if self._data.pop(token, None) is not None:
+                removed += 1
+        return removed
+
+
+class SQLiteTokenStore(object):
+    """A token store keeping tokens in the given SQLite database file.
+
+    The tokens are stored in the given table, so that several stores can
+    share the same file. A connection is opened for each process using the
+    store, and expired tokens are purged when the connection is opened.
+    """
+
+    def __init__(self, path, table, compress_size=DEFAULT_COMPRESS_SIZE):
+        if re.match(r'^[A-Za-z_]\w*$', table) is None:
+            raise ValueError('invalid table name: {}'.format(table))
+        self._path = path
+        self._table = table
+        self._compress_size = compress_size
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        """Return the connection for the current process."""
+        pid = os.getpid()
+        if self._connection is not None and self._pid == pid:
+            return self._connection
+        # SQLite connections must not be used across a fork.
+        connection = sqlite3.connect(
+            self._path, timeout=5, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS {} ('
+            'token TEXT PRIMARY KEY, '
+            'expires REAL NOT NULL, '
+            'compressed INTEGER NOT NULL, '
+            'data BLOB NOT NULL)'.format(self._table))
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS {0}_expires ON {0} (expires)'.format(
+                self._table))
+        self._connection, self._pid = connection, pid
+        purged = self.purge()
+        if purged:
+            logging.info('token store: purged {} expired {} tokens'.format(
+                purged, self._table))
+        return connection
+
+    def __len__(self):
+        cursor = self._connect().execute(
+            'SELECT COUNT(*) FROM {} WHERE expires > ?'.format(self._table),
+            (time.time(),))
+        return cursor.fetchone()[0]
+
+    def __contains__(self, token):
+        cursor = self._connect().execute(
+            'SELECT 1 FROM {} WHERE token = ? AND expires > ?'.format(
+                self._table),
+            (token, time.time()))
+        return cursor.fetchone() is not None
+
+    def put(self, token, value, ttl):
+        """Store the value for the given token and time to live."""
+        expires = time.time() + _total_seconds(ttl)
+        compressed, data = encode(value, self._compress_size)
+        self._connect().execute(
+            'INSERT OR REPLACE INTO {} (token, expires, compressed, data) '
+            'VALUES (?, ?, ?, ?)'.format(self._table),
+            (token, expires, int(compressed), sqlite3.Binary(data)))
+
+    def pop(self, token):
+        """Remove the given token and return its value.
+
+        Return None if the token is unknown, already used or expired.
+        The token is retrieved and deleted in a single transaction, so that
+        it can be used only once even if several processes try to use it.
+        """
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT expires, compressed, data FROM {} '
+                'WHERE token = ?'.format(self._table),
+                (token,)).fetchone()
+            if row is not None:
+                connection.execute(
+                    'DELETE FROM {} WHERE token = ?'.format(self._table),
+                    (token,))
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        if row is None:
+            return None
+        expires, compressed, data = row
+        if expires <= time.time():
+            return None
+        return decode(compressed, bytes(data))
+
+    def discard(self, token):
+        """Remove the given token if present."""
+        self._connect().execute(
+            'DELETE FROM {} WHERE token = ?'.format(self._table), (token,))
+
+    def purge(self):
+        """Remove the expired tokens and return how many were removed."""
+        cursor = self._connect().execute(
+            'DELETE FROM {} WHERE expires <= ?'.format(self._table),
+            (time.time(),))
+        return cursor.rowcount
+
+
+class Sweeper(object):
+    """Periodically remove the expired tokens from the given stores.
+
+    A single sweeper replaces an IO loop timeout for each token.
+    """
+
+    def __init__(self, stores, interval=DEFAULT_SWEEP_INTERVAL, io_loop=None):
+        if io_loop is None:
+            io_loop = IOLoop.current()
+        self._stores = stores
+        self._callback = PeriodicCallback(
+            self.sweep, interval * 1000, io_loop=io_loop)
+
+    def start(self):
+        """Start sweeping the stores."""
+        self._callback.start()
+
+    def stop(self):
+        """Stop sweeping the stores."""
+        self._callback.stop()
+
+    def sweep(self):
+        """Remove the expired tokens from all the stores."""
+        for store in self._stores:
+            try:
+                removed = store.purge()
+            except Exception as err:
+                logging.error('token store: cannot purge tokens: {}'.format(
+                    err))
+                continue
+            if removed:
+                logging.info('token store: expired {} tokens'.format(removed))
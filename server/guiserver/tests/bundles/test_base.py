@@ -353,6 +353,44 @@ class TestDeployer(helpers.BundlesTestMixin, LogTrapTestCase, AsyncTestCase):
         self.assertEqual(deployment1, change1['DeploymentId'])
         self.assertEqual(deployment2, change2['DeploymentId'])
 
+    def test_initial_worker_stats(self):
+        # Initially the queue is empty and the workers are idle.
+        deployer = self.make_deployer()
+        expected = {
+            'queue': 0,
+            'busy_time': {'validate': 0.0, 'import': 0.0},
+        }
+        self.assertEqual(expected, deployer.worker_stats())
+
+    def test_worker_stats(self):
+        # The time spent processing the deployment queue is recorded.
+        deployer = self.make_deployer()
+        with mock.patch('time.time', mock.Mock(return_value=10)):
+            with self.patch_import_bundle():
+                deployer.import_bundle(
+                    self.user, 'bundle', self.bundle, self.version,
+                    bundle_id=None, test_callback=self.stop)
+        with mock.patch('time.time', mock.Mock(return_value=15)):
+            stats = deployer.worker_stats()
+            self.assertEqual(1, stats['queue'])
+            self.assertEqual(5, stats['busy_time']['import'])
+            # Wait for the deployment to be completed.
+            self.wait()
+            stats = deployer.worker_stats()
+        self.assertEqual(0, stats['queue'])
+        self.assertEqual(5, stats['busy_time']['import'])
+
+    @gen_test
+    def test_validation_worker_stats(self):
+        # The time spent validating bundles is recorded.
+        deployer = self.make_deployer()
+        mock_time = mock.Mock()
+        mock_time.time.side_effect = [10, 12]
+        with self.patch_validate():
+            with mock.patch('guiserver.bundles.base.time', mock_time):
+                yield deployer.validate(self.user, self.bundle)
+        self.assertEqual(2, deployer.worker_stats()['busy_time']['validate'])
+
     def test_import_callback_cancelled(self):
         deployer = self.make_deployer()
         deployer_id = 123
@@ -26,6 +26,7 @@ from tornado.testing import(
 )
 import yaml
 
+from guiserver import stores
 from guiserver.bundles import views
 from guiserver.tests import helpers
 
@@ -682,6 +683,20 @@ class TestGetChanges(
         response = yield self.view(request)
         self.assertEqual(expected_response, response)
 
+    @gen_test
+    def test_shared_store(self):
+        # Change sets stored by other worker processes can be retrieved.
+        store = stores.MemoryTokenStore()
+        store.put('DEFACED', [{'id': 'addCharm-0'}], 60)
+        original = views._bundle_changesets
+        views.set_changeset_store(store)
+        self.addCleanup(views.set_changeset_store, original)
+        request = self.make_view_request(params={'Token': 'DEFACED'})
+        response = yield self.view(request)
+        self.assertEqual(
+            {'Response': {'Changes': [{'id': 'addCharm-0'}]}}, response)
+        self.assertEqual(0, len(store))
+
     @gen_test
     def test_both_yaml_and_token_error(self):
         # An error is returned if both the bundle content and the token are
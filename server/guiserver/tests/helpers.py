@@ -16,6 +16,7 @@
 
 """Juju GUI server test utilities."""
 
+from collections import deque
 from contextlib import contextmanager
 import datetime
 import json
@@ -80,6 +81,20 @@ class EchoWebSocketHandler(websocket.WebSocketHandler):
             self._closed_future.set_result(None)
 
 
+class FakeStream(object):
+    """A fake IOStream exposing its write buffer."""
+
+    def __init__(self, *chunks):
+        self._write_buffer = deque(chunks)
+        self.is_closed = False
+
+    def writing(self):
+        return bool(self._write_buffer)
+
+    def closed(self):
+        return self.is_closed
+
+
 class GoAPITestMixin(object):
     """Add helper methods for testing the Go API implementation."""
 
@@ -119,8 +134,8 @@ class GoAPITestMixin(object):
                                  token='DEFACED', username=None,
                                  password=None):
         if username is not None and password is not None:
-            tokens._data[token] = dict(
-                username=username, password=password, handle="handle")
+            tokens._store.put(
+                token, dict(username=username, password=password), 60)
         return dict(
             RequestId=request_id, Type='GUIToken', Request='Login',
             Params={'Token': token})
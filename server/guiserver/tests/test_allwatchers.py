@@ -0,0 +1,347 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the Juju GUI server shared AllWatcher support."""
+
+import json
+import unittest
+
+import mock
+from tornado.testing import LogTrapTestCase
+
+from guiserver import (
+    allwatchers,
+    multiplex,
+)
+from guiserver.tests import helpers
+
+
+class TestGetEntityId(unittest.TestCase):
+
+    def test_juju1(self):
+        # Juju 1 entity identifiers are returned.
+        get_entity_id = allwatchers.get_entity_id
+        self.assertEqual('0', get_entity_id({'Id': '0'}))
+        self.assertEqual('django', get_entity_id({'Name': 'django'}))
+        self.assertEqual('a b', get_entity_id({'Key': 'a b'}))
+
+    def test_juju2(self):
+        # Juju 2 entity identifiers are returned.
+        get_entity_id = allwatchers.get_entity_id
+        self.assertEqual('0', get_entity_id({'id': '0'}))
+        self.assertEqual('django', get_entity_id({'name': 'django'}))
+        self.assertEqual('unit-a-0', get_entity_id({'tag': 'unit-a-0'}))
+
+    def test_precedence(self):
+        # The id field takes precedence over other identifiers.
+        entity = {'Id': 1, 'Key': 'a b'}
+        self.assertEqual(1, allwatchers.get_entity_id(entity))
+
+    def test_not_found(self):
+        # None is returned if the entity identifier is not found.
+        self.assertIsNone(allwatchers.get_entity_id({'Life': 'alive'}))
+
+
+class TestGetAccessKey(unittest.TestCase):
+
+    def test_model_access(self):
+        # The key includes the model access level if available.
+        response = {'Response': {'user-info': {'model-access': 'read'}}}
+        self.assertEqual(
+            ('wss://example.com', 'access', 'read'),
+            allwatchers.get_access_key('wss://example.com', 'who', response))
+
+    def test_user(self):
+        # The key includes the user name if the access level is not available.
+        self.assertEqual(
+            ('wss://example.com', 'user', 'who'),
+            allwatchers.get_access_key(
+                'wss://example.com', 'who', {'Response': {}}))
+
+
+class TestJoinBatches(unittest.TestCase):
+
+    def test_join(self):
+        # JSON encoded lists are joined.
+        self.assertEqual(
+            [1, 2, 3], json.loads(allwatchers.join_batches(['[1,2]', '[3]'])))
+
+    def test_single(self):
+        # A single list is returned as is.
+        self.assertEqual('[1]', allwatchers.join_batches(['[1]']))
+
+    def test_empty(self):
+        # Empty lists are skipped.
+        self.assertEqual(
+            [1, 2], json.loads(allwatchers.join_batches(['[]', '[1,2]'])))
+        self.assertEqual(
+            [1], json.loads(allwatchers.join_batches(['[1]', '[]', '[ ]'])))
+        self.assertEqual('[]', allwatchers.join_batches(['[]']))
+
+
+class TestWatcherHub(
+        helpers.GoAPITestMixin, LogTrapTestCase, unittest.TestCase):
+
+    def setUp(self):
+        self.multiplexer = multiplex.Multiplexer(
+            io_loop=mock.Mock(), share_watchers=True)
+        self.hub = self.multiplexer.watchers
+
+    def make_session(self, username='user', access='read'):
+        """Create and return a logged in session using a mock connection."""
+        session = multiplex.SharedSession(
+            self.multiplexer, ('wss://example.com', username), 'passwd')
+        session._connection = mock.Mock()
+        received = []
+        connection = session.attach(received.append)
+        connection.write_message(
+            self.make_login_request(username=username, encoded=True))
+        response = self.make_login_response(request_id=1)
+        response['Response']['user-info'] = {'model-access': access}
+        session.on_message(json.dumps(response))
+        return session
+
+    def get_sent(self, session):
+        """Return the last request sent by the session to the Juju API."""
+        return json.loads(session._connection.write_message.call_args[0][0])
+
+    def reply(self, session, response):
+        """Reply to the last request sent by the given session."""
+        request_id = self.get_sent(session)['RequestId']
+        session.on_message(
+            json.dumps({'RequestId': request_id, 'Response': response}))
+
+    def watch(self, session, request_id=10):
+        """Start watching the model using a new browser connection.
+
+        Return the connection, the watcher id and the received messages.
+        """
+        received = []
+        connection = session.attach(received.append)
+        connection.write_message(json.dumps({
+            'RequestId': request_id, 'Type': 'Client', 'Request': 'WatchAll',
+            'Params': {}}))
+        response = json.loads(received.pop())
+        self.assertEqual(request_id, response['RequestId'])
+        return connection, response['Response']['AllWatcherId'], received
+
+    def next(self, connection, watcher_id, request_id=11):
+        """Send a Next request for the given watcher."""
+        connection.write_message(json.dumps({
+            'RequestId': request_id, 'Type': 'AllWatcher', 'Request': 'Next',
+            'Id': watcher_id}))
+
+    def start_watcher(self, session, deltas):
+        """Reply to the upstream WatchAll request and send initial deltas."""
+        watch_all = self.get_sent(session)
+        self.assertEqual('WatchAll', watch_all['Request'])
+        self.reply(session, {'AllWatcherId': '5'})
+        self.assertEqual(
+            {'Type': 'AllWatcher', 'Request': 'Next', 'Id': '5'},
+            dict((k, v) for k, v in self.get_sent(session).items()
+                 if k != 'RequestId'))
+        self.reply(session, {'Deltas': deltas})
+
+    def test_snapshot(self):
+        # Subscribers receive the current snapshot on their first Next.
+        session = self.make_session()
+        connection, watcher_id, received = self.watch(session)
+        self.assertTrue(watcher_id.startswith(allwatchers.WATCHER_ID_PREFIX))
+        self.next(connection, watcher_id)
+        # The Next request is parked until the snapshot is available.
+        self.assertEqual([], received)
+        delta = ['service', 'change', {'Name': 'django'}]
+        self.start_watcher(session, [delta])
+        self.assertEqual(
+            {'RequestId': 11, 'Response': {'Deltas': [delta]}},
+            json.loads(received.pop()))
+
+    def test_shared(self):
+        # Users with the same access level share the upstream watcher, and
+        # deltas are fanned out to all the subscribers.
+        session1 = self.make_session(username='user1')
+        session2 = self.make_session(username='user2')
+        conn1, watcher_id1, received1 = self.watch(session1)
+        delta1 = ['service', 'change', {'Name': 'django', 'Exposed': False}]
+        self.start_watcher(session1, [delta1])
+        conn2, watcher_id2, received2 = self.watch(session2)
+        self.assertNotEqual(watcher_id1, watcher_id2)
+        # Only the login request is sent to the Juju API by the second session.
+        self.assertEqual(1, session2._connection.write_message.call_count)
+        self.next(conn1, watcher_id1)
+        self.next(conn2, watcher_id2, request_id=42)
+        self.assertEqual(
+            {'RequestId': 42, 'Response': {'Deltas': [delta1]}},
+            json.loads(received2.pop()))
+        # New deltas are sent to all the subscribers.
+        delta2 = ['service', 'change', {'Name': 'django', 'Exposed': True}]
+        self.reply(session1, {'Deltas': [delta2]})
+        self.next(conn1, watcher_id1, request_id=12)
+        self.next(conn2, watcher_id2, request_id=43)
+        self.assertEqual(
+            [{'RequestId': 11, 'Response': {'Deltas': [delta1]}},
+             {'RequestId': 12, 'Response': {'Deltas': [delta2]}}],
+            [json.loads(message) for message in received1])
+        self.assertEqual(
+            {'RequestId': 43, 'Response': {'Deltas': [delta2]}},
+            json.loads(received2.pop()))
+        # The snapshot only includes the most recent entity state.
+        _, watcher_id3, received3 = self.watch(session1)
+        self.next(conn1, watcher_id3, request_id=99)
+        self.assertEqual([delta2], json.loads(received1.pop())['Response'][
+            'Deltas'])
+
+    def test_empty_deltas(self):
+        # Empty delta lists are not queued along with the other deltas.
+        session = self.make_session()
+        connection, watcher_id, received = self.watch(session)
+        self.start_watcher(session, [])
+        self.next(connection, watcher_id)
+        self.assertEqual(
+            {'RequestId': 11, 'Response': {'Deltas': []}},
+            json.loads(received.pop()))
+        self.reply(session, {'Deltas': []})
+        delta = ['service', 'change', {'Name': 'django'}]
+        self.reply(session, {'Deltas': [delta]})
+        self.reply(session, {'Deltas': []})
+        self.next(connection, watcher_id, request_id=12)
+        self.assertEqual(
+            {'RequestId': 12, 'Response': {'Deltas': [delta]}},
+            json.loads(received.pop()))
+
+    def test_different_access(self):
+        # Users with different access levels do not share watchers.
+        session1 = self.make_session(username='user1', access='read')
+        session2 = self.make_session(username='user2', access='admin')
+        self.watch(session1)
+        self.watch(session2)
+        self.assertEqual(2, len(self.hub.watchers))
+        self.assertEqual('WatchAll', self.get_sent(session2)['Request'])
+
+    def test_remove_delta(self):
+        # Removed entities are deleted from the snapshot.
+        session = self.make_session()
+        self.watch(session)
+        self.start_watcher(session, [
+            ['machine', 'change', {'Id': '0'}],
+            ['machine', 'change', {'Id': '1'}],
+        ])
+        self.reply(session, {'Deltas': [['machine', 'remove', {'Id': '0'}]]})
+        watcher = self.hub.watchers.values()[0]
+        self.assertEqual(
+            [['machine', 'change', {'Id': '1'}]],
+            json.loads(watcher.get_snapshot()))
+
+    def test_juju2_deltas(self):
+        # The deltas key used by Juju 2 is preserved.
+        session = self.make_session()
+        connection, watcher_id, received = self.watch(session)
+        self.reply(session, {'AllWatcherId': '5'})
+        delta = ['application', 'change', {'name': 'django'}]
+        self.reply(session, {'deltas': [delta]})
+        self.next(connection, watcher_id)
+        self.assertEqual(
+            {'RequestId': 11, 'Response': {'deltas': [delta]}},
+            json.loads(received.pop()))
+
+    def test_stop(self):
+        # Stopping a subscription does not stop the shared watcher until the
+        # last subscriber leaves.
+        session = self.make_session()
+        conn1, watcher_id1, received1 = self.watch(session)
+        conn2, watcher_id2, _ = self.watch(session)
+        self.start_watcher(session, [])
+        conn1.write_message(json.dumps({
+            'RequestId': 20, 'Type': 'AllWatcher', 'Request': 'Stop',
+            'Id': watcher_id1}))
+        self.assertEqual(
+            {'RequestId': 20, 'Response': {}}, json.loads(received1.pop()))
+        self.assertEqual(1, len(self.hub.watchers))
+        conn2.close()
+        self.assertEqual({}, self.hub.watchers)
+        self.assertEqual(
+            {'Type': 'AllWatcher', 'Request': 'Stop', 'Id': '5'},
+            dict((k, v) for k, v in self.get_sent(session).items()
+                 if k != 'RequestId'))
+
+    def test_failure(self):
+        # Parked Next requests receive an error if the upstream watcher fails.
+        session = self.make_session()
+        connection, watcher_id, received = self.watch(session)
+        self.next(connection, watcher_id)
+        request_id = self.get_sent(session)['RequestId']
+        session.on_message(json.dumps(
+            {'RequestId': request_id, 'Error': 'boom', 'Response': {}}))
+        self.assertEqual(
+            {'RequestId': 11, 'Error': 'boom', 'Response': {}},
+            json.loads(received.pop()))
+        self.assertEqual({}, self.hub.watchers)
+        self.assertEqual({}, self.hub.subscriptions)
+
+    def test_session_closed(self):
+        # Shared watchers are moved to another session when the session
+        # driving them is closed.
+        session1 = self.make_session(username='user1')
+        session2 = self.make_session(username='user2')
+        self.watch(session1)
+        self.start_watcher(session1, [
+            ['machine', 'change', {'Id': '0'}],
+            ['machine', 'change', {'Id': '1'}],
+        ])
+        conn2, watcher_id2, received2 = self.watch(session2)
+        self.next(conn2, watcher_id2)
+        received2.pop()
+        session1.on_message(None)
+        self.assertEqual(1, len(self.hub.watchers))
+        self.assertIs(session2, self.hub.watchers.values()[0].session)
+        self.assertEqual(1, len(self.hub.subscriptions))
+        # The watcher is restarted in the remaining session. Entities removed
+        # in the meantime are reported to the subscribers.
+        self.next(conn2, watcher_id2, request_id=12)
+        self.assertEqual([], received2)
+        self.start_watcher(session2, [['machine', 'change', {'Id': '1'}]])
+        expected = {'RequestId': 12, 'Response': {'Deltas': [
+            ['machine', 'change', {'Id': '1'}],
+            ['machine', 'remove', {'Id': '0'}],
+        ]}}
+        self.assertEqual(expected, json.loads(received2.pop()))
+        # Subsequent deltas are received from the new upstream watcher.
+        delta = ['machine', 'change', {'Id': '2'}]
+        self.reply(session2, {'Deltas': [delta]})
+        self.next(conn2, watcher_id2, request_id=13)
+        self.assertEqual(
+            {'RequestId': 13, 'Response': {'Deltas': [delta]}},
+            json.loads(received2.pop()))
+
+    def test_last_session_closed(self):
+        # Shared watchers are stopped if no subscriber session remains.
+        session = self.make_session()
+        self.watch(session)
+        self.start_watcher(session, [])
+        session.on_message(None)
+        self.assertEqual({}, self.hub.watchers)
+        self.assertEqual({}, self.hub.subscriptions)
+
+    def test_not_shared_without_login(self):
+        # WatchAll requests are propagated if the session is not logged in.
+        session = multiplex.SharedSession(
+            self.multiplexer, ('wss://example.com', 'user'), 'passwd')
+        session._connection = mock.Mock()
+        connection = session.attach(lambda message: None)
+        connection.write_message(json.dumps({
+            'RequestId': 1, 'Type': 'Client', 'Request': 'WatchAll'}))
+        self.assertEqual({}, self.hub.watchers)
+        self.assertEqual('WatchAll', self.get_sent(session)['Request'])
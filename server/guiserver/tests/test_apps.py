@@ -16,15 +16,26 @@
 
 """Tests for the Juju GUI server applications."""
 
+import os
 import unittest
 
 import mock
 
 from guiserver import (
+    allwatchers,
     apps,
     auth,
+    backpressure,
+    cache,
+    deflate,
     handlers,
     manage,
+    multiplex,
+    pool,
+    static,
+    stores,
+    workers,
+    wsgi,
 )
 from guiserver.bundles import base
 
@@ -71,7 +82,7 @@ class AppsTestMixin(object):
 
 class TestServer(AppsTestMixin, unittest.TestCase):
 
-    def get_app(self, **kwargs):
+    def get_app(self, shared_state=None, **kwargs):
         """Create and return the server application.
 
         Use the options provided in kwargs.
@@ -85,17 +96,40 @@ class TestServer(AppsTestMixin, unittest.TestCase):
             'sandbox': False,
             'charmstoreurl': 'https://api.jujucharms.com/charmstore/',
             'bundleservice_url': '',
+            'wscompression': False,
+            'multiplex': False,
+            'sharewatchers': False,
+            'poolsize': 0,
+            'wshighwatermark': 0,
+            'wsqueuemessages': 1000,
+            'wsqueuesize': 10485760,
+            'wsreconnectattempts': 0,
+            'apiaddresses': '',
+            'resumegrace': 0,
+            'wslogsample': 1,
+            'wslogpayload': 256,
+            'wsframes': 16,
+            'wslatency': True,
+            'profiledir': '/var/log/guiserver',
+            'profiletoken': '',
+            'profileduration': 30,
+            'tokenstore': '',
+            'wsgithreads': 4,
+            'wsgiqueue': 100,
+            'wsgicachesize': 1024,
         }
         options_dict.update(kwargs)
         options = mock.Mock(**options_dict)
         with mock.patch('guiserver.apps.options', options):
-            return apps.server()
+            return apps.server(shared_state=shared_state)
 
     def get_gui_config(self, app):
         """Return the GUI config as a dictionary, given an app object."""
         spec = self.get_url_spec(app, r'.*$')
-        application = spec.kwargs['fallback'].wsgi_application.application
-        return application.registry.settings
+        application = spec.kwargs['fallback'].wsgi_application
+        if isinstance(application, cache.ResponseCache):
+            application = application.application
+        return application.application.registry.settings
 
     def test_auth_backend(self):
         # The authentication backend instance is correctly passed to the
@@ -159,6 +193,212 @@ class TestServer(AppsTestMixin, unittest.TestCase):
         tokens = self.assert_in_spec(spec, 'tokens')
         self.assertIsInstance(tokens, auth.AuthenticationTokenHandler)
 
+    def test_shared_tokens(self):
+        # Tokens are stored in the shared state if provided.
+        shared_state = workers.SharedState(
+            stores.MemoryTokenStore(), stores.MemoryTokenStore())
+        store_path = 'guiserver.bundles.views.set_changeset_store'
+        with mock.patch(store_path) as mock_set:
+            app = self.get_app(shared_state=shared_state)
+        mock_set.assert_called_once_with(shared_state.changesets)
+        spec = self.get_url_spec(app, r'^/ws/model-api(?:/.*)?$')
+        tokens = self.assert_in_spec(spec, 'tokens')
+        self.assertIs(shared_state.tokens, tokens._store)
+
+    def test_token_sweeper(self):
+        # Expired tokens are periodically removed from the token stores.
+        with mock.patch('guiserver.stores.Sweeper') as mock_sweeper:
+            app = self.get_app()
+        spec = self.get_url_spec(app, r'^/ws/model-api(?:/.*)?$')
+        tokens = self.assert_in_spec(spec, 'tokens')
+        token_store, changeset_store = mock_sweeper.call_args[0][0]
+        self.assertIs(tokens._store, token_store)
+        self.assertIsInstance(changeset_store, stores.MemoryTokenStore)
+        mock_sweeper().start.assert_called_once_with()
+
+    def test_sqlite_token_store(self):
+        # Tokens are stored in SQLite if a database path is provided.
+        store_path = 'guiserver.bundles.views.set_changeset_store'
+        with mock.patch(store_path) as mock_set:
+            app = self.get_app(tokenstore='/tmp/tokens.db')
+        changeset_store = mock_set.call_args[0][0]
+        self.assertIsInstance(changeset_store, stores.SQLiteTokenStore)
+        self.assertEqual('changesets', changeset_store._table)
+        spec = self.get_url_spec(app, r'^/ws/model-api(?:/.*)?$')
+        tokens = self.assert_in_spec(spec, 'tokens')
+        self.assertIsInstance(tokens._store, stores.SQLiteTokenStore)
+        self.assertEqual('/tmp/tokens.db', tokens._store._path)
+
+    def test_compression_disabled(self):
+        # WebSocket compression is disabled by default.
+        app = self.get_app()
+        for pattern in (
+                r'^/ws/controller-api(?:/.*)?$', r'^/ws/model-api(?:/.*)?$'):
+            spec = self.get_url_spec(app, pattern)
+            self.assertIsNone(self.assert_in_spec(spec, 'compression'))
+
+    def test_compression_enabled(self):
+        # The WebSocket compression options are passed to the handlers.
+        app = self.get_app(
+            wscompression=True, wscompressionlevel=9,
+            wscompressionwindowbits=12, wscompressioncontexttakeover=False)
+        for pattern in (
+                r'^/ws/controller-api(?:/.*)?$', r'^/ws/model-api(?:/.*)?$'):
+            spec = self.get_url_spec(app, pattern)
+            compression = self.assert_in_spec(spec, 'compression')
+            self.assertIsInstance(compression, deflate.CompressionOptions)
+            self.assertEqual(9, compression.level)
+            self.assertEqual(12, compression.window_bits)
+            self.assertFalse(compression.context_takeover)
+
+    def test_multiplexer_disabled(self):
+        # Juju API connections are not shared by default.
+        app = self.get_app()
+        for pattern in (
+                r'^/ws/controller-api(?:/.*)?$', r'^/ws/model-api(?:/.*)?$'):
+            spec = self.get_url_spec(app, pattern)
+            self.assertIsNone(self.assert_in_spec(spec, 'multiplexer'))
+
+    def test_multiplexer_enabled(self):
+        # The same multiplexer is passed to all the WebSocket handlers.
+        app = self.get_app(multiplex=True)
+        spec = self.get_url_spec(app, r'^/ws/controller-api(?:/.*)?$')
+        multiplexer = self.assert_in_spec(spec, 'multiplexer')
+        self.assertIsInstance(multiplexer, multiplex.Multiplexer)
+        spec = self.get_url_spec(app, r'^/ws/model-api(?:/.*)?$')
+        self.assert_in_spec(spec, 'multiplexer', value=multiplexer)
+        self.assertIsNone(multiplexer.watchers)
+
+    def test_shared_watchers(self):
+        # The multiplexer can be configured to share AllWatchers.
+        app = self.get_app(multiplex=True, sharewatchers=True)
+        spec = self.get_url_spec(app, r'^/ws/model-api(?:/.*)?$')
+        multiplexer = self.assert_in_spec(spec, 'multiplexer')
+        self.assertIsInstance(multiplexer.watchers, allwatchers.WatcherHub)
+
+    def test_pool_disabled(self):
+        # The connection pool is disabled by default.
+        app = self.get_app()
+        for pattern in (
+                r'^/ws/controller-api(?:/.*)?$', r'^/ws/model-api(?:/.*)?$'):
+            spec = self.get_url_spec(app, pattern)
+            self.assertIsNone(self.assert_in_spec(spec, 'pool'))
+
+    def test_pool_enabled(self):
+        # The same connection pool is used by handlers and the multiplexer.
+        app = self.get_app(poolsize=3, multiplex=True)
+        spec = self.get_url_spec(app, r'^/ws/controller-api(?:/.*)?$')
+        connection_pool = self.assert_in_spec(spec, 'pool')
+        self.assertIsInstance(connection_pool, pool.ConnectionPool)
+        self.assertEqual(3, connection_pool.size)
+        spec = self.get_url_spec(app, r'^/ws/model-api(?:/.*)?$')
+        self.assert_in_spec(spec, 'pool', value=connection_pool)
+        multiplexer = self.assert_in_spec(spec, 'multiplexer')
+        self.assertIs(connection_pool, multiplexer.pool)
+
+    def test_backpressure_disabled(self):
+        # Backpressure is disabled if the high watermark is 0.
+        app = self.get_app()
+        spec = self.get_url_spec(app, r'^/ws/model-api(?:/.*)?$')
+        self.assertIsNone(self.assert_in_spec(spec, 'watermarks'))
+
+    def test_backpressure_enabled(self):
+        # The watermarks are passed to the WebSocket handlers.
+        app = self.get_app(
+            wshighwatermark=1000, wslowwatermark=100,
+            wsbackpressure='coalesce')
+        for pattern in (
+                r'^/ws/controller-api(?:/.*)?$', r'^/ws/model-api(?:/.*)?$'):
+            spec = self.get_url_spec(app, pattern)
+            watermarks = self.assert_in_spec(spec, 'watermarks')
+            self.assertIsInstance(watermarks, backpressure.Watermarks)
+            self.assertEqual(1000, watermarks.high)
+            self.assertEqual(100, watermarks.low)
+            self.assertEqual(backpressure.COALESCE, watermarks.policy)
+
+    def test_queue_limits(self):
+        # The queue limits are passed to the WebSocket handlers.
+        app = self.get_app(wsqueuemessages=10, wsqueuesize=1024)
+        for pattern in (
+                r'^/ws/controller-api(?:/.*)?$', r'^/ws/model-api(?:/.*)?$'):
+            spec = self.get_url_spec(app, pattern)
+            self.assert_in_spec(spec, 'max_queued_messages', value=10)
+            self.assert_in_spec(spec, 'max_queued_size', value=1024)
+
+    def test_reconnect_policy(self):
+        # The reconnect policy is passed to the WebSocket handlers.
+        app = self.get_app(
+            wsreconnectattempts=3, apiaddresses='1.2.3.4:17070, 4.3.2.1:17070')
+        for pattern in (
+                r'^/ws/controller-api(?:/.*)?$', r'^/ws/model-api(?:/.*)?$'):
+            spec = self.get_url_spec(app, pattern)
+            policy = self.assert_in_spec(spec, 'reconnect_policy')
+            self.assertEqual(3, policy.attempts)
+            self.assertEqual(
+                ('1.2.3.4:17070', '4.3.2.1:17070'), policy.addresses)
+
+    def test_no_reconnect_policy(self):
+        # Reconnections are disabled by default.
+        app = self.get_app()
+        spec = self.get_url_spec(app, r'^/ws/model-api(?:/.*)?$')
+        self.assertIsNone(self.assert_in_spec(spec, 'reconnect_policy'))
+
+    def test_resume_grace(self):
+        # The resume grace window is passed to the WebSocket handlers.
+        app = self.get_app(resumegrace=30)
+        for pattern in (
+                r'^/ws/controller-api(?:/.*)?$', r'^/ws/model-api(?:/.*)?$'):
+            spec = self.get_url_spec(app, pattern)
+            self.assert_in_spec(spec, 'resume_grace', value=30)
+
+    def test_frame_log_options(self):
+        # The frame log options are passed to the WebSocket handlers.
+        app = self.get_app(wslogsample=10, wslogpayload=100, wsframes=0)
+        for pattern in (
+                r'^/ws/controller-api(?:/.*)?$', r'^/ws/model-api(?:/.*)?$'):
+            spec = self.get_url_spec(app, pattern)
+            log_options = self.assert_in_spec(spec, 'frame_log_options')
+            self.assertEqual(10, log_options.sample)
+            self.assertEqual(100, log_options.max_payload)
+            self.assertEqual(0, log_options.ring_size)
+
+    def test_measure_latency(self):
+        # Latency measurements are passed to the WebSocket handlers.
+        app = self.get_app(wslatency=False)
+        for pattern in (
+                r'^/ws/controller-api(?:/.*)?$', r'^/ws/model-api(?:/.*)?$'):
+            spec = self.get_url_spec(app, pattern)
+            self.assert_in_spec(spec, 'measure_latency', value=False)
+
+    def test_latency_handler(self):
+        # The latency histograms are exposed by the server.
+        app = self.get_app()
+        spec = self.get_url_spec(app, r'^/gui-server-latency$')
+        self.assertEqual(handlers.LatencyHandler, spec.handler_class)
+
+    def test_metrics_handler(self):
+        # The metrics are exposed by the server.
+        app = self.get_app()
+        spec = self.get_url_spec(app, r'^/metrics$')
+        self.assertEqual(handlers.MetricsHandler, spec.handler_class)
+        self.assertIsNotNone(self.assert_in_spec(spec, 'tokens'))
+        self.assertIsNotNone(self.assert_in_spec(spec, 'deployer'))
+
+    def test_metrics_handler_in_sandbox_mode(self):
+        # Tokens are not used in sandbox mode.
+        app = self.get_app(sandbox=True)
+        spec = self.get_url_spec(app, r'^/metrics$')
+        self.assertIsNone(self.assert_in_spec(spec, 'tokens'))
+
+    def test_profile_handler(self):
+        # The profiler endpoint is properly set up.
+        app = self.get_app(profiletoken='secret')
+        spec = self.get_url_spec(app, r'^/gui-server-profile$')
+        self.assertEqual(handlers.ProfileHandler, spec.handler_class)
+        self.assert_in_spec(spec, 'directory', value='/var/log/guiserver')
+        self.assert_in_spec(spec, 'token', value='secret')
+        self.assert_in_spec(spec, 'duration', value=30)
+
     def test_websocket_in_sandbox_mode(self):
         # The sandbox WebSocket handler is used if sandbox mode is enabled.
         app = self.get_app(sandbox=True)
@@ -229,6 +469,46 @@ class TestServer(AppsTestMixin, unittest.TestCase):
         config = self.get_gui_config(app)
         self.assertTrue(config['jujugui.raw'])
 
+    def test_static_files(self):
+        # The GUI static files are served by the GUI server.
+        app = self.get_app()
+        spec = self.get_url_spec(app, r'^/static/(.*)$')
+        self.assertIsNotNone(spec)
+        self.assertIs(static.StaticFileHandler, spec.handler_class)
+        self.assertEqual('static', os.path.basename(spec.kwargs['path']))
+
+    def test_threaded_wsgi(self):
+        # The GUI application is run in a pool of threads.
+        app = self.get_app(wsgithreads=8, wsgiqueue=42)
+        spec = self.get_url_spec(app, r'.*$')
+        container = spec.kwargs['fallback']
+        self.assertIsInstance(container, wsgi.ThreadedWSGIContainer)
+        self.assertEqual(8, container._executor._max_workers)
+        self.assertEqual(42, container._max_queued)
+
+    def test_wsgi_in_ioloop(self):
+        # The GUI application can be run in the IO loop.
+        app = self.get_app(wsgithreads=0)
+        spec = self.get_url_spec(app, r'.*$')
+        container = spec.kwargs['fallback']
+        self.assertNotIsInstance(container, wsgi.ThreadedWSGIContainer)
+
+    def test_response_cache(self):
+        # The GUI application responses are cached.
+        app = self.get_app(wsgicachesize=4096)
+        spec = self.get_url_spec(app, r'.*$')
+        application = spec.kwargs['fallback'].wsgi_application
+        self.assertIsInstance(application, cache.ResponseCache)
+        self.assertEqual(4096, application._max_size)
+        self.assertIsNotNone(application._release)
+
+    def test_response_cache_disabled(self):
+        # The GUI application response cache can be disabled.
+        app = self.get_app(wsgicachesize=0)
+        spec = self.get_url_spec(app, r'.*$')
+        application = spec.kwargs['fallback'].wsgi_application
+        self.assertNotIsInstance(application, cache.ResponseCache)
+
 
 class TestRedirector(AppsTestMixin, unittest.TestCase):
 
@@ -22,7 +22,10 @@ import unittest
 import mock
 from tornado.testing import LogTrapTestCase
 
-from guiserver import auth
+from guiserver import (
+    auth,
+    stores,
+)
 from guiserver.tests import helpers
 
 
@@ -295,7 +298,7 @@ class TestAuthenticationTokenHandler(LogTrapTestCase, unittest.TestCase):
         # The class accepted the explicit initialization.
         self.assertEqual(self.max_life, self.tokens._max_life)
         self.assertEqual(self.io_loop, self.tokens._io_loop)
-        self.assertEqual({}, self.tokens._data)
+        self.assertEqual(0, len(self.tokens._store))
 
     @mock.patch('tornado.ioloop.IOLoop.current',
                 mock.Mock(return_value='mockloop'))
@@ -306,6 +309,26 @@ class TestAuthenticationTokenHandler(LogTrapTestCase, unittest.TestCase):
             datetime.timedelta(minutes=2), tokens._max_life)
         self.assertEqual('mockloop', tokens._io_loop)
 
+    def test_shared_store(self):
+        # Tokens created elsewhere can be used.
+        store = stores.MemoryTokenStore()
+        store.put('DEFACED', {'username': 'who', 'password': 'secret'}, 60)
+        tokens = auth.AuthenticationTokenHandler(
+            self.max_life, self.io_loop, store=store)
+        request = dict(
+            RequestId=42, Type='GUIToken', Request='Login',
+            Params={'Token': 'DEFACED'})
+        self.assertEqual(
+            ('who', 'secret'),
+            tokens.process_authentication_request(request, mock.Mock()))
+        self.assertEqual(0, len(store))
+
+    def test_sizes(self):
+        # The number of stored tokens and parked sessions is returned.
+        self.assertEqual({'tokens': 0, 'parked': 0}, self.tokens.sizes())
+        self.tokens.park('token', mock.Mock(), self.max_life)
+        self.assertEqual({'tokens': 0, 'parked': 1}, self.tokens.sizes())
+
     def test_token_requested(self):
         # It recognizes a token request.
         requests = (
@@ -342,20 +365,19 @@ class TestAuthenticationTokenHandler(LogTrapTestCase, unittest.TestCase):
                 Expires='2013-11-21T21:01:00Z'
             )
         ))
-        self.assertTrue('DEFACED' in self.tokens._data)
-        self.assertEqual(
-            {'username', 'password', 'handle'},
-            set(self.tokens._data['DEFACED'].keys()))
-        self.assertEqual(
-            user.username, self.tokens._data['DEFACED']['username'])
-        self.assertEqual(
-            user.password, self.tokens._data['DEFACED']['password'])
+        self.assertTrue('DEFACED' in self.tokens._store)
+        # Expiration is handled by the store, not by IO loop timeouts.
+        self.assertFalse(self.io_loop.add_timeout.called)
+
+    @mock.patch('uuid.uuid4', mock.Mock(return_value=mock.Mock(hex='DEFACED')))
+    def test_stored_credentials(self):
+        # The credentials of the user are stored with the token.
+        user = auth.User('user-admin', 'ADMINSECRET', True)
+        data = dict(RequestId=42, Type='GUIToken', Request='Create')
+        self.tokens.process_token_request(data, user, mock.Mock())
         self.assertEqual(
-            self.max_life, self.io_loop.add_timeout.call_args[0][0])
-        self.assertTrue('DEFACED' in self.tokens._data)
-        expire_token = self.io_loop.add_timeout.call_args[0][1]
-        expire_token()
-        self.assertFalse('DEFACED' in self.tokens._data)
+            {'username': 'user-admin', 'password': 'ADMINSECRET'},
+            self.tokens._store.pop('DEFACED'))
 
     def test_unauthenticated_process_token_request(self):
         # Unauthenticated token requests get an informative error.
@@ -369,7 +391,7 @@ class TestAuthenticationTokenHandler(LogTrapTestCase, unittest.TestCase):
             ErrorCode='unauthorized access',
             Response={}
         ))
-        self.assertEqual({}, self.tokens._data)
+        self.assertEqual(0, len(self.tokens._store))
         self.assertFalse(self.io_loop.add_timeout.called)
 
     def test_authentication_requested(self):
@@ -397,8 +419,9 @@ class TestAuthenticationTokenHandler(LogTrapTestCase, unittest.TestCase):
         # It correctly responds to authentication requests with known tokens.
         username = 'user-admin'
         password = 'ADMINSECRET'
-        self.tokens._data['DEFACED'] = dict(
-            handle='handle marker', username=username, password=password)
+        self.tokens._store.put(
+            'DEFACED', dict(username=username, password=password),
+            self.max_life)
         request = dict(
             RequestId=42, Type='GUIToken', Request='Login',
             Params={'Token': 'DEFACED'})
@@ -406,9 +429,8 @@ class TestAuthenticationTokenHandler(LogTrapTestCase, unittest.TestCase):
         self.assertEqual(
             (username, password),
             self.tokens.process_authentication_request(request, write_message))
-        self.io_loop.remove_timeout.assert_called_once_with('handle marker')
         self.assertFalse(write_message.called)
-        self.assertFalse('DEFACED' in self.tokens._data)
+        self.assertFalse('DEFACED' in self.tokens._store)
 
     def test_unknown_authentication_request(self):
         # It correctly rejects authentication requests with unknown tokens.
@@ -459,3 +481,70 @@ class TestAuthenticationTokenHandler(LogTrapTestCase, unittest.TestCase):
         self.assertEqual(expected_response, obtained_response)
         # The original response is not mutated in the process.
         self.assertNotEqual(original_response, obtained_response)
+
+    def test_resume_token_requested(self):
+        # It recognizes a resume token request.
+        request = dict(RequestId=42, Type='GUIToken', Request='CreateResume')
+        self.assertTrue(self.tokens.resume_token_requested(request))
+        request = dict(RequestId=42, Type='GUIToken', Request='Create')
+        self.assertFalse(self.tokens.resume_token_requested(request))
+
+    @mock.patch('uuid.uuid4', mock.Mock(return_value=mock.Mock(hex='DEFACED')))
+    def test_process_resume_token_request(self):
+        # A resume token is returned to authenticated users.
+        user = auth.User('user-admin', 'ADMINSECRET', True)
+        write_message = mock.Mock()
+        data = dict(RequestId=42, Type='GUIToken', Request='CreateResume')
+        token = self.tokens.process_resume_token_request(
+            data, user, write_message)
+        self.assertEqual('DEFACED', token)
+        write_message.assert_called_once_with(
+            dict(RequestId=42, Response=dict(Token='DEFACED')))
+        # The token is not usable before the session is parked.
+        self.assertEqual(0, len(self.tokens._store))
+        self.assertIsNone(self.tokens.unpark('DEFACED'))
+
+    def test_unauthenticated_process_resume_token_request(self):
+        # Unauthenticated resume token requests get an informative error.
+        user = auth.User(is_authenticated=False)
+        write_message = mock.Mock()
+        data = dict(RequestId=42, Type='GUIToken', Request='CreateResume')
+        token = self.tokens.process_resume_token_request(
+            data, user, write_message)
+        self.assertIsNone(token)
+        write_message.assert_called_once_with(dict(
+            RequestId=42,
+            Error='tokens can only be created by authenticated users.',
+            ErrorCode='unauthorized access',
+            Response={}
+        ))
+
+    def test_resume_requested(self):
+        # It recognizes a resume request.
+        request = dict(
+            RequestId=42, Type='GUIToken', Request='Resume',
+            Params={'Token': 'DEFACED'})
+        self.assertTrue(self.tokens.resume_requested(request))
+        del request['Params']
+        self.assertFalse(self.tokens.resume_requested(request))
+
+    def test_park_unpark(self):
+        # Parked sessions can be retrieved only once.
+        session = mock.Mock()
+        self.tokens.park('DEFACED', session, self.max_life)
+        self.assertEqual(
+            self.max_life, self.io_loop.add_timeout.call_args[0][0])
+        self.assertIs(session, self.tokens.unpark('DEFACED'))
+        self.io_loop.remove_timeout.assert_called_once_with(
+            self.io_loop.add_timeout())
+        self.assertIsNone(self.tokens.unpark('DEFACED'))
+        self.assertFalse(session.expire.called)
+
+    def test_park_expired(self):
+        # Parked sessions expire after the given max life.
+        session = mock.Mock()
+        self.tokens.park('DEFACED', session, self.max_life)
+        expire_session = self.io_loop.add_timeout.call_args[0][1]
+        expire_session()
+        session.expire.assert_called_once_with()
+        self.assertIsNone(self.tokens.unpark('DEFACED'))
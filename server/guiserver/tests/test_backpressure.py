@@ -0,0 +1,161 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the Juju GUI server WebSocket backpressure support."""
+
+import unittest
+
+import mock
+from tornado.testing import LogTrapTestCase
+
+from guiserver import backpressure
+from guiserver.tests import helpers
+
+
+class TestWatermarks(unittest.TestCase):
+
+    def test_watermarks(self):
+        # The watermarks are correctly stored.
+        watermarks = backpressure.Watermarks(10, 5)
+        self.assertEqual(10, watermarks.high)
+        self.assertEqual(5, watermarks.low)
+
+    def test_invalid(self):
+        # The low watermark cannot be greater than the high one.
+        with self.assertRaises(ValueError):
+            backpressure.Watermarks(5, 10)
+
+    def test_policy(self):
+        # The backpressure policy defaults to pausing the Juju connection.
+        self.assertEqual(
+            backpressure.PAUSE, backpressure.Watermarks(10, 5).policy)
+        watermarks = backpressure.Watermarks(10, 5, backpressure.COALESCE)
+        self.assertEqual(backpressure.COALESCE, watermarks.policy)
+
+    def test_invalid_policy(self):
+        # Only known policies are accepted.
+        with self.assertRaises(ValueError):
+            backpressure.Watermarks(10, 5, 'drop')
+
+
+class TestGetWriteBufferSize(unittest.TestCase):
+
+    def test_empty(self):
+        # Zero is returned if the stream is not writing.
+        stream = helpers.FakeStream()
+        self.assertEqual(0, backpressure.get_write_buffer_size(stream))
+
+    def test_size(self):
+        # The buffered bytes are returned.
+        stream = helpers.FakeStream(b'abc', b'de')
+        self.assertEqual(5, backpressure.get_write_buffer_size(stream))
+
+
+class TestBackpressure(LogTrapTestCase, unittest.TestCase):
+
+    def setUp(self):
+        backpressure.stats.reset()
+        self.addCleanup(backpressure.stats.reset)
+        self.receive_frame = mock.Mock()
+        self.source = mock.Mock()
+        self.source.protocol._receive_frame = self.receive_frame
+        self.stream = helpers.FakeStream()
+        self.handler = mock.Mock()
+        self.handler.ws_connection.stream = self.stream
+        self.io_loop = mock.Mock()
+        self.io_loop.time.return_value = 0
+        self.backpressure = backpressure.Backpressure(
+            backpressure.Watermarks(10, 4), self.source, self.handler,
+            io_loop=self.io_loop)
+
+    def test_not_congested(self):
+        # Frames are read as usual if the browser is not congested.
+        self.stream._write_buffer.append(b'0123456789')
+        self.backpressure.check()
+        self.assertFalse(self.backpressure.paused)
+        self.source.protocol._receive_frame()
+        self.receive_frame.assert_called_once_with()
+
+    def test_pause(self):
+        # Reading is paused if the browser exceeds the high watermark.
+        self.stream._write_buffer.extend([b'0123456789', b'a'])
+        self.backpressure.check()
+        self.assertTrue(self.backpressure.paused)
+        self.source.protocol._receive_frame()
+        self.assertFalse(self.receive_frame.called)
+        self.assertEqual(
+            {'stalled': 1, 'stalls': 1, 'coalesced': 0},
+            backpressure.stats.as_dict())
+        self.assertEqual(1, self.io_loop.add_timeout.call_count)
+
+    def test_still_congested(self):
+        # Reading is not resumed until the low watermark is reached.
+        self.stream._write_buffer.extend([b'0123456789', b'a'])
+        self.backpressure.check()
+        self.stream._write_buffer.popleft()
+        self.stream._write_buffer.append(b'1234')
+        self.backpressure._poll()
+        self.assertTrue(self.backpressure.paused)
+        self.assertEqual(2, self.io_loop.add_timeout.call_count)
+
+    def test_resume(self):
+        # Reading is resumed when the browser drops below the low watermark.
+        self.stream._write_buffer.extend([b'0123456789', b'a'])
+        self.backpressure.check()
+        self.source.protocol._receive_frame()
+        self.stream._write_buffer.popleft()
+        self.backpressure._poll()
+        self.assertFalse(self.backpressure.paused)
+        self.receive_frame.assert_called_once_with()
+        self.assertEqual(
+            {'stalled': 0, 'stalls': 1, 'coalesced': 0},
+            backpressure.stats.as_dict())
+
+    def test_resume_without_pending_read(self):
+        # Frames are not read on resume if no read was requested.
+        self.stream._write_buffer.extend([b'0123456789', b'a'])
+        self.backpressure.check()
+        self.stream._write_buffer.clear()
+        self.backpressure._poll()
+        self.assertFalse(self.receive_frame.called)
+
+    def test_browser_disconnected(self):
+        # Backpressure is released if the browser disconnects.
+        self.stream._write_buffer.extend([b'0123456789', b'a'])
+        self.backpressure.check()
+        self.stream.is_closed = True
+        self.backpressure._poll()
+        self.assertFalse(self.backpressure.paused)
+        self.assertEqual(0, backpressure.stats.stalled)
+
+    def test_close(self):
+        # Closing removes the scheduled check and updates the counters.
+        self.stream._write_buffer.extend([b'0123456789', b'a'])
+        self.backpressure.check()
+        self.backpressure.close()
+        self.io_loop.remove_timeout.assert_called_once_with(
+            self.io_loop.add_timeout())
+        self.assertEqual(0, backpressure.stats.stalled)
+
+    def test_close_pending_read(self):
+        # Closing restores reading from the source.
+        self.source.protocol.stream.closed.return_value = False
+        self.stream._write_buffer.extend([b'0123456789', b'a'])
+        self.backpressure.check()
+        self.source.protocol._receive_frame()
+        self.backpressure.close()
+        self.receive_frame.assert_called_once_with()
+        self.assertIs(self.receive_frame, self.source.protocol._receive_frame)
@@ -0,0 +1,33 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the Juju GUI server benchmarks."""
+
+import unittest
+
+from guiserver import benchmarks
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_results(self):
+        # Each benchmark returns a list of labeled timings.
+        for benchmark in benchmarks.BENCHMARKS:
+            results = benchmark(number=1)
+            self.assertTrue(results)
+            for label, seconds in results:
+                self.assertIsInstance(label, str)
+                self.assertGreaterEqual(seconds, 0)
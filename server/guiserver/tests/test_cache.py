@@ -0,0 +1,288 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the Juju GUI server WSGI response cache."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from tornado.testing import LogTrapTestCase
+
+from guiserver import cache
+
+
+class Application(object):
+    """A WSGI application used for tests, counting its calls."""
+
+    def __init__(self):
+        self.calls = 0
+        self.closed = 0
+
+    def __call__(self, environ, start_response):
+        self.calls += 1
+        path = environ['PATH_INFO']
+        headers = [('Content-Type', 'text/plain')]
+        if path == '/missing':
+            start_response('404 Not Found', headers)
+            return ['not found']
+        if path == '/cookie':
+            headers.append(('Set-Cookie', 'session=42'))
+        elif path == '/private':
+            headers.append(('Cache-Control', 'private, max-age=0'))
+        elif path == '/vary':
+            headers.append(('Vary', 'Cookie'))
+        elif path == '/etag':
+            headers.append(('ETag', '"42"'))
+        elif path == '/large':
+            start_response('200 OK', headers)
+            return ['x' * 2000]
+        elif path == '/lazy':
+            return self.lazy(start_response)
+        start_response('200 OK', headers)
+        return self.Response(self, ['hello ', path])
+
+    def lazy(self, start_response):
+        start_response('200 OK', [])
+        yield 'lazy'
+
+    class Response(list):
+        """A WSGI response which can be closed."""
+
+        def __init__(self, application, chunks):
+            super(Application.Response, self).__init__(chunks)
+            self.application = application
+
+        def close(self):
+            self.application.closed += 1
+
+
+def make_environ(path='/', method='GET', **headers):
+    """Return a WSGI environment for the given request."""
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+    }
+    for key, value in headers.items():
+        environ['HTTP_' + key.upper()] = value
+    return environ
+
+
+class TestResponseCache(LogTrapTestCase, unittest.TestCase):
+
+    def setUp(self):
+        super(TestResponseCache, self).setUp()
+        cache.stats.reset()
+        self.addCleanup(cache.stats.reset)
+        self.application = Application()
+        self.cache = cache.ResponseCache(self.application, max_size=4096)
+
+    def call(self, environ):
+        """Call the cache, returning the status, headers and body."""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = dict(headers)
+
+        chunks = self.cache(environ, start_response)
+        body = ''.join(chunks)
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        return response['status'], response['headers'], body
+
+    def test_cached(self):
+        # Responses are only generated once.
+        for _ in range(3):
+            status, headers, body = self.call(make_environ('/index'))
+            self.assertEqual('200 OK', status)
+            self.assertEqual('hello /index', body)
+            self.assertEqual('text/plain', headers['Content-Type'])
+        self.assertEqual(1, self.application.calls)
+        self.assertEqual(1, self.application.closed)
+        self.assertEqual(2, cache.stats.hits)
+        self.assertEqual(1, cache.stats.misses)
+        self.assertEqual(1, cache.stats.entries)
+
+    def test_validators(self):
+        # An ETag and a Last-Modified header are added to cached responses.
+        _, headers, _ = self.call(make_environ('/index'))
+        self.assertIn('ETag', headers)
+        self.assertIn('Last-Modified', headers)
+
+    def test_existing_etag(self):
+        # The ETag provided by the application is preserved.
+        _, headers, _ = self.call(make_environ('/etag'))
+        self.assertEqual('"42"', headers['ETag'])
+
+    def test_if_none_match(self):
+        # Requests having a fresh copy get a "304 Not Modified" response.
+        _, headers, _ = self.call(make_environ('/index'))
+        environ = make_environ(
+            '/index', if_none_match='"other", ' + headers['ETag'])
+        status, headers, body = self.call(environ)
+        self.assertEqual('304 Not Modified', status)
+        self.assertEqual('', body)
+        self.assertNotIn('Content-Type', headers)
+        self.assertIn('ETag', headers)
+        self.assertEqual(1, cache.stats.not_modified)
+
+    def test_if_none_match_stale(self):
+        # Requests having a stale copy get the response.
+        self.call(make_environ('/index'))
+        status, _, body = self.call(
+            make_environ('/index', if_none_match='"other"'))
+        self.assertEqual('200 OK', status)
+        self.assertEqual('hello /index', body)
+
+    def test_if_modified_since(self):
+        # Requests for unmodified responses get a "304 Not Modified".
+        _, headers, _ = self.call(make_environ('/index'))
+        environ = make_environ(
+            '/index', if_modified_since=headers['Last-Modified'])
+        status, _, _ = self.call(environ)
+        self.assertEqual('304 Not Modified', status)
+        environ = make_environ(
+            '/index', if_modified_since='Thu, 01 Jan 2015 00:00:00 GMT')
+        status, _, _ = self.call(environ)
+        self.assertEqual('200 OK', status)
+
+    def test_conditional_miss(self):
+        # Conditional requests are also answered on cache misses.
+        environ = make_environ('/etag', if_none_match='"42"')
+        status, _, _ = self.call(environ)
+        self.assertEqual('304 Not Modified', status)
+
+    def test_head(self):
+        # HEAD requests are served from cached GET responses.
+        self.call(make_environ('/index'))
+        status, headers, body = self.call(make_environ('/index', 'HEAD'))
+        self.assertEqual('200 OK', status)
+        self.assertEqual('', body)
+        self.assertEqual(1, self.application.calls)
+
+    def test_head_not_cached(self):
+        # Responses to HEAD requests are not cached.
+        self.call(make_environ('/index', 'HEAD'))
+        self.call(make_environ('/index', 'HEAD'))
+        self.assertEqual(2, self.application.calls)
+        self.assertEqual(0, cache.stats.entries)
+
+    def test_post(self):
+        # Requests with other methods are not cached.
+        self.call(make_environ('/index', 'POST'))
+        self.call(make_environ('/index', 'POST'))
+        self.assertEqual(2, self.application.calls)
+        self.assertEqual(0, cache.stats.misses)
+
+    def test_keys(self):
+        # Responses are cached by path, query and gzip support.
+        self.call(make_environ('/index'))
+        environ = make_environ('/index')
+        environ['QUERY_STRING'] = 'v=2'
+        self.call(environ)
+        self.call(make_environ('/index', accept_encoding='gzip, deflate'))
+        self.call(make_environ('/other'))
+        self.assertEqual(4, self.application.calls)
+        self.assertEqual(4, cache.stats.entries)
+
+    def test_not_cacheable(self):
+        # Errors, private responses and responses setting cookies or varying
+        # on other headers are not cached.
+        for path in ('/missing', '/cookie', '/private', '/vary'):
+            self.call(make_environ(path))
+            self.call(make_environ(path))
+        self.assertEqual(8, self.application.calls)
+        self.assertEqual(0, cache.stats.entries)
+        # Streamed responses are closed.
+        self.assertEqual(6, self.application.closed)
+
+    def test_large_response(self):
+        # Responses larger than a quarter of the cache size are not cached.
+        status, _, body = self.call(make_environ('/large'))
+        self.assertEqual('200 OK', status)
+        self.assertEqual(2000, len(body))
+        self.call(make_environ('/large'))
+        self.assertEqual(2, self.application.calls)
+
+    def test_lazy_start_response(self):
+        # Applications calling start_response while iterated are supported.
+        for _ in range(2):
+            status, _, body = self.call(make_environ('/lazy'))
+            self.assertEqual('200 OK', status)
+            self.assertEqual('lazy', body)
+        self.assertEqual(1, self.application.calls)
+
+    def test_eviction(self):
+        # The least recently used responses are evicted.
+        self.cache = cache.ResponseCache(self.application, max_size=500)
+        for num in range(5):
+            self.call(make_environ('/{}'.format(num)))
+            self.call(make_environ('/0'))
+        self.assertLessEqual(self.cache._size, 500)
+        self.assertGreater(cache.stats.evictions, 0)
+        self.assertEqual(cache.stats.size, self.cache._size)
+        # The most recently used response is still cached.
+        self.assertIn(('/0', '', False), self.cache._entries)
+        self.assertNotIn(('/1', '', False), self.cache._entries)
+
+
+class TestResponseCacheRelease(LogTrapTestCase, unittest.TestCase):
+
+    def setUp(self):
+        super(TestResponseCacheRelease, self).setUp()
+        cache.stats.reset()
+        self.addCleanup(cache.stats.reset)
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.application = Application()
+        self.cache = cache.ResponseCache(
+            self.application, release_path=self.path, check_interval=0)
+        self.environ = make_environ('/index')
+
+    def call(self):
+        """Call the cache and return the response body."""
+        return ''.join(self.cache(self.environ, lambda *args: None))
+
+    def test_same_release(self):
+        # The cache is preserved if the release is not changed.
+        self.call()
+        self.call()
+        self.assertEqual(1, self.application.calls)
+        self.assertEqual(0, cache.stats.invalidations)
+
+    def test_new_release(self):
+        # The cache is cleared when a new release is installed.
+        self.call()
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+        self.call()
+        self.assertEqual(2, self.application.calls)
+        self.assertEqual(1, cache.stats.invalidations)
+        self.assertEqual(1, cache.stats.entries)
+
+    def test_check_interval(self):
+        # The release is not checked more often than the given interval.
+        self.cache._check_interval = 60
+        with mock.patch('guiserver.cache._get_release') as mock_get_release:
+            self.call()
+            self.call()
+        self.assertEqual(0, mock_get_release.call_count)
@@ -16,6 +16,7 @@
 
 """Tests for the Juju GUI server clients."""
 
+import mock
 from tornado import (
     concurrent,
     web,
@@ -25,7 +26,10 @@ from tornado.testing import (
     gen_test,
 )
 
-from guiserver import clients
+from guiserver import (
+    clients,
+    metrics,
+)
 from guiserver.tests import helpers
 
 
@@ -53,6 +57,18 @@ class TestWebSocketClientConnection(AsyncHTTPSTestCase, helpers.WSSTestMixin):
         # The client correctly establishes a connection to the server.
         yield self.connect()
 
+    @gen_test
+    def test_connections_count(self):
+        # Open connections are counted.
+        metrics.stats.reset()
+        self.addCleanup(metrics.stats.reset)
+        client = yield self.connect()
+        self.assertEqual(1, metrics.stats.juju_connections)
+        client.close()
+        yield client.read_message()
+        self.assertEqual(0, metrics.stats.juju_connections)
+        yield self.server_closed_future
+
     @gen_test
     def test_send_receive(self):
         # The client correctly sends and receives messages on the secure
@@ -62,6 +78,28 @@ class TestWebSocketClientConnection(AsyncHTTPSTestCase, helpers.WSSTestMixin):
         message = yield client.read_message()
         self.assertEqual('hello', message)
 
+    @gen_test
+    def test_write_messages(self):
+        # Multiple messages can be sent using a single stream write.
+        client = yield self.connect()
+        with mock.patch.object(
+                client.protocol.stream, 'write',
+                wraps=client.protocol.stream.write) as mock_write:
+            client.write_messages(['hello', 'world'])
+        self.assertEqual(1, mock_write.call_count)
+        self.assertEqual('hello', (yield client.read_message()))
+        self.assertEqual('world', (yield client.read_message()))
+
+    @gen_test
+    def test_write_messages_closed_stream(self):
+        # Writing messages to a closed stream aborts the connection without
+        # raising errors.
+        client = yield self.connect()
+        client.protocol.stream.close()
+        with mock.patch.object(client.protocol, '_abort') as mock_abort:
+            client.write_messages(['hello', 'world'])
+        mock_abort.assert_called_once_with()
+
     @gen_test
     def test_callback(self):
         # The client executes the given callback each time a message is
@@ -0,0 +1,227 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the Juju GUI server AllWatcher deltas coalescing."""
+
+import json
+import unittest
+
+import mock
+from tornado.testing import LogTrapTestCase
+
+from guiserver import (
+    backpressure,
+    coalesce,
+)
+from guiserver.tests import helpers
+
+
+class TestWatcherState(unittest.TestCase):
+
+    def setUp(self):
+        backpressure.stats.reset()
+        self.addCleanup(backpressure.stats.reset)
+
+    def test_merge(self):
+        # Only the latest delta for each entity is retained.
+        state = coalesce.WatcherState('AllWatcher', '1', None)
+        state.merge({'Deltas': [
+            ['service', 'change', {'Name': 'django', 'Exposed': False}],
+            ['machine', 'change', {'Id': '0'}],
+        ]})
+        state.merge({'Deltas': [
+            ['service', 'change', {'Name': 'django', 'Exposed': True}],
+            ['machine', 'remove', {'Id': '1'}],
+        ]})
+        expected = {
+            'RequestId': 42,
+            'Response': {'Deltas': [
+                ['machine', 'change', {'Id': '0'}],
+                ['service', 'change', {'Name': 'django', 'Exposed': True}],
+                ['machine', 'remove', {'Id': '1'}],
+            ]},
+        }
+        self.assertEqual(expected, json.loads(state.pop_response(42)))
+        self.assertIsNone(state.deltas)
+        self.assertEqual(1, backpressure.stats.coalesced)
+
+    def test_juju2(self):
+        # The deltas key used by Juju 2 is preserved.
+        state = coalesce.WatcherState('AllWatcher', '1', 1)
+        state.merge({'deltas': [['application', 'change', {'name': 'a'}]]})
+        response = json.loads(state.pop_response(42))
+        self.assertEqual(
+            [['application', 'change', {'name': 'a'}]],
+            response['Response']['deltas'])
+
+    def test_unexpected_deltas(self):
+        # Unexpected deltas are retained as they are.
+        state = coalesce.WatcherState('AllWatcher', '1', None)
+        state.merge({'Deltas': ['bad', 'bad']})
+        response = json.loads(state.pop_response(42))
+        self.assertEqual(['bad', 'bad'], response['Response']['Deltas'])
+
+
+class TestDeltaCoalescer(LogTrapTestCase, unittest.TestCase):
+
+    def setUp(self):
+        backpressure.stats.reset()
+        self.addCleanup(backpressure.stats.reset)
+        self.stream = helpers.FakeStream()
+        self.handler = mock.Mock()
+        self.handler.ws_connection.stream = self.stream
+        self.io_loop = mock.Mock()
+        self.io_loop.time.return_value = 0
+        self.coalescer = coalesce.DeltaCoalescer(
+            backpressure.Watermarks(10, 4, backpressure.COALESCE),
+            self.handler, io_loop=self.io_loop)
+
+    def next(self, request_id=1):
+        """Send a Next request from the browser."""
+        return self.coalescer.handle_request(json.dumps({
+            'RequestId': request_id, 'Type': 'AllWatcher', 'Request': 'Next',
+            'Id': '5'}))
+
+    def respond(self, request_id, deltas):
+        """Send a Next response from the Juju API."""
+        return self.coalescer.handle_response(json.dumps({
+            'RequestId': request_id, 'Response': {'Deltas': deltas}}))
+
+    def get_written(self):
+        """Return the decoded messages written to the browser."""
+        return [json.loads(call[0][0])
+                for call in self.handler.write_message.call_args_list]
+
+    def get_sent(self):
+        """Return the decoded requests sent to the Juju API."""
+        calls = self.handler.juju_connection.write_message.call_args_list
+        return [json.loads(call[0][0]) for call in calls]
+
+    def congest(self):
+        """Simulate a congested browser connection."""
+        self.stream._write_buffer.append(b'x' * 11)
+
+    def drain(self):
+        """Simulate a drained browser connection."""
+        self.stream._write_buffer.clear()
+
+    def test_other_messages(self):
+        # Messages unrelated to AllWatchers are ignored.
+        self.assertFalse(self.coalescer.handle_request(
+            '{"RequestId": 1, "Type": "Client", "Request": "FullStatus"}'))
+        self.assertFalse(self.coalescer.handle_response(
+            '{"RequestId": 1, "Response": {}}'))
+
+    def test_not_congested(self):
+        # Requests and responses are propagated if the browser keeps up.
+        self.assertFalse(self.next())
+        self.assertFalse(self.respond(1, [['machine', 'change', {'Id': 0}]]))
+        self.assertFalse(self.handler.write_message.called)
+
+    def test_coalesce(self):
+        # Deltas are retained and merged while the browser is congested, and
+        # sent when the browser connection drains.
+        self.assertFalse(self.next())
+        self.congest()
+        self.assertTrue(self.respond(1, [['machine', 'change', {'Id': 0}]]))
+        # The GUI server requests the next deltas.
+        request = self.get_sent()[-1]
+        self.assertEqual(coalesce.REQUEST_ID_BASE, request['RequestId'])
+        self.assertEqual('Next', request['Request'])
+        self.assertEqual('5', request['Id'])
+        self.assertTrue(self.respond(
+            request['RequestId'], [['machine', 'change', {'Id': 0, 'S': 1}]]))
+        self.assertEqual(2, len(self.get_sent()))
+        self.assertFalse(self.handler.write_message.called)
+        # The merged deltas are sent once the browser drains.
+        self.drain()
+        self.coalescer._poll()
+        expected = {
+            'RequestId': 1,
+            'Response': {'Deltas': [['machine', 'change', {'Id': 0, 'S': 1}]]},
+        }
+        self.assertEqual([expected], self.get_written())
+        self.assertEqual(1, backpressure.stats.coalesced)
+
+    def test_next_while_in_flight(self):
+        # A browser Next request waits for the in progress GUI server one.
+        self.next()
+        self.congest()
+        self.respond(1, [['machine', 'change', {'Id': 0}]])
+        self.drain()
+        self.coalescer._poll()
+        self.assertTrue(self.next(request_id=2))
+        self.assertEqual(1, len(self.get_sent()))
+        self.respond(coalesce.REQUEST_ID_BASE, [['unit', 'change', {'Id': 1}]])
+        expected = {
+            'RequestId': 2,
+            'Response': {'Deltas': [['unit', 'change', {'Id': 1}]]},
+        }
+        self.assertEqual(expected, self.get_written()[-1])
+
+    def test_retained_deltas(self):
+        # Deltas retained when no browser request is waiting are returned
+        # on the next browser request.
+        self.next()
+        self.congest()
+        self.respond(1, [['machine', 'change', {'Id': 0}]])
+        self.drain()
+        self.coalescer._poll()
+        self.respond(coalesce.REQUEST_ID_BASE, [['unit', 'change', {'Id': 1}]])
+        self.assertEqual(1, len(self.get_written()))
+        self.assertTrue(self.next(request_id=2))
+        expected = {
+            'RequestId': 2,
+            'Response': {'Deltas': [['unit', 'change', {'Id': 1}]]},
+        }
+        self.assertEqual(expected, self.get_written()[-1])
+        # No further requests are sent by the GUI server.
+        self.assertEqual(1, len(self.get_sent()))
+
+    def test_still_congested(self):
+        # The browser connection is checked again until it drains.
+        self.next()
+        self.congest()
+        self.respond(1, [])
+        self.coalescer._poll()
+        self.assertFalse(self.handler.write_message.called)
+        self.assertEqual(2, self.io_loop.add_timeout.call_count)
+
+    def test_error(self):
+        # Errors in GUI server requests are propagated to the browser.
+        self.next()
+        self.congest()
+        self.respond(1, [])
+        self.drain()
+        self.coalescer._poll()
+        self.next(request_id=2)
+        self.assertTrue(self.coalescer.handle_response(json.dumps({
+            'RequestId': coalesce.REQUEST_ID_BASE, 'Error': 'stopped',
+            'Response': {}})))
+        self.assertEqual(
+            {'RequestId': 2, 'Error': 'stopped', 'Response': {}},
+            self.get_written()[-1])
+        # The watcher is no longer tracked.
+        self.assertFalse(self.next(request_id=3))
+
+    def test_close(self):
+        # Closing the coalescer removes the scheduled check.
+        self.next()
+        self.congest()
+        self.respond(1, [])
+        self.coalescer.close()
+        self.io_loop.remove_timeout.assert_called_once_with(
+            self.io_loop.add_timeout())
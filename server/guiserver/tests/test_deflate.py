@@ -0,0 +1,289 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the Juju GUI server WebSocket compression support."""
+
+import unittest
+
+from tornado import web
+from tornado.testing import (
+    AsyncHTTPSTestCase,
+    gen_test,
+    LogTrapTestCase,
+)
+
+from guiserver import (
+    clients,
+    deflate,
+    handlers,
+)
+from guiserver.tests import helpers
+
+
+class TestParseExtensions(unittest.TestCase):
+
+    def test_empty(self):
+        # An empty list is returned if the header is empty or missing.
+        self.assertEqual([], deflate.parse_extensions(''))
+        self.assertEqual([], deflate.parse_extensions(None))
+
+    def test_extensions(self):
+        # Extensions and their parameters are correctly parsed.
+        header = (
+            'permessage-deflate; client_max_window_bits; '
+            'server_max_window_bits="10", x-webkit-deflate-frame')
+        expected = [
+            ('permessage-deflate', {
+                'client_max_window_bits': None,
+                'server_max_window_bits': '10',
+            }),
+            ('x-webkit-deflate-frame', {}),
+        ]
+        self.assertEqual(expected, deflate.parse_extensions(header))
+
+
+class TestNegotiateServer(unittest.TestCase):
+
+    options = deflate.CompressionOptions()
+
+    def test_accepted(self):
+        # A simple offer is accepted.
+        params, response = deflate.negotiate_server(
+            'permessage-deflate; client_max_window_bits', self.options)
+        self.assertEqual('permessage-deflate', response)
+        self.assertEqual({
+            'level': self.options.level,
+            'window_bits': 15,
+            'context_takeover': True,
+        }, params)
+
+    def test_not_offered(self):
+        # The extension is not used if not offered by the client.
+        self.assertEqual(
+            (None, None), deflate.negotiate_server('', self.options))
+        self.assertEqual(
+            (None, None),
+            deflate.negotiate_server('x-webkit-deflate-frame', self.options))
+
+    def test_server_max_window_bits(self):
+        # The client can restrict the server window size.
+        params, response = deflate.negotiate_server(
+            'permessage-deflate; server_max_window_bits=10', self.options)
+        self.assertEqual(
+            'permessage-deflate; server_max_window_bits=10', response)
+        self.assertEqual(10, params['window_bits'])
+
+    def test_server_no_context_takeover(self):
+        # The client can ask the server not to reuse the compression context.
+        params, response = deflate.negotiate_server(
+            'permessage-deflate; server_no_context_takeover', self.options)
+        self.assertEqual(
+            'permessage-deflate; server_no_context_takeover', response)
+        self.assertFalse(params['context_takeover'])
+
+    def test_configured_no_context_takeover(self):
+        # The server notifies the client if the context is not reused.
+        options = deflate.CompressionOptions(context_takeover=False)
+        params, response = deflate.negotiate_server(
+            'permessage-deflate', options)
+        self.assertEqual(
+            'permessage-deflate; server_no_context_takeover', response)
+        self.assertFalse(params['context_takeover'])
+
+    def test_invalid_offer(self):
+        # Invalid offers are skipped.
+        header = (
+            'permessage-deflate; server_max_window_bits=42, '
+            'permessage-deflate; unknown, '
+            'permessage-deflate; server_max_window_bits=11')
+        params, response = deflate.negotiate_server(header, self.options)
+        self.assertEqual(
+            'permessage-deflate; server_max_window_bits=11', response)
+        self.assertEqual(11, params['window_bits'])
+
+
+    def test_missing_server_max_window_bits(self):
+        # Offers including a server window size without a value are skipped.
+        self.assertEqual((None, None), deflate.negotiate_server(
+            'permessage-deflate; server_max_window_bits', self.options))
+        params, response = deflate.negotiate_server(
+            'permessage-deflate; server_max_window_bits, permessage-deflate',
+            self.options)
+        self.assertEqual('permessage-deflate', response)
+        self.assertEqual(15, params['window_bits'])
+
+class TestNegotiateClient(unittest.TestCase):
+
+    options = deflate.CompressionOptions(level=9, window_bits=14)
+
+    def test_accepted(self):
+        # The compression parameters are returned if the server accepted the
+        # extension.
+        params = deflate.negotiate_client('permessage-deflate', self.options)
+        expected = {'level': 9, 'window_bits': 14, 'context_takeover': True}
+        self.assertEqual(expected, params)
+
+    def test_not_accepted(self):
+        # None is returned if the server did not accept the extension.
+        self.assertIsNone(deflate.negotiate_client(None, self.options))
+
+    def test_client_parameters(self):
+        # The server can restrict the client window and context takeover.
+        params = deflate.negotiate_client(
+            'permessage-deflate; client_max_window_bits=10; '
+            'client_no_context_takeover', self.options)
+        self.assertEqual(10, params['window_bits'])
+        self.assertFalse(params['context_takeover'])
+
+    def test_invalid_window_bits(self):
+        # None is returned if the server responded with invalid parameters.
+        params = deflate.negotiate_client(
+            'permessage-deflate; client_max_window_bits=bad', self.options)
+        self.assertIsNone(params)
+
+
+class TestCompression(unittest.TestCase):
+
+    data = b'{"RequestId": 42, "Response": {}}' * 10
+
+    def setUp(self):
+        deflate.stats.reset()
+        self.addCleanup(deflate.stats.reset)
+
+    def test_round_trip(self):
+        # Compressed messages are correctly decompressed.
+        compressor = deflate._Compressor(6, 15, True)
+        decompressor = deflate._Decompressor()
+        for _ in range(3):
+            compressed = compressor.compress(self.data)
+            self.assertLess(len(compressed), len(self.data))
+            self.assertEqual(self.data, decompressor.decompress(compressed))
+
+    def test_context_takeover(self):
+        # Reusing the compression context improves the compression ratio for
+        # similar messages.
+        compressor = deflate._Compressor(6, 15, True)
+        first = compressor.compress(self.data)
+        second = compressor.compress(self.data)
+        self.assertLess(len(second), len(first))
+
+    def test_no_context_takeover(self):
+        # Without context takeover each message is compressed independently.
+        compressor = deflate._Compressor(6, 15, False)
+        first = compressor.compress(self.data)
+        second = compressor.compress(self.data)
+        self.assertEqual(first, second)
+        self.assertEqual(self.data, deflate._Decompressor().decompress(second))
+
+    def test_invalid_data(self):
+        # A ValueError is raised if the compressed data is not valid.
+        with self.assertRaises(ValueError):
+            deflate._Decompressor().decompress(b'\xff\xff\xff\xff')
+
+    def test_stats(self):
+        # Compression counters are updated.
+        compressed = deflate._Compressor(6, 15, True).compress(self.data)
+        deflate._Decompressor().decompress(compressed)
+        info = deflate.stats.as_dict()
+        self.assertEqual(len(self.data), info['sent_raw_bytes'])
+        self.assertEqual(len(compressed), info['sent_compressed_bytes'])
+        self.assertEqual(len(self.data), info['received_raw_bytes'])
+        self.assertEqual(len(compressed), info['received_compressed_bytes'])
+        self.assertGreater(info['sent_ratio'], 1)
+        self.assertEqual(info['sent_ratio'], info['received_ratio'])
+
+    def test_empty_stats(self):
+        # Ratios are None if nothing has been compressed yet.
+        info = deflate.stats.as_dict()
+        self.assertIsNone(info['sent_ratio'])
+        self.assertIsNone(info['received_ratio'])
+
+
+class CompressedEchoHandler(handlers._WebSocketBaseHandler):
+    """A WebSocket server echoing back messages, supporting compression."""
+
+    def initialize(self, compression):
+        self.compression = compression
+
+    def on_message(self, message):
+        self.write_message(message)
+
+
+class TestDeflateWebSocketProtocol(
+        helpers.WSSTestMixin, LogTrapTestCase, AsyncHTTPSTestCase):
+
+    message = u'{"Response": {"Deltas": ["\u2603"]}}' * 20
+
+    def get_app(self):
+        options = {'compression': deflate.CompressionOptions()}
+        return web.Application([(r'/', CompressedEchoHandler, options)])
+
+    def setUp(self):
+        super(TestDeflateWebSocketProtocol, self).setUp()
+        deflate.stats.reset()
+        self.addCleanup(deflate.stats.reset)
+
+    def connect(self, compression=None):
+        """Return a future whose result is a connected client."""
+        return clients.websocket_connect(
+            self.io_loop, self.get_wss_url('/'), lambda message: None,
+            compression=compression)
+
+    @gen_test
+    def test_compressed(self):
+        # Messages are compressed in both directions if the extension is
+        # negotiated.
+        client = yield self.connect(compression=deflate.CompressionOptions())
+        self.assertIsInstance(
+            client.protocol, deflate.DeflateWebSocketProtocol)
+        client.write_message(self.message)
+        message = yield client.read_message()
+        self.assertEqual(self.message, message)
+        info = deflate.stats.as_dict()
+        # The message has been compressed by both the client and the server.
+        size = len(self.message.encode('utf-8'))
+        self.assertEqual(size * 2, info['sent_raw_bytes'])
+        self.assertEqual(size * 2, info['received_raw_bytes'])
+        self.assertGreater(info['sent_ratio'], 1)
+
+    @gen_test
+    def test_write_messages(self):
+        # Multiple messages can be compressed and sent at once.
+        client = yield self.connect(compression=deflate.CompressionOptions())
+        client.write_messages([self.message, 'hello'])
+        self.assertEqual(self.message, (yield client.read_message()))
+        self.assertEqual('hello', (yield client.read_message()))
+        size = len(self.message.encode('utf-8'))
+        self.assertEqual(size * 2, deflate.stats.as_dict()['sent_raw_bytes'])
+
+    @gen_test
+    def test_small_messages(self):
+        # Small messages are not compressed.
+        client = yield self.connect(compression=deflate.CompressionOptions())
+        client.write_message('hello')
+        message = yield client.read_message()
+        self.assertEqual('hello', message)
+        self.assertEqual(0, deflate.stats.as_dict()['sent_raw_bytes'])
+
+    @gen_test
+    def test_not_offered(self):
+        # Compression is not used if the client does not offer it.
+        client = yield self.connect()
+        self.assertIs(type(client.protocol), deflate.BatchWebSocketProtocol)
+        client.write_message(self.message)
+        message = yield client.read_message()
+        self.assertEqual(self.message, message)
+        self.assertEqual(0, deflate.stats.as_dict()['sent_raw_bytes'])
@@ -0,0 +1,83 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the Juju GUI server key expiry."""
+
+import unittest
+
+from guiserver.expiry import TimingWheel
+
+
+class TestTimingWheel(unittest.TestCase):
+
+    def setUp(self):
+        self.wheel = TimingWheel(resolution=10)
+
+    def test_add(self):
+        # Keys are added to the wheel.
+        self.wheel.add('key1', 105)
+        self.wheel.add('key2', 107)
+        self.assertEqual(2, len(self.wheel))
+        self.assertIn('key1', self.wheel)
+        # Keys expiring in the same slot share the bucket.
+        self.assertEqual({11: {'key1', 'key2'}}, self.wheel._buckets)
+
+    def test_update(self):
+        # Adding a key again updates its expiration time.
+        self.wheel.add('key', 105)
+        self.wheel.add('key', 205)
+        self.assertEqual(1, len(self.wheel))
+        self.assertEqual({21: {'key'}}, self.wheel._buckets)
+
+    def test_discard(self):
+        # Keys can be removed, and empty buckets are removed as well.
+        self.wheel.add('key1', 105)
+        self.wheel.add('key2', 205)
+        self.wheel.discard('key1')
+        self.wheel.discard('no-such')
+        self.assertEqual(1, len(self.wheel))
+        self.assertNotIn('key1', self.wheel)
+        self.assertEqual({21: {'key2'}}, self.wheel._buckets)
+
+    def test_expire(self):
+        # Keys are expired by the first sweep after their expiration time.
+        self.wheel.add('key1', 105)
+        self.wheel.add('key2', 110)
+        self.wheel.add('key3', 125)
+        self.assertEqual([], self.wheel.expire(105))
+        self.assertEqual(['key1', 'key2'], sorted(self.wheel.expire(112)))
+        self.assertEqual([], self.wheel.expire(125))
+        self.assertEqual(['key3'], self.wheel.expire(130))
+        self.assertEqual(0, len(self.wheel))
+        self.assertEqual({}, self.wheel._buckets)
+
+    def test_expire_after_long_pause(self):
+        # All the elapsed buckets are swept even after a long pause.
+        self.wheel.add('key1', 105)
+        self.wheel.expire(100)
+        self.wheel.add('key2', 1005)
+        self.wheel.add('key3', 100005)
+        self.assertEqual(['key1', 'key2'], sorted(self.wheel.expire(50000)))
+        self.assertEqual(['key3'], self.wheel.expire(100010))
+
+    def test_already_expired(self):
+        # Keys added with an elapsed expiration time are expired in the slot
+        # following the last sweep.
+        self.wheel.expire(200)
+        self.wheel.add('key', 105)
+        self.assertEqual([], self.wheel.expire(205))
+        self.assertEqual(['key'], self.wheel.expire(210))
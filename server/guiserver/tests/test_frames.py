@@ -0,0 +1,169 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the Juju GUI server WebSocket frames logging."""
+
+import logging
+import unittest
+
+import mock
+from tornado.testing import (
+    ExpectLog,
+    LogTrapTestCase,
+)
+
+from guiserver import frames
+
+
+class TestFrameLogOptions(unittest.TestCase):
+
+    def test_defaults(self):
+        # Default options are provided.
+        options = frames.FrameLogOptions()
+        self.assertEqual(frames.DEFAULT_SAMPLE, options.sample)
+        self.assertEqual(frames.DEFAULT_MAX_PAYLOAD, options.max_payload)
+        self.assertEqual(frames.DEFAULT_RING_SIZE, options.ring_size)
+
+    def test_invalid_sample(self):
+        # At least one frame every sample frames must be logged.
+        with self.assertRaises(ValueError):
+            frames.FrameLogOptions(sample=0)
+
+
+class TestPayload(unittest.TestCase):
+
+    def test_short(self):
+        # Short messages are logged as they are.
+        self.assertEqual('hello', str(frames.Payload(u'hello', 10)))
+
+    def test_truncated(self):
+        # Long messages are truncated.
+        payload = frames.Payload(u'hello world', 5)
+        self.assertEqual('hello... (11 characters)', str(payload))
+
+    def test_non_ascii(self):
+        # Unicode messages are encoded.
+        self.assertEqual('\xc3\xa8', str(frames.Payload(u'\xe8', 10)))
+
+
+class TestFrameLog(LogTrapTestCase, unittest.TestCase):
+
+    def setUp(self):
+        logger = logging.getLogger()
+        level = logger.level
+        logger.setLevel(logging.DEBUG)
+        self.addCleanup(logger.setLevel, level)
+
+    def test_record(self):
+        # Frames are logged when debug is enabled.
+        frame_log = frames.FrameLog('summary ')
+        with ExpectLog('', 'summary client -> juju: hello', required=True):
+            frame_log.record('client -> juju', u'hello')
+
+    def test_not_formatted(self):
+        # Frames are not formatted if debug is disabled.
+        logging.getLogger().setLevel(logging.INFO)
+        frame_log = frames.FrameLog('summary ')
+        with mock.patch('guiserver.frames.Payload') as mock_payload:
+            frame_log.record('client -> juju', u'hello')
+        self.assertFalse(mock_payload.called)
+
+    def test_sample(self):
+        # Only one frame every sample frames is logged.
+        options = frames.FrameLogOptions(sample=3)
+        frame_log = frames.FrameLog('summary ', options)
+        with mock.patch('logging.debug') as mock_debug:
+            for num in range(7):
+                frame_log.record('juju -> client', u'frame {}'.format(num))
+        self.assertEqual(2, mock_debug.call_count)
+        payload = mock_debug.call_args[0][-1]
+        self.assertEqual('frame 5', str(payload))
+
+    def test_ring_buffer(self):
+        # The most recent frames are kept and can be dumped.
+        options = frames.FrameLogOptions(max_payload=5, ring_size=2)
+        frame_log = frames.FrameLog('summary ', options)
+        for num in range(3):
+            frame_log.record('juju -> client', u'frame {}'.format(num))
+        with mock.patch('logging.info') as mock_info:
+            frame_log.dump()
+        self.assertEqual(3, mock_info.call_count)
+        messages = [
+            args[0] % args[1:] for args, _ in mock_info.call_args_list[1:]]
+        self.assertTrue(messages[0].endswith(
+            'juju -> client: frame... (7 characters)'))
+        self.assertTrue(messages[1].endswith(
+            'juju -> client: frame... (7 characters)'))
+
+    def test_ring_buffer_disabled(self):
+        # Frames are not kept if the ring size is zero.
+        options = frames.FrameLogOptions(ring_size=0)
+        frame_log = frames.FrameLog('summary ', options)
+        frame_log.record('juju -> client', u'hello')
+        with mock.patch('logging.info') as mock_info:
+            frame_log.dump()
+        self.assertFalse(mock_info.called)
+
+    def test_credentials_redacted(self):
+        # Login requests and responses are neither logged nor kept.
+        frame_log = frames.FrameLog('summary ')
+        request = (
+            u'{"Type": "Admin", "Request": "Login", "RequestId": 1, '
+            u'"Params": {"AuthTag": "user-admin", "Password": "secret"}}')
+        response = (
+            u'{"RequestId": 1, "Response": '
+            u'{"AuthTag": "user-admin", "Password": "secret"}}')
+        with mock.patch('logging.debug') as mock_debug:
+            frame_log.record('client -> juju', request)
+            frame_log.record('juju -> client', response)
+        with mock.patch('logging.info') as mock_info:
+            frame_log.dump()
+        messages = [
+            args[0] % args[1:] for args, _ in
+            mock_debug.call_args_list + mock_info.call_args_list]
+        self.assertEqual(5, len(messages))
+        for message in messages:
+            self.assertNotIn('secret', message)
+            self.assertNotIn('user-admin', message)
+        self.assertTrue(messages[-2].endswith(
+            'client -> juju: <redacted {"Request": "Login", "RequestId": 1, '
+            '"Type": "Admin"} (112 characters)>'))
+        self.assertTrue(messages[-1].endswith(
+            'juju -> client: <redacted {"RequestId": 1} (77 characters)>'))
+        self.assertEqual(set(), frame_log._redacted_ids)
+
+    def test_token_redacted(self):
+        # Token requests are redacted.
+        frame_log = frames.FrameLog('summary ')
+        request = (
+            u'{"Type": "GUIToken", "Request": "Login", "RequestId": 2, '
+            u'"Params": {"Token": "DEFACED"}}')
+        frame_log.record('client -> queue', request)
+        with mock.patch('logging.info') as mock_info:
+            frame_log.dump()
+        message = mock_info.call_args[0][0] % mock_info.call_args[0][1:]
+        self.assertNotIn('DEFACED', message)
+        self.assertIn('"Type": "GUIToken"', message)
+
+    def test_dump_all(self):
+        # The frames of all the live connections are dumped.
+        frame_logs = [frames.FrameLog('log1 '), frames.FrameLog('log2 ')]
+        for frame_log in frame_logs:
+            frame_log.record('juju -> client', u'hello')
+        with ExpectLog('', 'log1 last 1 frames', required=True):
+            with ExpectLog('', 'log2 last 1 frames', required=True):
+                frames.dump_all()
@@ -28,6 +28,7 @@ from tornado import (
     escape,
     gen,
     httpclient,
+    httputil,
     web,
 )
 from tornado.testing import (
@@ -42,10 +43,25 @@ import yaml
 from guiserver import (
     apps,
     auth,
+    backpressure,
+    cache,
     clients,
+    coalesce,
+    deflate,
     get_version,
     handlers,
+    latency,
+    logs,
     manage,
+    metrics,
+    multiplex,
+    pool,
+    profiler,
+    queues,
+    reconnect,
+    resume,
+    watchdog,
+    wsgi,
 )
 from guiserver.bundles import base
 from guiserver.tests import helpers
@@ -80,6 +96,8 @@ class WebSocketHandlerTestMixin(object):
             'auth_backend': self.auth_backend,
             'deployer': self.deployer,
             'io_loop': self.io_loop,
+            'multiplexer': self.make_multiplexer(),
+            'pool': self.make_pool(),
             'tokens': self.tokens,
             'ws_source_template': apps.WEBSOCKET_MODEL_SOURCE_TEMPLATE,
             'ws_target_template': apps.WEBSOCKET_MODEL_TARGET_TEMPLATE,
@@ -89,6 +107,14 @@ class WebSocketHandlerTestMixin(object):
             (r'/ws', handlers.WebSocketHandler, ws_options),
         ])
 
+    def make_multiplexer(self):
+        """Return the multiplexer used by the WebSocket handler, if any."""
+        return None
+
+    def make_pool(self):
+        """Return the connection pool used by the WebSocket handler, if any."""
+        return None
+
     def make_client(self):
         """Return a WebSocket client ready to be connected to the server."""
         url = self.get_wss_url('/ws')
@@ -188,6 +214,47 @@ class TestWebSocketHandlerConnection(
         call_args = mock_websocket_connect.call_args[0]
         self.assertEqual(call_args[1], self.apiurl)
 
+    @gen_test
+    def test_backpressure(self):
+        # Backpressure is applied to the Juju API connection if watermarks
+        # are provided.
+        handler = self.make_handler()
+        watermarks = backpressure.Watermarks(1000, 100)
+        yield handler.initialize(
+            self.apiurl,
+            self.auth_backend,
+            self.deployer,
+            self.tokens,
+            apps.WEBSOCKET_MODEL_SOURCE_TEMPLATE,
+            apps.WEBSOCKET_MODEL_TARGET_TEMPLATE,
+            io_loop=self.io_loop,
+            watermarks=watermarks)
+        self.assertIsInstance(
+            handler._backpressure, backpressure.Backpressure)
+
+    @gen_test
+    def test_coalesce(self):
+        # AllWatcher deltas are coalesced if required by the policy.
+        handler = self.make_handler()
+        watermarks = backpressure.Watermarks(1000, 100, backpressure.COALESCE)
+        yield handler.initialize(
+            self.apiurl,
+            self.auth_backend,
+            self.deployer,
+            self.tokens,
+            apps.WEBSOCKET_MODEL_SOURCE_TEMPLATE,
+            apps.WEBSOCKET_MODEL_TARGET_TEMPLATE,
+            io_loop=self.io_loop,
+            watermarks=watermarks)
+        self.assertIsNone(handler._backpressure)
+        self.assertIsInstance(handler._coalescer, coalesce.DeltaCoalescer)
+
+    @gen_test
+    def test_no_backpressure(self):
+        # Backpressure is not applied by default.
+        handler = yield self.make_initialized_handler()
+        self.assertIsNone(handler._backpressure)
+
     @gen_test
     def test_juju_connection_failure(self):
         # If the connection to the Juju API server does not succeed, an
@@ -272,13 +339,27 @@ class TestWebSocketHandlerProxy(
             handler.on_juju_message(self.hello_message)
             handler.write_message.assert_called_once_with(self.hello_message)
 
+    @gen_test
+    def test_from_juju_to_browser_passthrough(self):
+        # Juju messages are not decoded if authentication is not in progress.
+        handler = yield self.make_initialized_handler()
+        mock_decode_path = 'guiserver.handlers.json_decode_dict'
+        with mock.patch('guiserver.handlers.WebSocketHandler.write_message'):
+            with mock.patch(mock_decode_path) as mock_json_decode_dict:
+                handler.on_juju_message(self.hello_message)
+            self.assertFalse(mock_json_decode_dict.called)
+            handler.write_message.assert_called_once_with(self.hello_message)
+            message = handler.write_message.call_args[0][0]
+        # The very same message object is propagated to the browser.
+        self.assertIs(self.hello_message, message)
+
     @gen_test
     def test_queued_messages(self):
         # Messages sent before the client connection is established are
         # preserved and sent right after the connection is opened.
         handler = self.make_handler()
-        mock_path = 'guiserver.clients.WebSocketClientConnection.write_message'
-        with mock.patch(mock_path) as mock_write_message:
+        mock_path = 'guiserver.clients.WebSocketClientConnection'
+        with mock.patch(mock_path + '.write_messages') as mock_write_messages:
             initialization = handler.initialize(
                 self.apiurl,
                 self.auth_backend,
@@ -288,9 +369,41 @@ class TestWebSocketHandlerProxy(
                 apps.WEBSOCKET_MODEL_TARGET_TEMPLATE,
                 io_loop=self.io_loop)
             handler.on_message(self.hello_message)
-            self.assertFalse(mock_write_message.called)
+            handler.on_message(self.hello_message)
+            self.assertFalse(mock_write_messages.called)
             yield initialization
-        mock_write_message.assert_called_once_with(self.hello_message)
+        # Queued messages are sent all at once.
+        mock_write_messages.assert_called_once_with(
+            [self.hello_message, self.hello_message])
+        self.assertEqual(0, len(handler._juju_message_queue))
+
+    @gen_test
+    def test_queue_full(self):
+        # An error is returned to the browser if the queue is full.
+        handler = self.make_handler(mock_protocol=True)
+        initialization = handler.initialize(
+            self.apiurl,
+            self.auth_backend,
+            self.deployer,
+            self.tokens,
+            apps.WEBSOCKET_MODEL_SOURCE_TEMPLATE,
+            apps.WEBSOCKET_MODEL_TARGET_TEMPLATE,
+            io_loop=self.io_loop,
+            max_queued_messages=1)
+        handler.on_message('{"RequestId": 1}')
+        self.assertFalse(handler.ws_connection.write_message.called)
+        with ExpectLog('', '.*message queue full', required=True):
+            handler.on_message('{"RequestId": 2}')
+        message = handler.ws_connection.write_message.call_args[0][0]
+        expected = {
+            'RequestId': 2,
+            'Error': 'too many messages sent while connecting to the Juju API',
+            'ErrorCode': 'queue full',
+            'Response': {},
+        }
+        self.assertEqual(expected, json.loads(message))
+        self.assertEqual(1, len(handler._juju_message_queue))
+        yield initialization
 
     @gen_test
     def test_end_to_end_proxy(self):
@@ -301,6 +414,21 @@ class TestWebSocketHandlerProxy(
         message = yield client.read_message()
         self.assertEqual(self.hello_message, message)
 
+    @gen_test
+    def test_traffic_metrics(self):
+        # Connections and proxied messages are counted.
+        metrics.stats.reset()
+        self.addCleanup(metrics.stats.reset)
+        client = yield self.make_client()
+        client.write_message(self.hello_message)
+        yield client.read_message()
+        stats = metrics.stats
+        self.assertEqual(1, stats.browser_connections)
+        self.assertEqual(1, stats.browser_frames)
+        self.assertEqual(len(self.hello_message), stats.browser_bytes)
+        self.assertEqual(1, stats.juju_frames)
+        self.assertEqual(len(self.hello_message), stats.juju_bytes)
+
     @gen_test
     def test_end_to_end_proxy_non_ascii(self):
         # Non-ascii messages are correctly forwarded from the client to the
@@ -311,25 +439,494 @@ class TestWebSocketHandlerProxy(
         message = yield client.read_message()
         self.assertEqual(snowman, message)
 
+    @gen_test
+    def test_not_decoded(self):
+        # Messages not handled by the GUI server are propagated to the Juju
+        # API without being decoded.
+        handler = yield self.make_initialized_handler()
+        mock_decode_path = 'guiserver.handlers.json_decode_dict'
+        with mock.patch(mock_decode_path) as mock_json_decode_dict:
+            handler.on_message(self.hello_message)
+        self.assertFalse(mock_json_decode_dict.called)
+
+    @gen_test
+    def test_invalid_json_propagated(self):
+        # Invalid JSON messages not handled by the GUI server are propagated
+        # to the Juju API, which is responsible for returning an error.
+        client = yield self.make_client()
+        client.write_message('not-json')
+        message = yield client.read_message()
+        self.assertEqual('not-json', message)
+
     @gen_test
     def test_invalid_json(self):
         # A warning is logged if the message is not valid JSON.
         client = yield self.make_client()
-        expected_log = "JSON decoder: message is not valid JSON: u'not-json'"
+        message = '{"Type": "Admin", not-json'
+        expected_log = 'JSON decoder: message is not valid JSON: .*not-json'
         with ExpectLog('', expected_log, required=True):
-            client.write_message('not-json')
+            client.write_message(message)
             yield client.read_message()
 
     @gen_test
     def test_not_a_dict(self):
         # A warning is logged if the decoded message is not a dict.
         client = yield self.make_client()
-        expected_log = 'JSON decoder: message is not a dict: u\'"not-a-dict"\''
+        expected_log = 'JSON decoder: message is not a dict: .*GUIToken'
         with ExpectLog('', expected_log, required=True):
-            client.write_message('"not-a-dict"')
+            client.write_message('[{"Type": "GUIToken"}]')
             yield client.read_message()
 
 
+class TestWebSocketHandlerMultiplexer(
+        WebSocketHandlerTestMixin, helpers.WSSTestMixin,
+        helpers.GoAPITestMixin, LogTrapTestCase, AsyncHTTPSTestCase):
+
+    def make_multiplexer(self):
+        self.multiplexer = multiplex.Multiplexer(io_loop=self.io_loop)
+        return self.multiplexer
+
+    @gen.coroutine
+    def login(self, request_id=42, password='passwd'):
+        """Connect a new client and log in.
+
+        Return the client and the login response.
+        """
+        client = yield self.make_client()
+        client.write_message(self.make_login_request(
+            request_id=request_id, password=password, encoded=True))
+        response = yield client.read_message()
+        raise gen.Return((client, json.loads(response)))
+
+    @gen_test
+    def test_connection_deferred(self):
+        # The Juju API connection is established when the first message is
+        # received from the browser.
+        handler = self.make_handler(mock_protocol=True)
+        yield handler.initialize(
+            self.apiurl,
+            self.auth_backend,
+            self.deployer,
+            self.tokens,
+            apps.WEBSOCKET_MODEL_SOURCE_TEMPLATE,
+            apps.WEBSOCKET_MODEL_TARGET_TEMPLATE,
+            io_loop=self.io_loop,
+            multiplexer=self.multiplexer)
+        self.assertFalse(handler.juju_connected)
+        self.assertIsNone(handler._juju_connected_future)
+        handler.on_message(self.hello_message)
+        self.assertIsNotNone(handler._juju_connected_future)
+        yield handler._juju_connected_future
+        self.assertIsInstance(
+            handler.juju_connection, clients.WebSocketClientConnection)
+
+    @gen_test
+    def test_shared_session(self):
+        # Browser connections logged in with the same credentials share the
+        # same Juju API connection.
+        client1, response1 = yield self.login(request_id=1)
+        client2, response2 = yield self.login(request_id=2)
+        self.assertEqual(1, response1['RequestId'])
+        self.assertEqual(2, response2['RequestId'])
+        self.assertEqual(1, len(self.multiplexer.sessions))
+        session = self.multiplexer.sessions.values()[0]
+        self.assertEqual(2, len(session._connections))
+        # Messages are still routed to the right browser connection.
+        client2.write_message('{"RequestId": 1, "Type": "Client"}')
+        message = yield client2.read_message()
+        self.assertEqual('{"RequestId": 1, "Type": "Client"}', message)
+
+    @gen_test
+    def test_different_credentials(self):
+        # The Juju API connection is not shared if the credentials differ.
+        yield self.login()
+        client, _ = yield self.login(password='another-passwd')
+        session = self.multiplexer.sessions.values()[0]
+        self.assertEqual(1, len(session._connections))
+
+
+class TestWebSocketHandlerPool(
+        WebSocketHandlerTestMixin, helpers.WSSTestMixin, LogTrapTestCase,
+        AsyncHTTPSTestCase):
+
+    def setUp(self):
+        super(TestWebSocketHandlerPool, self).setUp()
+        pool.stats.reset()
+        self.addCleanup(pool.stats.reset)
+
+    def make_pool(self):
+        self.pool = pool.ConnectionPool(2, io_loop=self.io_loop)
+        return self.pool
+
+    @gen_test
+    def test_pooled_connection(self):
+        # Connections to the Juju API are taken from the pool when available.
+        client = yield self.make_client()
+        client.write_message(self.hello_message)
+        message = yield client.read_message()
+        self.assertEqual(self.hello_message, message)
+        self.assertEqual(1, pool.stats.misses)
+        # Wait for the pool to be filled.
+        while not self.pool._idle.values()[0]:
+            yield gen.Task(self.io_loop.add_callback)
+        client = yield self.make_client()
+        client.write_message(self.hello_message)
+        message = yield client.read_message()
+        self.assertEqual(self.hello_message, message)
+        self.assertEqual(1, pool.stats.hits)
+
+
+class TestWebSocketHandlerReconnect(
+        WebSocketHandlerTestMixin, helpers.WSSTestMixin,
+        helpers.GoAPITestMixin, LogTrapTestCase, AsyncHTTPSTestCase):
+
+    def setUp(self):
+        super(TestWebSocketHandlerReconnect, self).setUp()
+        reconnect.stats.reset()
+        self.addCleanup(reconnect.stats.reset)
+        self.connections = []
+
+    def websocket_connect(self, *args, **kwargs):
+        """Return a Future whose result is a mock Juju API connection."""
+        future = concurrent.Future()
+        connection = mock.Mock()
+        self.connections.append(connection)
+        future.set_result(connection)
+        return future
+
+    def make_logged_in_handler(self, attempts=1):
+        """Create and return a handler connected and logged in to Juju."""
+        handler = self.make_handler(mock_protocol=True)
+        policy = reconnect.ReconnectPolicy(
+            attempts, addresses=['1.2.3.4:17070'], delay=0)
+        handler.initialize(
+            self.apiurl,
+            self.auth_backend,
+            self.deployer,
+            self.tokens,
+            apps.WEBSOCKET_MODEL_SOURCE_TEMPLATE,
+            apps.WEBSOCKET_MODEL_TARGET_TEMPLATE,
+            io_loop=self.io_loop,
+            reconnect_policy=policy)
+        handler.on_message(self.make_login_request(encoded=True))
+        handler.on_juju_message(self.make_login_response(encoded=True))
+        handler.ws_connection.reset_mock()
+        return handler
+
+    def get_browser_messages(self, handler):
+        """Return the decoded messages sent to the browser."""
+        calls = handler.ws_connection.write_message.call_args_list
+        return [json.loads(args[0]) for args, _ in calls]
+
+    def test_reconnect(self):
+        # The Juju API is reconnected and the login request is replayed.
+        with mock.patch(
+                'guiserver.handlers.websocket_connect',
+                self.websocket_connect):
+            handler = self.make_logged_in_handler()
+            with ExpectLog('', '.*Juju API disconnected', required=True):
+                handler.on_juju_message(None)
+        self.assertEqual(2, len(self.connections))
+        self.assertTrue(handler.connected)
+        self.assertFalse(handler.juju_connected)
+        self.assertIs(self.connections[1], handler.juju_connection)
+        login = json.loads(
+            self.connections[1].write_message.call_args[0][0])
+        expected = self.make_login_request(
+            request_id=reconnect.LOGIN_REQUEST_ID)
+        self.assertEqual(expected, login)
+        # Messages are queued until the login succeeds.
+        handler.on_message(self.hello_message)
+        handler.on_juju_message(self.make_login_response(
+            request_id=reconnect.LOGIN_REQUEST_ID, encoded=True))
+        self.assertTrue(handler.juju_connected)
+        self.connections[1].write_messages.assert_called_once_with(
+            [self.hello_message])
+        # The login response is not sent to the browser.
+        self.assertFalse(handler.ws_connection.write_message.called)
+        self.assertEqual(1, reconnect.stats.reconnections)
+
+    def test_pending_requests(self):
+        # Pending read requests are re-issued, and other ones are failed.
+        read = json.dumps(
+            {'RequestId': 1, 'Type': 'Client', 'Request': 'FullStatus'})
+        write = json.dumps(
+            {'RequestId': 2, 'Type': 'Client', 'Request': 'AddMachines'})
+        answered = json.dumps(
+            {'RequestId': 3, 'Type': 'Client', 'Request': 'AddMachines'})
+        with mock.patch(
+                'guiserver.handlers.websocket_connect',
+                self.websocket_connect):
+            handler = self.make_logged_in_handler()
+            for message in (read, write, answered):
+                handler.on_message(message)
+            handler.on_juju_message('{"RequestId": 3, "Response": {}}')
+            handler.ws_connection.reset_mock()
+            handler.on_juju_message(None)
+        expected = [{
+            'RequestId': 2,
+            'Error': 'connection to the Juju API lost',
+            'ErrorCode': 'connection lost',
+            'Response': {},
+        }]
+        self.assertEqual(expected, self.get_browser_messages(handler))
+        handler.on_juju_message(self.make_login_response(
+            request_id=reconnect.LOGIN_REQUEST_ID, encoded=True))
+        self.connections[1].write_messages.assert_called_once_with([read])
+        self.assertEqual(1, reconnect.stats.reissued)
+        self.assertEqual(1, reconnect.stats.failed)
+
+    def test_login_failure(self):
+        # The browser is disconnected if the replayed login fails.
+        with mock.patch(
+                'guiserver.handlers.websocket_connect',
+                self.websocket_connect):
+            handler = self.make_logged_in_handler()
+            handler.on_juju_message(None)
+        protocol = handler.ws_connection
+        expected_log = '.*login failed after reconnecting to Juju'
+        with ExpectLog('', expected_log, required=True):
+            handler.on_juju_message(self.make_login_response(
+                request_id=reconnect.LOGIN_REQUEST_ID, successful=False,
+                encoded=True))
+        protocol.close.assert_called_once_with()
+        self.assertFalse(handler.juju_connected)
+        self.assertEqual(1, reconnect.stats.failures)
+
+    @gen_test
+    def test_reconnection_failure(self):
+        # The browser is disconnected if the Juju API cannot be reached.
+        with mock.patch(
+                'guiserver.handlers.websocket_connect',
+                self.websocket_connect):
+            handler = self.make_logged_in_handler(attempts=2)
+        protocol = handler.ws_connection
+        future = concurrent.Future()
+        future.set_exception(ValueError('bad wolf'))
+        expected_log = '.*unable to reconnect to the Juju API'
+        with mock.patch(
+                'guiserver.handlers.websocket_connect',
+                mock.Mock(return_value=future)) as mock_websocket_connect:
+            with ExpectLog('', expected_log, required=True):
+                yield handler.on_juju_message(None)
+        # Both addresses have been tried twice.
+        self.assertEqual(4, mock_websocket_connect.call_count)
+        urls = [call[0][1] for call in mock_websocket_connect.call_args_list]
+        self.assertEqual('wss://1.2.3.4:17070/echo', urls[0])
+        self.assertEqual(self.apiurl, urls[1])
+        protocol.close.assert_called_once_with()
+        self.assertEqual(1, reconnect.stats.failures)
+
+    def test_not_authenticated(self):
+        # The browser is disconnected if the user is not logged in.
+        with mock.patch(
+                'guiserver.handlers.websocket_connect',
+                self.websocket_connect):
+            handler = self.make_logged_in_handler()
+        handler.user.is_authenticated = False
+        protocol = handler.ws_connection
+        expected_log = '.*Juju API unexpectedly disconnected'
+        with ExpectLog('', expected_log, required=True):
+            handler.on_juju_message(None)
+        protocol.close.assert_called_once_with()
+        self.assertEqual(1, len(self.connections))
+
+
+class TestWebSocketHandlerResume(
+        WebSocketHandlerTestMixin, helpers.WSSTestMixin,
+        helpers.GoAPITestMixin, LogTrapTestCase, AsyncHTTPSTestCase):
+
+    def setUp(self):
+        super(TestWebSocketHandlerResume, self).setUp()
+        resume.stats.reset()
+        self.addCleanup(resume.stats.reset)
+        self.juju_connection = mock.Mock()
+        future = concurrent.Future()
+        future.set_result(self.juju_connection)
+        patcher = mock.patch(
+            'guiserver.handlers.websocket_connect',
+            mock.Mock(return_value=future))
+        self.mock_websocket_connect = patcher.start()
+        self.addCleanup(patcher.stop)
+        # Share the tokens between the handlers created by the test.
+        self.resume_tokens = auth.AuthenticationTokenHandler(
+            io_loop=self.io_loop)
+
+    def make_resumable_handler(self):
+        """Create and return an initialized handler supporting resumption."""
+        handler = self.make_handler(mock_protocol=True)
+        handler.initialize(
+            self.apiurl,
+            self.auth_backend,
+            self.deployer,
+            self.resume_tokens,
+            apps.WEBSOCKET_MODEL_SOURCE_TEMPLATE,
+            apps.WEBSOCKET_MODEL_TARGET_TEMPLATE,
+            io_loop=self.io_loop,
+            resume_grace=30)
+        return handler
+
+    def get_response(self, handler):
+        """Return the last decoded message sent to the browser."""
+        return json.loads(handler.ws_connection.write_message.call_args[0][0])
+
+    def park(self):
+        """Log in, start a watcher and park the session.
+
+        Return the resume token.
+        """
+        handler = self.make_resumable_handler()
+        # The connection to Juju is established on the first message.
+        self.assertFalse(self.mock_websocket_connect.called)
+        handler.on_message(self.make_login_request(encoded=True))
+        handler.on_juju_message(self.make_login_response(encoded=True))
+        handler.on_message(json.dumps(
+            {'RequestId': 43, 'Type': 'GUIToken', 'Request': 'CreateResume'}))
+        token = self.get_response(handler)['Response']['Token']
+        handler.on_message(json.dumps(
+            {'RequestId': 44, 'Type': 'Client', 'Request': 'WatchAll'}))
+        handler.on_juju_message(json.dumps(
+            {'RequestId': 44, 'Response': {'AllWatcherId': '1'}}))
+        handler.on_message(json.dumps(
+            {'RequestId': 45, 'Type': 'AllWatcher', 'Request': 'Next',
+             'Id': '1'}))
+        handler.on_juju_message(json.dumps({'RequestId': 45, 'Response': {
+            'deltas': [['unit', 'change', {'id': 'a/0'}]]}}))
+        handler.on_close()
+        return token
+
+    def test_park(self):
+        # The Juju API connection is parked when the browser disconnects.
+        self.park()
+        self.assertFalse(self.juju_connection.close.called)
+        self.assertEqual(1, resume.stats.parked)
+        # The parked session keeps retrieving deltas.
+        request = json.loads(
+            self.juju_connection.write_message.call_args[0][0])
+        self.assertEqual('Next', request['Request'])
+        self.assertEqual(resume.REQUEST_ID_BASE, request['RequestId'])
+
+    def test_resume(self):
+        # A new browser connection can resume the parked session.
+        token = self.park()
+        handler = self.make_resumable_handler()
+        handler.on_message(json.dumps({
+            'RequestId': 1, 'Type': 'GUIToken', 'Request': 'Resume',
+            'Params': {'Token': token}}))
+        self.assertEqual(1, self.mock_websocket_connect.call_count)
+        self.assertIs(self.juju_connection, handler.juju_connection)
+        self.assertTrue(handler.juju_connected)
+        self.assertTrue(handler.user.is_authenticated)
+        self.assertEqual('user', handler.user.username)
+        self.assertEqual(
+            self.make_login_response(request_id=1), self.get_response(handler))
+        self.juju_connection.set_on_message_callback.assert_called_with(
+            handler.on_juju_message)
+        # The watcher is reused, and the snapshot is returned once the
+        # deltas requested while parked are received.
+        handler.on_message(json.dumps(
+            {'RequestId': 2, 'Type': 'Client', 'Request': 'WatchAll'}))
+        self.assertEqual(
+            {'RequestId': 2, 'Response': {'AllWatcherId': '1'}},
+            self.get_response(handler))
+        handler.on_message(json.dumps(
+            {'RequestId': 3, 'Type': 'AllWatcher', 'Request': 'Next',
+             'Id': '1'}))
+        handler.on_juju_message(json.dumps({
+            'RequestId': resume.REQUEST_ID_BASE,
+            'Response': {'deltas': [['unit', 'change', {'id': 'a/1'}]]}}))
+        expected = {'RequestId': 3, 'Response': {'deltas': [
+            ['unit', 'change', {'id': 'a/0'}],
+            ['unit', 'change', {'id': 'a/1'}],
+        ]}}
+        self.assertEqual(expected, self.get_response(handler))
+        self.assertEqual(1, resume.stats.resumed)
+
+    def test_unknown_token(self):
+        # An error is returned if the token is not valid.
+        handler = self.make_resumable_handler()
+        handler.on_message(json.dumps({
+            'RequestId': 1, 'Type': 'GUIToken', 'Request': 'Resume',
+            'Params': {'Token': 'no-such'}}))
+        expected = {
+            'RequestId': 1,
+            'Error': 'unknown, fulfilled, or expired token',
+            'ErrorCode': 'unauthorized access',
+            'Response': {},
+        }
+        self.assertEqual(expected, self.get_response(handler))
+        self.assertFalse(handler.juju_connected)
+
+    @gen_test
+    def test_no_token(self):
+        # The Juju API connection is closed if no resume token was requested.
+        handler = self.make_resumable_handler()
+        handler.on_message(self.make_login_request(encoded=True))
+        handler.on_juju_message(self.make_login_response(encoded=True))
+        handler.on_close()
+        yield gen.Task(self.io_loop.add_callback)
+        self.juju_connection.close.assert_called_once_with()
+        self.assertEqual(0, resume.stats.parked)
+
+
+class TestWebSocketHandlerLatency(
+        WebSocketHandlerTestMixin, helpers.WSSTestMixin, LogTrapTestCase,
+        AsyncHTTPSTestCase):
+
+    request = '{"RequestId": 1, "Type": "Client", "Request": "FullStatus"}'
+
+    def setUp(self):
+        super(TestWebSocketHandlerLatency, self).setUp()
+        latency.stats.reset()
+        self.addCleanup(latency.stats.reset)
+
+    @gen.coroutine
+    def make_latency_handler(self, measure_latency=True):
+        """Create and return a handler possibly measuring latencies."""
+        handler = self.make_handler()
+        yield handler.initialize(
+            self.apiurl,
+            self.auth_backend,
+            self.deployer,
+            self.tokens,
+            apps.WEBSOCKET_MODEL_SOURCE_TEMPLATE,
+            apps.WEBSOCKET_MODEL_TARGET_TEMPLATE,
+            io_loop=self.io_loop,
+            measure_latency=measure_latency)
+        raise gen.Return(handler)
+
+    @gen_test
+    def test_latency(self):
+        # The latency of requests sent to the Juju API is recorded.
+        handler = yield self.make_latency_handler()
+        with mock.patch('guiserver.handlers.WebSocketHandler.write_message'):
+            handler.on_message(self.request)
+            handler.on_juju_message('{"RequestId": 1, "Response": {}}')
+        histograms = latency.stats.as_dict()
+        self.assertEqual(['Client.FullStatus'], histograms.keys())
+        self.assertEqual(1, histograms['Client.FullStatus']['count'])
+        self.assertEqual(0, histograms['Client.FullStatus']['errors'])
+
+    @gen_test
+    def test_errors(self):
+        # Error responses are counted.
+        handler = yield self.make_latency_handler()
+        with mock.patch('guiserver.handlers.WebSocketHandler.write_message'):
+            handler.on_message(self.request)
+            handler.on_juju_message('{"RequestId": 1, "Error": "bad wolf"}')
+        histogram = latency.stats.as_dict()['Client.FullStatus']
+        self.assertEqual(1, histogram['errors'])
+
+    @gen_test
+    def test_disabled(self):
+        # Latencies are not recorded if measurements are disabled.
+        handler = yield self.make_latency_handler(measure_latency=False)
+        with mock.patch('guiserver.handlers.WebSocketHandler.write_message'):
+            handler.on_message(self.request)
+            handler.on_juju_message('{"RequestId": 1, "Response": {}}')
+        self.assertEqual({}, latency.stats.as_dict())
+
+
 class TestWebSocketHandlerAuthentication(
         WebSocketHandlerTestMixin, helpers.WSSTestMixin,
         helpers.GoAPITestMixin, LogTrapTestCase, AsyncHTTPSTestCase):
@@ -435,10 +1032,9 @@ class TestWebSocketHandlerAuthentication(
         # It supports authenticating with a token.
         request = self.make_token_login_request(
             self.tokens, username='user', password='passwd')
-        with mock.patch.object(self.io_loop,
-                               'remove_timeout') as mock_remove_timeout:
-            self.handler.on_message(json.dumps(request))
-            mock_remove_timeout.assert_called_once_with('handle')
+        self.handler.on_message(json.dumps(request))
+        # The token can only be used once.
+        self.assertNotIn('DEFACED', self.tokens._store)
         self.assertEqual(
             self.make_login_request(
                 request_id=42, username='user', password='passwd'),
@@ -455,10 +1051,9 @@ class TestWebSocketHandlerAuthentication(
         # It correctly handles a token that will not authenticate.
         request = self.make_token_login_request(
             self.tokens, username='user', password='passwd')
-        with mock.patch.object(self.io_loop,
-                               'remove_timeout') as mock_remove_timeout:
-            self.handler.on_message(json.dumps(request))
-            mock_remove_timeout.assert_called_once_with('handle')
+        self.handler.on_message(json.dumps(request))
+        # The token can only be used once.
+        self.assertNotIn('DEFACED', self.tokens._store)
         self.send_login_response(False)
         message = self.handler.ws_connection.write_message.call_args[0][0]
         self.assertEqual(
@@ -717,6 +1312,34 @@ class TestProxyHandler(LogTrapTestCase, AsyncHTTPTestCase):
         mock_client.reset_mock()
         return mock.patch('tornado.httpclient.AsyncHTTPClient', mock_client)
 
+    def patch_streaming_http_client(self, code, headers, chunks, curl=None):
+        """Patch the asynchronous HTTP client so that it streams responses.
+
+        The patched client sends the given status code, headers and body
+        chunks using the request callbacks. If a curl handle is provided, it
+        is passed to the request prepare_curl_callback.
+        """
+        def fetch(request):
+            if curl is not None:
+                request.prepare_curl_callback(curl)
+            request.header_callback('HTTP/1.1 {} {}\r\n'.format(
+                code, httputil.responses[code]))
+            for key, value in headers.items():
+                request.header_callback('{}: {}\r\n'.format(key, value))
+            request.header_callback('\r\n')
+            for chunk in chunks:
+                request.streaming_callback(chunk)
+            # Complete the request after the chunks are flushed.
+            future = futures.Future()
+            response = helpers.make_response(code, request=request)
+            self.io_loop.add_callback(future.set_result, response)
+            return future
+
+        mock_client = mock.Mock()
+        mock_client().fetch.side_effect = fetch
+        mock_client.reset_mock()
+        return mock.patch('tornado.httpclient.AsyncHTTPClient', mock_client)
+
     def test_get_request(self):
         # GET requests are properly sent to the target URL. Responses are
         # propagated back to the client.
@@ -741,6 +1364,17 @@ class TestProxyHandler(LogTrapTestCase, AsyncHTTPTestCase):
         self.assert_include_headers(
             self.request_headers, remote_request.headers)
 
+    def test_queue_wait(self):
+        # The time spent by requests in the HTTP client queue is recorded.
+        metrics.stats.reset()
+        self.addCleanup(metrics.stats.reset)
+        remote_response = helpers.make_response(200, body='ok')
+        remote_response.time_info = {'queue': 0.5}
+        with self.patch_http_client(remote_response):
+            self.fetch('/base/remote-path/')
+        self.assertEqual(1, metrics.stats.http_requests)
+        self.assertEqual(0.5, metrics.stats.http_queue_wait)
+
     def test_post_request(self):
         # POST requests are properly sent to the target URL.
         remote_response = helpers.make_response(
@@ -807,6 +1441,103 @@ class TestProxyHandler(LogTrapTestCase, AsyncHTTPTestCase):
         self.assertEqual('try later', response.body)
         self.assertEqual('Not Found', response.reason)
 
+    def test_request_options(self):
+        # Responses are streamed, and they are not decompressed.
+        remote_response = helpers.make_response(200)
+        with self.patch_http_client(remote_response) as mock_client:
+            self.fetch('/base/remote-path/')
+        remote_request = mock_client().fetch.call_args[0][0]
+        self.assertIsNotNone(remote_request.streaming_callback)
+        self.assertIsNotNone(remote_request.header_callback)
+        self.assertFalse(remote_request.use_gzip)
+        self.assertEqual(
+            handlers.PROXY_REQUEST_TIMEOUT, remote_request.request_timeout)
+
+    def test_streamed_response(self):
+        # Responses declaring their length are relayed while received.
+        headers = {
+            'Connection': 'keep-alive',
+            'Content-Length': '10',
+            'Content-Type': 'application/zip',
+        }
+        chunks = ['hello', 'world']
+        with self.patch_streaming_http_client(200, headers, chunks):
+            response = self.fetch('/base/remote-path/')
+        self.assertEqual(200, response.code)
+        self.assertEqual('helloworld', response.body)
+        self.assertEqual('application/zip', response.headers['Content-Type'])
+        # Hop-by-hop headers are not propagated.
+        self.assertNotIn('keep-alive', response.headers.get('Connection', ''))
+
+    def test_buffered_response(self):
+        # Responses not declaring their length are buffered.
+        headers = {'Content-Type': 'text/plain'}
+        chunks = ['hello', 'world']
+        with self.patch_streaming_http_client(201, headers, chunks):
+            response = self.fetch('/base/remote-path/')
+        self.assertEqual(201, response.code)
+        self.assertEqual('helloworld', response.body)
+        self.assertEqual('10', response.headers['Content-Length'])
+
+    @mock.patch('guiserver.handlers.PROXY_MAX_PENDING', 8)
+    @mock.patch('guiserver.handlers.pycurl')
+    def test_flow_control(self, mock_pycurl):
+        # The transfer is paused until the data received is flushed.
+        curl = mock.Mock()
+        headers = {'Content-Length': '15'}
+        chunks = ['hello', 'world', 'again']
+        with self.patch_streaming_http_client(200, headers, chunks, curl):
+            response = self.fetch('/base/remote-path/')
+        self.assertEqual('helloworldagain', response.body)
+        self.assertEqual([
+            mock.call(mock_pycurl.PAUSE_RECV),
+            mock.call(mock_pycurl.PAUSE_CONT),
+        ], curl.pause.call_args_list)
+
+    def test_client_closed(self):
+        # The transfer is aborted if the client goes away.
+        handlers_ = []
+        results = []
+
+        def fetch(request):
+            future = futures.Future()
+            # Retrieve the handler through the prepare curl callback.
+            request.prepare_curl_callback(mock.Mock())
+            request.header_callback('HTTP/1.1 200 OK\r\n')
+            request.header_callback('Content-Length: 10\r\n')
+            request.header_callback('\r\n')
+            results.append(request.streaming_callback('hello'))
+            handlers_[0].request.connection.stream.close()
+
+            def receive():
+                # Curl aborts the transfer if the chunk is not consumed.
+                results.append(request.streaming_callback('world'))
+                future.set_exception(
+                    httpclient.HTTPError(599, 'Failed writing body'))
+            # Receive the next chunk after the connection close callback.
+            self.io_loop.add_timeout(self.io_loop.time() + 0.01, receive)
+            return future
+
+        mock_client = mock.Mock()
+        mock_client().fetch.side_effect = fetch
+        expected_log = 'proxy: client went away'
+        responses = []
+        with mock.patch('tornado.httpclient.AsyncHTTPClient', mock_client):
+            with mock.patch.object(
+                    handlers.ProxyHandler, '_on_curl', autospec=True,
+                    side_effect=lambda handler, curl: handlers_.append(
+                        handler)):
+                with ExpectLog('', expected_log, required=True):
+                    self.http_client.fetch(
+                        self.get_url('/base/remote-path/'), responses.append)
+                    # Wait for the handler to be finished.
+                    with mock.patch.object(
+                            handlers.ProxyHandler, 'on_finish',
+                            lambda handler: self.stop()):
+                        self.wait()
+        self.assertEqual(599, responses[0].code)
+        self.assertEqual([None, 0], results)
+
     def test_internal_server_error(self):
         # A 500 error is returned if an HTTP error occurs during the remote
         # request/response process.
@@ -848,6 +1579,17 @@ class TestJujuProxyHandler(TestProxyHandler):
             self.charmworld_url + handlers.DEFAULT_CHARM_ICON_PATH,
             response.headers['location'])
 
+    def test_default_charm_icon_streamed(self):
+        # Missing charm icons are not relayed while received.
+        headers = {'Content-Length': '9'}
+        path = '/base/charms?url=local:trusty/django=42&file=icon.svg'
+        with self.patch_streaming_http_client(404, headers, ['not found']):
+            response = self.fetch(path, follow_redirects=False)
+        self.assertEqual(302, response.code)
+        self.assertEqual(
+            self.charmworld_url + handlers.DEFAULT_CHARM_ICON_PATH,
+            response.headers['location'])
+
     def test_charm_file_not_found(self):
         # If a charm file is not found and it is not the icon, a 404 is
         # correctly returned to the original client.
@@ -879,11 +1621,22 @@ class TestInfoHandler(LogTrapTestCase, AsyncHTTPTestCase):
         expected = {
             'apiurl': 'wss://api.example.com:17070',
             'apiversion': 'clojure',
+            'backpressure': backpressure.stats.as_dict(),
+            'cache': cache.stats.as_dict(),
+            'compression': deflate.stats.as_dict(),
             'debug': False,
             'deployer': 'deployments status',
+            'logs': logs.stats.as_dict(),
+            'pool': pool.stats.as_dict(),
+            'profiler': profiler.stats.as_dict(),
+            'queues': queues.stats.as_dict(),
+            'reconnect': reconnect.stats.as_dict(),
+            'resume': resume.stats.as_dict(),
             'sandbox': False,
             'uptime': 42,
             'version': get_version(),
+            'watchdog': watchdog.stats.as_dict(),
+            'wsgi': wsgi.stats.as_dict(),
         }
         response = self.fetch('/info')
         self.assertEqual(200, response.code)
@@ -894,6 +1647,184 @@ class TestInfoHandler(LogTrapTestCase, AsyncHTTPTestCase):
         self.assertEqual(expected, info)
 
 
+class TestLatencyHandler(LogTrapTestCase, AsyncHTTPTestCase):
+
+    def setUp(self):
+        super(TestLatencyHandler, self).setUp()
+        latency.stats.reset()
+        self.addCleanup(latency.stats.reset)
+
+    def get_app(self):
+        return web.Application([(r'^/latency', handlers.LatencyHandler)])
+
+    def test_latency(self):
+        # The handler returns the latency histograms of the GUI server.
+        latency.stats.observe(('Client', 'FullStatus'), 0.2, error=True)
+        response = self.fetch('/latency')
+        self.assertEqual(200, response.code)
+        self.assertEqual(
+            'application/json; charset=UTF-8',
+            response.headers['Content-Type'])
+        histograms = escape.json_decode(response.body)
+        self.assertEqual(latency.stats.as_dict(), histograms)
+        self.assertEqual(1, histograms['Client.FullStatus']['errors'])
+
+
+class TestMetricsHandler(LogTrapTestCase, AsyncHTTPTestCase):
+
+    def setUp(self):
+        super(TestMetricsHandler, self).setUp()
+        for stats in (cache.stats, latency.stats, metrics.stats, wsgi.stats):
+            stats.reset()
+            self.addCleanup(stats.reset)
+
+    def get_app(self):
+        self.deployer = mock.Mock()
+        self.deployer.worker_stats.return_value = {
+            'queue': 2,
+            'busy_time': {'validate': 1.5, 'import': 3},
+        }
+        self.tokens = mock.Mock()
+        self.tokens.sizes.return_value = {'tokens': 4, 'parked': 1}
+        options = {'deployer': self.deployer, 'tokens': self.tokens}
+        return web.Application([
+            (r'^/metrics', handlers.MetricsHandler, options)])
+
+    def test_content_type(self):
+        # The metrics are returned using the Prometheus text format.
+        response = self.fetch('/metrics')
+        self.assertEqual(200, response.code)
+        self.assertEqual(
+            metrics.CONTENT_TYPE, response.headers['Content-Type'])
+
+    def test_metrics(self):
+        # The GUI server metrics are included.
+        metrics.stats.browser_connections = 3
+        metrics.stats.juju_frames = 10
+        metrics.stats.ioloop_lag = 0.25
+        wsgi.stats.queued = 5
+        cache.stats.hits = 7
+        lines = self.fetch('/metrics').body.splitlines()
+        for line in (
+            'guiserver_browser_connections 3',
+            'guiserver_websocket_frames_received_total{source="juju"} 10',
+            'guiserver_queued_messages 0',
+            'guiserver_tokens{kind="login"} 4',
+            'guiserver_tokens{kind="resume"} 1',
+            'guiserver_deployer_queue_length 2',
+            'guiserver_deployer_busy_seconds_total{worker="import"} 3',
+            'guiserver_deployer_busy_seconds_total{worker="validate"} 1.5',
+            'guiserver_ioloop_lag_seconds 0.25',
+            'guiserver_ioloop_stalls_total 0',
+            'guiserver_wsgi_queued_requests 5',
+            'guiserver_wsgi_execution_seconds_total 0.0',
+            'guiserver_wsgi_cache_hits_total 7',
+            'guiserver_wsgi_cache_bytes 0',
+        ):
+            self.assertIn(line, lines)
+
+    def test_latency(self):
+        # The Juju API latency histograms are included.
+        latency.stats.observe(('Client', 'FullStatus'), 0.2, error=True)
+        lines = self.fetch('/metrics').body.splitlines()
+        labels = 'request="FullStatus",type="Client"'
+        name = 'guiserver_juju_api_request_duration_seconds'
+        for line in (
+            '# TYPE {} histogram'.format(name),
+            '{}_bucket{{le="0.1",{}}} 0'.format(name, labels),
+            '{}_bucket{{le="0.25",{}}} 1'.format(name, labels),
+            '{}_bucket{{le="+Inf",{}}} 1'.format(name, labels),
+            '{}_sum{{{}}} 0.2'.format(name, labels),
+            '{}_count{{{}}} 1'.format(name, labels),
+            'guiserver_juju_api_request_errors_total{{{}}} 1'.format(labels),
+        ):
+            self.assertIn(line, lines)
+
+    def test_sandbox(self):
+        # Token metrics are not included if tokens are not available.
+        handler = handlers.MetricsHandler(
+            self.get_app(), mock.Mock(), deployer=self.deployer)
+        self.assertNotIn('guiserver_tokens', handler.get_metrics())
+
+
+class TestProfileHandler(LogTrapTestCase, AsyncHTTPTestCase):
+
+    def get_app(self):
+        options = {
+            'directory': '/my/profiles',
+            'token': 'secret',
+            'duration': 30,
+        }
+        return web.Application([
+            (r'^/profile', handlers.ProfileHandler, options)])
+
+    def start(self, authorization='Bearer secret', query=''):
+        """Request the profiler to start, and return the response."""
+        headers = {'Authorization': authorization}
+        return self.fetch(
+            '/profile' + query, method='POST', body='', headers=headers)
+
+    @mock.patch('guiserver.profiler.start')
+    def test_start(self, mock_start):
+        # The profiler is started.
+        mock_start.return_value = '/my/profiles/profile.collapsed'
+        response = self.start()
+        self.assertEqual(200, response.code)
+        expected = {
+            'duration': 30,
+            'path': '/my/profiles/profile.collapsed',
+        }
+        self.assertEqual(expected, escape.json_decode(response.body))
+        mock_start.assert_called_once_with(30, '/my/profiles')
+
+    @mock.patch('guiserver.profiler.start')
+    def test_duration(self, mock_start):
+        # The profile duration can be provided.
+        mock_start.return_value = '/my/profiles/profile.collapsed'
+        response = self.start(query='?duration=2.5')
+        self.assertEqual(200, response.code)
+        mock_start.assert_called_once_with(2.5, '/my/profiles')
+
+    @mock.patch('guiserver.profiler.start')
+    def test_invalid_duration(self, mock_start):
+        # Invalid durations are rejected.
+        for duration in ('bad-wolf', '0', '1000'):
+            response = self.start(query='?duration=' + duration)
+            self.assertEqual(400, response.code)
+        self.assertFalse(mock_start.called)
+
+    @mock.patch('guiserver.profiler.start')
+    def test_unauthorized(self, mock_start):
+        # The profiler token is required.
+        for authorization in ('', 'Bearer wrong', 'secret'):
+            response = self.start(authorization=authorization)
+            self.assertEqual(403, response.code)
+        self.assertFalse(mock_start.called)
+
+    @mock.patch('guiserver.profiler.start', mock.Mock(return_value=None))
+    def test_already_running(self):
+        # A conflict is returned if the profiler is already running.
+        response = self.start()
+        self.assertEqual(409, response.code)
+
+
+class TestProfileHandlerDisabled(LogTrapTestCase, AsyncHTTPTestCase):
+
+    def get_app(self):
+        options = {'directory': '/my/profiles', 'token': '', 'duration': 30}
+        return web.Application([
+            (r'^/profile', handlers.ProfileHandler, options)])
+
+    @mock.patch('guiserver.profiler.start')
+    def test_disabled(self, mock_start):
+        # The endpoint is disabled if no token is configured.
+        response = self.fetch(
+            '/profile', method='POST', body='',
+            headers={'Authorization': 'Bearer '})
+        self.assertEqual(404, response.code)
+        self.assertFalse(mock_start.called)
+
+
 class TestHttpsRedirectHandler(LogTrapTestCase, AsyncHTTPTestCase):
 
     def get_app(self):
@@ -0,0 +1,182 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the Juju GUI server Juju API latency measurements."""
+
+import unittest
+
+import mock
+
+from guiserver import latency
+
+
+class TestIsError(unittest.TestCase):
+
+    def test_error(self):
+        # Error responses are recognized.
+        message = '{"RequestId":1,"Error":"bad wolf","Response":{}}'
+        self.assertTrue(latency.is_error(message))
+
+    def test_error_without_response(self):
+        # Error responses without a response value are recognized.
+        self.assertTrue(latency.is_error('{"RequestId":1,"Error":"boo"}'))
+
+    def test_success(self):
+        # Successful responses are not errors.
+        self.assertFalse(latency.is_error('{"RequestId":1,"Response":{}}'))
+
+    def test_error_in_response_value(self):
+        # Errors included in the response value are ignored.
+        message = '{"RequestId":1,"Response":{"Error":"unit failed"}}'
+        self.assertFalse(latency.is_error(message))
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_empty(self):
+        # An empty histogram does not return percentiles.
+        histogram = latency.Histogram()
+        expected = {
+            'count': 0,
+            'errors': 0,
+            'mean': None,
+            'max': 0.0,
+            'p50': None,
+            'p95': None,
+            'p99': None,
+        }
+        self.assertEqual(expected, histogram.as_dict())
+
+    def test_observe(self):
+        # Values are stored in the corresponding buckets.
+        histogram = latency.Histogram()
+        histogram.observe(0.005)
+        histogram.observe(0.007, error=True)
+        histogram.observe(1000)
+        self.assertEqual(3, histogram.count)
+        self.assertEqual(1, histogram.errors)
+        self.assertEqual(1000, histogram.max)
+        self.assertEqual(1, histogram.buckets[0])
+        self.assertEqual(1, histogram.buckets[1])
+        self.assertEqual(1, histogram.buckets[-1])
+
+    def test_percentiles(self):
+        # Percentiles are interpolated within buckets.
+        histogram = latency.Histogram()
+        for _ in range(100):
+            histogram.observe(0.2)
+        # All the values are in the (0.1, 0.25] bucket, capped by the max.
+        self.assertAlmostEqual(0.15, histogram.percentile(0.5))
+        self.assertAlmostEqual(0.2, histogram.percentile(1))
+
+    def test_percentiles_distribution(self):
+        # Percentiles reflect the value distribution.
+        histogram = latency.Histogram()
+        for _ in range(95):
+            histogram.observe(0.001)
+        for _ in range(5):
+            histogram.observe(20)
+        summary = histogram.as_dict()
+        self.assertLessEqual(summary['p50'], 0.005)
+        self.assertLessEqual(summary['p95'], 0.005)
+        self.assertGreater(summary['p99'], 10)
+        self.assertLessEqual(summary['p99'], 20)
+
+
+class TestLatencyStats(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = latency.LatencyStats()
+
+    def test_as_dict(self):
+        # Histograms are keyed by facade and method.
+        self.stats.observe(('Client', 'FullStatus'), 0.1)
+        self.stats.observe(('Client', 'FullStatus'), 0.3, error=True)
+        self.stats.observe(('AllWatcher', 'Next'), 2)
+        summary = self.stats.as_dict()
+        self.assertEqual(
+            ['AllWatcher.Next', 'Client.FullStatus'], sorted(summary))
+        self.assertEqual(2, summary['Client.FullStatus']['count'])
+        self.assertEqual(1, summary['Client.FullStatus']['errors'])
+
+    @mock.patch('guiserver.latency.MAX_KEYS', 1)
+    def test_max_keys(self):
+        # Additional keys are recorded together.
+        self.stats.observe(('Client', 'FullStatus'), 0.1)
+        self.stats.observe(('Client', 'AddMachines'), 0.1)
+        self.stats.observe(('Client', 'DestroyMachines'), 0.1)
+        summary = self.stats.as_dict()
+        self.assertEqual(['Client.FullStatus', 'other.other'], sorted(summary))
+        self.assertEqual(2, summary['other.other']['count'])
+
+    def test_reset(self):
+        # Histograms can be removed.
+        self.stats.observe(('Client', 'FullStatus'), 0.1)
+        self.stats.reset()
+        self.assertEqual({}, self.stats.as_dict())
+
+
+@mock.patch('time.time')
+class TestRequestTimer(unittest.TestCase):
+
+    def setUp(self):
+        latency.stats.reset()
+        self.addCleanup(latency.stats.reset)
+        self.timer = latency.RequestTimer()
+
+    def test_latency(self, mock_time):
+        # The time elapsed between a request and its response is recorded.
+        mock_time.return_value = 10
+        self.timer.sent(
+            '{"RequestId": 42, "Type": "Client", "Request": "FullStatus"}')
+        mock_time.return_value = 10.5
+        self.timer.received('{"RequestId": 42, "Response": {}}')
+        summary = latency.stats.as_dict()['Client.FullStatus']
+        self.assertEqual(1, summary['count'])
+        self.assertEqual(0.5, summary['max'])
+        self.assertEqual(0, summary['errors'])
+
+    def test_error(self, mock_time):
+        # Error responses are counted.
+        mock_time.return_value = 10
+        self.timer.sent(
+            '{"RequestId": 1, "Type": "Admin", "Request": "Login"}')
+        self.timer.received('{"RequestId": 1, "Error": "bad wolf"}')
+        summary = latency.stats.as_dict()['Admin.Login']
+        self.assertEqual(1, summary['errors'])
+
+    def test_unknown_response(self, mock_time):
+        # Responses not matching a request are ignored.
+        mock_time.return_value = 10
+        self.timer.sent(
+            '{"RequestId": 1, "Type": "Admin", "Request": "Login"}')
+        self.timer.received('{"RequestId": 2, "Response": {}}')
+        self.assertEqual({}, latency.stats.as_dict())
+
+    def test_no_request_id(self, mock_time):
+        # Messages without a request identifier are ignored.
+        mock_time.return_value = 10
+        self.timer.sent('{"Type": "Admin", "Request": "Login"}')
+        self.timer.received('{"Response": {}}')
+        self.assertEqual({}, latency.stats.as_dict())
+
+    def test_missing_fields(self, mock_time):
+        # Requests without facade or method are still recorded.
+        mock_time.return_value = 10
+        self.timer.sent('{"RequestId": 1}')
+        self.timer.received('{"RequestId": 1, "Response": {}}')
+        self.assertEqual(['.'], latency.stats.as_dict().keys())
@@ -0,0 +1,129 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the Juju GUI server non-blocking logging."""
+
+import logging
+import unittest
+
+import mock
+
+from guiserver import logs
+
+
+class RecordingHandler(logging.Handler):
+    """A logging handler storing the records it handles."""
+
+    def __init__(self, level=logging.NOTSET):
+        logging.Handler.__init__(self, level=level)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestQueueLogHandler(unittest.TestCase):
+
+    def setUp(self):
+        logs.stats.reset()
+        self.addCleanup(logs.stats.reset)
+        self.target = RecordingHandler()
+        self.handler = logs.QueueLogHandler([self.target], max_size=2)
+        self.logger = logging.getLogger('guiserver.tests.test_logs')
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def test_background_thread(self):
+        # Records are written by the background thread.
+        self.handler.start()
+        self.logger.warning('hello %s', 'world')
+        self.handler.close()
+        self.assertEqual(1, len(self.target.records))
+        record = self.target.records[0]
+        self.assertEqual('hello world', record.getMessage())
+        self.assertIsNone(record.args)
+
+    def test_dropped(self):
+        # Records are dropped if the queue is full.
+        for num in range(3):
+            self.logger.warning('message %d', num)
+        self.assertEqual(1, logs.stats.dropped)
+        self.assertEqual({'dropped': 1}, logs.stats.as_dict())
+        self.assertEqual([], self.target.records)
+        # Queued records are written once the thread is started.
+        self.handler.start()
+        self.handler.flush()
+        messages = [record.getMessage() for record in self.target.records]
+        self.assertEqual(['message 0', 'message 1'], messages)
+        self.handler.close()
+
+    def test_exception(self):
+        # Exception information is included in the message.
+        self.handler.start()
+        try:
+            raise ValueError('bad wolf')
+        except ValueError:
+            self.logger.exception('error')
+        self.handler.close()
+        record = self.target.records[0]
+        self.assertIsNone(record.exc_info)
+        self.assertIn('ValueError: bad wolf', record.getMessage())
+
+    def test_target_level(self):
+        # The level of the target handlers is respected.
+        self.target.setLevel(logging.ERROR)
+        self.handler.start()
+        self.logger.warning('discarded')
+        self.logger.error('written')
+        self.handler.close()
+        messages = [record.getMessage() for record in self.target.records]
+        self.assertEqual(['written'], messages)
+
+    def test_restart(self):
+        # Records are written by a new thread after restarting.
+        self.logger.warning('queued')
+        self.handler.restart()
+        self.logger.warning('written')
+        self.handler.close()
+        messages = [record.getMessage() for record in self.target.records]
+        self.assertEqual(['written'], messages)
+        self.assertEqual(2, self.handler._queue.maxsize)
+
+
+class TestInstall(unittest.TestCase):
+
+    def test_install(self):
+        # The root logger handlers are replaced by a queue handler.
+        root = logging.getLogger()
+        target = RecordingHandler()
+        with mock.patch.object(root, 'handlers', [target]):
+            handler = logs.install(max_size=10)
+            try:
+                self.assertEqual([handler], root.handlers)
+            finally:
+                handler.close()
+        self.assertEqual([target], handler.handlers)
+        self.assertEqual(10, handler._queue.maxsize)
+
+    def test_restart(self):
+        # Queue handlers attached to the root logger are restarted.
+        root = logging.getLogger()
+        handler = mock.Mock(spec=logs.QueueLogHandler)
+        with mock.patch.object(root, 'handlers', [handler, mock.Mock()]):
+            logs.restart()
+        handler.restart.assert_called_once_with()
@@ -19,12 +19,18 @@
 from contextlib import contextmanager
 import logging
 import ssl
+import tempfile
 import unittest
 
 import mock
 from tornado.testing import LogTrapTestCase
 
-from guiserver import manage
+from guiserver import (
+    frames,
+    manage,
+    metrics,
+    profiler,
+)
 
 
 @mock.patch('guiserver.manage.options')
@@ -186,15 +192,21 @@ class TestRun(LogTrapTestCase, unittest.TestCase):
             'apiversion': 'go',
             'port': None,
             'sslpath': '/my/sslpath',
+            'watchdog': 0,
+            'workers': 1,
         }
         options.update(kwargs)
         with \
-                mock.patch('guiserver.manage.IOLoop') as ioloop, \
+                mock.patch('guiserver.manage.IOLoop') as self.ioloop, \
                 mock.patch('guiserver.manage.options', mock.Mock(**options)), \
                 mock.patch('guiserver.manage.redirector') as redirector, \
-                mock.patch('guiserver.manage.server') as server:
+                mock.patch('guiserver.manage.server') as server, \
+                mock.patch('guiserver.manage.signal') as self.signal, \
+                mock.patch('guiserver.metrics.LagMonitor') as self.monitor, \
+                mock.patch('guiserver.watchdog.Watchdog') as self.watchdog:
             manage.run()
-        return ioloop.instance().start, redirector().listen, server().listen
+        return (
+            self.ioloop.instance().start, redirector().listen, server().listen)
 
     def test_secure_mode(self):
         # The application is correctly run in secure mode.
@@ -230,3 +242,139 @@ class TestRun(LogTrapTestCase, unittest.TestCase):
         # The IO loop instance is started when the application is run.
         ioloop_start, _, _ = self.mock_and_run()
         ioloop_start.assert_called_once_with()
+
+    def test_lag_monitor(self):
+        # The IO loop lag is measured when the application is run.
+        self.mock_and_run()
+        self.monitor.assert_called_once_with(
+            interval=metrics.DEFAULT_LAG_INTERVAL,
+            io_loop=self.ioloop.instance())
+        self.monitor().start.assert_called_once_with()
+        self.assertFalse(self.watchdog.called)
+
+    def test_watchdog(self):
+        # The watchdog is started if enabled.
+        self.mock_and_run(watchdog=0.5)
+        self.monitor.assert_called_once_with(
+            interval=0.25, io_loop=self.ioloop.instance())
+        self.watchdog.assert_called_once_with(self.monitor(), 0.5)
+        self.watchdog().start.assert_called_once_with()
+
+    def test_dump_frames_signal(self):
+        # Recent WebSocket frames are logged when SIGUSR1 is received.
+        self.mock_and_run()
+        self.signal.signal.assert_any_call(
+            self.signal.SIGUSR1, manage._dump_frames)
+        with mock.patch('guiserver.manage.IOLoop') as ioloop:
+            manage._dump_frames(10, None)
+        ioloop.instance().add_callback_from_signal.assert_called_once_with(
+            frames.dump_all)
+
+    def test_start_profiler_signal(self):
+        # The sampling profiler is started when SIGUSR2 is received.
+        self.mock_and_run()
+        self.signal.signal.assert_any_call(
+            self.signal.SIGUSR2, manage._start_profiler)
+        options = mock.Mock(profileduration=10, profiledir='/tmp/profiles')
+        with \
+                mock.patch('guiserver.manage.IOLoop') as ioloop, \
+                mock.patch('guiserver.manage.options', options):
+            manage._start_profiler(12, None)
+        ioloop.instance().add_callback_from_signal.assert_called_once_with(
+            profiler.start, 10, '/tmp/profiles')
+
+
+class TestRunWorkers(LogTrapTestCase, unittest.TestCase):
+
+    expected_ssl_options = TestRun.expected_ssl_options
+
+    def mock_and_run(self, **kwargs):
+        """Run the application in multi-process mode after mocking forking.
+
+        Additional options can be specified using kwargs.
+        """
+        options = {
+            'apiversion': 'go',
+            'port': None,
+            'sslpath': '/my/sslpath',
+            'tokenstore': '',
+            'watchdog': 0,
+            'workers': 4,
+        }
+        options.update(kwargs)
+        with \
+                mock.patch('guiserver.manage.IOLoop'), \
+                mock.patch('guiserver.manage.options', mock.Mock(**options)), \
+                mock.patch('guiserver.manage.redirector') as self.redirector, \
+                mock.patch('guiserver.manage.server') as self.server, \
+                mock.patch('guiserver.manage.signal'), \
+                mock.patch('guiserver.manage.bind_sockets') as self.bind, \
+                mock.patch('guiserver.manage.fork_processes') as self.fork, \
+                mock.patch('guiserver.manage.HTTPServer') as self.http, \
+                mock.patch('guiserver.logs.restart') as self.restart, \
+                mock.patch('guiserver.workers.start_coordinator') as start, \
+                mock.patch('guiserver.metrics.LagMonitor'), \
+                mock.patch('guiserver.watchdog.Watchdog'):
+            manage.run()
+        self.start = start
+
+    def test_secure_mode(self):
+        # The sockets are bound before forking the workers.
+        self.mock_and_run(insecure=False)
+        self.assertEqual(
+            [mock.call(443), mock.call(80)], self.bind.call_args_list)
+        self.fork.assert_called_once_with(4)
+        self.http.assert_any_call(self.redirector())
+        self.http.assert_any_call(
+            self.server(), ssl_options=self.expected_ssl_options)
+        self.http().add_sockets.assert_any_call(self.bind())
+
+    def test_insecure_mode(self):
+        # The application is correctly run in insecure mode.
+        self.mock_and_run(insecure=True, port=8080)
+        self.bind.assert_called_once_with(8080)
+        self.http.assert_called_once_with(self.server(), ssl_options=None)
+        self.http().add_sockets.assert_called_once_with(self.bind())
+        self.assertFalse(self.redirector.called)
+
+    def test_shared_state(self):
+        # The workers share the state owned by the coordinator process.
+        self.mock_and_run(insecure=True)
+        self.start.assert_called_once_with()
+        self.server.assert_called_once_with(shared_state=self.start())
+        self.restart.assert_called_once_with()
+
+    def test_token_store(self):
+        # The coordinator is not started if tokens are stored in SQLite.
+        self.mock_and_run(insecure=True, tokenstore='/tmp/tokens.db')
+        self.assertFalse(self.start.called)
+        self.server.assert_called_once_with(shared_state=None)
+
+    def test_cpu_count(self):
+        # A worker is started for each CPU if zero workers are requested.
+        self.mock_and_run(insecure=True, workers=0)
+        self.fork.assert_called_once_with(None)
+
+
+class TestGetProfileDir(unittest.TestCase):
+
+    def patch_options(self, profiledir='', log_file_prefix=None):
+        """Patch the profiler directory and log file options."""
+        options = mock.Mock(
+            profiledir=profiledir, log_file_prefix=log_file_prefix)
+        return mock.patch('guiserver.manage.options', options)
+
+    def test_provided(self):
+        # The directory provided in the options is used.
+        with self.patch_options(profiledir='/my/profiles'):
+            self.assertEqual('/my/profiles', manage._get_profile_dir())
+
+    def test_log_file(self):
+        # Profiles are written in the directory of the log file.
+        with self.patch_options(log_file_prefix='/var/log/guiserver.log'):
+            self.assertEqual('/var/log', manage._get_profile_dir())
+
+    def test_temporary(self):
+        # The temporary directory is used when logging to stderr.
+        with self.patch_options():
+            self.assertEqual(tempfile.gettempdir(), manage._get_profile_dir())
@@ -0,0 +1,135 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the Juju GUI server Prometheus metrics."""
+
+import unittest
+
+import mock
+
+from guiserver import metrics
+
+
+class TestMetricsStats(unittest.TestCase):
+
+    def test_reset(self):
+        # All the counters can be reset.
+        stats = metrics.MetricsStats()
+        stats.browser_frames = 3
+        stats.ioloop_lag_max = 0.5
+        stats.reset()
+        self.assertEqual(0, stats.browser_frames)
+        self.assertEqual(0, stats.ioloop_lag_max)
+
+    def test_as_dict(self):
+        # The counters are returned as a dict.
+        stats = metrics.MetricsStats()
+        stats.juju_connections = 2
+        info = stats.as_dict()
+        self.assertEqual(2, info['juju_connections'])
+        self.assertEqual(12, len(info))
+
+
+class TestLagMonitor(unittest.TestCase):
+
+    def setUp(self):
+        metrics.stats.reset()
+        self.addCleanup(metrics.stats.reset)
+        self.io_loop = mock.Mock()
+        self.io_loop.time.return_value = 10
+        self.monitor = metrics.LagMonitor(interval=2, io_loop=self.io_loop)
+
+    def test_start(self):
+        # A check is scheduled when the monitor is started.
+        self.monitor.start()
+        self.io_loop.add_timeout.assert_called_once_with(
+            12, self.monitor._check)
+
+    def test_lag(self):
+        # The delay of the scheduled check is recorded.
+        self.monitor.start()
+        self.io_loop.time.return_value = 12.5
+        self.monitor._check()
+        self.assertEqual(0.5, metrics.stats.ioloop_lag)
+        self.assertEqual(0.5, metrics.stats.ioloop_lag_max)
+        self.assertEqual(1, metrics.stats.ioloop_checks)
+        self.assertEqual(0.5, metrics.stats.ioloop_lag_total)
+        # The next check is scheduled.
+        self.assertEqual(2, self.io_loop.add_timeout.call_count)
+        self.io_loop.add_timeout.assert_called_with(14.5, self.monitor._check)
+
+    def test_max_lag(self):
+        # The maximum lag is preserved.
+        self.monitor.start()
+        self.io_loop.time.return_value = 13
+        self.monitor._check()
+        self.monitor._check()
+        self.assertEqual(0, metrics.stats.ioloop_lag)
+        self.assertEqual(1, metrics.stats.ioloop_lag_max)
+        self.assertEqual(1, metrics.stats.ioloop_lag_total)
+
+    def test_stop(self):
+        # The scheduled check is removed when the monitor is stopped.
+        self.monitor.start()
+        self.monitor.stop()
+        self.io_loop.remove_timeout.assert_called_once_with(
+            self.io_loop.add_timeout())
+
+
+class TestMetricsWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = metrics.MetricsWriter()
+
+    def test_value(self):
+        # A metric with a single value is correctly written.
+        self.writer.add('connections', 'gauge', 'Open connections.', 42)
+        expected = (
+            '# HELP guiserver_connections Open connections.\n'
+            '# TYPE guiserver_connections gauge\n'
+            'guiserver_connections 42\n')
+        self.assertEqual(expected, self.writer.getvalue())
+
+    def test_labels(self):
+        # Labels are sorted and escaped.
+        self.writer.add('frames', 'counter', 'Frames.', [
+            ({'source': 'browser', 'kind': 'a"b\\c'}, 1),
+            ({'source': 'juju', 'kind': 'x\ny'}, 0.5),
+        ])
+        expected = (
+            '# HELP guiserver_frames Frames.\n'
+            '# TYPE guiserver_frames counter\n'
+            'guiserver_frames{kind="a\\"b\\\\c",source="browser"} 1\n'
+            'guiserver_frames{kind="x\\ny",source="juju"} 0.5\n')
+        self.assertEqual(expected, self.writer.getvalue())
+
+    def test_histogram(self):
+        # Histogram samples include a name suffix.
+        self.writer.add('duration', 'histogram', 'Duration.', [
+            ('_bucket', {'le': 0.5}, 1),
+            ('_bucket', {'le': float('inf')}, 2),
+            ('_sum', {}, 3.5),
+            ('_count', {}, 2),
+        ])
+        expected = (
+            '# HELP guiserver_duration Duration.\n'
+            '# TYPE guiserver_duration histogram\n'
+            'guiserver_duration_bucket{le="0.5"} 1\n'
+            'guiserver_duration_bucket{le="+Inf"} 2\n'
+            'guiserver_duration_sum 3.5\n'
+            'guiserver_duration_count 2\n')
+        self.assertEqual(expected, self.writer.getvalue())
@@ -0,0 +1,260 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the Juju GUI server Juju API connections multiplexing."""
+
+import json
+import unittest
+
+import mock
+from tornado import concurrent
+from tornado.testing import (
+    AsyncTestCase,
+    gen_test,
+    LogTrapTestCase,
+)
+
+from guiserver import multiplex
+from guiserver.tests import helpers
+
+
+class SessionTestMixin(helpers.GoAPITestMixin):
+    """Add helper methods for testing shared sessions."""
+
+    def make_session(self, multiplexer=None, password='passwd'):
+        """Create and return a session connected to a mock Juju API."""
+        if multiplexer is None:
+            multiplexer = multiplex.Multiplexer(io_loop=mock.Mock())
+        session = multiplex.SharedSession(
+            multiplexer, ('wss://example.com', 'user'), password)
+        session._connection = mock.Mock()
+        return session
+
+    def get_sent(self, session):
+        """Return the decoded messages sent by the session to the Juju API."""
+        return [
+            json.loads(call[0][0])
+            for call in session._connection.write_message.call_args_list]
+
+    def attach(self, session):
+        """Attach a browser connection to the given session.
+
+        Return the connection and the list of messages it receives.
+        """
+        received = []
+        return session.attach(received.append), received
+
+    def login(self, session, request_id=42):
+        """Log in the given session using a new browser connection.
+
+        Return the connection and the list of messages it receives.
+        """
+        connection, received = self.attach(session)
+        connection.write_message(
+            self.make_login_request(request_id=request_id, encoded=True))
+        juju_request_id = self.get_sent(session)[-1]['RequestId']
+        session.on_message(self.make_login_response(
+            request_id=juju_request_id, encoded=True))
+        return connection, received
+
+
+class TestSharedSession(SessionTestMixin, LogTrapTestCase, unittest.TestCase):
+
+    def test_request_ids_rewritten(self):
+        # Request ids are unique in the Juju API connection, and responses are
+        # routed to the connections using the original request ids.
+        session = self.make_session()
+        conn1, received1 = self.attach(session)
+        conn2, received2 = self.attach(session)
+        conn1.write_message('{"RequestId": 1, "Type": "Client"}')
+        conn2.write_message('{"RequestId": 1, "Type": "Client"}')
+        sent = self.get_sent(session)
+        self.assertEqual([1, 2], [data['RequestId'] for data in sent])
+        session.on_message('{"RequestId":2,"Response":{}}')
+        session.on_message('{"RequestId":1,"Response":{}}')
+        self.assertEqual(['{"RequestId":1,"Response":{}}'], received1)
+        self.assertEqual(['{"RequestId":1,"Response":{}}'], received2)
+
+    def test_unknown_response(self):
+        # Responses to unknown requests are discarded.
+        session = self.make_session()
+        _, received = self.attach(session)
+        session.on_message('{"RequestId":47,"Response":{}}')
+        self.assertEqual([], received)
+
+    def test_login_shared(self):
+        # Once logged in, the session is shared and subsequent login requests
+        # are replied using the cached login response.
+        multiplexer = multiplex.Multiplexer(io_loop=mock.Mock())
+        session = self.make_session(multiplexer=multiplexer)
+        self.login(session)
+        self.assertEqual({session.key: session}, multiplexer.sessions)
+        self.assertTrue(session.check_password('passwd'))
+        self.assertFalse(session.check_password('bad-wolf'))
+        _, received = self.login(session, request_id=47)
+        # The second login request is not sent to the Juju API.
+        self.assertEqual(1, session._connection.write_message.call_count)
+        self.assertEqual(
+            self.make_login_response(request_id=47), json.loads(received[0]))
+
+    def test_login_different_credentials(self):
+        # Login requests with credentials other than the ones of the session
+        # are rejected without sending them to the Juju API.
+        session = self.make_session()
+        connection, received = self.login(session)
+        for username, password in (('user', 'bad-wolf'), ('admin', 'passwd')):
+            connection.write_message(self.make_login_request(
+                request_id=47, username=username, password=password,
+                encoded=True))
+            self.assertEqual(
+                'invalid entity name or password',
+                json.loads(received[-1])['Error'])
+        self.assertEqual(1, session._connection.write_message.call_count)
+
+    def test_login_invalid_params(self):
+        # Login requests without valid credentials are rejected.
+        session = self.make_session()
+        connection, received = self.login(session)
+        connection.write_message(json.dumps({
+            'RequestId': 47, 'Type': 'Admin', 'Request': 'Login',
+            'Params': {'AuthTag': 'user', 'Password': None}}))
+        self.assertIn('Error', json.loads(received[-1]))
+
+    def test_admin_request_forwarded(self):
+        # Admin requests other than logins are sent to the Juju API.
+        session = self.make_session()
+        connection, received = self.login(session)
+        connection.write_message(json.dumps({
+            'RequestId': 47, 'Type': 'Admin', 'Request': 'RedirectInfo',
+            'Params': {}}))
+        sent = self.get_sent(session)[-1]
+        self.assertEqual('RedirectInfo', sent['Request'])
+        self.assertNotIn(sent['RequestId'], session._login_request_ids)
+        session.on_message(json.dumps(
+            {'RequestId': sent['RequestId'], 'Response': {}}))
+        self.assertEqual(
+            {'RequestId': 47, 'Response': {}}, json.loads(received[-1]))
+
+    def test_login_failure(self):
+        # Sessions are not shared if the login fails.
+        multiplexer = multiplex.Multiplexer(io_loop=mock.Mock())
+        session = self.make_session(multiplexer=multiplexer)
+        connection, received = self.attach(session)
+        connection.write_message(self.make_login_request(encoded=True))
+        session.on_message(self.make_login_response(
+            request_id=1, successful=False, encoded=True))
+        self.assertEqual({}, multiplexer.sessions)
+        self.assertFalse(session.check_password('passwd'))
+        self.assertEqual('Error', sorted(json.loads(received[0]))[0])
+
+    def test_detach_stops_watchers(self):
+        # The watchers started by a connection are stopped when the connection
+        # is closed.
+        session = self.make_session()
+        conn1, _ = self.attach(session)
+        self.attach(session)
+        conn1.write_message(json.dumps({
+            'RequestId': 5, 'Type': 'Client', 'Request': 'WatchAll',
+            'Version': 1, 'Params': {}}))
+        session.on_message('{"RequestId":1,"Response":{"AllWatcherId":"7"}}')
+        conn1.close()
+        expected = {
+            'RequestId': 2, 'Type': 'AllWatcher', 'Request': 'Stop',
+            'Id': '7', 'Version': 1}
+        self.assertEqual(expected, self.get_sent(session)[-1])
+        self.assertFalse(session._connection.close.called)
+
+    def test_detach_discards_responses(self):
+        # Pending responses for a closed connection are discarded.
+        session = self.make_session()
+        conn1, received = self.attach(session)
+        self.attach(session)
+        conn1.write_message('{"RequestId": 1, "Type": "Client"}')
+        conn1.close()
+        session.on_message('{"RequestId":1,"Response":{}}')
+        self.assertEqual([], received)
+        # Closed connections do not send messages.
+        conn1.write_message('{"RequestId": 2, "Type": "Client"}')
+        self.assertEqual(1, session._connection.write_message.call_count)
+
+    def test_last_detach_closes(self):
+        # The Juju API connection is closed when the last browser connection
+        # is detached.
+        multiplexer = multiplex.Multiplexer(io_loop=mock.Mock())
+        session = self.make_session(multiplexer=multiplexer)
+        connection, _ = self.login(session)
+        connection.close()
+        session._connection.close.assert_called_once_with()
+        self.assertEqual({}, multiplexer.sessions)
+
+    def test_juju_close(self):
+        # All the browser connections are notified when the Juju API closes
+        # the connection.
+        multiplexer = multiplex.Multiplexer(io_loop=mock.Mock())
+        session = self.make_session(multiplexer=multiplexer)
+        _, received1 = self.login(session)
+        _, received2 = self.attach(session)
+        session.on_message(None)
+        self.assertIsNone(received1[-1])
+        self.assertEqual([None], received2)
+        self.assertEqual({}, multiplexer.sessions)
+
+
+class TestMultiplexer(SessionTestMixin, LogTrapTestCase, AsyncTestCase):
+
+    def patch_websocket_connect(self):
+        """Mock the guiserver.multiplex.websocket_connect function."""
+        future = concurrent.Future()
+        future.set_result(mock.Mock())
+        return mock.patch(
+            'guiserver.multiplex.websocket_connect',
+            mock.Mock(return_value=future))
+
+    @gen_test
+    def test_new_session(self):
+        # A new session is created if no session is shared for the user.
+        multiplexer = multiplex.Multiplexer(io_loop=self.io_loop)
+        with self.patch_websocket_connect() as mock_websocket_connect:
+            connection = yield multiplexer.connect(
+                'wss://example.com', 'user', 'passwd', lambda message: None)
+        self.assertIsInstance(connection, multiplex.MultiplexedConnection)
+        self.assertEqual(1, mock_websocket_connect.call_count)
+        # The session is not shared until the user is logged in.
+        self.assertEqual({}, multiplexer.sessions)
+
+    @gen_test
+    def test_shared_session(self):
+        # A logged in session is shared if the credentials match.
+        multiplexer = multiplex.Multiplexer(io_loop=self.io_loop)
+        session = self.make_session(multiplexer=multiplexer)
+        self.login(session)
+        with self.patch_websocket_connect() as mock_websocket_connect:
+            connection = yield multiplexer.connect(
+                'wss://example.com', 'user', 'passwd', lambda message: None)
+        self.assertIs(session, connection._session)
+        self.assertFalse(mock_websocket_connect.called)
+
+    @gen_test
+    def test_invalid_password(self):
+        # A logged in session is not shared if the password does not match.
+        multiplexer = multiplex.Multiplexer(io_loop=self.io_loop)
+        session = self.make_session(multiplexer=multiplexer)
+        self.login(session)
+        with self.patch_websocket_connect() as mock_websocket_connect:
+            connection = yield multiplexer.connect(
+                'wss://example.com', 'user', 'bad-wolf', lambda message: None)
+        self.assertIsNot(session, connection._session)
+        self.assertEqual(1, mock_websocket_connect.call_count)
@@ -0,0 +1,184 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the Juju GUI server pool of Juju API connections."""
+
+import unittest
+
+import mock
+from tornado import concurrent
+from tornado.testing import (
+    AsyncTestCase,
+    LogTrapTestCase,
+)
+
+from guiserver import pool
+
+
+class TestPoolStats(unittest.TestCase):
+
+    def test_empty(self):
+        # Ratios and averages are None if no data is available.
+        expected = {
+            'hits': 0,
+            'misses': 0,
+            'hit_ratio': None,
+            'handshakes': 0,
+            'handshake_avg_ms': None,
+            'handshake_max_ms': 0,
+        }
+        self.assertEqual(expected, pool.PoolStats().as_dict())
+
+    def test_counters(self):
+        # Hit ratio and handshake latencies are correctly calculated.
+        stats = pool.PoolStats()
+        stats.hits = 3
+        stats.misses = 1
+        stats.add_handshake(0.1)
+        stats.add_handshake(0.3)
+        expected = {
+            'hits': 3,
+            'misses': 1,
+            'hit_ratio': 0.75,
+            'handshakes': 2,
+            'handshake_avg_ms': 200,
+            'handshake_max_ms': 300,
+        }
+        self.assertEqual(expected, stats.as_dict())
+
+
+class TestConnectionPool(LogTrapTestCase, AsyncTestCase):
+
+    url = 'wss://example.com/api'
+
+    def setUp(self):
+        super(TestConnectionPool, self).setUp()
+        pool.stats.reset()
+        self.addCleanup(pool.stats.reset)
+        self.connections = []
+        self.futures = []
+        patcher = mock.patch(
+            'guiserver.pool.websocket_connect', self.websocket_connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def websocket_connect(
+            self, io_loop, url, on_message_callback, headers=None,
+            compression=None):
+        """Simulate a connection, whose Future must be manually resolved."""
+        conn = mock.Mock(
+            url=url, on_message_callback=on_message_callback, headers=headers)
+        self.connections.append(conn)
+        future = concurrent.Future()
+        self.futures.append(future)
+        return future
+
+    def resolve(self):
+        """Resolve all the connection futures and run the callbacks."""
+        for conn, future in zip(self.connections, self.futures):
+            if not future.done():
+                future.set_result(conn)
+        self.io_loop.add_callback(self.stop)
+        self.wait()
+
+    def test_miss(self):
+        # A new connection is established if no idle ones are available, and
+        # the pool is filled.
+        connection_pool = pool.ConnectionPool(3, io_loop=self.io_loop)
+        future = connection_pool.connect(self.url, None)
+        self.assertEqual(3, len(self.connections))
+        self.resolve()
+        self.assertIs(self.connections[0], future.result())
+        self.assertEqual(1, pool.stats.misses)
+        self.assertEqual(3, pool.stats.handshakes)
+
+    def test_cold_miss(self):
+        # The first connection for a key counts toward the pool size.
+        connection_pool = pool.ConnectionPool(1, io_loop=self.io_loop)
+        connection_pool.connect(self.url, None)
+        self.assertEqual(1, len(self.connections))
+        self.resolve()
+        # The pool is filled if another connection is requested.
+        connection_pool.connect(self.url, None)
+        self.assertEqual(3, len(self.connections))
+        self.resolve()
+        self.assertEqual(2, pool.stats.misses)
+        future = connection_pool.connect(self.url, None)
+        self.assertIs(self.connections[2], future.result())
+        self.assertEqual(1, pool.stats.hits)
+
+    def test_hit(self):
+        # Idle connections are returned when available, and the pool is
+        # refilled.
+        connection_pool = pool.ConnectionPool(2, io_loop=self.io_loop)
+        connection_pool.connect(self.url, None)
+        self.resolve()
+        callback = mock.Mock()
+        future = connection_pool.connect(self.url, callback)
+        conn = future.result()
+        self.assertIs(self.connections[1], conn)
+        conn.set_on_message_callback.assert_called_once_with(callback)
+        self.assertEqual(1, pool.stats.hits)
+        self.assertEqual(4, len(self.connections))
+
+    def test_headers(self):
+        # Idle connections are only returned to callers sending the headers
+        # used to establish them.
+        connection_pool = pool.ConnectionPool(2, io_loop=self.io_loop)
+        connection_pool.connect(
+            self.url, None, headers={'Origin': 'https://example.com'})
+        self.resolve()
+        self.assertEqual(
+            {'Origin': 'https://example.com'}, self.connections[1].headers)
+        connection_pool.connect(
+            self.url, None, headers={'Origin': 'https://evil.example.com'})
+        self.assertEqual(
+            {'Origin': 'https://evil.example.com'},
+            self.connections[2].headers)
+        self.assertEqual(0, pool.stats.hits)
+        self.assertEqual(2, pool.stats.misses)
+        future = connection_pool.connect(
+            self.url, None, headers={'Origin': 'https://example.com'})
+        self.assertIs(self.connections[1], future.result())
+        self.assertEqual(1, pool.stats.hits)
+
+    def test_idle_connection_closed(self):
+        # Idle connections closed by Juju are removed from the pool.
+        connection_pool = pool.ConnectionPool(2, io_loop=self.io_loop)
+        connection_pool.connect(self.url, None)
+        self.resolve()
+        self.connections[1].on_message_callback(None)
+        connection_pool.connect(self.url, None)
+        self.assertEqual(0, pool.stats.hits)
+        self.assertEqual(2, pool.stats.misses)
+
+    def test_connection_error(self):
+        # Failed connections are not added to the pool.
+        connection_pool = pool.ConnectionPool(2, io_loop=self.io_loop)
+        connection_pool.connect(self.url, None)
+        self.futures[1].set_exception(ValueError('bad wolf'))
+        self.resolve()
+        connection_pool.connect(self.url, None)
+        self.assertEqual(2, pool.stats.misses)
+
+    def test_eviction(self):
+        # Idle connections to the least recently used URLs are closed.
+        connection_pool = pool.ConnectionPool(2, io_loop=self.io_loop)
+        for num in range(pool.MAX_TARGETS + 1):
+            connection_pool.connect('{}/{}'.format(self.url, num), None)
+            self.resolve()
+        self.connections[1].close.assert_called_once_with()
+        self.assertEqual(pool.MAX_TARGETS, len(connection_pool._idle))
@@ -0,0 +1,139 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the Juju GUI server sampling profiler."""
+
+import os
+import shutil
+import sys
+import tempfile
+import thread
+import unittest
+
+import mock
+from tornado.testing import (
+    ExpectLog,
+    LogTrapTestCase,
+)
+
+from guiserver import profiler
+
+
+class TestCollapse(unittest.TestCase):
+
+    def test_stack(self):
+        # The stack is collapsed root first.
+        stack = profiler.collapse(sys._getframe())
+        names = stack.split(';')
+        self.assertEqual('test_profiler.py:test_stack', names[-1])
+        self.assertGreater(len(names), 1)
+
+
+class ProfilerTestMixin(object):
+
+    def setUp(self):
+        super(ProfilerTestMixin, self).setUp()
+        profiler.stats.reset()
+        self.addCleanup(profiler.stats.reset)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+
+class TestSampler(ProfilerTestMixin, LogTrapTestCase, unittest.TestCase):
+
+    def make_sampler(self, duration=0):
+        """Return a sampler of the current thread."""
+        path = os.path.join(self.directory, 'profile.collapsed')
+        return profiler.Sampler(
+            thread.get_ident(), duration, path, interval=0)
+
+    def test_sample(self):
+        # The stack of the sampled thread is recorded.
+        sampler = self.make_sampler()
+        sampler.sample()
+        sampler.sample()
+        self.assertEqual(1, len(sampler.stacks))
+        stack, count = sampler.stacks.items()[0]
+        # The current thread is sampled while running the sampler itself.
+        self.assertTrue(stack.endswith(
+            'test_profiler.py:test_sample;profiler.py:sample'))
+        self.assertEqual(2, count)
+
+    def test_unknown_thread(self):
+        # Nothing is recorded if the sampled thread is gone.
+        sampler = self.make_sampler()
+        sampler.thread_id = -1
+        sampler.sample()
+        self.assertEqual({}, sampler.stacks)
+
+    def test_run(self):
+        # The collapsed stacks are written to the file.
+        sampler = self.make_sampler()
+        sampler.stacks.update({'a;b': 2, 'a;c': 1})
+        with ExpectLog('', '.*3 samples written to .*', required=True):
+            sampler.run()
+        with open(sampler.path) as profile:
+            self.assertEqual('a;b 2\na;c 1\n', profile.read())
+        self.assertEqual({'profiles': 1, 'samples': 3},
+                         profiler.stats.as_dict())
+
+    def test_run_duration(self):
+        # The thread is sampled until the duration elapses.
+        sampler = self.make_sampler(duration=10)
+        mock_time = mock.Mock()
+        mock_time.time.side_effect = [0, 4, 8, 12]
+        with \
+                mock.patch('guiserver.profiler.time', mock_time), \
+                mock.patch.object(sampler, 'sample') as mock_sample:
+            sampler.run()
+        self.assertEqual(2, mock_sample.call_count)
+
+    def test_write_error(self):
+        # Errors writing the profile are logged.
+        sampler = self.make_sampler()
+        sampler.path = os.path.join(self.directory, 'no-such-dir', 'profile')
+        with ExpectLog('', '.*profiler: cannot write .*', required=True):
+            sampler.run()
+        self.assertEqual(0, profiler.stats.profiles)
+
+
+class TestStart(ProfilerTestMixin, LogTrapTestCase, unittest.TestCase):
+
+    def setUp(self):
+        super(TestStart, self).setUp()
+        self.addCleanup(setattr, profiler, '_sampler', None)
+
+    def test_start(self):
+        # The profile of the calling thread is written in the directory.
+        path = profiler.start(0.05, self.directory, interval=0.001)
+        self.assertTrue(path.startswith(self.directory))
+        self.assertTrue(path.endswith('.collapsed'))
+        profiler._sampler._thread.join()
+        self.assertFalse(profiler.is_running())
+        with open(path) as profile:
+            contents = profile.read()
+        self.assertIn('test_profiler.py:test_start', contents)
+        self.assertEqual(1, profiler.stats.profiles)
+
+    def test_already_running(self):
+        # Only one profile can be collected at a time.
+        profiler.start(10, self.directory)
+        self.assertTrue(profiler.is_running())
+        profiler._sampler.duration = 0
+        with ExpectLog('', '.*profiler: already running', required=True):
+            self.assertIsNone(profiler.start(10, self.directory))
+        profiler._sampler._thread.join()
@@ -0,0 +1,77 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the Juju GUI server bounded message queues."""
+
+import unittest
+
+from guiserver import queues
+
+
+class TestMessageQueue(unittest.TestCase):
+
+    def setUp(self):
+        queues.stats.reset()
+        self.addCleanup(queues.stats.reset)
+
+    def test_append(self):
+        # Messages are queued in order, and their size is tracked.
+        queue = queues.MessageQueue()
+        self.assertTrue(queue.append('foo'))
+        self.assertTrue(queue.append('bar!'))
+        self.assertEqual(2, len(queue))
+        self.assertEqual('foo', queue[0])
+        self.assertEqual(7, queue.size)
+        self.assertEqual(
+            {'messages': 2, 'size': 7, 'overflows': 0},
+            queues.stats.as_dict())
+
+    def test_max_messages(self):
+        # Messages are rejected if the queue is full.
+        queue = queues.MessageQueue(max_messages=1)
+        self.assertTrue(queue.append('foo'))
+        self.assertFalse(queue.append('bar'))
+        self.assertEqual(1, len(queue))
+        self.assertEqual(1, queues.stats.overflows)
+
+    def test_max_size(self):
+        # Messages are rejected if they exceed the maximum size.
+        queue = queues.MessageQueue(max_size=5)
+        self.assertTrue(queue.append('foo'))
+        self.assertFalse(queue.append('bar'))
+        self.assertTrue(queue.append('ba'))
+        self.assertEqual(['foo', 'ba'], queue.popall())
+
+    def test_popall(self):
+        # All the messages are returned and removed from the queue.
+        queue = queues.MessageQueue()
+        queue.append('foo')
+        queue.append('bar')
+        self.assertEqual(['foo', 'bar'], queue.popall())
+        self.assertEqual(0, len(queue))
+        self.assertEqual(0, queue.size)
+        self.assertEqual(
+            {'messages': 0, 'size': 0, 'overflows': 0},
+            queues.stats.as_dict())
+
+    def test_clear(self):
+        # Clearing the queue updates the counters.
+        queue = queues.MessageQueue()
+        queue.append('foo')
+        queue.clear()
+        self.assertEqual(0, len(queue))
+        self.assertEqual(0, queues.stats.messages)
+        self.assertEqual(0, queues.stats.size)
@@ -0,0 +1,109 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the Juju GUI server reconnection support."""
+
+import unittest
+
+from guiserver import reconnect
+
+
+class TestReconnectPolicy(unittest.TestCase):
+
+    def test_urls(self):
+        # Alternative controllers are tried before the original one.
+        policy = reconnect.ReconnectPolicy(
+            1, addresses=['1.2.3.4:17070', '4.3.2.1:17070'])
+        urls = policy.get_urls('wss://1.1.1.1:17070/model/uuid/api')
+        expected = [
+            'wss://1.2.3.4:17070/model/uuid/api',
+            'wss://4.3.2.1:17070/model/uuid/api',
+            'wss://1.1.1.1:17070/model/uuid/api',
+        ]
+        self.assertEqual(expected, urls)
+
+    def test_urls_duplicates(self):
+        # Each URL is only returned once.
+        policy = reconnect.ReconnectPolicy(
+            1, addresses=['1.1.1.1:17070', '1.2.3.4:17070', '1.2.3.4:17070'])
+        urls = policy.get_urls('wss://1.1.1.1:17070/api')
+        self.assertEqual(
+            ['wss://1.2.3.4:17070/api', 'wss://1.1.1.1:17070/api'], urls)
+
+    def test_urls_no_addresses(self):
+        # Without alternative addresses, the original URL is used.
+        policy = reconnect.ReconnectPolicy(1)
+        self.assertEqual(['wss://1.1.1.1/api'], policy.get_urls(
+            'wss://1.1.1.1/api'))
+
+    def test_invalid_attempts(self):
+        # At least one attempt is required.
+        with self.assertRaises(ValueError):
+            reconnect.ReconnectPolicy(0)
+
+
+class TestIsIdempotent(unittest.TestCase):
+
+    def test_idempotent(self):
+        # Requests only reading data are idempotent.
+        for request in ('FullStatus', 'GetAnnotations', 'ListKeys',
+                        'ModelInfo', 'ModelGet'):
+            message = '{{"Type": "Client", "Request": "{}"}}'.format(request)
+            self.assertTrue(reconnect.is_idempotent(message), request)
+
+    def test_not_idempotent(self):
+        # Other requests, including watcher requests, are not idempotent.
+        for request in ('AddMachines', 'Next', 'WatchAll', 'Login'):
+            message = '{{"Type": "Client", "Request": "{}"}}'.format(request)
+            self.assertFalse(reconnect.is_idempotent(message), request)
+
+
+class TestPendingRequests(unittest.TestCase):
+
+    def test_pending(self):
+        # Requests are pending until a response is received.
+        requests = reconnect.PendingRequests()
+        requests.sent('{"RequestId": 2, "Request": "Foo"}')
+        requests.sent('{"RequestId": 1, "Request": "Bar"}')
+        requests.sent('{"RequestId": 3, "Request": "Baz"}')
+        requests.received('{"RequestId": 3, "Response": {}}')
+        self.assertEqual(2, len(requests))
+        expected = [
+            (1, '{"RequestId": 1, "Request": "Bar"}'),
+            (2, '{"RequestId": 2, "Request": "Foo"}'),
+        ]
+        self.assertEqual(expected, requests.popall())
+        self.assertEqual(0, len(requests))
+
+    def test_no_request_id(self):
+        # Messages without a request identifier are ignored.
+        requests = reconnect.PendingRequests()
+        requests.sent('{"Request": "Foo"}')
+        requests.received('{"Response": {}}')
+        self.assertEqual(0, len(requests))
+
+
+class TestReconnectStats(unittest.TestCase):
+
+    def test_reset(self):
+        # The counters can be reset.
+        stats = reconnect.ReconnectStats()
+        stats.reconnections = stats.failures = 2
+        stats.reset()
+        expected = {
+            'reconnections': 0, 'failures': 0, 'reissued': 0, 'failed': 0}
+        self.assertEqual(expected, stats.as_dict())
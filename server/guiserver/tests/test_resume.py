@@ -0,0 +1,222 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the Juju GUI server session resumption support."""
+
+import json
+import unittest
+
+import mock
+from tornado.testing import LogTrapTestCase
+
+from guiserver import resume
+
+
+def make_next_response(request_id, *deltas):
+    """Return an encoded AllWatcher Next response with the given deltas."""
+    return json.dumps({'RequestId': request_id, 'Response': {
+        'deltas': [list(delta) for delta in deltas]}})
+
+
+class WatcherCacheTestMixin(object):
+    """Set up a cache tracking a started watcher."""
+
+    watch_all = json.dumps(
+        {'RequestId': 1, 'Type': 'Client', 'Request': 'WatchAll'})
+    watch_all_response = json.dumps(
+        {'RequestId': 1, 'Response': {'AllWatcherId': '42'}})
+
+    def setUp(self):
+        super(WatcherCacheTestMixin, self).setUp()
+        self.cache = resume.WatcherCache()
+        self.write_message = mock.Mock()
+        self.assertFalse(
+            self.cache.handle_request(self.watch_all, self.write_message))
+        self.assertFalse(self.cache.handle_response(
+            self.watch_all_response, self.write_message))
+
+    def next(self, request_id):
+        """Send a browser Next request to the cache."""
+        message = json.dumps({
+            'RequestId': request_id, 'Type': 'AllWatcher', 'Request': 'Next',
+            'Id': '42'})
+        return self.cache.handle_request(message, self.write_message)
+
+
+class TestWatcherCache(WatcherCacheTestMixin, unittest.TestCase):
+
+    def test_watcher_started(self):
+        # The watcher id is stored.
+        self.assertEqual('42', self.cache.watcher_id)
+
+    def test_deltas(self):
+        # Deltas are applied to the snapshot and propagated to the browser.
+        self.assertFalse(self.next(2))
+        response = make_next_response(
+            2, ('unit', 'change', {'id': 'a/0'}),
+            ('unit', 'change', {'id': 'a/1'}))
+        self.assertFalse(
+            self.cache.handle_response(response, self.write_message))
+        self.assertFalse(self.next(3))
+        response = make_next_response(3, ('unit', 'remove', {'id': 'a/0'}))
+        self.assertFalse(
+            self.cache.handle_response(response, self.write_message))
+        self.assertEqual(
+            [('unit', 'a/1')], list(self.cache.snapshot.keys()))
+        self.assertFalse(self.write_message.called)
+
+    def test_other_responses(self):
+        # Other responses are ignored.
+        self.next(2)
+        response = make_next_response(3, ('unit', 'change', {'id': 'a/0'}))
+        self.assertFalse(
+            self.cache.handle_response(response, self.write_message))
+        self.assertEqual(0, len(self.cache.snapshot))
+
+    def test_stop(self):
+        # The watcher is forgotten when stopped by the browser.
+        message = json.dumps({
+            'RequestId': 2, 'Type': 'AllWatcher', 'Request': 'Stop',
+            'Id': '42'})
+        self.assertFalse(
+            self.cache.handle_request(message, self.write_message))
+        self.assertIsNone(self.cache.watcher_id)
+        self.assertIsNone(self.cache.next_request())
+
+    def test_error(self):
+        # The watcher is forgotten if an error is returned.
+        self.next(2)
+        response = json.dumps({'RequestId': 2, 'Error': 'bad wolf'})
+        self.assertFalse(
+            self.cache.handle_response(response, self.write_message))
+        self.assertIsNone(self.cache.watcher_id)
+
+    def test_next_request(self):
+        # The cache requests deltas when no other requests are in progress.
+        self.next(2)
+        self.assertIsNone(self.cache.next_request())
+        self.cache.handle_response(make_next_response(2), self.write_message)
+        request = json.loads(self.cache.next_request())
+        expected = {
+            'RequestId': resume.REQUEST_ID_BASE, 'Type': 'AllWatcher',
+            'Request': 'Next', 'Id': '42'}
+        self.assertEqual(expected, request)
+        self.assertIsNone(self.cache.next_request())
+        # Responses to these requests are consumed by the cache.
+        response = make_next_response(
+            resume.REQUEST_ID_BASE, ('unit', 'change', {'id': 'a/0'}))
+        self.assertTrue(
+            self.cache.handle_response(response, self.write_message))
+        self.assertEqual(1, len(self.cache.snapshot))
+
+    def test_park(self):
+        # Responses to browser requests are consumed once parked.
+        self.next(2)
+        self.cache.park()
+        response = make_next_response(2, ('unit', 'change', {'id': 'a/0'}))
+        self.assertTrue(
+            self.cache.handle_response(response, self.write_message))
+        self.assertEqual(1, len(self.cache.snapshot))
+
+    def test_resume(self):
+        # A resumed browser reuses the watcher and receives the snapshot.
+        self.next(2)
+        self.cache.handle_response(make_next_response(
+            2, ('unit', 'change', {'id': 'a/0'})), self.write_message)
+        self.cache.park()
+        self.cache.resume()
+        self.assertTrue(
+            self.cache.handle_request(self.watch_all, self.write_message))
+        response = json.loads(self.write_message.call_args[0][0])
+        self.assertEqual(
+            {'RequestId': 1, 'Response': {'AllWatcherId': '42'}}, response)
+        self.assertTrue(self.next(2))
+        response = json.loads(self.write_message.call_args[0][0])
+        expected = {'RequestId': 2, 'Response': {
+            'deltas': [['unit', 'change', {'id': 'a/0'}]]}}
+        self.assertEqual(expected, response)
+        # Subsequent requests are propagated to Juju.
+        self.assertFalse(self.next(3))
+
+    def test_resume_in_flight(self):
+        # The snapshot is sent once the in flight deltas are received.
+        self.cache.park()
+        self.cache.next_request()
+        self.cache.resume()
+        self.assertTrue(self.next(2))
+        self.assertFalse(self.write_message.called)
+        response = make_next_response(
+            resume.REQUEST_ID_BASE, ('unit', 'change', {'id': 'a/0'}))
+        self.assertTrue(
+            self.cache.handle_response(response, self.write_message))
+        response = json.loads(self.write_message.call_args[0][0])
+        expected = {'RequestId': 2, 'Response': {
+            'deltas': [['unit', 'change', {'id': 'a/0'}]]}}
+        self.assertEqual(expected, response)
+
+
+class TestParkedSession(WatcherCacheTestMixin, LogTrapTestCase):
+
+    def setUp(self):
+        super(TestParkedSession, self).setUp()
+        resume.stats.reset()
+        self.addCleanup(resume.stats.reset)
+        self.connection = mock.Mock()
+        self.session = resume.ParkedSession(
+            self.connection, 'user', 'passwd', 'login', {'Response': {}},
+            watchers=self.cache)
+
+    def test_park(self):
+        # Parked sessions keep retrieving deltas.
+        self.session.park()
+        self.connection.set_on_message_callback.assert_called_once_with(
+            self.session.on_message)
+        request = json.loads(self.connection.write_message.call_args[0][0])
+        self.assertEqual(resume.REQUEST_ID_BASE, request['RequestId'])
+        self.session.on_message(make_next_response(resume.REQUEST_ID_BASE))
+        request = json.loads(self.connection.write_message.call_args[0][0])
+        self.assertEqual(resume.REQUEST_ID_BASE + 1, request['RequestId'])
+        self.assertEqual(1, resume.stats.parked)
+
+    def test_resume(self):
+        # Sessions are handed over to the resuming browser connection.
+        self.session.park()
+        callback = mock.Mock()
+        self.assertTrue(self.session.resume(callback))
+        self.connection.set_on_message_callback.assert_called_with(callback)
+        self.assertEqual(
+            {'parked': 0, 'resumed': 1, 'expired': 0},
+            resume.stats.as_dict())
+
+    def test_expire(self):
+        # The connection is closed when the session expires.
+        self.session.park()
+        self.session.expire()
+        self.connection.close.assert_called_once_with()
+        self.assertFalse(self.session.resume(mock.Mock()))
+        self.assertEqual(
+            {'parked': 0, 'resumed': 0, 'expired': 1},
+            resume.stats.as_dict())
+
+    def test_closed_by_juju(self):
+        # Sessions closed by Juju cannot be resumed.
+        self.session.park()
+        self.session.on_message(None)
+        self.assertFalse(self.session.resume(mock.Mock()))
+        self.session.expire()
+        self.assertFalse(self.connection.close.called)
+        self.assertEqual(0, resume.stats.parked)
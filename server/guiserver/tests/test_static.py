@@ -0,0 +1,289 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the Juju GUI server static files handler."""
+
+import gzip
+import json
+import mimetypes
+import os
+import shutil
+import tempfile
+import unittest
+
+from tornado import web
+from tornado.testing import (
+    AsyncHTTPTestCase,
+    ExpectLog,
+    LogTrapTestCase,
+)
+
+from guiserver import static
+
+
+class TestStaticFileHandler(LogTrapTestCase, AsyncHTTPTestCase):
+
+    def setUp(self):
+        # Set up a static path with some files in it.
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.large_contents = ''.join(
+            '{:08d}\n'.format(num) for num in range(50000))
+        self.make_file('large.txt', self.large_contents)
+        self.make_file('app.js', 'var answer = 42;')
+        self.make_file('app.js.gz', 'var answer = 42;', compressed=True)
+        self.make_file('8f4e2a1c/app.css', 'body {}')
+        super(TestStaticFileHandler, self).setUp()
+
+    def get_app(self):
+        return web.Application([
+            (r'/static/(.*)', static.StaticFileHandler, {'path': self.path}),
+        ])
+
+    def make_file(self, name, contents, compressed=False):
+        """Create a file with the given name and contents."""
+        path = os.path.join(self.path, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open_file = gzip.open if compressed else open
+        with open_file(path, 'wb') as static_file:
+            static_file.write(contents)
+
+    def test_large_file(self):
+        # Large files are streamed in chunks.
+        response = self.fetch('/static/large.txt')
+        self.assertEqual(200, response.code)
+        self.assertEqual(self.large_contents, response.body)
+        self.assertEqual(
+            str(len(self.large_contents)), response.headers['Content-Length'])
+        self.assertEqual('text/plain', response.headers['Content-Type'])
+        self.assertIn('Etag', response.headers)
+
+    def test_not_found(self):
+        # A 404 is returned for missing files.
+        response = self.fetch('/static/no-such.js')
+        self.assertEqual(404, response.code)
+
+    def test_head(self):
+        # HEAD requests get the headers only.
+        response = self.fetch('/static/large.txt', method='HEAD')
+        self.assertEqual(200, response.code)
+        self.assertEqual('', response.body)
+        self.assertEqual(
+            str(len(self.large_contents)), response.headers['Content-Length'])
+
+    def test_range(self):
+        # Range requests are supported.
+        response = self.fetch(
+            '/static/large.txt', headers={'Range': 'bytes=9-17'})
+        self.assertEqual(206, response.code)
+        self.assertEqual('00000001\n', response.body)
+        self.assertEqual(
+            'bytes 9-17/{}'.format(len(self.large_contents)),
+            response.headers['Content-Range'])
+
+    def test_range_not_satisfiable(self):
+        # Invalid ranges are rejected.
+        response = self.fetch(
+            '/static/app.js', headers={'Range': 'bytes=1000-'})
+        self.assertEqual(416, response.code)
+
+    def test_not_modified(self):
+        # Conditional requests for unmodified files get a 304.
+        response = self.fetch('/static/large.txt')
+        response = self.fetch('/static/large.txt', headers={
+            'If-None-Match': response.headers['Etag']})
+        self.assertEqual(304, response.code)
+
+    def test_gzip(self):
+        # Precompressed variants are sent to clients accepting gzip.
+        response = self.fetch('/static/app.js', use_gzip=False, headers={
+            'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(200, response.code)
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual('Accept-Encoding', response.headers['Vary'])
+        # The content type is the one of the uncompressed file.
+        self.assertEqual(
+            mimetypes.guess_type('app.js')[0],
+            response.headers['Content-Type'])
+        with open(os.path.join(self.path, 'app.js.gz'), 'rb') as gzip_file:
+            self.assertEqual(gzip_file.read(), response.body)
+
+    def test_gzip_not_accepted(self):
+        # Uncompressed files are sent to clients not accepting gzip.
+        response = self.fetch('/static/app.js', use_gzip=False)
+        self.assertEqual('var answer = 42;', response.body)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual('Accept-Encoding', response.headers['Vary'])
+
+    def test_gzip_refused(self):
+        # Uncompressed files are sent to clients refusing gzip.
+        response = self.fetch('/static/app.js', use_gzip=False, headers={
+            'Accept-Encoding': 'deflate, gzip;q=0'})
+        self.assertEqual('var answer = 42;', response.body)
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_gzip_range(self):
+        # Range requests are served using the uncompressed file.
+        response = self.fetch('/static/app.js', use_gzip=False, headers={
+            'Accept-Encoding': 'gzip', 'Range': 'bytes=0-2'})
+        self.assertEqual(206, response.code)
+        self.assertEqual('var', response.body)
+
+    def test_version_argument(self):
+        # Files requested with a version argument are cached forever.
+        response = self.fetch('/static/app.js?v=42')
+        self.assertEqual(200, response.code)
+        self.assertEqual(
+            'public, max-age={}, immutable'.format(
+                static.StaticFileHandler.CACHE_MAX_AGE),
+            response.headers['Cache-Control'])
+        self.assertIn('Expires', response.headers)
+
+    def test_not_versioned(self):
+        # Other files must be revalidated.
+        response = self.fetch('/static/app.js')
+        self.assertNotIn('Cache-Control', response.headers)
+        self.assertNotIn('Expires', response.headers)
+
+    def test_hash_like_path(self):
+        # Hexadecimal path segments are not versions without a manifest.
+        response = self.fetch('/static/8f4e2a1c/app.css')
+        self.assertEqual(200, response.code)
+        self.assertNotIn('Cache-Control', response.headers)
+
+
+class TestStaticFileHandlerManifest(LogTrapTestCase, AsyncHTTPTestCase):
+
+    def setUp(self):
+        # Set up a static path with a manifest in it.
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        names = (
+            'app.js', 'app.js.gz', 'style.css', 'style.css.gz',
+            'app.8f4e2a1c.js', 'deadbeef.js')
+        for name in names:
+            with open(os.path.join(self.path, name), 'w') as static_file:
+                static_file.write(name)
+        self.manifest = {
+            'app.js': {'sha256': 'js-hash', 'gzip_sha256': 'gz-hash'},
+            # The style.css.gz file is not listed in the manifest.
+            'style.css': {'sha256': 'css-hash'},
+            'app.8f4e2a1c.js': {'sha256': '8f4e2a1c9b'},
+            'deadbeef.js': {'sha256': '0123456789'},
+        }
+        with open(os.path.join(self.path, static.MANIFEST), 'w') as f:
+            json.dump(self.manifest, f)
+        super(TestStaticFileHandlerManifest, self).setUp()
+
+    def get_app(self):
+        options = {
+            'path': self.path,
+            'manifest': static.load_manifest(self.path),
+        }
+        return web.Application([
+            (r'/static/(.*)', static.StaticFileHandler, options),
+        ])
+
+    def test_load_manifest(self):
+        # The manifest is loaded from the static directory.
+        self.assertEqual(self.manifest, static.load_manifest(self.path))
+
+    def test_missing_manifest(self):
+        # None is returned if the manifest is missing.
+        os.remove(os.path.join(self.path, static.MANIFEST))
+        self.assertIsNone(static.load_manifest(self.path))
+
+    def test_invalid_manifest(self):
+        # None is returned if the manifest is not valid.
+        with open(os.path.join(self.path, static.MANIFEST), 'w') as f:
+            f.write('bad wolf')
+        with ExpectLog('', 'static: cannot load', required=True):
+            self.assertIsNone(static.load_manifest(self.path))
+
+    def test_etag(self):
+        # ETags are computed using the hashes in the manifest.
+        response = self.fetch('/static/app.js', use_gzip=False)
+        self.assertEqual('app.js', response.body)
+        self.assertEqual('"js-hash"', response.headers['Etag'])
+
+    def test_gzip(self):
+        # Precompressed variants are listed in the manifest.
+        response = self.fetch('/static/app.js', use_gzip=False, headers={
+            'Accept-Encoding': 'gzip'})
+        self.assertEqual('app.js.gz', response.body)
+        self.assertEqual('"gz-hash"', response.headers['Etag'])
+
+    def test_gzip_not_listed(self):
+        # Variants not listed in the manifest are not used.
+        response = self.fetch('/static/style.css', use_gzip=False, headers={
+            'Accept-Encoding': 'gzip'})
+        self.assertEqual('style.css', response.body)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual('"css-hash"', response.headers['Etag'])
+
+    def test_versioned(self):
+        # Files whose name includes the hash of their contents are cached
+        # forever.
+        response = self.fetch('/static/app.8f4e2a1c.js')
+        self.assertEqual('app.8f4e2a1c.js', response.body)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+    def test_not_versioned(self):
+        # Hexadecimal file names not matching the contents hash are not
+        # versions.
+        response = self.fetch('/static/deadbeef.js')
+        self.assertEqual('deadbeef.js', response.body)
+        self.assertNotIn('Cache-Control', response.headers)
+
+
+class TestAcceptsGzip(unittest.TestCase):
+
+    def test_accepted(self):
+        # Gzip is accepted if listed with a non-zero quality value.
+        for header in (
+                'gzip', 'deflate, gzip', 'GZIP;q=0.5', 'x-gzip', '*',
+                'gzip ; q=1, *;q=0'):
+            self.assertTrue(static.accepts_gzip(header), header)
+
+    def test_not_accepted(self):
+        # Gzip is not accepted if missing, or if its quality value is zero.
+        for header in (
+                '', 'deflate', 'identity', 'gzip;q=0', 'gzip;q=0.0, *',
+                '*;q=0', 'gzip;q=bad', 'gzipped'):
+            self.assertFalse(static.accepts_gzip(header), header)
+
+
+class TestIncludesHash(unittest.TestCase):
+
+    def test_included(self):
+        # File names including a prefix of the hash are recognized.
+        paths = ('app.8f4e2a1c.js', 'build/8f4e2a1c9b.css', 'app-8f4e2a1c')
+        for path in paths:
+            self.assertTrue(static.includes_hash(path, '8f4e2a1c9b'), path)
+
+    def test_not_included(self):
+        # Other file names, and hashes in directory names, are ignored.
+        paths = (
+            'app.js', '8f4e2a1c/app.js', 'app.8f4e2a.js', 'app.deadbeef.js',
+            '20161016.js')
+        for path in paths:
+            self.assertFalse(static.includes_hash(path, '8f4e2a1c9b'), path)
+
+    def test_no_hash(self):
+        # Files without a known hash are not versioned.
+        self.assertFalse(static.includes_hash('app.8f4e2a1c.js', None))
@@ -0,0 +1,245 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the Juju GUI server token stores."""
+
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from tornado.testing import (
+    ExpectLog,
+    LogTrapTestCase,
+)
+
+from guiserver import stores
+
+
+class TestEncoding(unittest.TestCase):
+
+    def test_small_value(self):
+        # Small values are not compressed.
+        compressed, data = stores.encode({'username': 'who'})
+        self.assertFalse(compressed)
+        self.assertEqual({'username': 'who'}, stores.decode(compressed, data))
+
+    def test_large_value(self):
+        # Large values are compressed.
+        value = [{'id': 'deploy-{}'.format(num)} for num in range(1000)]
+        compressed, data = stores.encode(value, compress_size=100)
+        self.assertTrue(compressed)
+        self.assertLess(len(data), len(json.dumps(value)))
+        self.assertEqual(value, stores.decode(compressed, data))
+
+
+class TokenStoreTestMixin(object):
+    """Common tests for token stores.
+
+    Subclasses must define a make_store() method returning the store.
+    """
+
+    def setUp(self):
+        super(TokenStoreTestMixin, self).setUp()
+        self.store = self.make_store()
+
+    def test_put_and_pop(self):
+        # Stored values can be retrieved only once.
+        self.store.put('DEFACED', {'username': 'who'}, 60)
+        self.assertIn('DEFACED', self.store)
+        self.assertEqual(1, len(self.store))
+        self.assertEqual({'username': 'who'}, self.store.pop('DEFACED'))
+        self.assertNotIn('DEFACED', self.store)
+        self.assertIsNone(self.store.pop('DEFACED'))
+
+    def test_unknown_token(self):
+        # None is returned for unknown tokens.
+        self.assertIsNone(self.store.pop('no-such'))
+
+    def test_timedelta(self):
+        # The time to live can be provided as a timedelta.
+        self.store.put('DEFACED', 42, datetime.timedelta(minutes=2))
+        self.assertEqual(42, self.store.pop('DEFACED'))
+
+    def test_compressed(self):
+        # Large values are transparently compressed.
+        value = ['change {}'.format(num) for num in range(1000)]
+        self.store.put('DEFACED', value, 60)
+        self.assertEqual(value, self.store.pop('DEFACED'))
+
+    def test_expired(self):
+        # Expired tokens cannot be used.
+        with mock.patch('time.time', mock.Mock(return_value=1000)):
+            self.store.put('DEFACED', 42, 60)
+        with mock.patch('time.time', mock.Mock(return_value=1060)):
+            self.assertIsNone(self.store.pop('DEFACED'))
+
+    def test_discard(self):
+        # Tokens can be removed without being used.
+        self.store.put('DEFACED', 42, 60)
+        self.store.discard('DEFACED')
+        self.store.discard('no-such')
+        self.assertIsNone(self.store.pop('DEFACED'))
+
+    def test_purge(self):
+        # Expired tokens are purged.
+        with mock.patch('time.time', mock.Mock(return_value=1000)):
+            self.store.put('old', 1, 60)
+            self.store.put('new', 2, 120)
+        with mock.patch('time.time', mock.Mock(return_value=1100)):
+            self.assertEqual(1, self.store.purge())
+            self.assertEqual(1, len(self.store))
+            self.assertEqual(2, self.store.pop('new'))
+
+
+class TestMemoryTokenStore(TokenStoreTestMixin, unittest.TestCase):
+
+    def make_store(self):
+        return stores.MemoryTokenStore()
+
+    def test_shared_dict(self):
+        # Tokens are stored in the given dict.
+        data = {}
+        store = stores.MemoryTokenStore(data)
+        store.put('DEFACED', 42, 60)
+        self.assertEqual(['DEFACED'], list(data))
+
+
+class TestSQLiteTokenStore(TokenStoreTestMixin, unittest.TestCase):
+
+    def make_store(self):
+        self.path = os.path.join(self.make_dir(), 'tokens.db')
+        return stores.SQLiteTokenStore(self.path, 'tokens')
+
+    def make_dir(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        return path
+
+    def test_invalid_table(self):
+        # The table name is validated.
+        with self.assertRaises(ValueError) as context_manager:
+            stores.SQLiteTokenStore(self.path, 'bad; table')
+        self.assertEqual(
+            'invalid table name: bad; table', str(context_manager.exception))
+
+    def test_wal_mode(self):
+        # The database is used in WAL mode.
+        self.store.put('DEFACED', 42, 60)
+        cursor = self.store._connect().execute('PRAGMA journal_mode')
+        self.assertEqual('wal', cursor.fetchone()[0])
+
+    def test_shared(self):
+        # Tokens are shared by stores using the same database.
+        self.store.put('DEFACED', 42, 60)
+        other = stores.SQLiteTokenStore(self.path, 'tokens')
+        self.assertEqual(42, other.pop('DEFACED'))
+        self.assertIsNone(self.store.pop('DEFACED'))
+
+    def test_tables(self):
+        # Stores using different tables do not share tokens.
+        self.store.put('DEFACED', 42, 60)
+        other = stores.SQLiteTokenStore(self.path, 'changesets')
+        self.assertIsNone(other.pop('DEFACED'))
+        self.assertEqual(42, self.store.pop('DEFACED'))
+
+    def test_fork(self):
+        # A new connection is opened in forked processes.
+        connection = self.store._connect()
+        with mock.patch('os.getpid', mock.Mock(return_value=-1)):
+            self.assertIsNot(connection, self.store._connect())
+
+    def test_purge_on_connect(self):
+        # Expired tokens are purged when the database is opened.
+        with mock.patch('time.time', mock.Mock(return_value=1000)):
+            self.store.put('DEFACED', 42, 60)
+        other = stores.SQLiteTokenStore(self.path, 'tokens')
+        other._connect()
+        cursor = other._connect().execute('SELECT COUNT(*) FROM tokens')
+        self.assertEqual(0, cursor.fetchone()[0])
+
+
+class TestMemoryTokenStoreWheel(unittest.TestCase):
+
+    def test_purge_expired_only(self):
+        # Purging only goes through the expired tokens.
+        store = stores.MemoryTokenStore()
+        with mock.patch('time.time', mock.Mock(return_value=1000)):
+            for num in range(10):
+                store.put('token-{}'.format(num), num, num * 10)
+        with mock.patch('time.time', mock.Mock(return_value=1035)):
+            self.assertEqual(4, store.purge())
+        self.assertEqual(6, len(store))
+        self.assertEqual(6, len(store._wheel))
+
+    def test_used_tokens(self):
+        # Used tokens are removed from the timing wheel.
+        store = stores.MemoryTokenStore()
+        store.put('DEFACED', 42, 60)
+        store.pop('DEFACED')
+        self.assertEqual(0, len(store._wheel))
+
+    def test_shared_dict(self):
+        # Tokens used by other processes are not counted as purged.
+        store = stores.MemoryTokenStore()
+        with mock.patch('time.time', mock.Mock(return_value=1000)):
+            store.put('DEFACED', 42, 60)
+        del store._data['DEFACED']
+        with mock.patch('time.time', mock.Mock(return_value=1100)):
+            self.assertEqual(0, store.purge())
+        self.assertEqual(0, len(store._wheel))
+
+
+class TestSweeper(LogTrapTestCase, unittest.TestCase):
+
+    def setUp(self):
+        super(TestSweeper, self).setUp()
+        self.io_loop = mock.Mock()
+        self.io_loop.time.return_value = 1000
+        self.stores = [mock.Mock(), mock.Mock()]
+        self.sweeper = stores.Sweeper(
+            self.stores, interval=2, io_loop=self.io_loop)
+
+    def test_start_stop(self):
+        # A single periodic callback sweeps all the stores.
+        self.sweeper.start()
+        self.assertEqual(1, self.io_loop.add_timeout.call_count)
+        self.assertEqual(2000, self.sweeper._callback.callback_time)
+        self.sweeper.stop()
+        self.io_loop.remove_timeout.assert_called_once_with(
+            self.io_loop.add_timeout())
+
+    def test_sweep(self):
+        # All the stores are purged.
+        self.stores[0].purge.return_value = 3
+        self.stores[1].purge.return_value = 0
+        with ExpectLog('', 'token store: expired 3 tokens', required=True):
+            self.sweeper.sweep()
+        self.stores[0].purge.assert_called_once_with()
+        self.stores[1].purge.assert_called_once_with()
+
+    def test_sweep_error(self):
+        # Errors purging a store are logged, and other stores are purged.
+        self.stores[0].purge.side_effect = ValueError('bad wolf')
+        self.stores[1].purge.return_value = 0
+        expected_log = 'token store: cannot purge tokens: bad wolf'
+        with ExpectLog('', expected_log, required=True):
+            self.sweeper.sweep()
+        self.stores[1].purge.assert_called_once_with()
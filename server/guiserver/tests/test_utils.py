@@ -17,6 +17,7 @@
 """Tests for the Juju GUI server utilities."""
 
 import json
+import logging
 import unittest
 
 import mock
@@ -105,6 +106,12 @@ class TestCloneRequest(unittest.TestCase):
             self.request, 'http://example.com/test', validate_cert=False)
         self.assertFalse(request.validate_cert)
 
+    def test_additional_arguments(self):
+        # Additional arguments are passed to the resulting request.
+        request = utils.clone_request(
+            self.request, 'http://example.com/test', request_timeout=42)
+        self.assertEqual(42, request.request_timeout)
+
     def test_request_type(self):
         # The resulting request is a tornado.httpclient.HTTPRequest instance.
         request = utils.clone_request(self.request, 'http://example.com')
@@ -127,6 +134,35 @@ class TestGetHeaders(unittest.TestCase):
         self.assertEqual({'Origin': 'https://server.example.com'}, headers)
 
 
+class TestGetRequestId(unittest.TestCase):
+
+    def test_request_id(self):
+        # The request id and its position in the message are returned.
+        message = '{"RequestId": 42, "Type": "Client"}'
+        request_id, start, end = utils.get_request_id(message)
+        self.assertEqual(42, request_id)
+        self.assertEqual('42', message[start:end])
+
+    def test_first_match(self):
+        # The first request id found in the message is returned.
+        message = '{"RequestId":1,"Response":{"RequestId":2}}'
+        request_id, _, _ = utils.get_request_id(message)
+        self.assertEqual(1, request_id)
+
+    def test_not_found(self):
+        # A tuple of None values is returned if the request id is not found.
+        self.assertEqual(
+            (None, None, None), utils.get_request_id('{"Type": "Client"}'))
+
+    def test_replace(self):
+        # The request id in the message can be replaced.
+        message = '{"RequestId": 42, "Type": "Client"}'
+        _, start, end = utils.get_request_id(message)
+        self.assertEqual(
+            '{"RequestId": 1000, "Type": "Client"}',
+            utils.replace_request_id(message, 1000, start, end))
+
+
 class TestGetJujuApiUrl(unittest.TestCase):
 
     source_template = '/api/$server/$port/$uuid'
@@ -154,6 +190,25 @@ class TestGetJujuApiUrl(unittest.TestCase):
         self.assertEqual('wss://1.2.3.4:47/model/uuid/exterminate', url)
 
 
+class TestIsDebugEnabled(unittest.TestCase):
+
+    def patch_level(self, level):
+        """Patch the root logger level, restoring it at the end of the test."""
+        logger = logging.getLogger()
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(level)
+
+    def test_enabled(self):
+        # Debug is enabled if the root logger level is debug.
+        self.patch_level(logging.DEBUG)
+        self.assertTrue(utils.is_debug_enabled())
+
+    def test_disabled(self):
+        # Debug is disabled if the root logger level is higher than debug.
+        self.patch_level(logging.INFO)
+        self.assertFalse(utils.is_debug_enabled())
+
+
 class TestJoinUrl(unittest.TestCase):
 
     def test_url_parts(self):
@@ -212,6 +267,41 @@ class TestJsonDecodeDict(unittest.TestCase):
             self.assertIsNone(utils.json_decode_dict('"not-a-dict"'))
 
 
+class TestMakeTypeMatcher(unittest.TestCase):
+
+    matcher = staticmethod(utils.make_type_matcher(('Admin', 'GUIToken')))
+
+    def test_match(self):
+        # The matching type is returned.
+        message = json.dumps({'RequestId': 1, 'Type': 'Admin'})
+        self.assertEqual('Admin', self.matcher(message))
+
+    def test_whitespace(self):
+        # The type is found regardless of the whitespace around the colon.
+        message = '{"RequestId": 1, "Type"  :"GUIToken"}'
+        self.assertEqual('GUIToken', self.matcher(message))
+
+    def test_no_match(self):
+        # None is returned if the message has a different type.
+        message = json.dumps({'RequestId': 1, 'Type': 'Client'})
+        self.assertIsNone(self.matcher(message))
+
+    def test_partial_match(self):
+        # Types are matched entirely.
+        message = json.dumps({'RequestId': 1, 'Type': 'AdminV2'})
+        self.assertIsNone(self.matcher(message))
+
+    def test_in_string_value(self):
+        # Types included in JSON encoded strings are ignored.
+        content = json.dumps({'Type': 'Admin'})
+        message = json.dumps({'Type': 'Client', 'Params': {'Data': content}})
+        self.assertIsNone(self.matcher(message))
+
+    def test_invalid_json(self):
+        # The message is not decoded: None is returned for invalid JSON.
+        self.assertIsNone(self.matcher('not-json'))
+
+
 class TestRequestSummary(unittest.TestCase):
 
     def test_summary(self):
@@ -0,0 +1,99 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the Juju GUI server IO loop watchdog."""
+
+import threading
+import unittest
+
+import mock
+from tornado.testing import (
+    ExpectLog,
+    LogTrapTestCase,
+)
+
+from guiserver import watchdog
+
+
+class TestWatchdog(LogTrapTestCase, unittest.TestCase):
+
+    def setUp(self):
+        watchdog.stats.reset()
+        self.addCleanup(watchdog.stats.reset)
+        self.monitor = mock.Mock(deadline=10)
+        self.monitor.io_loop.time.return_value = 10
+        self.watchdog = watchdog.Watchdog(self.monitor, 2)
+
+    def test_not_blocked(self):
+        # Nothing is logged if the lag monitor is not overdue.
+        self.monitor.io_loop.time.return_value = 11.5
+        self.assertFalse(self.watchdog.check())
+        self.assertEqual(0, watchdog.stats.stalls)
+
+    def test_not_started(self):
+        # The IO loop is not checked before the lag monitor is started.
+        self.monitor.deadline = None
+        self.assertFalse(self.watchdog.check())
+
+    def test_blocked(self):
+        # The stack of the IO loop thread is logged if the loop is blocked.
+        self.monitor.io_loop.time.return_value = 12.5
+        expected_log = '.*IO loop blocked for more than 2.500 seconds.*'
+        with ExpectLog('', expected_log, required=True):
+            self.assertTrue(self.watchdog.check())
+        self.assertEqual({'stalls': 1}, watchdog.stats.as_dict())
+
+    def test_stack(self):
+        # The logged stack refers to the IO loop thread.
+        self.monitor.io_loop.time.return_value = 12.5
+        with mock.patch('logging.warning') as mock_warning:
+            self.watchdog.check()
+        stack = mock_warning.call_args[0][2]
+        self.assertIn('test_stack', stack)
+
+    def test_stack_from_another_thread(self):
+        # The IO loop thread stack is logged when checking from a helper.
+        self.monitor.io_loop.time.return_value = 12.5
+        with mock.patch('logging.warning') as mock_warning:
+            helper = threading.Thread(target=self.watchdog.check)
+            helper.start()
+            helper.join()
+        stack = mock_warning.call_args[0][2]
+        self.assertIn('test_stack_from_another_thread', stack)
+        self.assertNotIn('guiserver/watchdog.py', stack)
+
+    def test_reported_once(self):
+        # The stack is logged once for each blocking callback.
+        self.monitor.io_loop.time.return_value = 12.5
+        with ExpectLog('', '.*IO loop blocked.*', required=True):
+            self.watchdog.check()
+        self.assertFalse(self.watchdog.check())
+        # A new blocking callback is reported again.
+        self.monitor.deadline = 20
+        self.monitor.io_loop.time.return_value = 25
+        with ExpectLog('', '.*IO loop blocked.*', required=True):
+            self.assertTrue(self.watchdog.check())
+        self.assertEqual(2, watchdog.stats.stalls)
+
+    def test_start_stop(self):
+        # The watchdog runs in a daemon thread until stopped.
+        self.watchdog.start()
+        thread = self.watchdog._thread
+        self.assertTrue(thread.daemon)
+        self.assertTrue(thread.is_alive())
+        self.watchdog.stop()
+        self.assertFalse(thread.is_alive())
@@ -0,0 +1,41 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the Juju GUI server multi-process mode."""
+
+import unittest
+
+import mock
+
+from guiserver import (
+    stores,
+    workers,
+)
+
+
+class TestStartCoordinator(unittest.TestCase):
+
+    def test_shared_state(self):
+        # The shared dicts are owned by the manager process.
+        with mock.patch('multiprocessing.Manager') as mock_manager:
+            state = workers.start_coordinator()
+        manager = mock_manager()
+        self.assertIsInstance(state.tokens, stores.MemoryTokenStore)
+        self.assertEqual(manager.dict(), state.tokens._data)
+        self.assertIsInstance(state.changesets, stores.MemoryTokenStore)
+        self.assertEqual(manager.dict(), state.changesets._data)
+        self.assertEqual(manager, state._manager)
@@ -0,0 +1,132 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the Juju GUI server threaded WSGI container."""
+
+import threading
+import time
+
+from tornado import web
+from tornado.testing import (
+    AsyncHTTPTestCase,
+    ExpectLog,
+    LogTrapTestCase,
+)
+
+from guiserver import wsgi
+
+
+def application(environ, start_response):
+    """A WSGI application used for tests."""
+    path = environ['PATH_INFO']
+    thread_name = threading.current_thread().name
+    if path == '/streamed':
+        start_response('200 OK', [
+            ('Content-Length', '10'),
+            ('Content-Type', 'text/plain'),
+        ])
+        return ['hello', 'world']
+    if path == '/buffered':
+        start_response('200 OK', [('X-Thread', thread_name)])
+        return ['hello', ' ', 'world']
+    if path == '/write':
+        write = start_response('200 OK', [('Content-Length', '10')])
+        write('hello')
+        return ['world']
+    raise ValueError('bad wolf')
+
+
+class TestThreadedWSGIContainer(LogTrapTestCase, AsyncHTTPTestCase):
+
+    def setUp(self):
+        super(TestThreadedWSGIContainer, self).setUp()
+        wsgi.stats.reset()
+        self.addCleanup(wsgi.stats.reset)
+
+    def get_app(self):
+        self.container = wsgi.ThreadedWSGIContainer(
+            application, max_workers=2, max_queued=10,
+            io_loop=self.io_loop)
+        self.addCleanup(self.container._executor.shutdown)
+        return web.Application([
+            (r'.*', web.FallbackHandler, {'fallback': self.container}),
+        ])
+
+    def wait_for(self, condition, timeout=5):
+        """Run the IO loop until the given condition is true."""
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            self.io_loop.add_timeout(time.time() + 0.01, self.stop)
+            self.wait()
+        self.assertTrue(condition())
+
+    def test_streamed(self):
+        # Responses declaring their length are streamed.
+        response = self.fetch('/streamed')
+        self.assertEqual(200, response.code)
+        self.assertEqual('helloworld', response.body)
+        self.assertEqual('text/plain', response.headers['Content-Type'])
+
+    def test_buffered(self):
+        # Responses not declaring their length are buffered.
+        response = self.fetch('/buffered')
+        self.assertEqual(200, response.code)
+        self.assertEqual('hello world', response.body)
+        self.assertEqual('11', response.headers['Content-Length'])
+        self.assertEqual(
+            'text/html; charset=UTF-8', response.headers['Content-Type'])
+
+    def test_thread(self):
+        # The application is not run in the IO loop thread.
+        response = self.fetch('/buffered')
+        self.assertNotEqual(
+            threading.current_thread().name, response.headers['X-Thread'])
+
+    def test_write(self):
+        # The legacy write callable is supported.
+        response = self.fetch('/write')
+        self.assertEqual(200, response.code)
+        self.assertEqual('helloworld', response.body)
+
+    def test_error(self):
+        # Application errors are logged and a server error is returned.
+        with ExpectLog('', 'wsgi: error running the application',
+                       required=True):
+            response = self.fetch('/error')
+        self.assertEqual(500, response.code)
+
+    def test_stats(self):
+        # Requests are counted.
+        self.fetch('/streamed')
+        self.fetch('/buffered')
+        # The response can be received before the counters are updated.
+        self.wait_for(lambda: wsgi.stats.requests == 2)
+        self.assertEqual(0, wsgi.stats.queued)
+        self.assertEqual(0, wsgi.stats.running)
+        self.assertGreater(wsgi.stats.execution_time, 0)
+        self.assertEqual(
+            wsgi.stats.execution_max_time,
+            wsgi.stats.as_dict()['execution_max_time'])
+
+    def test_rejected(self):
+        # Requests are rejected if too many requests are queued.
+        self.container._max_queued = 0
+        with ExpectLog('', 'wsgi: too many queued requests', required=True):
+            response = self.fetch('/streamed')
+        self.assertEqual(503, response.code)
+        self.assertEqual(1, wsgi.stats.rejected)
+        self.assertEqual(0, wsgi.stats.requests)
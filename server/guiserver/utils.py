@@ -29,6 +29,12 @@ from tornado import (
 )
 
 
+# Match the request identifier in WebSocket messages. Juju responses always
+# start with the request identifier, and browser requests do not include
+# other RequestId fields: the first match is the top level identifier.
+_REQUEST_ID_PATTERN = re.compile(r'"RequestId"\s*:\s*(\d+)')
+
+
 def add_future(io_loop, future, callback, *args):
     """Schedule a callback on the IO loop when the given Future is finished.
 
@@ -38,15 +44,16 @@ def add_future(io_loop, future, callback, *args):
     io_loop.add_future(future, partial_callback)
 
 
-def clone_request(request, url, validate_cert=True):
+def clone_request(request, url, validate_cert=True, **kwargs):
     """Create and return an httpclient.HTTPRequest from the given request.
 
     The passed url is used for the new request. The given request object is
-    usually an instance of tornado.httpserver.HTTPRequest.
+    usually an instance of tornado.httpserver.HTTPRequest. Additional keyword
+    arguments are passed to httpclient.HTTPRequest.
     """
     return httpclient.HTTPRequest(
         url, body=request.body or None, headers=request.headers,
-        method=request.method, validate_cert=validate_cert)
+        method=request.method, validate_cert=validate_cert, **kwargs)
 
 
 def get_headers(request, websocket_url):
@@ -62,6 +69,18 @@ def get_headers(request, websocket_url):
     return {'Origin': origin}
 
 
+def get_request_id(message):
+    """Return a (request_id, start, end) tuple for the given message.
+
+    The start and end values are the indexes delimiting the request id in
+    the message. Return (None, None, None) if the request id is not found.
+    """
+    match = _REQUEST_ID_PATTERN.search(message)
+    if match is None:
+        return None, None, None
+    return int(match.group(1)), match.start(1), match.end(1)
+
+
 def get_juju_api_url(path, source_template, target_template, default):
     """Return the Juju WebSocket API fully qualified URL.
 
@@ -84,6 +103,15 @@ def get_juju_api_url(path, source_template, target_template, default):
     return target_template.format(**match.groupdict())
 
 
+def is_debug_enabled():
+    """Return True if debug messages are currently emitted, False otherwise.
+
+    Use this function to avoid building expensive log messages (e.g. encoding
+    whole WebSocket frames) when they would be discarded anyway.
+    """
+    return logging.getLogger().isEnabledFor(logging.DEBUG)
+
+
 def join_url(base_url, path, query):
     """Create and return an URL string joining the given parts.
 
@@ -114,6 +142,36 @@ def json_decode_dict(message):
     return data
 
 
+def make_type_matcher(types):
+    """Return a function detecting WebSocket requests of the given types.
+
+    The returned function receives a JSON encoded message and returns the
+    first request type found in it, or None if the message does not include
+    any of the given types. The message is not decoded: a compiled regular
+    expression is used instead, so that the check is cheap even for large
+    messages. Note that the type could also be found in nested objects: the
+    matcher is intended to be used to decide whether a message must be
+    decoded, not to route the decoded request.
+    """
+    pattern = re.compile(r'"Type"\s*:\s*"({})"'.format(
+        '|'.join(re.escape(i) for i in sorted(types))))
+
+    def matcher(message):
+        match = pattern.search(message)
+        if match is not None:
+            return match.group(1)
+
+    return matcher
+
+
+def replace_request_id(message, request_id, start, end):
+    """Replace the request id in the given message.
+
+    The start and end arguments are the ones returned by get_request_id.
+    """
+    return message[:start] + str(request_id) + message[end:]
+
+
 def request_summary(request):
     """Return a string representing a summary for the given request."""
     return '{} {} ({})'.format(request.method, request.uri, request.remote_ip)
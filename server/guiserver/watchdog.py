@@ -0,0 +1,120 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Juju GUI server IO loop watchdog.
+
+All the GUI server connections are served by a single IO loop: a callback
+blocking the loop (for instance parsing a large bundle or serving a WSGI
+request) delays every other connection. The lag monitor in guiserver.metrics
+measures how late scheduled callbacks run, but it can only do that once the
+loop is unblocked. The watchdog runs in a helper thread and checks whether
+the lag monitor measurement is overdue: in that case the loop is blocked, and
+the stack of the IO loop thread is logged, pointing at the blocking code.
+"""
+
+import logging
+import sys
+import thread
+import threading
+import traceback
+
+
+# The minimum number of seconds between watchdog checks.
+MIN_POLL_INTERVAL = 0.05
+
+
+class WatchdogStats(object):
+    """Collect watchdog counters."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Reset all the counters."""
+        # The number of times the IO loop was found blocked.
+        self.stalls = 0
+
+    def as_dict(self):
+        """Return the counters."""
+        return {'stalls': self.stalls}
+
+
+# Collect watchdog counters for this process.
+stats = WatchdogStats()
+
+
+class Watchdog(object):
+    """Log the stack of the IO loop thread when the loop is blocked.
+
+    The loop is considered blocked when the measurement scheduled by the
+    given lag monitor is overdue by more than the given threshold in seconds.
+    The watchdog must be created in the thread running the IO loop. The stack
+    is logged once for each blocking callback.
+    """
+
+    def __init__(self, lag_monitor, threshold):
+        self._lag_monitor = lag_monitor
+        self._threshold = threshold
+        self._thread_id = thread.get_ident()
+        self._stopped = threading.Event()
+        self._thread = None
+        # The deadline of the last measurement found overdue.
+        self._reported = None
+
+    def start(self):
+        """Start watching the IO loop in a helper thread."""
+        self._thread = threading.Thread(
+            target=self._run, name='guiserver-watchdog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching the IO loop."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """Periodically check the IO loop until stopped."""
+        interval = max(self._threshold / 4.0, MIN_POLL_INTERVAL)
+        while not self._stopped.wait(interval):
+            self.check()
+
+    def check(self):
+        """Log the IO loop thread stack if the loop is blocked.
+
+        Return True if the loop is found blocked, False otherwise.
+        """
+        monitor = self._lag_monitor
+        deadline = monitor.deadline
+        if deadline is None or deadline == self._reported:
+            return False
+        lag = monitor.io_loop.time() - deadline
+        if lag < self._threshold:
+            return False
+        self._reported = deadline
+        stats.stalls += 1
+        frame = sys._current_frames().get(self._thread_id)
+        if frame is None:
+            stack = 'stack not available\n'
+        else:
+            stack = ''.join(traceback.format_stack(frame))
+        logging.warning(
+            'watchdog: IO loop blocked for more than %.3f seconds in:\n%s',
+            lag, stack.rstrip())
+        return True
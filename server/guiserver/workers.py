@@ -0,0 +1,71 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Juju GUI server multi-process mode.
+
+When more than one worker is requested, the listening sockets are bound once
+and the server forks a process for each worker: the kernel distributes the
+incoming connections between the workers, each one running its own IO loop.
+
+Tokens must be usable whatever worker a request lands on: authentication
+tokens and bundle change set tokens are created on one connection and used
+on another one. For this reason they are stored in dicts owned by a
+coordinator process, started before forking and accessed by the workers
+through proxies. Expired tokens are purged by the worker which created
+them. When a SQLite token store is configured, the workers share the
+database file instead, and the coordinator is not started.
+
+Other state stays in each worker:
+  - bundle deployments are started, watched and cancelled over a single
+    WebSocket connection, so each worker runs its own Deployer, and the one
+    deployment at a time queue is enforced per worker;
+  - parked Juju API connections (see guiserver.resume) cannot be moved
+    between processes: a reloaded GUI resumes its session only if it
+    reconnects to the same worker, and falls back to a new login otherwise;
+  - stats and metrics are collected per worker.
+"""
+
+import multiprocessing
+
+from guiserver.stores import MemoryTokenStore
+
+
+class SharedState(object):
+    """State shared by all the worker processes.
+
+    The tokens and changesets attributes are token stores mapping,
+    respectively, authentication tokens to credentials and bundle tokens to
+    change sets: see guiserver.stores.
+    """
+
+    def __init__(self, tokens, changesets, manager=None):
+        self.tokens = tokens
+        self.changesets = changesets
+        # Keep a reference to the manager: the coordinator process is
+        # terminated when the manager is garbage collected.
+        self._manager = manager
+
+
+def start_coordinator():
+    """Start the coordinator process and return the shared state.
+
+    This must be called before forking the workers.
+    """
+    manager = multiprocessing.Manager()
+    return SharedState(
+        MemoryTokenStore(manager.dict()), MemoryTokenStore(manager.dict()),
+        manager=manager)
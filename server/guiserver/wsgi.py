@@ -0,0 +1,270 @@
+# This file is part of the Juju GUI, which lets users view and manage Juju
+# environments within a graphical interface (https://launchpad.net/juju-gui).
+# Copyright (C) 2016 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Juju GUI server threaded WSGI container.
+
+The Juju GUI index, its configuration file and its static files are served
+by the jujugui Pyramid application. Tornado's WSGIContainer runs WSGI
+applications synchronously on the IO loop, so that every request served by
+jujugui delays all the proxied WebSocket connections.
+
+The ThreadedWSGIContainer runs the application in a bounded pool of threads
+instead. The response is written back by the IO loop: responses declaring
+their length are streamed chunk by chunk, each chunk being flushed to the
+client before the next one is produced, so that slow clients do not make the
+GUI server memory grow. Other responses are buffered, as Tornado does.
+"""
+
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+import tornado
+from tornado import escape
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.wsgi import WSGIContainer
+
+
+# The default number of threads running the WSGI application.
+DEFAULT_MAX_WORKERS = 4
+# The default number of requests waiting for a thread before new requests
+# are rejected.
+DEFAULT_MAX_QUEUED = 100
+# The seconds between checks for closed connections while waiting for a
+# chunk to be flushed.
+FLUSH_CHECK_INTERVAL = 1
+
+
+class WSGIStats(object):
+    """Collect WSGI requests counters.
+
+    The counters are only updated by the IO loop thread.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Reset all the counters."""
+        # The number of requests waiting for a thread and being run.
+        self.queued = 0
+        self.running = 0
+        # The number of completed requests, and the number of requests
+        # rejected because too many requests were queued.
+        self.requests = 0
+        self.rejected = 0
+        # The total seconds requests waited for a thread, and the total and
+        # maximum seconds spent running the application.
+        self.queue_wait = 0.0
+        self.execution_time = 0.0
+        self.execution_max_time = 0.0
+
+    def started(self, queue_wait):
+        """Record that a request waited for the given seconds and started."""
+        self.queued -= 1
+        self.running += 1
+        self.queue_wait += queue_wait
+
+    def finished(self, execution_time):
+        """Record that a request completed in the given seconds."""
+        self.running -= 1
+        self.requests += 1
+        self.execution_time += execution_time
+        self.execution_max_time = max(self.execution_max_time, execution_time)
+
+    def as_dict(self):
+        """Return the counters."""
+        return {
+            'queued': self.queued,
+            'running': self.running,
+            'requests': self.requests,
+            'rejected': self.rejected,
+            'queue_wait': self.queue_wait,
+            'execution_time': self.execution_time,
+            'execution_max_time': self.execution_max_time,
+        }
+
+
+# Collect WSGI counters for all the requests in this process.
+stats = WSGIStats()
+
+
+class ThreadedWSGIContainer(WSGIContainer):
+    """Run a WSGI application in a pool of threads.
+
+    This can be used in place of tornado.wsgi.WSGIContainer, e.g. as the
+    fallback of a tornado.web.FallbackHandler.
+    """
+
+    def __init__(
+            self, wsgi_application, max_workers=DEFAULT_MAX_WORKERS,
+            max_queued=DEFAULT_MAX_QUEUED, io_loop=None):
+        WSGIContainer.__init__(self, wsgi_application)
+        if io_loop is None:
+            io_loop = IOLoop.current()
+        self._io_loop = io_loop
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._max_queued = max_queued
+
+    def __call__(self, request):
+        """Schedule the given request to be handled by a pool thread."""
+        if stats.queued >= self._max_queued:
+            stats.rejected += 1
+            logging.warning('wsgi: too many queued requests')
+            request.write(
+                self._render_head('503 Service Unavailable', [], b''))
+            request.finish()
+            self._log(503, request)
+            return
+        stats.queued += 1
+        # The environment is built by the IO loop, as it reads the request.
+        environ = self.environ(request)
+        self._executor.submit(self._run, request, environ, time.time())
+
+    def _run(self, request, environ, submitted):
+        """Run the application in a pool thread."""
+        started = time.time()
+        self._io_loop.add_callback(stats.started, started - submitted)
+        state = {'sent': False}
+        status_code = 500
+        try:
+            status_code = self._handle(request, environ, state)
+        except StreamClosedError:
+            logging.debug('wsgi: connection closed by the client')
+            return
+        except Exception:
+            logging.exception('wsgi: error running the application')
+            if state['sent']:
+                # The response is partially sent: close the connection.
+                self._io_loop.add_callback(request.connection.stream.close)
+                return
+            try:
+                self._send(request, self._render_head(
+                    '500 Internal Server Error', [], b''))
+            except StreamClosedError:
+                return
+        finally:
+            self._io_loop.add_callback(
+                stats.finished, time.time() - started)
+        self._io_loop.add_callback(self._finish, request, status_code)
+
+    def _handle(self, request, environ, state):
+        """Run the application and send the response.
+
+        Return the response status code.
+        """
+        data = {}
+        written = []
+
+        def start_response(status, response_headers, exc_info=None):
+            data['status'] = status
+            data['headers'] = response_headers
+            return written.append
+
+        app_response = self.wsgi_application(environ, start_response)
+        try:
+            streaming = None
+            for chunk in app_response:
+                if not chunk:
+                    continue
+                if streaming is None:
+                    if not data:
+                        raise Exception(
+                            'WSGI app did not call start_response')
+                    streaming = _has_length(data['headers'])
+                    if streaming:
+                        head = self._render_head(
+                            data['status'], data['headers'])
+                        self._send(request, head + b''.join(written))
+                        state['sent'] = True
+                if streaming:
+                    self._send(request, chunk)
+                else:
+                    written.append(chunk)
+        finally:
+            if hasattr(app_response, 'close'):
+                app_response.close()
+        if not data:
+            raise Exception('WSGI app did not call start_response')
+        if not streaming:
+            body = escape.utf8(b''.join(written))
+            head = self._render_head(data['status'], data['headers'], body)
+            self._send(request, head + body)
+        return int(data['status'].split()[0])
+
+    def _render_head(self, status, headers, body=None):
+        """Return the HTTP status line and headers.
+
+        If the body is provided, the missing Content-Length and Content-Type
+        headers are added.
+        """
+        headers = list(headers)
+        header_set = set(key.lower() for key, _ in headers)
+        status_code = int(status.split()[0])
+        if body is not None and status_code != 304:
+            if 'content-length' not in header_set:
+                headers.append(('Content-Length', str(len(body))))
+            if 'content-type' not in header_set:
+                headers.append(('Content-Type', 'text/html; charset=UTF-8'))
+        if 'server' not in header_set:
+            headers.append(
+                ('Server', 'TornadoServer/{}'.format(tornado.version)))
+        parts = [escape.utf8('HTTP/1.1 ' + status + '\r\n')]
+        for key, value in headers:
+            parts.append(
+                escape.utf8(key) + b': ' + escape.utf8(value) + b'\r\n')
+        parts.append(b'\r\n')
+        return b''.join(parts)
+
+    def _send(self, request, data):
+        """Write the given data to the client from a pool thread.
+
+        Block until the data is flushed, so that at most one chunk for each
+        request is buffered. Raise a StreamClosedError if the client closed
+        the connection.
+        """
+        flushed = threading.Event()
+        errors = []
+
+        def write():
+            try:
+                request.write(data, callback=flushed.set)
+            except Exception as err:
+                errors.append(err)
+                flushed.set()
+
+        self._io_loop.add_callback(write)
+        while not flushed.wait(FLUSH_CHECK_INTERVAL):
+            if request.connection.stream.closed():
+                raise StreamClosedError()
+        if errors:
+            raise StreamClosedError()
+
+    def _finish(self, request, status_code):
+        """Finish the request in the IO loop thread."""
+        try:
+            request.finish()
+        except StreamClosedError:
+            return
+        self._log(status_code, request)
+
+
+def _has_length(headers):
+    """Report whether the given response headers include Content-Length."""
+    return any(key.lower() == 'content-length' for key, _ in headers)
@@ -17,6 +17,8 @@
 """Juju GUI utils tests."""
 
 from contextlib import contextmanager
+import gzip
+import json
 import os
 import shutil
 from subprocess import CalledProcessError
@@ -34,7 +36,9 @@ from utils import (
     RESTART,
     STOP,
     cmd_log,
+    compress_static_files,
     get_api_address,
+    get_jujugui_static_dir,
     get_port,
     get_release_file_path,
     install_builtin_server,
@@ -685,6 +689,78 @@ class TestInstallBuiltinServer(unittest.TestCase):
         ])
 
 
+class TestGetJujuguiStaticDir(unittest.TestCase):
+
+    @mock.patch('utils.run')
+    def test_static_dir(self, mock_run):
+        # The static directory of the installed jujugui package is returned.
+        mock_run.return_value = '/usr/lib/python2.7/jujugui\n'
+        self.assertEqual(
+            '/usr/lib/python2.7/jujugui/static', get_jujugui_static_dir())
+        self.assertEqual('python2', mock_run.call_args[0][0])
+
+
+class TestCompressStaticFiles(unittest.TestCase):
+
+    def setUp(self):
+        # Set up a static directory.
+        self.static_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_dir)
+        self.contents = 'var answer = 42;\n' * 100
+        self.make_file('app/app.js', self.contents)
+        self.make_file('small.css', 'a')
+        self.make_file('img/logo.png', 'PNG')
+
+    def make_file(self, name, contents):
+        """Create a file in the static directory."""
+        path = os.path.join(self.static_dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as static_file:
+            static_file.write(contents)
+        return path
+
+    def test_compressed(self):
+        # Gzip variants of the static files are written.
+        compress_static_files(self.static_dir)
+        gzip_path = os.path.join(self.static_dir, 'app', 'app.js.gz')
+        with gzip.open(gzip_path) as gzip_file:
+            self.assertEqual(self.contents, gzip_file.read())
+
+    def test_reproducible(self):
+        # Compressing again produces the same files.
+        compress_static_files(self.static_dir)
+        gzip_path = os.path.join(self.static_dir, 'app', 'app.js.gz')
+        with open(gzip_path, 'rb') as gzip_file:
+            expected = gzip_file.read()
+        compress_static_files(self.static_dir)
+        with open(gzip_path, 'rb') as gzip_file:
+            self.assertEqual(expected, gzip_file.read())
+
+    def test_skipped(self):
+        # Files not worth compressing are skipped.
+        stale_path = self.make_file('small.css.gz', 'stale')
+        compress_static_files(self.static_dir)
+        self.assertFalse(os.path.exists(stale_path))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.static_dir, 'img', 'logo.png.gz')))
+
+    def test_manifest(self):
+        # A manifest listing the files and their hashes is written.
+        manifest = compress_static_files(self.static_dir)
+        self.assertEqual(['app/app.js', 'small.css'], sorted(manifest))
+        entry = manifest['app/app.js']
+        self.assertEqual(len(self.contents), entry['size'])
+        self.assertEqual(64, len(entry['sha256']))
+        self.assertIn('gzip_sha256', entry)
+        self.assertLess(entry['gzip_size'], entry['size'])
+        self.assertNotIn('gzip_sha256', manifest['small.css'])
+        manifest_path = os.path.join(
+            self.static_dir, 'guiserver-manifest.json')
+        with open(manifest_path) as manifest_file:
+            self.assertEqual(manifest, json.load(manifest_file))
+
+
 @mock.patch('utils.find_missing_packages')
 @mock.patch('utils.install_extra_repositories')
 @mock.patch('utils.apt_get_install')